@@ -0,0 +1,53 @@
+"""
+Compares the cost of the float (fast) and Decimal (precise) arithmetic modes used by
+portfolio.py, fiatpurchase.py and optimalpurchase.py.
+
+Usage:
+    python benchmarks/bench_arithmetic.py [--holdings 1000] [--repeat 5]
+
+Each iteration values a synthetic portfolio the same way portfolio.py does: convert the price and
+units, multiply, round to the currency, then sum the totals and the 24 hour change.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import get_arithmetic
+
+def make_holdings(count: int):
+    rng = random.Random(42)
+    return [(rng.uniform(0.0001, 100000), rng.uniform(0.001, 10000), rng.uniform(-20, 20)) for _ in range(count)]
+
+def value_portfolio(holdings, precise: bool):
+    to_number, round_amount = get_arithmetic(precise)
+    total_value = 0
+    total_24h_change = 0
+    for price, units, change in holdings:
+        currency_value = round_amount(to_number(price) * to_number(units), 'aud')
+        total_value += currency_value
+        total_24h_change += currency_value * (to_number(change) / 100)
+    return total_value, total_24h_change
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark float vs Decimal portfolio valuation.")
+    parser.add_argument('--holdings', type=int, default=1000, help="Number of synthetic holdings to value.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats, the best is reported.")
+    args = parser.parse_args()
+
+    holdings = make_holdings(args.holdings)
+    number = max(1, 100000 // args.holdings)
+
+    results = {}
+    for label, precise in (('float', False), ('decimal', True)):
+        best = min(timeit.repeat(lambda: value_portfolio(holdings, precise), number=number, repeat=args.repeat)) / number
+        results[label] = best
+        print(f"{label:>8}: {best * 1000:.3f} ms per valuation ({best / args.holdings * 1e9:.0f} ns per holding)")
+
+    print(f"Decimal is {results['decimal'] / results['float']:.1f}x the cost of float for {args.holdings} holdings.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Compares ways of formatting money amounts the tools use when building tables and alerts.
+
+Usage:
+    python benchmarks/bench_formatting.py [--values 10000] [--repeat 5]
+
+- inline: get_currency_symbol() and format_currency() on every value, as the tools used to.
+- formatter: a cached formatter from get_formatter(), called once per value.
+- column: format_column() formatting the whole column in one call.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import format_column, format_currency, get_currency_symbol, get_formatter
+
+def make_values(count: int):
+    rng = random.Random(42)
+    # A mix of magnitudes so every formatting branch is exercised
+    return [rng.choice((0.001, 0.5, 100, 100000)) * rng.uniform(0.1, 10) for _ in range(count)]
+
+def inline(values, currency):
+    return [f"{get_currency_symbol(currency)}{format_currency(value)}" for value in values]
+
+def formatter(values, currency):
+    format_amount = get_formatter(currency)
+    return [format_amount(value) for value in values]
+
+def column(values, currency):
+    return format_column(values, currency)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark currency formatting.")
+    parser.add_argument('--values', type=int, default=10000, help="Number of amounts to format.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats, the best is reported.")
+    args = parser.parse_args()
+
+    values = make_values(args.values)
+    number = max(1, 100000 // args.values)
+
+    assert inline(values, 'aud') == formatter(values, 'aud') == column(values, 'aud')
+
+    results = {}
+    for label, function in (('inline', inline), ('formatter', formatter), ('column', column)):
+        best = min(timeit.repeat(lambda: function(values, 'aud'), number=number, repeat=args.repeat)) / number
+        results[label] = best
+        print(f"{label:>9}: {best * 1000:.3f} ms per column ({best / args.values * 1e9:.0f} ns per value)")
+
+    for label in ('formatter', 'column'):
+        print(f"{label} is {results['inline'] / results[label]:.2f}x faster than inline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures recording portfolio runs in a history file and reporting on months of them.
+
+Usage:
+    python benchmarks/bench_history.py [--days 180] [--interval 300] [--holdings 20]
+
+Fills a history file with a run every --interval seconds over --days days, then times appending one more run
+and each report query. The file is written to a temporary directory and removed afterwards.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from portfoliohistory import PERIODS, append_run, connect, get_max_drawdown, get_period_returns, get_span
+
+START = 1704067200  # 2024-01-01 00:00 UTC
+
+def fill(path: str, days: int, interval: int, holdings: int) -> int:
+    """Writes a random walk of runs straight into the tables, as appending them one at a time would take a while."""
+    rng = random.Random(42)
+    prices = [rng.uniform(1, 100000) for _ in range(holdings)]
+    runs = days * 86400 // interval
+    with closing(connect(path)) as connection, connection:
+        connection.executemany("INSERT INTO coins (id, coin_id) VALUES (?, ?)", ((index, f"coin-{index}") for index in range(holdings)))
+        for run_id in range(1, runs + 1):
+            prices = [price * rng.lognormvariate(0, 0.002) for price in prices]
+            connection.execute("INSERT INTO runs (id, time, currency, investment, value, change_24h) VALUES (?, ?, 'AUD', 0, ?, 0)", (run_id, START + run_id * interval, sum(prices)))
+            connection.executemany("INSERT INTO holdings (run_id, coin, units, price) VALUES (?, ?, 1, ?)", ((run_id, index, price) for index, price in enumerate(prices)))
+    return runs
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark portfolio history recording and reports.")
+    parser.add_argument('--days', type=int, default=180, help="Days of history.")
+    parser.add_argument('--interval', type=int, default=300, help="Seconds between runs.")
+    parser.add_argument('--holdings', type=int, default=20, help="Holdings in each run.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.sqlite')
+        runs, elapsed = timed(lambda: fill(path, args.days, args.interval, args.holdings))
+        print(f"Filled {runs:,} runs of {args.holdings} holdings in {elapsed:.1f}s, {os.path.getsize(path) / 1e6:.1f} MB")
+
+        holdings = [{'coin_id': f"coin-{index}", 'units': 1, 'price': 100.0, 'value': 100.0, 'change_24h_percent': 0} for index in range(args.holdings)]
+        _, elapsed = timed(lambda: append_run(path, 'AUD', 0, holdings))
+        print(f"{'append run':>14}: {elapsed * 1000:.2f} ms")
+
+        with closing(connect(path)) as connection:
+            for period in PERIODS:
+                periods, elapsed = timed(lambda: get_period_returns(connection, 'AUD', period))
+                print(f"{period + ' returns':>14}: {elapsed * 1000:.2f} ms for {len(periods):,} periods")
+            _, elapsed = timed(lambda: get_max_drawdown(connection, 'AUD'))
+            print(f"{'max drawdown':>14}: {elapsed * 1000:.2f} ms")
+            _, elapsed = timed(lambda: get_span(connection, 'AUD'))
+            print(f"{'span':>14}: {elapsed * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
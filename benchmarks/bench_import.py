@@ -0,0 +1,77 @@
+"""
+Measures importing exchange CSV exports of different sizes, and importing the rows added to one since.
+
+Usage:
+    python benchmarks/bench_import.py [--rows 100000 300000] [--coins 50] [--added 1000]
+
+Writes an export of random trades for each size to a temporary directory, imports it from scratch, then adds
+--added rows and imports again from the checkpoint. The peak memory of importing the whole export again is
+traced in a dry run, and should stay the same as the export grows as rows are read one at a time.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import portfolioimport
+
+def write_trades(path: str, rows: int, coins: int, rng: random.Random, header: bool = True):
+    with open(path, 'a' if not header else 'w', newline='') as file:
+        if header:
+            file.write('Date,Pair,Side,Amount,Price,Fee\r\n')
+        for _ in range(rows):
+            side = 'Buy' if rng.random() < 0.6 else 'Sell'
+            file.write(f"2024-01-01T00:00:00Z,C{rng.randrange(coins)}/AUD,{side},{rng.uniform(0.01, 10):.6f},{rng.uniform(1, 1000):.2f},{rng.uniform(0, 5):.2f}\r\n")
+
+def timed_import(argv) -> float:
+    start = time.perf_counter()
+    portfolioimport.main(argv)
+    return time.perf_counter() - start
+
+def traced_import(argv) -> int:
+    """Returns the peak memory allocated by an import, run separately as tracing slows it down several times."""
+    tracemalloc.start()
+    portfolioimport.main(argv)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark importing exchange CSV exports.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 300000], help="Rows in each export.")
+    parser.add_argument('--coins', type=int, default=50, help="Coins traded.")
+    parser.add_argument('--added', type=int, default=1000, help="Rows added before importing again.")
+    args = parser.parse_args()
+
+    coin_list = {f"coin-{index}": {'symbol': f"c{index}", 'name': f"Coin {index}"} for index in range(args.coins)}
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as directory, mock.patch('coingecko.fetch_coin_list', return_value=coin_list), mock.patch('sys.stdout', new=open(os.devnull, 'w')), mock.patch('sys.stderr', new=open(os.devnull, 'w')):
+        results = []
+        for rows in args.rows:
+            csv_file = os.path.join(directory, f"trades-{rows}.csv")
+            config_file = os.path.join(directory, f"portfolio-{rows}.json")
+            argv = [config_file, csv_file, '--checkpoint', os.path.join(directory, f"checkpoint-{rows}.json")]
+            write_trades(csv_file, rows, args.coins, rng)
+            size = os.path.getsize(csv_file)
+            full = timed_import(argv)
+            write_trades(csv_file, args.added, args.coins, rng, header=False)
+            incremental = timed_import(argv)
+            peak = traced_import(argv + ['--full', '--dry-run'])
+            with open(config_file) as file:
+                held = len(json.load(file)['holdings'])
+            results.append((rows, size, full, incremental, peak, held))
+
+    for rows, size, full, incremental, peak, held in results:
+        print(f"{rows:>9,} rows, {size / 1e6:.1f} MB, {held} coins held")
+        print(f"{'full import':>20}: {full:.2f}s, {rows / full:,.0f} rows/s, peak {peak / 1024:,.0f} KiB")
+        print(f"{f'{args.added:,} rows added':>20}: {incremental * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures building the return matrices of a portfolio history from scratch against updating them after another
+day of runs, and the risk analysis on them.
+
+Usage:
+    python benchmarks/bench_risk.py [--days 180] [--interval 300] [--holdings 20]
+
+The history is filled as in bench_history.py and removed afterwards.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from contextlib import closing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from bench_history import START, fill, timed
+from portfoliohistory import append_run, connect
+from portfoliorisk import ReturnCache, analyse, get_cache_filename, load_returns
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark portfolio risk analytics.")
+    parser.add_argument('--days', type=int, default=180, help="Days of history.")
+    parser.add_argument('--interval', type=int, default=300, help="Seconds between runs.")
+    parser.add_argument('--holdings', type=int, default=20, help="Holdings in each run.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.sqlite')
+        runs = fill(path, args.days, args.interval, args.holdings)
+        print(f"History of {runs:,} runs of {args.holdings} holdings over {args.days} days")
+
+        with closing(connect(path)) as connection:
+            cache, elapsed = timed(lambda: load_returns(connection, path, 'AUD'))
+        print(f"{'full build':>18}: {elapsed * 1000:.1f} ms")
+
+        # Another day of runs, then the update reads only those
+        holdings = [{'coin_id': f"coin-{index}", 'units': 1, 'price': 100.0, 'value': 100.0, 'change_24h_percent': 0} for index in range(args.holdings)]
+        for run in range(86400 // args.interval):
+            append_run(path, 'AUD', 0, holdings, timestamp=START + (runs + 1) * args.interval + run * args.interval)
+        with closing(connect(path)) as connection:
+            _, elapsed = timed(lambda: load_returns(connection, path, 'AUD'))
+            print(f"{'incremental update':>18}: {elapsed * 1000:.1f} ms")
+            _, elapsed = timed(lambda: ReturnCache('AUD').update(connection))
+            print(f"{'rebuild':>18}: {elapsed * 1000:.1f} ms")
+
+        cache = ReturnCache.load(get_cache_filename(path), 'AUD')
+        units = {coin_id: 1 for coin_id in cache.coins}
+        _, elapsed = timed(lambda: analyse(cache, units))
+        print(f"{'analysis':>18}: {elapsed * 1000:.1f} ms for {len(cache.days)} days")
+
+if __name__ == "__main__":
+    main()
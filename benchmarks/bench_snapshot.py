@@ -0,0 +1,79 @@
+"""
+Compares holding prices as nested dicts, as fetch_price_data returns them, with a PriceSnapshot.
+
+Usage:
+    python benchmarks/bench_snapshot.py [--coins 10000] [--currencies 4] [--repeat 5]
+
+Reports the memory each takes and the time to read every coin's price and 24 hour change in one currency,
+through string keys for the dicts, and through the snapshot's dict view and its columns.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pricesnapshot import PriceSnapshot
+
+CURRENCIES = ['aud', 'usd', 'eur', 'btc', 'eth', 'jpy', 'gbp', 'cad']
+
+def make_prices(coins: int, currencies: list) -> dict:
+    rng = random.Random(42)
+    prices = {}
+    for index in range(coins):
+        coin_prices = {}
+        for currency in currencies:
+            coin_prices[currency] = rng.uniform(0.0001, 100000)
+            coin_prices[f"{currency}_24h_change"] = rng.uniform(-20, 20)
+        prices[f"coin-{index}"] = coin_prices
+    return prices
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    return size
+
+def read_dicts(prices: dict, coin_ids: list, currency: str) -> float:
+    total = 0
+    for coin_id in coin_ids:
+        total += prices[coin_id][currency] * prices[coin_id][f"{currency}_24h_change"]
+    return total
+
+def read_columns(snapshot: PriceSnapshot, coin_ids: list, currency: str) -> float:
+    price_column = snapshot.price_column(currency)
+    change_column = snapshot.change_column(currency)
+    rows = snapshot.rows
+    total = 0
+    for coin_id in coin_ids:
+        row = rows[coin_id]
+        total += price_column[row] * change_column[row]
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nested dict prices against PriceSnapshot.")
+    parser.add_argument('--coins', type=int, default=10000, help="Number of coins.")
+    parser.add_argument('--currencies', type=int, default=4, help=f"Number of currencies, up to {len(CURRENCIES)}.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats, the best is reported.")
+    args = parser.parse_args()
+
+    currencies = CURRENCIES[:args.currencies]
+    prices = make_prices(args.coins, currencies)
+    snapshot = PriceSnapshot.from_dict(prices)
+    coin_ids = list(prices)
+
+    dict_memory = measure_memory(lambda: make_prices(args.coins, currencies))
+    snapshot_memory = measure_memory(lambda: PriceSnapshot.from_dict(prices))
+    print(f"Memory for {args.coins:,} coins in {len(currencies)} currencies: dicts {dict_memory / 1e6:.1f} MB, snapshot {snapshot_memory / 1e6:.1f} MB")
+
+    for label, read, data in (('dicts', read_dicts, prices), ('snapshot view', read_dicts, snapshot), ('snapshot columns', read_columns, snapshot)):
+        best = min(timeit.repeat(lambda: read(data, coin_ids, 'aud'), number=1, repeat=args.repeat))
+        print(f"{label:>16}: {best * 1000:.2f} ms to read every price and change ({best / args.coins * 1e9:.0f} ns per coin)")
+
+if __name__ == "__main__":
+    main()
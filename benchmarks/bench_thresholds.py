@@ -0,0 +1,73 @@
+"""
+Compares finding the optimal purchases by checking every purchase against finding them with the threshold index.
+
+Usage:
+    python benchmarks/bench_thresholds.py [--purchases 100000] [--coins 10] [--optimal 0.01] [--repeat 5]
+
+The purchases are a ladder of target prices for a few coins, with --optimal of them below the current price.
+
+- scan: every purchase is compared with its target price, as optimalpurchase.py used to.
+- index: purchases that could be optimal are found by binary search in the index. The index is built the second
+  time a config is run in a process, so this is the cost of each run after that.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import optimalpurchase
+from utils import get_arithmetic
+
+def make_config(purchase_count: int, coin_count: int, optimal_fraction: float) -> tuple:
+    rng = random.Random(42)
+    prices = {f"coin-{index}": {'aud': rng.uniform(1, 1000)} for index in range(coin_count)}
+    purchases = []
+    for index in range(purchase_count):
+        coin_id = f"coin-{index % coin_count}"
+        units = rng.uniform(0.1, 10)
+        # Targets mostly below the current price, so only about optimal_fraction are worth buying
+        unit_target = prices[coin_id]['aud'] * rng.uniform(1 - 1 / optimal_fraction / 100, 1.01)
+        purchases.append({'coinId': coin_id, 'buyUnits': units, 'price': unit_target * units, 'currency': 'AUD'})
+    return {'showOptimalOnly': True, 'purchases': purchases}, prices
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the optimal purchase threshold index.")
+    parser.add_argument('--purchases', type=int, default=100000, help="Number of purchases.")
+    parser.add_argument('--coins', type=int, default=10, help="Number of coins the purchases are spread over.")
+    parser.add_argument('--optimal', type=float, default=0.01, help="Rough fraction of purchases that are optimal.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats, the best is reported.")
+    args = parser.parse_args()
+
+    config, prices = make_config(args.purchases, args.coins, args.optimal)
+    to_number, round_amount = get_arithmetic(False)
+
+    def scan():
+        # Every purchase is a candidate, so each one is checked
+        with patch.object(optimalpurchase, 'get_candidate_purchases', lambda config, prices: config['purchases']):
+            return list(optimalpurchase.iter_purchases(config, prices, to_number, round_amount))
+
+    def index():
+        return list(optimalpurchase.iter_purchases(config, prices, to_number, round_amount))
+
+    with patch('coingecko.get_coin_symbol', side_effect=str.upper):
+        build = min(timeit.repeat(lambda: optimalpurchase.build_purchase_index(config['purchases']).above('coin-0', 'aud', 0), number=1, repeat=args.repeat))
+        # The first run only remembers the config, the second builds the index
+        index()
+        optimal = index()
+        assert scan() == optimal
+
+        print(f"{len(optimal):,} of {args.purchases:,} purchases are optimal")
+        print(f"index build: {build * 1000:.3f} ms, once per config per process")
+        results = {}
+        for label, function in (('scan', scan), ('index', index)):
+            results[label] = min(timeit.repeat(function, number=1, repeat=args.repeat))
+            print(f"{label:>11}: {results[label] * 1000:.3f} ms per run")
+
+    print(f"index is {results['scan'] / results['index']:.2f}x faster than scan.")
+
+if __name__ == "__main__":
+    main()
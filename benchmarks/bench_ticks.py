@@ -0,0 +1,72 @@
+"""
+Measures how many price ticks per second cointracker stream can take in, first decoding and coalescing
+messages in process, then end to end over a WebSocket from the fake ticker in tests/fake_ticker.py.
+
+Usage:
+    python benchmarks/bench_ticks.py [--coins 1000] [--ticks 200000] [--batch 100]
+
+A burst of ticks for the same coins collapses to one price per coin and currency, so the configs are
+evaluated against --coins coins however many ticks arrive.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+
+from fake_ticker import FakeTicker
+from pricefeed import PriceFeed, TickCoalescer
+
+def make_batches(coins: int, ticks: int, batch: int):
+    rng = random.Random(42)
+    return [[(f"coin-{rng.randrange(coins)}", 'aud', rng.uniform(1, 100000)) for _ in range(batch)] for _ in range(ticks // batch)]
+
+def bench_in_process(batches) -> float:
+    coalescer = TickCoalescer()
+    feed = PriceFeed('ws://unused/', [], [], coalescer)
+    messages = [json.dumps([{'i': coin_id, 'vs': currency, 'p': price} for coin_id, currency, price in batch]) for batch in batches]
+
+    start = time.perf_counter()
+    for message in messages:
+        feed.handle(message)
+    coalescer.take(timeout=0)
+    return time.perf_counter() - start
+
+def bench_websocket(batches, coins: int) -> float:
+    coalescer = TickCoalescer()
+    with FakeTicker() as ticker:
+        feed = PriceFeed(ticker.url, [f"coin-{index}" for index in range(coins)], ['aud'], coalescer)
+        feed.start()
+        ticker.wait_for_subscribers(1)
+        coalescer.take(timeout=5)  # The snapshot sent on subscribing
+
+        # The last tick has a price no other has so it's clear when everything has arrived
+        marker = ('coin-0', 'aud', -1.0)
+        start = time.perf_counter()
+        for batch in batches:
+            ticker.publish(batch)
+        ticker.publish([marker])
+        while coalescer.take(timeout=10).get('coin-0', {}).get('aud') != -1.0:
+            pass
+        elapsed = time.perf_counter() - start
+        feed.stop()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark price feed tick ingestion.")
+    parser.add_argument('--coins', type=int, default=1000, help="Number of coins ticking.")
+    parser.add_argument('--ticks', type=int, default=200000, help="Number of ticks to send.")
+    parser.add_argument('--batch', type=int, default=100, help="Ticks per message.")
+    args = parser.parse_args()
+
+    batches = make_batches(args.coins, args.ticks, args.batch)
+    ticks = len(batches) * args.batch
+    for label, elapsed in (('in process', bench_in_process(batches)), ('websocket', bench_websocket(batches, args.coins))):
+        print(f"{label:>10}: {ticks / elapsed:,.0f} ticks per second ({elapsed * 1000:.0f} ms for {ticks:,} ticks)")
+
+if __name__ == "__main__":
+    main()
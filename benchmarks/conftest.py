@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import pytest
+from synthetic import LARGE_SIZE
+
+# add parent directory to import path so we can import the tools, and tests for the fake CoinGecko server
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(__file__), '..', '.benchmarks', 'baselines.json')
+
+def pytest_addoption(parser):
+    group = parser.getgroup('tool benchmarks')
+    group.addoption('--benchmark-large', action='store_true', help=f"Also benchmark configs with {LARGE_SIZE:,} entries.")
+    group.addoption('--baseline-file', default=DEFAULT_BASELINE_FILE, help="JSON file the baselines are read from and saved to.")
+    group.addoption('--update-baselines', action='store_true', help="Replace the stored baselines with this run's results instead of checking them.")
+    group.addoption('--time-tolerance', type=float, default=0.5, help="Allowed slowdown over the baseline before failing, 0.5 means 50%%.")
+    group.addoption('--time-floor', type=float, default=0.002, help="Slowdowns smaller than this many seconds are ignored, since sub-millisecond stages are too noisy to compare.")
+    group.addoption('--memory-tolerance', type=float, default=0.2, help="Allowed peak memory increase over the baseline before failing, 0.2 means 20%%.")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark-large'):
+        return
+    skip_large = pytest.mark.skip(reason="large benchmark, run with --benchmark-large")
+    for item in items:
+        callspec = getattr(item, 'callspec', None)
+        if callspec and callspec.params.get('size') == LARGE_SIZE:
+            item.add_marker(skip_large)
+
+class Baselines:
+    """
+    Stored results from an earlier run. The first run of a benchmark records its results, later runs fail if
+    any time or the peak memory is worse than the stored value by more than the tolerance. Times also have to be
+    worse by more than the floor, so a stage that takes 0.1ms doesn't fail for taking 0.2ms.
+
+    Times are machine specific, so the baselines live in .benchmarks which isn't committed.
+    """
+
+    def __init__(self, path: str, update: bool, time_tolerance: float, time_floor: float, memory_tolerance: float):
+        self.path = path
+        self.update = update
+        self.time_tolerance = time_tolerance
+        self.time_floor = time_floor
+        self.memory_tolerance = memory_tolerance
+        self.changed = False
+        self.results = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.results = json.load(file)
+
+    def check(self, name: str, times: dict, peak_memory: int = None):
+        """
+        Compares a benchmark's results against its baseline, recording them if there isn't one.
+
+        Args:
+        name (str): The benchmark name, e.g. portfolio[1000].
+        times (dict): Seconds taken, keyed by stage.
+        peak_memory (int): Peak traced memory in bytes, if it was measured.
+
+        Returns:
+        list of str: A description of each regression, empty if there are none.
+        """
+        baseline = self.results.get(name)
+        if baseline is None or self.update:
+            self.results[name] = {'times': times, 'peak_memory': peak_memory}
+            self.changed = True
+            return []
+
+        regressions = []
+        for stage, seconds in times.items():
+            baseline_seconds = baseline['times'].get(stage)
+            if baseline_seconds is None or seconds - baseline_seconds < self.time_floor:
+                continue
+            if seconds > baseline_seconds * (1 + self.time_tolerance):
+                regressions.append(f"{stage} took {seconds * 1000:.2f}ms, the baseline is {baseline_seconds * 1000:.2f}ms")
+        baseline_memory = baseline.get('peak_memory')
+        if peak_memory is not None and baseline_memory is not None and peak_memory > baseline_memory * (1 + self.memory_tolerance):
+            regressions.append(f"peak memory was {peak_memory / 1024:,.0f}KiB, the baseline is {baseline_memory / 1024:,.0f}KiB")
+        return regressions
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as file:
+            json.dump(self.results, file, indent=4, sort_keys=True)
+
+@pytest.fixture(scope='session')
+def baselines(request):
+    options = request.config.option
+    baselines = Baselines(options.baseline_file, options.update_baselines, options.time_tolerance, options.time_floor, options.memory_tolerance)
+    yield baselines
+    baselines.save()
+
+@pytest.fixture
+def cache_directory(mocker, tmp_path):
+    """Keeps the config cache and the alert tools' state out of the project cache directory."""
+    import configloader
+    mocker.patch('configloader.CACHE_DIRECTORY', str(tmp_path / 'config_cache'))
+    configloader.clear_cache()
+    yield str(tmp_path / 'cache')
+    configloader.clear_cache()
@@ -0,0 +1,114 @@
+"""
+Synthetic configs and CoinGecko price payloads for benchmarking the tools at any scale.
+
+Coins are named coin-0, coin-1, ... and priced in AUD, USD and BTC. Every generator is seeded so the same
+count always gives the same config and prices.
+"""
+import random
+
+# Number of holdings, purchases, trades or coins in the benchmarked configs
+SIZES = [10, 1000, 100000]
+
+# Sizes that take minutes rather than seconds only run with --benchmark-large
+LARGE_SIZE = 100000
+
+SMTP = {
+    "sendEmail": False,
+    "email": "my@email.com",
+    "smtp": {"host": "smtp.server.com", "port": 587, "username": "", "password": ""}
+}
+
+def coin_id(index: int) -> str:
+    return f"coin-{index}"
+
+def make_prices(count: int) -> dict:
+    """Returns a price payload shaped like coingecko.fetch_price_data's for count coins."""
+    rng = random.Random(count)
+    prices = {}
+    for index in range(count):
+        aud = rng.uniform(0.0001, 100000)
+        prices[coin_id(index)] = {
+            'aud': aud,
+            'aud_24h_change': rng.uniform(-20, 20),
+            'usd': aud * 0.65,
+            'usd_24h_change': rng.uniform(-20, 20),
+            'btc': aud / 100000,
+            'btc_24h_change': rng.uniform(-20, 20)
+        }
+    return prices
+
+def portfolio(count: int, rng: random.Random) -> dict:
+    return {
+        "investmentAmount": 10000,
+        "defaultCurrency": "AUD",
+        "currencies": ["USD", "BTC"],
+        "holdings": [{"coinId": coin_id(index), "units": rng.uniform(0.01, 1000)} for index in range(count)]
+    }
+
+def fiatpurchase(count: int, rng: random.Random) -> dict:
+    return {
+        "purchases": [
+            {"coinId": coin_id(index), "currency": "AUD", "unitAmount": rng.uniform(0.01, 10)} if index % 2 else
+            {"coinId": coin_id(index), "currency": "USD", "currencyAmount": rng.uniform(100, 10000)}
+            for index in range(count)
+        ]
+    }
+
+def optimalpurchase(count: int, rng: random.Random) -> dict:
+    return {
+        "showOptimalOnly": False,
+        "purchases": [{"coinId": coin_id(index), "buyUnits": rng.uniform(0.1, 100), "price": rng.uniform(1, 100000), "currency": "AUD"} for index in range(count)],
+        **SMTP
+    }
+
+def optimaltrade(count: int, rng: random.Random) -> dict:
+    return {
+        "showOptimalOnly": False,
+        "currency": "AUD",
+        "trades": [
+            {"sellCoinId": coin_id(index), "sellUnits": rng.uniform(0.1, 100), "buyCoinId": coin_id((index + 1) % count), "buyUnits": rng.uniform(0.1, 100)}
+            for index in range(count)
+        ],
+        **SMTP
+    }
+
+def pricealert(count: int, rng: random.Random) -> dict:
+    return {
+        "coins": [{"coinId": coin_id(index), "currency": "AUD" if index % 2 else "USD"} for index in range(count)],
+        "increasePercent": 10,
+        "decreasePercent": 10,
+        "trailingStopPercent": 15,
+        **SMTP
+    }
+
+def pricepercentalert(count: int, rng: random.Random) -> dict:
+    return {
+        "coins": [{"coinId": coin_id(index), "currency": "AUD", "window": "24h" if index % 2 else "1h"} for index in range(count)],
+        "alertPercent": 10,
+        **SMTP
+    }
+
+def indicatoralert(count: int, rng: random.Random) -> dict:
+    conditions = [
+        [{"type": "emaCross", "fast": 12, "slow": 26}],
+        [{"type": "rsi", "period": 14, "above": 70, "below": 30}],
+        [{"type": "bollinger", "period": 20, "stdDev": 2}]
+    ]
+    return {
+        "coins": [{"coinId": coin_id(index), "currency": "USD", "conditions": conditions[index % 3]} for index in range(count)],
+        **SMTP
+    }
+
+GENERATORS = {
+    'portfolio': portfolio,
+    'fiatpurchase': fiatpurchase,
+    'optimalpurchase': optimalpurchase,
+    'optimaltrade': optimaltrade,
+    'pricealert': pricealert,
+    'pricepercentalert': pricepercentalert,
+    'indicatoralert': indicatoralert
+}
+
+def make_config(tool: str, count: int) -> dict:
+    """Returns a valid config for the tool with count holdings, purchases, trades or coins."""
+    return GENERATORS[tool](count, random.Random(count))
@@ -0,0 +1,45 @@
+"""
+Measures the throughput of the CoinGecko client against the local fake server in tests/fake_coingecko.py,
+so the cost of the real HTTP path (URL building, connection reuse, JSON decoding) can be tracked offline.
+
+Usage:
+    pytest benchmarks/test_api_throughput.py
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import coingecko
+from fake_coingecko import FakeCoinGecko
+
+# Number of coin IDs in each price request
+BATCH_SIZES = [10, 1000]
+CONCURRENT_REQUESTS = 100
+WORKERS = 8
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    with FakeCoinGecko(coin_count=max(BATCH_SIZES)) as server:
+        monkeypatch.setenv('COINGECKO_API_URL', server.url)
+        yield server
+
+@pytest.mark.parametrize('batch_size', BATCH_SIZES)
+def test_price_requests(benchmark, baselines, fake_api, batch_size):
+    ids = [coin['id'] for coin in fake_api.coins[:batch_size]]
+    currencies = ['aud', 'usd', 'btc']
+
+    benchmark.pedantic(lambda: coingecko.fetch_price_data(ids, currencies), rounds=20, warmup_rounds=1)
+
+    # Requests from several threads at once, with a little server latency so they overlap
+    fake_api.latency = 0.005
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda _: coingecko.fetch_price_data(ids, currencies), range(CONCURRENT_REQUESTS)))
+        concurrent = (time.perf_counter() - start) / CONCURRENT_REQUESTS
+
+    times = {'concurrent': concurrent}
+    if benchmark.stats:
+        times['sequential'] = benchmark.stats.stats.min
+    benchmark.extra_info.update({'requests_per_second': {stage: 1 / seconds for stage, seconds in times.items()}})
+
+    regressions = baselines.check(f"api_price_requests[{batch_size}]", times)
+    assert not regressions, f"Price requests for {batch_size:,} coins regressed: " + "; ".join(regressions)
@@ -0,0 +1,130 @@
+"""
+Benchmarks every tool end to end and stage by stage on synthetic configs of 10, 1,000 and 100,000 entries.
+
+Usage:
+    pytest benchmarks                       # 10 and 1,000 entries
+    pytest benchmarks --benchmark-large     # also 100,000 entries
+    pytest benchmarks --update-baselines    # accept the current results as the new baselines
+
+The CoinGecko API is mocked with a synthetic price payload so only the tools' own work is measured. Besides
+the pytest-benchmark timing of main(), each benchmark records the time of each stage and the peak memory
+traced during main(), and fails if any of them regress against the stored baselines (see conftest.py).
+"""
+import importlib
+import io
+import json
+import shutil
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+import pytest
+import configloader
+from synthetic import GENERATORS, SIZES, make_config, make_prices
+from utils import fetch_prices, get_arithmetic
+
+ALERT_TOOLS = {'pricealert', 'pricepercentalert', 'indicatoralert'}
+
+# Rows calculated without rendering them, for the tools that separate the two
+COMPUTE = {
+    'portfolio': lambda tool, config, prices: tool.iter_holdings(config, prices, *get_arithmetic(False)),
+    'fiatpurchase': lambda tool, config, prices: tool.iter_purchases(config, prices, *get_arithmetic(False)),
+    'optimalpurchase': lambda tool, config, prices: tool.iter_purchases(config, prices, *get_arithmetic(False)),
+    'optimaltrade': lambda tool, config, prices: tool.iter_trades(config, prices)
+}
+
+# Number of timed runs, fewer for larger configs to keep the suite's run time reasonable
+ROUNDS = {10: 20, 1000: 5, 100000: 1}
+STAGE_ROUNDS = {10: 5, 1000: 3, 100000: 1}
+
+def time_stage(function, rounds, setup=None):
+    """Returns the fastest of several runs of function in seconds, calling setup untimed before each run."""
+    best = None
+    for _ in range(rounds):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure_peak_memory(function, setup) -> int:
+    setup()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('tool_name', sorted(GENERATORS))
+def test_tool(benchmark, baselines, cache_directory, mocker, tmp_path, tool_name, size):
+    tool = importlib.import_module(tool_name)
+    config_path = str(tmp_path / f"{tool_name}.json")
+    with open(config_path, 'w') as file:
+        json.dump(make_config(tool_name, size), file)
+
+    prices = make_prices(size)
+    mocker.patch('coingecko.fetch_price_data', return_value=prices)
+    mocker.patch('coingecko.get_coin_symbol', side_effect=lambda coin_id: coin_id.upper())
+
+    def clear_caches():
+        shutil.rmtree(configloader.CACHE_DIRECTORY, ignore_errors=True)
+        configloader.clear_cache()
+        clear_state()
+
+    def clear_state():
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+    def run_main():
+        with redirect_stdout(io.StringIO()):
+            if tool_name in ALERT_TOOLS:
+                tool.main(cache_directory=cache_directory, argv=[config_path])
+            else:
+                tool.main(argv=[config_path])
+
+    benchmark.pedantic(run_main, setup=clear_caches, rounds=ROUNDS[size])
+
+    # Everything after this point reuses the results of the earlier stages
+    rounds = STAGE_ROUNDS[size]
+    times = {}
+    if benchmark.stats:
+        times['main'] = benchmark.stats.stats.min
+
+    def parse():
+        with open(config_path, 'r') as file:
+            return json.load(file)
+
+    times['parse'] = time_stage(parse, rounds)
+    validator = configloader.get_validator(tool.config_schema)
+    raw_config = parse()
+    times['validate'] = time_stage(lambda: validator.validate(raw_config), rounds)
+    times['load'] = time_stage(lambda: tool.load(config_path), rounds, setup=clear_caches)
+    times['load_disk_cache'] = time_stage(lambda: tool.load(config_path), rounds, setup=configloader.clear_cache)
+    times['load_memory_cache'] = time_stage(lambda: tool.load(config_path), rounds)
+
+    config = tool.load(config_path)
+    args = tool.parse_args([config_path])
+    price_request = tool.get_price_request(config)
+    times['price_request'] = time_stage(lambda: tool.get_price_request(config), rounds)
+    times['fetch'] = time_stage(lambda: fetch_prices(*price_request), rounds)
+
+    if tool_name in COMPUTE:
+        times['compute'] = time_stage(lambda: list(COMPUTE[tool_name](tool, config, prices)), rounds)
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            if tool_name in ALERT_TOOLS:
+                tool.run(config, prices, args, cache_directory)
+            else:
+                tool.run(config, prices, args)
+
+    times['run'] = time_stage(run, rounds, setup=clear_state)
+
+    peak_memory = measure_peak_memory(run_main, clear_caches)
+    benchmark.extra_info.update({'stage_times': times, 'peak_memory': peak_memory})
+
+    regressions = baselines.check(f"{tool_name}[{size}]", times, peak_memory)
+    assert not regressions, f"{tool_name} with {size:,} entries regressed: " + "; ".join(regressions)
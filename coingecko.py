@@ -1,22 +1,94 @@
-import requests
 import json
 import os
+import sys
+import threading
 import time
 from typing import List, Dict
+from metrics import API_DURATION, API_REQUESTS, CACHE_LOOKUPS, COIN_LIST_REFRESHES
+from tracing import span
 
 # Define cache settings for coin list data
 CACHE_FILENAME = os.path.join(os.path.dirname(__file__), 'cache', 'coin_list_cache.json')
-CACHE_EXPIRY = 604800  # Cache expiry time in seconds (1 week)
+# When the API last confirmed the cached list was current, kept apart from the list so that confirming it
+# doesn't mean writing the whole list again
+CHECKED_FILENAME = os.path.join(os.path.dirname(__file__), 'cache', 'coin_list_checked.json')
+CACHE_EXPIRY = 604800  # Age in seconds (1 week) after which the coin list is checked for changes in the background
+MIN_REFRESH_INTERVAL = 3600  # Seconds between checks for changes when a coin ID isn't found, or after a check fails
+EXCHANGE_RATES_EXPIRY = 600  # Seconds a process reuses the exchange rates before fetching them again
 
-def fetch_data_from_api(url: str):
+# Base URL of the CoinGecko API. Set the COINGECKO_API_URL environment variable to use another server,
+# such as the local stand-in in tests/fake_coingecko.py.
+API_URL = "https://api.coingecko.com/api/v3"
+REQUEST_TIMEOUT = 30  # Seconds to wait for the API to respond
+
+# Shared HTTP session so requests made by the same process reuse connections
+_session = None
+# Coin list loaded by this process and when the API last confirmed it was current, so the cache file is only read once
+_coin_dict = None
+_coin_dict_timestamp = 0
+# ETag and Last-Modified values of the coin list, sent back so the API only sends the list again if it has changed
+_coin_list_validators = {}
+# When this process last tried to refresh the coin list, successfully or not
+_coin_list_attempted = 0
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+# Exchange rates fetched by this process and when
+_exchange_rates = None
+_exchange_rates_timestamp = 0
+
+def get_api_url(path: str) -> str:
+    """Returns the full URL of an API path such as /simple/price."""
+    return (os.environ.get('COINGECKO_API_URL') or API_URL).rstrip('/') + path
+
+def get_endpoint(url: str) -> str:
+    """
+    Returns the API path of a URL without its query string, with coin IDs replaced by {id} so that
+    metrics have one entry per endpoint rather than one per coin, for example /coins/{id}/market_chart.
+    """
+    from urllib.parse import urlsplit
+
+    path = urlsplit(url).path
+    base_path = urlsplit(get_api_url('')).path
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    parts = path.split('/')
+    if len(parts) == 4 and parts[1] == 'coins':
+        parts[2] = '{id}'
+    return '/'.join(parts)
+
+def get_session():
+    """Returns the HTTP session shared by all API requests in this process."""
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+# Response headers identifying a version of the data, by the key they are stored under
+VALIDATOR_HEADERS = {'etag': 'ETag', 'last_modified': 'Last-Modified'}
+
+def _conditional_headers(validators: dict) -> dict:
+    """Returns the request headers that ask the API to answer 304 Not Modified if the data hasn't changed."""
+    headers = {}
+    if validators:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def fetch_data_from_api(url: str, validators: dict = None):
     """
     Fetches data from the specified API URL. Handles response checking and error handling.
 
     Parameters:
         url (str): The URL to send the GET request to.
+        validators (dict): For a conditional request, the 'etag' and 'last_modified' values of the copy of the
+                           data already held. They are updated to the values of the data returned.
 
     Returns:
-        data (dict): Parsed JSON data from the API response.
+        data (dict): Parsed JSON data from the API response, or None for a conditional request if the data
+                     hasn't changed.
 
     Raises:
         ValueError: If no data is returned from the API.
@@ -24,64 +96,220 @@ def fetch_data_from_api(url: str):
         ConnectionError: If there's a problem connecting to the API.
         Exception: If an unexpected error occurs.
     """
+    # Imported here as requests is slow to import and isn't needed when the data is cached
+    import requests
+
+    endpoint = get_endpoint(url)
     try:
-        response = requests.get(url)
+        with span('api.request', path=url.split('?')[0]) as current:
+            start = time.perf_counter()
+            try:
+                response = get_session().get(url, headers=_conditional_headers(validators), timeout=REQUEST_TIMEOUT)
+            except requests.RequestException:
+                API_REQUESTS.inc(endpoint=endpoint, status='error')
+                raise
+            API_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
+            API_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+            current.set(status=response.status_code, bytes=len(response.content))
+        if response.status_code == 304 and validators:
+            return None
+        if validators is not None:
+            validators.clear()
+            validators.update({key: response.headers[header] for key, header in VALIDATOR_HEADERS.items() if header in response.headers})
         # Check if the response was successful
         if response.status_code == 200:
-            data = response.json()
+            with span('api.decode'):
+                data = response.json()
             if not data:
                 raise ValueError("No data returned from API")
             return data
         else:
-            raise requests.HTTPError(f"HTTP Error getting data from API: {response.status_code} - {response.reason}")
+            raise requests.HTTPError(f"HTTP Error getting data from API: {response.status_code} - {response.reason}", response=response)
+    except requests.HTTPError:
+        # HTTPError is a RequestException but the API did respond, so it isn't a connection problem
+        raise
     except requests.RequestException as e:
         raise ConnectionError(f"Failed to connect to API: {e}")
     except Exception as e:
         raise Exception(f"An unexpected error occurred getting data from API: {e}")
 
 
+class CoinListChanges:
+    """The coin IDs added, removed and changed (renamed or given a new symbol) by a coin list refresh."""
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self, added: List[str] = (), removed: List[str] = (), changed: List[str] = ()):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.changed = list(changed)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        if not self:
+            return "no changes"
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed"
+
+def diff_coin_lists(old: dict, new: dict) -> CoinListChanges:
+    """Compares two coin dictionaries, as returned by fetch_coin_list."""
+    return CoinListChanges(
+        added=sorted(new.keys() - old.keys()),
+        removed=sorted(old.keys() - new.keys()),
+        changed=sorted(coin_id for coin_id in old.keys() & new.keys() if old[coin_id] != new[coin_id])
+    )
+
+def _read_coin_list_cache():
+    """Loads the cached coin list whatever its age, leaving the list unset if there is no usable cache."""
+    global _coin_dict, _coin_dict_timestamp, _coin_list_validators
+    if not os.path.exists(CACHE_FILENAME):
+        return
+    with span('coin_list.load', source='file'):
+        try:
+            with open(CACHE_FILENAME, 'r') as file:
+                cached_data = json.load(file)
+            _coin_dict = cached_data['data']
+            _coin_dict_timestamp = cached_data['timestamp']
+            _coin_list_validators = cached_data.get('validators', {})
+        except (ValueError, KeyError, TypeError):
+            return  # A damaged cache is downloaded again
+        try:
+            with open(CHECKED_FILENAME, 'r') as file:
+                checked = json.load(file)
+            # Only a check made after the list was written applies to it
+            if checked['timestamp'] > _coin_dict_timestamp:
+                _coin_dict_timestamp = checked['timestamp']
+                _coin_list_validators = checked['validators']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+def _write_json(filename: str, data: dict):
+    # Written to a temporary file and moved into place so other processes never read a partly written file
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temporary_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_filename, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary_filename, filename)
+
+def _write_coin_list_cache(coin_dict: dict, timestamp: float, validators: dict):
+    _write_json(CACHE_FILENAME, {'data': coin_dict, 'timestamp': timestamp, 'validators': validators})
+
+def refresh_coin_list(force: bool = False) -> CoinListChanges:
+    """
+    Checks the API for changes to the coin list, updating the cache and the list used by this process.
+    The request is conditional unless force is set, so if the list hasn't changed since it was last
+    downloaded the API answers 304 Not Modified instead of sending the whole list again.
+
+    Returns:
+    CoinListChanges: The coins that changed, empty if the list hasn't changed.
+
+    Raises:
+    The same exceptions as fetch_data_from_api.
+    """
+    global _coin_dict, _coin_dict_timestamp, _coin_list_validators, _coin_list_attempted
+    with _refresh_lock:
+        _coin_list_attempted = time.time()
+        if _coin_dict is None:
+            _read_coin_list_cache()
+        validators = {} if force or _coin_dict is None else dict(_coin_list_validators)
+        with span('coin_list.load', source='api') as current:
+            try:
+                coin_list = fetch_data_from_api(get_api_url("/coins/list"), validators)
+            except Exception:
+                COIN_LIST_REFRESHES.inc(result='error')
+                raise
+            timestamp = time.time()
+
+            if coin_list is None:
+                current.set(modified=False)
+                COIN_LIST_REFRESHES.inc(result='not_modified')
+                changes = CoinListChanges()
+                coin_dict = _coin_dict
+                # The list is unchanged, so only the time it was confirmed is saved rather than the whole list
+                _write_json(CHECKED_FILENAME, {'timestamp': timestamp, 'validators': validators})
+            else:
+                current.set(modified=True)
+                COIN_LIST_REFRESHES.inc(result='modified')
+                # Convert list to a dictionary with id as key and another dict for symbol and name as value for faster lookups
+                coin_dict = {coin['id']: coin for coin in coin_list}
+                changes = diff_coin_lists(_coin_dict or {}, coin_dict)
+                _write_coin_list_cache(coin_dict, timestamp, validators)
+
+        # Replaced rather than updated in place, so lookups running in other threads see either list but never a mix
+        _coin_dict = coin_dict
+        _coin_dict_timestamp = timestamp
+        _coin_list_validators = validators
+        return changes
+
+def _refresh_in_background():
+    try:
+        refresh_coin_list()
+    except Exception as e:
+        print(f"Warning: Failed to refresh the coin list, using the cached list: {e}", file=sys.stderr)
+
+def start_background_refresh():
+    """
+    Refreshes the coin list in a background thread unless a refresh is already running or one was attempted
+    recently. The process waits for the refresh to finish before exiting, so a script that runs briefly
+    still updates the cache for the next run.
+    """
+    global _refresh_thread
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        return
+    if time.time() - _coin_list_attempted < MIN_REFRESH_INTERVAL:
+        return
+    _refresh_thread = threading.Thread(target=_refresh_in_background, name='coin-list-refresh')
+    _refresh_thread.start()
+
 def fetch_coin_list():
     """
     Fetches the list of all coins from the CoinGecko API, caches it,
     and converts it to a dictionary for quick lookups.
     Each coin's ID maps to another dictionary containing the 'symbol' and 'name'.
+    The list is kept in memory after the first call so later lookups don't re-read the cache.
+    Once the list is older than CACHE_EXPIRY it is still returned while it is refreshed in the background,
+    so only the first run without a cache waits for the download.
     """
-    if not os.path.exists(os.path.dirname(CACHE_FILENAME)):
-        os.makedirs(os.path.dirname(CACHE_FILENAME))
-
-    if os.path.exists(CACHE_FILENAME):
-        with open(CACHE_FILENAME, 'r') as file:
-            cached_data = json.load(file)
-            # Check if the cache has expired
-            if time.time() - cached_data['timestamp'] < CACHE_EXPIRY:
-                return cached_data['data']  # Return cached data if it's still valid
-
-    # If no cache exists or cache is expired, fetch new data from API
-    url = "https://api.coingecko.com/api/v3/coins/list"
-    coin_list = fetch_data_from_api(url)
-    # Convert list to a dictionary with id as key and another dict for symbol and name as value for faster lookups
-    coin_dict = {coin['id']: coin for coin in coin_list}
+    if _coin_dict is None:
+        _read_coin_list_cache()
 
-    # Save the fetched data to cache
-    with open(CACHE_FILENAME, 'w') as file:
-        json.dump({'data': coin_dict, 'timestamp': time.time()}, file)
+    if _coin_dict is None:
+        CACHE_LOOKUPS.inc(cache='coin_list', result='miss')
+        refresh_coin_list()
+        return _coin_dict
 
-    return coin_dict
+    CACHE_LOOKUPS.inc(cache='coin_list', result='hit')
+    if time.time() - _coin_dict_timestamp >= CACHE_EXPIRY:
+        start_background_refresh()
+    return _coin_dict
 
+def _refresh_for_unknown_id():
+    """Refreshes the coin list because a coin wasn't found in it, in case it has been listed since the last check."""
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        _refresh_thread.join()
+        return
+    if time.time() - max(_coin_dict_timestamp, _coin_list_attempted) < MIN_REFRESH_INTERVAL:
+        return
+    try:
+        refresh_coin_list()
+    except Exception as e:
+        print(f"Warning: Failed to refresh the coin list: {e}", file=sys.stderr)
 
-def fetch_price_data(ids: List[str], currencies: List[str] = ['aud', 'usd', 'btc', 'eth']) -> Dict[str, Dict[str, float]]:
+def fetch_price_data(ids: List[str], currencies: List[str] = ['aud', 'usd', 'btc', 'eth'], include_24hr_change: bool = True, allow_missing: bool = False) -> Dict[str, Dict[str, float]]:
     """
     Fetches cryptocurrency prices from the CoinGecko API for given IDs.
     
     Args:
     ids (list of str): List of cryptocurrency IDs as recognized by CoinGecko.
     currencies (list of str): List of currency IDs to fetch prices for.
+    include_24hr_change (bool): Whether to include the 24 hour change in each currency, as {currency}_24h_change.
+    allow_missing (bool): Whether to return the coins found when CoinGecko doesn't know some of the IDs, rather than raising.
 
     Returns:
     dict: A dictionary with cryptocurrency prices.
 
     Raises:
-    ValueError: If the API response is empty or not in expected format.
+    ValueError: If the API response is empty or not in expected format, or a coin ID wasn't found.
     HTTPError: If the API response status is not 200.
     ConnectionError: If there is a network problem (e.g., DNS failure, refused connection, etc).
     Exception: For other unforeseen errors.
@@ -92,14 +320,68 @@ def fetch_price_data(ids: List[str], currencies: List[str] = ['aud', 'usd', 'btc
 
     ids_str = ','.join(ids_set)
     currencies_str = ','.join(currencies_set)
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={ids_str}&vs_currencies={currencies_str}&include_market_cap=false&include_24hr_vol=false&include_24hr_change=true"
+    url = get_api_url(f"/simple/price?ids={ids_str}&vs_currencies={currencies_str}&include_market_cap=false&include_24hr_vol=false&include_24hr_change={'true' if include_24hr_change else 'false'}")
     data = fetch_data_from_api(url)
 
-    if len(ids_set) != len(data):
+    if len(ids_set) != len(data) and not allow_missing:
         raise ValueError("Not all coin IDs were found in the API response. Check that all coin IDs are valid. Run coinsearch.py to find valid IDs.")
 
     return data
 
+def fetch_exchange_rates() -> Dict[str, dict]:
+    """
+    Fetches the value of one bitcoin in each currency CoinGecko supports. The rates are reused for
+    EXCHANGE_RATES_EXPIRY seconds, since the rate between two fiat currencies changes slowly.
+
+    Returns:
+    dict: Rates by lowercase currency code, each a dict with 'value' and 'type' ('fiat', 'crypto' or 'commodity').
+
+    Raises:
+    ValueError: If the API response is not in the expected format.
+    HTTPError: If the API response status is not 200.
+    ConnectionError: If there is a network problem.
+    """
+    global _exchange_rates, _exchange_rates_timestamp
+
+    if _exchange_rates is not None and time.time() - _exchange_rates_timestamp < EXCHANGE_RATES_EXPIRY:
+        CACHE_LOOKUPS.inc(cache='exchange_rates', result='hit')
+        return _exchange_rates
+    CACHE_LOOKUPS.inc(cache='exchange_rates', result='miss')
+
+    data = fetch_data_from_api(get_api_url("/exchange_rates"))
+    if not isinstance(data, dict) or 'rates' not in data:
+        raise ValueError("No exchange rates returned.")
+
+    _exchange_rates = data['rates']
+    _exchange_rates_timestamp = time.time()
+    return _exchange_rates
+
+def fetch_market_chart(coin_id: str, currency: str, days: int) -> List[List[float]]:
+    """
+    Fetches the price history of a coin from the CoinGecko API.
+
+    Args:
+    coin_id (str): The CoinGecko ID of the coin.
+    currency (str): The currency to get prices in.
+    days (int): How many days of history to get. CoinGecko returns 5 minute prices for 1 day,
+                hourly prices for up to 90 days and daily prices beyond that.
+
+    Returns:
+    list: [timestamp in milliseconds, price] pairs, oldest first.
+
+    Raises:
+    ValueError: If the API response is empty or not in expected format.
+    HTTPError: If the API response status is not 200.
+    ConnectionError: If there is a network problem.
+    """
+    url = get_api_url(f"/coins/{coin_id.lower()}/market_chart?vs_currency={currency.lower()}&days={days}")
+    data = fetch_data_from_api(url)
+
+    if 'prices' not in data:
+        raise ValueError(f"No price history returned for {coin_id}.")
+
+    return data['prices']
+
 def get_coin_info(coin_id, info='all'):
     """
     Retrieves information for a given cryptocurrency ID from the cached coin dictionary.
@@ -113,6 +395,9 @@ def get_coin_info(coin_id, info='all'):
         str or dict: The requested information, or None if no matching ID is found.
     """
     coin_dict = fetch_coin_list()
+    if coin_id not in coin_dict:
+        _refresh_for_unknown_id()
+        coin_dict = _coin_dict
     if coin_id in coin_dict:
         if info == 'all':
             return coin_dict[coin_id]
@@ -0,0 +1,300 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+from typing import List, Tuple
+from metrics import RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track, write_textfile
+from pricecache import add_arguments as add_resilience_arguments
+from pricefeed import COALESCE_INTERVAL, PriceFeed, Streamer, TickCoalescer
+from pricerequest import fetch_planned_prices, plan_requests
+from scheduler import DEFAULT_BUDGET, MAX_INTERVAL, MIN_INTERVAL, Watcher, WatchJob
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+
+# Subcommands that run one of the tools, mapped to the module implementing it and its help text
+TOOLS = {
+    'portfolio': ('portfolio', "Display your portfolio's value."),
+    'pricealert': ('pricealert', "Alert when prices rise or fall by a percentage."),
+    'pricepercentalert': ('pricepercentalert', "Alert when prices change by a percentage over a window."),
+    'indicatoralert': ('indicatoralert', "Alert on technical indicator conditions."),
+    'fiatpurchase': ('fiatpurchase', "Show how much crypto a fiat amount buys."),
+    'optimaltrade': ('optimaltrade', "Show and alert on optimal trades between coins."),
+    'optimalpurchase': ('optimalpurchase', "Show and alert on optimal purchase prices.")
+}
+
+# Seconds stream waits for ticks before writing the metrics file anyway
+STREAM_IDLE_TIMEOUT = 60
+
+BASE_CURRENCY_HELP = "Fetch prices in CURRENCY and convert them to the other fiat currencies with CoinGecko's exchange rates, for a smaller response when configs use several fiat currencies."
+
+# Tools that can be run by watch and stream, which need to say which prices would change their output
+WATCH_TOOLS = ('pricealert', 'pricepercentalert', 'optimaltrade', 'optimalpurchase')
+
+def get_tool(name: str):
+    """Imports a tool's module on demand so each subcommand only pays for the dependencies it uses."""
+    return importlib.import_module(TOOLS[name][0])
+
+def parse_config_entry(entry: str) -> Tuple[str, str]:
+    """
+    Splits a run-all argument into the tool name and config path. Arguments are either 'tool:path',
+    or a path whose file name starts with the tool name such as config/portfolio.json.
+
+    Raises:
+    ValueError: If the tool can't be determined.
+    """
+    tool_name, separator, path = entry.partition(':')
+    if separator and tool_name in TOOLS:
+        return tool_name, path
+
+    file_name = os.path.basename(entry)
+    # Longest names first so a more specific tool name wins over one it starts with
+    for tool_name in sorted(TOOLS, key=len, reverse=True):
+        if file_name.startswith(tool_name):
+            return tool_name, entry
+    raise ValueError(f"Can't tell which tool '{entry}' is for. Use tool:path, for example portfolio:{entry}")
+
+def report_exit(tool_name: str, path: str, error: SystemExit) -> bool:
+    """Prints the message of a tool that exited. Returns whether it was a failure."""
+    if error.code is None or error.code == 0:
+        return False
+    message = error.code if isinstance(error.code, str) else f"exited with status {error.code}"
+    print(f"{tool_name} ({path}): {message}", file=sys.stderr)
+    return True
+
+def load_jobs(entries: List[Tuple[str, str]]) -> Tuple[list, list, bool]:
+    """
+    Loads the configs to run, reporting any that fail to load.
+
+    Returns:
+    tuple: The (tool name, path, tool, config, args) of each loaded config, the price request of each
+           as returned by its tool's get_price_request, and whether any failed to load.
+    """
+    jobs = []
+    requests = []
+    failed = False
+
+    for tool_name, path in entries:
+        tool = get_tool(tool_name)
+        try:
+            args = tool.parse_args([path])
+            with span('load', tool=tool_name, path=path):
+                config = tool.load(path)
+            requests.append(tool.get_price_request(config))
+        except SystemExit as e:
+            failed = report_exit(tool_name, path, e) or failed
+            continue
+        jobs.append((tool_name, path, tool, config, args))
+
+    return jobs, requests, failed
+
+def run_all(entries: List[Tuple[str, str]], base_currency: str = None, resilient: bool = False) -> int:
+    """
+    Runs several tool configs in one process. All configs are loaded first, then the prices every config needs
+    are fetched in a single API call and each tool is run against them. A config that fails to load or run, or
+    needs a coin the API didn't return, is reported and skipped without stopping the others, and a failed price
+    fetch is reported rather than exiting.
+
+    Args:
+    entries (list of tuple): (tool name, config path) pairs.
+    base_currency (str): Fetch prices in this currency and convert them to the other fiat currencies.
+    resilient (bool): Use cached prices if the API fails and skip coins without a price, see pricecache.py.
+
+    Returns:
+    int: The exit status, 1 if any config failed.
+    """
+    jobs, requests, failed = load_jobs(entries)
+    if not jobs:
+        return 1
+
+    try:
+        # An unknown coin only fails the configs that need it rather than the whole fetch
+        prices = fetch_planned_prices(plan_requests(requests, base_currency), resilient=resilient, allow_missing=True)
+    except SystemExit as e:
+        # Reported rather than raised so that with --interval a failed fetch is retried on the next run
+        print(e.code, file=sys.stderr)
+        return 1
+
+    for (tool_name, path, tool, config, args), (coin_ids, _, _) in zip(jobs, requests):
+        # A --resilient fetch has already warned about the coins it left out, and the tools skip them
+        missing = [] if resilient else sorted({coin_id.lower() for coin_id in coin_ids if coin_id.lower() not in prices})
+        if missing:
+            failed = report_exit(tool_name, path, SystemExit(f"Error: No prices found for {', '.join(missing)}. Check that all coin IDs are valid. Run coinsearch.py to find valid IDs.")) or failed
+            continue
+        try:
+            with span('run', tool=tool_name, path=path), track(RUNS, RUN_DURATION, tool=tool_name):
+                tool.run(config, prices, args)
+        except SystemExit as e:
+            failed = report_exit(tool_name, path, e) or failed
+
+    return 1 if failed else 0
+
+def watch(entries: List[Tuple[str, str]], budget: float, min_interval: float, max_interval: float, base_currency: str = None, resilient: bool = False) -> Watcher:
+    """
+    Loads configs to run continuously with adaptive polling, exiting if none load. A coin the API doesn't
+    return is polled again on its own, and only the configs that need it wait for it.
+
+    Returns:
+    Watcher: The watcher, each call to step() makes one price request.
+    """
+    jobs, requests, failed = load_jobs(entries)
+    if not jobs:
+        sys.exit(1)
+    plan = plan_requests(requests, base_currency)
+    watch_jobs = [WatchJob(tool_name, path, tool, config, args) for tool_name, path, tool, config, args in jobs]
+    watcher = Watcher(watch_jobs, plan.currencies, budget, min_interval, max_interval, on_exit=report_exit,
+                      fetch=lambda coin_ids, currencies: fetch_planned_prices(plan, coin_ids, resilient=resilient, allow_missing=True))
+    watcher.failed = failed
+    return watcher
+
+def stream(entries: List[Tuple[str, str]], url: str, interval: float) -> Tuple[Streamer, PriceFeed]:
+    """
+    Loads configs to run against prices pushed by a streaming ticker, exiting if none load. Prices are
+    fetched once from the API to start from, so configs can run before every coin has ticked.
+
+    Returns:
+    tuple: The streamer, each call to step() evaluates the ticks received since the last, and the feed,
+           which needs starting.
+    """
+    jobs, requests, failed = load_jobs(entries)
+    if not jobs:
+        sys.exit(1)
+    plan = plan_requests(requests)
+    prices = fetch_planned_prices(plan)
+    coalescer = TickCoalescer()
+    watch_jobs = [WatchJob(tool_name, path, tool, config, args) for tool_name, path, tool, config, args in jobs]
+    streamer = Streamer(watch_jobs, prices, coalescer, interval, on_exit=report_exit)
+    streamer.failed = failed
+    return streamer, PriceFeed(url, plan.coin_ids, plan.currencies, coalescer)
+
+def parse_watch_entries(parser, configs: List[str]) -> List[Tuple[str, str]]:
+    """Parses the configs given to watch or stream, exiting with a usage error if any are for a tool that can't be watched."""
+    try:
+        entries = [parse_config_entry(entry) for entry in configs]
+    except ValueError as e:
+        parser.error(str(e))
+    for tool_name, path in entries:
+        if tool_name not in WATCH_TOOLS:
+            parser.error(f"{tool_name} ({path}) can't be watched, only {', '.join(WATCH_TOOLS)} can")
+    return entries
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cointracker', description="Cryptocurrency portfolio tracking and alerting tools using CoinGecko data.")
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    for name, (_, help_text) in TOOLS.items():
+        # The tool parses its own arguments, so its options are left unrecognised here and passed through
+        subparsers.add_parser(name, help=f"{help_text} Takes the same arguments as {name}.py.", add_help=False)
+
+    subparsers.add_parser('search', help="Search for coin IDs by symbol.")
+    subparsers.add_parser('import', help="Import trades from exchange CSV exports into a portfolio config. Takes the same arguments as portfolioimport.py.", add_help=False)
+
+    refresh_parser = subparsers.add_parser('refresh-coins', help="Check CoinGecko for changes to the cached coin list.")
+    refresh_parser.add_argument('--force', action='store_true', help="Download the whole list even if it hasn't changed.")
+
+    run_all_parser = subparsers.add_parser('run-all', help="Run several configs with one coin list load and one price fetch.")
+    run_all_parser.add_argument('configs', nargs='+', metavar='[tool:]config_file', help="Config files to run, for example config/portfolio.json or pricealert:config/alerts.json.")
+    run_all_parser.add_argument('--interval', type=float, metavar='SECONDS', help="Keep running, running the configs again every SECONDS seconds.")
+    run_all_parser.add_argument('--base-currency', metavar='CURRENCY', help=BASE_CURRENCY_HELP)
+    add_resilience_arguments(run_all_parser)
+    run_all_parser.add_argument('--metrics-port', type=int, metavar='PORT', help="Serve metrics in the Prometheus text format at http://127.0.0.1:PORT/metrics while running.")
+    add_metrics_arguments(run_all_parser)
+    add_tracing_arguments(run_all_parser)
+
+    watch_parser = subparsers.add_parser('watch', help="Keep running alert configs, checking coins more often when they are close to an alert or moving fast.")
+    watch_parser.add_argument('configs', nargs='+', metavar='[tool:]config_file', help=f"Config files to watch, for the tools {', '.join(WATCH_TOOLS)}.")
+    watch_parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, metavar='REQUESTS', help=f"Price requests allowed per minute. Default: {DEFAULT_BUDGET}.")
+    watch_parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL, metavar='SECONDS', help=f"Shortest time between checks of a coin. Default: {MIN_INTERVAL}.")
+    watch_parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL, metavar='SECONDS', help=f"Longest time between checks of a coin. Default: {MAX_INTERVAL}.")
+    watch_parser.add_argument('--base-currency', metavar='CURRENCY', help=BASE_CURRENCY_HELP)
+    add_resilience_arguments(watch_parser)
+    watch_parser.add_argument('--metrics-port', type=int, metavar='PORT', help="Serve metrics in the Prometheus text format at http://127.0.0.1:PORT/metrics while running.")
+    add_metrics_arguments(watch_parser)
+    add_tracing_arguments(watch_parser)
+
+    stream_parser = subparsers.add_parser('stream', help="Keep running alert configs against prices pushed by a streaming ticker.")
+    stream_parser.add_argument('configs', nargs='+', metavar='[tool:]config_file', help=f"Config files to run, for the tools {', '.join(WATCH_TOOLS)}.")
+    stream_parser.add_argument('--url', required=True, help="The ticker's WebSocket URL, ws:// or wss://.")
+    stream_parser.add_argument('--coalesce', type=float, default=COALESCE_INTERVAL, metavar='SECONDS', help=f"Shortest time between evaluations of the configs, ticks in between are combined. Default: {COALESCE_INTERVAL}.")
+    stream_parser.add_argument('--metrics-port', type=int, metavar='PORT', help="Serve metrics in the Prometheus text format at http://127.0.0.1:PORT/metrics while running.")
+    add_metrics_arguments(stream_parser)
+    add_tracing_arguments(stream_parser)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args, remaining = parser.parse_known_args(argv)
+
+    if args.command in TOOLS:
+        get_tool(args.command).main(argv=remaining)
+        return
+    if args.command == 'import':
+        importlib.import_module('portfolioimport').main(argv=remaining)
+        return
+
+    if remaining:
+        parser.error(f"unrecognized arguments: {' '.join(remaining)}")
+
+    if args.command == 'search':
+        # coinsearch initialises colorama when imported, so it is only imported for this subcommand
+        importlib.import_module('coinsearch').main()
+    elif args.command == 'refresh-coins':
+        import coingecko
+        try:
+            changes = coingecko.refresh_coin_list(force=args.force)
+        except Exception as e:
+            sys.exit(f"Error: Failed to refresh the coin list: {e}")
+        print(f"Coin list refreshed: {changes}.")
+    elif args.command == 'run-all':
+        try:
+            entries = [parse_config_entry(entry) for entry in args.configs]
+        except ValueError as e:
+            parser.error(str(e))
+        if args.interval is not None and args.interval <= 0:
+            parser.error("--interval must be greater than 0")
+        with instrument(args, 'run-all'), exporting(args):
+            status = run_all(entries, args.base_currency, args.resilient)
+            try:
+                while args.interval:
+                    if args.metrics_file:
+                        write_textfile(args.metrics_file)
+                    time.sleep(args.interval)
+                    status = run_all(entries, args.base_currency, args.resilient)
+            except KeyboardInterrupt:
+                pass
+        sys.exit(status)
+    elif args.command == 'watch':
+        entries = parse_watch_entries(parser, args.configs)
+        if args.budget <= 0:
+            parser.error("--budget must be greater than 0")
+        if not 0 < args.min_interval <= args.max_interval:
+            parser.error("--min-interval must be greater than 0 and no more than --max-interval")
+        with instrument(args, 'watch'), exporting(args):
+            watcher = watch(entries, args.budget, args.min_interval, args.max_interval, args.base_currency, args.resilient)
+            try:
+                while True:
+                    watcher.step()
+                    if args.metrics_file:
+                        write_textfile(args.metrics_file)
+            except KeyboardInterrupt:
+                pass
+        sys.exit(1 if watcher.failed else 0)
+    elif args.command == 'stream':
+        entries = parse_watch_entries(parser, args.configs)
+        if args.coalesce < 0:
+            parser.error("--coalesce can't be negative")
+        with instrument(args, 'stream'), exporting(args):
+            streamer, feed = stream(entries, args.url, args.coalesce)
+            feed.start()
+            try:
+                while True:
+                    streamer.step(timeout=STREAM_IDLE_TIMEOUT)
+                    if args.metrics_file:
+                        write_textfile(args.metrics_file)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                feed.stop()
+        sys.exit(1 if streamer.failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Tuple
+from utils import merge_configurations
+from metrics import CACHE_LOOKUPS
+from tracing import span
+
+# A stamp for each validated config is saved here so later runs can skip validating an unchanged file. Only the
+# stamp is kept, not the config, which can hold SMTP passwords. JSON rather than pickle, as unpickling a file from
+# a writable directory could run any code put there.
+CACHE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'cache', 'config')
+
+class ConfigError(ValueError):
+    """Raised when a config file is missing, can't be decoded or fails validation. The message is ready to show the user."""
+
+# Compiled validators and schema fingerprints by id(schema). The schema is kept in each entry so its id can't be reused.
+_validators: Dict[int, Tuple[dict, object]] = {}
+_fingerprints: Dict[int, Tuple[dict, str]] = {}
+# Validated configs by absolute path along with the file key they were loaded from
+_configs: Dict[str, Tuple[tuple, dict]] = {}
+
+def get_validator(schema: dict):
+    """Returns a validator for the schema, checking and compiling the schema only the first time it's seen."""
+    entry = _validators.get(id(schema))
+    if entry is None:
+        # jsonschema is slow to import so it's only loaded when a config actually needs validating
+        from jsonschema import validators
+        validator_class = validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        entry = _validators[id(schema)] = (schema, validator_class(schema))
+    return entry[1]
+
+def _fingerprint(schema: dict) -> str:
+    entry = _fingerprints.get(id(schema))
+    if entry is None:
+        entry = _fingerprints[id(schema)] = (schema, hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest())
+    return entry[1]
+
+def file_key(path: str) -> tuple:
+    """
+    Returns the key a config file is cached under. A change to the file's modification time or size invalidates it.
+
+    Raises:
+    ConfigError: If the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise ConfigError(f"Error: The file '{path}' does not exist.")
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _cache_filename(path: str) -> str:
+    return os.path.join(CACHE_DIRECTORY, hashlib.sha1(path.encode()).hexdigest() + '.json')
+
+def _read_stamp(filename: str) -> Optional[dict]:
+    try:
+        with open(filename, 'r') as file:
+            stamp = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return stamp if isinstance(stamp, dict) else None
+
+def _is_validated(path: str, key: tuple, fingerprint: str, digest: str) -> bool:
+    """Returns whether the disk cache has a stamp saying the file, as it is now, passed validation against the schema."""
+    stamp = _read_stamp(_cache_filename(path))
+    return stamp is not None and stamp.get('path') == path and stamp.get('key') == list(key) and stamp.get('fingerprint') == fingerprint and stamp.get('digest') == digest
+
+def _prune_disk_cache():
+    """Removes the stamps of config files that no longer exist, and configs saved whole by older versions."""
+    for name in os.listdir(CACHE_DIRECTORY):
+        filename = os.path.join(CACHE_DIRECTORY, name)
+        stamp = _read_stamp(filename)
+        if stamp is not None and ('config' in stamp or not os.path.exists(str(stamp.get('path')))):
+            os.remove(filename)
+
+def _write_disk_cache(path: str, key: tuple, fingerprint: str, digest: str):
+    # The cache is only an optimisation so failing to write it is not an error
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        # Written on a miss, which is rare enough to also tidy up the stamps that are no longer needed
+        _prune_disk_cache()
+        temp_filename = f"{_cache_filename(path)}.{os.getpid()}.tmp"
+        with open(temp_filename, 'w') as file:
+            json.dump({'path': path, 'key': list(key), 'fingerprint': fingerprint, 'digest': digest}, file)
+        os.replace(temp_filename, _cache_filename(path))
+    except OSError:
+        pass
+
+def _parse(data: bytes, default_config: Optional[dict]) -> dict:
+    try:
+        with span('config.parse'):
+            config = json.loads(data)
+    except json.JSONDecodeError:
+        raise ConfigError("Error: Failed to decode JSON from the provided file.")
+
+    if default_config is not None:
+        config = merge_configurations(default_config, config)
+    return config
+
+def _parse_and_validate(data: bytes, schema: dict, default_config: Optional[dict]) -> dict:
+    from jsonschema.exceptions import best_match
+
+    config = _parse(data, default_config)
+    with span('config.validate'):
+        error = best_match(get_validator(schema).iter_errors(config))
+    if error is not None:
+        error_path = " -> ".join(map(str, error.path))
+        raise ConfigError(f"Error: Configuration file validation failed at '{error_path}': {error.message}. Look at the sample configs to see how to structure the configuration.")
+    return config
+
+def load_config(path: str, schema: dict, default_config: Optional[dict] = None, use_cache: bool = True) -> dict:
+    """
+    Loads a JSON config file, merges it over the defaults and validates it against the schema.
+
+    Results are cached in memory by path, modification time and size, so loading an unchanged file again skips
+    parsing and validation. A stamp is also saved on disk with a hash of the file, so later runs only parse an
+    unchanged file again rather than validating it. The returned config is shared with the cache and must not be modified.
+
+    Args:
+    path (str): Path to the config file.
+    schema (dict): The tool's JSON schema.
+    default_config (dict): Optional top level defaults for keys missing from the file.
+    use_cache (bool): Whether to use the cache.
+
+    Returns:
+    dict: The validated config.
+
+    Raises:
+    ConfigError: If the file is missing, isn't valid JSON or fails validation.
+    """
+    key = file_key(path)
+    path = os.path.abspath(path)
+    fingerprint = _fingerprint(schema)
+    if default_config:
+        fingerprint = hashlib.sha1((fingerprint + json.dumps(default_config, sort_keys=True, default=str)).encode()).hexdigest()
+    cache_key = (key, fingerprint)
+
+    with span('config.load', path=path) as current:
+        if use_cache:
+            cached = _configs.get(path)
+            if cached is not None and cached[0] == cache_key:
+                current.set(cache='memory')
+                CACHE_LOOKUPS.inc(cache='config', result='hit')
+                return cached[1]
+
+        with open(path, 'rb') as file:
+            data = file.read()
+        digest = hashlib.sha1(data).hexdigest()
+
+        if use_cache:
+            if _is_validated(path, key, fingerprint, digest):
+                config = _parse(data, default_config)
+                current.set(cache='disk')
+                CACHE_LOOKUPS.inc(cache='config', result='hit')
+                _configs[path] = (cache_key, config)
+                return config
+            CACHE_LOOKUPS.inc(cache='config', result='miss')
+
+        current.set(cache='miss')
+        config = _parse_and_validate(data, schema, default_config)
+
+        if use_cache:
+            _configs[path] = (cache_key, config)
+            _write_disk_cache(path, key, fingerprint, digest)
+        return config
+
+def clear_cache():
+    """Forgets all configs cached in memory. Mainly for tests."""
+    _configs.clear()
+
+class ConfigWatcher:
+    """
+    Holds a config for a long running process and reloads it when the file changes.
+
+    If a changed file fails to load, the last good config is kept and the error is raised from reload_if_changed.
+    """
+
+    def __init__(self, path: str, schema: dict, default_config: Optional[dict] = None):
+        self.path = path
+        self.schema = schema
+        self.default_config = default_config
+        self.key = file_key(path)
+        self.config = load_config(path, schema, default_config)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Checks the file and reloads it if it has changed.
+
+        Returns:
+        bool: Whether a new config was loaded.
+
+        Raises:
+        ConfigError: If the changed file fails to load.
+        """
+        key = file_key(self.path)
+        if key == self.key:
+            return False
+        self.key = key
+        self.config = load_config(self.path, self.schema, self.default_config)
+        return True
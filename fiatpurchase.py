@@ -1,11 +1,12 @@
-import json
-import os
 import sys
 import argparse
-from prettytable import PrettyTable
 import coingecko
-from utils import validate_currency_prices, merge_configurations, get_currency_symbol, format_currency
-from jsonschema import validate, ValidationError
+from utils import fetch_prices, get_formatter, get_arithmetic
+from configloader import load_config, ConfigError
+from metrics import RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from pricecache import add_arguments as add_resilience_arguments
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from output import add_format_argument, render_table, write_records
 
 config_schema = {
     "type": "object",
@@ -49,57 +50,56 @@ config_schema = {
     "required": ["purchases"]
 }
 
+default_config = {
+    'purchases': []
+}
 
-def parse_arguments():
+def parse_args(argv=None):
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description="Shows how much crypto can be purchased for an equivalent fiat amount.")
     parser.add_argument("config_file", help="Path to the configuration JSON file. See config/fiatpurchase.json.example for an example.")
-    return parser.parse_args()
-
-def main():
-    args = parse_arguments()
-    config_path = args.config_file
-
-    if not os.path.exists(config_path):
-        sys.exit(f"Error: The file '{config_path}' does not exist.")
-
-    default_config = {
-        'purchases': []
-    }
-
-    try:
-        with open(config_path, 'r') as file:
-            config = json.load(file)
-            config = merge_configurations(default_config, config)
-    except Exception as e:
-        print(f"Config file error: {str(e)}")
-        sys.exit(1)
-
+    parser.add_argument("--precise", action="store_true", help="Use exact decimal arithmetic with amounts rounded to each currency's minor unit.")
+    add_format_argument(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    return parser.parse_args(argv)
+
+def load(config_path):
+    """Loads and validates the config, exiting with an error message if it can't be used."""
     try:
-        validate(instance=config, schema=config_schema)
-    except ValidationError as e:
-        error_path = " -> ".join(map(str, e.path))
-        sys.exit(f"Error: Configuration file validation failed at '{error_path}': {e.message}. Look at the sample configs to see how to structure the configuration.")
+        config = load_config(config_path, config_schema, default_config)
+    except ConfigError as e:
+        sys.exit(str(e))
 
     if not config['purchases']:
         sys.exit("Error: No purchases found in the configuration.")
 
+    return config
+
+def get_price_request(config):
+    """Returns the coin IDs and currencies the purchases need prices for, and the currencies they need the 24 hour change in (none)."""
     # Gather all exchange coin IDs and ensure they are unique
     coin_ids = list(set(p['coinId'] for p in config['purchases']))
 
     # Extract unique currencies from the configuration
     currencies = list(set(p['currency'] for p in config['purchases']))
 
-    try:
-        prices = coingecko.fetch_price_data(coin_ids, currencies)
-        validate_currency_prices(prices, currencies)
-    except Exception as e:
-        print(str(e))
-        sys.exit(1)
+    return coin_ids, currencies, []
 
-    table = PrettyTable()
-    table.field_names = ["Currency", "Currency Amount", "Symbol", "Units", "Unit Price"]
+# Machine readable output fields and the table columns rendered from them
+fields = ["coin_id", "symbol", "currency", "currency_amount", "units", "unit_price"]
 
+table_columns = [
+    ("Currency", lambda record: record['currency']),
+    ("Currency Amount", lambda record: get_formatter(record['currency'])(record['currency_amount'])),
+    ("Symbol", lambda record: record['symbol']),
+    ("Units", lambda record: f"{record['units']:.4f}"),
+    ("Unit Price", lambda record: get_formatter(record['currency'])(record['unit_price']))
+]
+
+def iter_purchases(config, prices, to_number, round_amount):
+    """Yields a record for each purchase with a price, giving the units and currency amount it works out to."""
     for purchase in config['purchases']:
         currency = purchase['currency'].lower()
         coin_data = prices.get(purchase['coinId'], {})
@@ -108,25 +108,49 @@ def main():
         if coin_price == 0:
             continue
 
-        currency_symbol = get_currency_symbol(currency)
-
-        units = int(purchase.get('unitAmount', 0))
-        currency_amount = int(purchase.get('currencyAmount', 0))
+        coin_price = to_number(coin_price)
+        units = to_number(purchase.get('unitAmount', 0))
+        currency_amount = to_number(purchase.get('currencyAmount', 0))
 
         if units > 0:
-            currency_amount = units * coin_price
+            currency_amount = round_amount(units * coin_price, currency)
         else:
             units = currency_amount / coin_price
 
-        table.add_row([
-            currency.upper(),
-            f"{currency_symbol}{format_currency(currency_amount)}",
-            coingecko.get_coin_symbol(purchase['coinId']),
-            f"{units:.4f}",
-            f"{currency_symbol}{format_currency(coin_price)}"
-        ])
+        yield {
+            'coin_id': purchase['coinId'],
+            'symbol': coingecko.get_coin_symbol(purchase['coinId']),
+            'currency': currency.upper(),
+            'currency_amount': currency_amount,
+            'units': units,
+            'unit_price': coin_price
+        }
 
-    print(table)
+def run(config, prices, args):
+    """Prints how much of each coin the configured amounts buy at the given prices."""
+    to_number, round_amount = get_arithmetic(args.precise)
+    records = iter_purchases(config, prices, to_number, round_amount)
+
+    if args.format != 'table':
+        # Rows are calculated as they are written, so this span covers both
+        with span('render', format=args.format):
+            write_records(records, fields, args.format)
+        return
+
+    with span('compute'):
+        records = list(records)
+    with span('render'):
+        output = render_table(records, table_columns)
+    print(output)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with instrument(args, 'fiatpurchase'), exporting(args):
+        with span('load'):
+            config = load(args.config_file)
+        prices = fetch_prices(*get_price_request(config), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='fiatpurchase'):
+            run(config, prices, args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,207 @@
+import json
+import os
+import sys
+from argparse import ArgumentParser
+import coingecko
+from utils import fetch_prices, get_formatter
+from configloader import load_config, ConfigError
+from metrics import ALERTS_FIRED, NOTIFICATIONS, NOTIFICATION_DURATION, RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from pricecache import add_arguments as add_resilience_arguments
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from indicators import CONDITION_TYPES, condition_key, create_condition
+
+config_schema = {
+    "type": "object",
+    "properties": {
+        "coins": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "coinId": {
+                        "type": "string",
+                        "minLength": 1
+                    },
+                    "currency": {
+                        "type": "string",
+                        "minLength": 3
+                    },
+                    "conditions": {
+                        "type": "array",
+                        "minItems": 1,
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "type": {
+                                    "enum": list(CONDITION_TYPES)
+                                },
+                                "fast": {"type": "integer", "minimum": 1},
+                                "slow": {"type": "integer", "minimum": 2},
+                                "period": {"type": "integer", "minimum": 2},
+                                "above": {"type": "number", "minimum": 0, "maximum": 100},
+                                "below": {"type": "number", "minimum": 0, "maximum": 100},
+                                "stdDev": {"type": "number", "exclusiveMinimum": 0}
+                            },
+                            "required": ["type"]
+                        }
+                    }
+                },
+                "required": ["coinId", "currency", "conditions"]
+            }
+        },
+        "sendEmail": {
+            "type": "boolean"
+        },
+        "email": {
+            "type": "string",
+            "format": "email"
+        },
+        "smtp": {
+            "type": "object",
+            "properties": {
+                "host": {
+                    "type": "string",
+                    "minLength": 1
+                },
+                "port": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "maximum": 65535
+                },
+                "username": {
+                    "type": "string"
+                },
+                "password": {
+                    "type": "string"
+                }
+            },
+            "required": ["host", "port", "username", "password"]
+        }
+    },
+    "required": ["coins", "sendEmail", "email", "smtp"]
+}
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Track technical indicators (EMA crossovers, RSI, Bollinger bands) for cryptocurrencies and send alerts.")
+    parser.add_argument('config_file', type=str, help="Path to the configuration JSON file. See config/indicatoralert.json.example for an example.")
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    return parser.parse_args(argv)
+
+def send_email(config, message):
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    msg = MIMEMultipart()
+    msg['From'] = config['email']
+    msg['To'] = config['email']
+    msg['Subject'] = "Coin Indicator Alert"
+    msg.attach(MIMEText(message, 'plain'))
+    try:
+        with span('notify'), track(NOTIFICATIONS, NOTIFICATION_DURATION, tool='indicatoralert'), smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
+            server.starttls()
+            server.login(config['smtp']['username'], config['smtp']['password'])
+            server.send_message(msg)
+            print("Email sent successfully.")
+    except Exception as e:
+        sys.exit(f"Failed to send email: {e}")
+
+def load(config_file):
+    """Loads and validates the config, exiting with an error message if it can't be used."""
+    try:
+        config = load_config(config_file, config_schema)
+    except ConfigError as e:
+        sys.exit(str(e))
+
+    if not config['coins']:
+        sys.exit("Error: No coins specified in the configuration.")
+
+    return config
+
+def get_price_request(config):
+    """Returns the coin IDs and currencies the coins need prices for, and the currencies they need the 24 hour change in (none)."""
+    coin_ids = [coin['coinId'] for coin in config['coins']]
+    currencies = list(set(coin['currency'] for coin in config['coins']))
+    return coin_ids, currencies, []
+
+def run(config, prices, args, cache_directory=None):
+    """Feeds the given prices to each coin's indicator conditions as one tick, printing and sending any alerts."""
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(__file__), 'cache')
+
+    state_filename = os.path.join(cache_directory, 'indicator_state.json')
+
+    if not os.path.exists(cache_directory):
+        os.makedirs(cache_directory)
+
+    if os.path.exists(state_filename):
+        try:
+            with open(state_filename, 'r') as file:
+                with span('state.load'):
+                    indicator_state = json.load(file)
+        except json.JSONDecodeError:
+            sys.exit("Error: Failed to decode JSON from the indicator state file.")
+    else:
+        indicator_state = {}
+
+    alert = False
+    output = ""
+    new_state = {}
+
+    # Each run is one tick: every condition consumes the current price and its state is carried to the next run
+    with span('compute', coins=len(config['coins'])):
+        for coin in config['coins']:
+            coin_id = coin['coinId']
+            currency = coin['currency'].lower()
+            if coin_id not in prices:
+                # Left out by a --resilient fetch, which has already warned about it. Its indicators keep their
+                # state so they don't warm up again, or fire again as if new, once its price is back.
+                for condition_config in coin['conditions']:
+                    key = condition_key(coin_id, currency, condition_config)
+                    if key in indicator_state:
+                        new_state[key] = indicator_state[key]
+                continue
+            current_price = prices.get(coin_id, {}).get(currency, 0)
+            if current_price == 0:
+                sys.exit(f"Error: No price data for {coin_id} in {currency.upper()}.")
+
+            messages = []
+            for condition_config in coin['conditions']:
+                key = condition_key(coin_id, currency, condition_config)
+                if key in new_state:
+                    continue  # The same condition is configured twice for this coin, only tick it once
+                condition = create_condition(condition_config, indicator_state.get(key))
+                message = condition.update(current_price)
+                new_state[key] = condition.to_dict()
+                if message:
+                    messages.append(message)
+
+            if messages:
+                ALERTS_FIRED.inc(len(messages), tool='indicatoralert', kind='indicator')
+                output += f"{coingecko.get_coin_symbol(coin_id)} is now {currency.upper()} {get_formatter(currency)(current_price)}: {'; '.join(messages)}\n"
+                alert = True
+
+    try:
+        with span('state.save'), open(state_filename, 'w') as file:
+            json.dump(new_state, file)
+    except Exception as e:
+        sys.exit(f"Failed to write indicator state: {e}")
+
+    if alert:
+        print(output)
+        if config['sendEmail']:
+            send_email(config, output)
+
+def main(cache_directory=None, argv=None):
+    args = parse_args(argv)
+    with instrument(args, 'indicatoralert'), exporting(args):
+        with span('load'):
+            config = load(args.config_file)
+        prices = fetch_prices(*get_price_request(config), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='indicatoralert'):
+            run(config, prices, args, cache_directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import json
+import math
+from collections import deque
+from typing import Optional, Tuple
+
+class EMA:
+    """Exponential moving average updated one price at a time."""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.value = None
+        self.count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.period
+
+    def update(self, price: float) -> float:
+        if self.value is None:
+            self.value = price
+        else:
+            self.value += self.alpha * (price - self.value)
+        self.count += 1
+        return self.value
+
+    def to_dict(self) -> dict:
+        return {'value': self.value, 'count': self.count}
+
+    def load(self, state: dict):
+        self.value = state['value']
+        self.count = state['count']
+
+class RSI:
+    """
+    Relative strength index using Wilder's smoothing. The first period changes are averaged,
+    after that each new price adjusts the averages in constant time.
+    """
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.previous_price = None
+        self.average_gain = 0.0
+        self.average_loss = 0.0
+        self.count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.period
+
+    @property
+    def value(self) -> Optional[float]:
+        if not self.ready:
+            return None
+        if self.average_loss == 0:
+            return 100.0
+        return 100 - 100 / (1 + self.average_gain / self.average_loss)
+
+    def update(self, price: float) -> Optional[float]:
+        if self.previous_price is not None:
+            change = price - self.previous_price
+            gain = max(change, 0)
+            loss = max(-change, 0)
+            self.count += 1
+            if self.count <= self.period:
+                # Simple average while warming up
+                self.average_gain += (gain - self.average_gain) / self.count
+                self.average_loss += (loss - self.average_loss) / self.count
+            else:
+                self.average_gain = (self.average_gain * (self.period - 1) + gain) / self.period
+                self.average_loss = (self.average_loss * (self.period - 1) + loss) / self.period
+        self.previous_price = price
+        return self.value
+
+    def to_dict(self) -> dict:
+        return {'previousPrice': self.previous_price, 'averageGain': self.average_gain, 'averageLoss': self.average_loss, 'count': self.count}
+
+    def load(self, state: dict):
+        self.previous_price = state['previousPrice']
+        self.average_gain = state['averageGain']
+        self.average_loss = state['averageLoss']
+        self.count = state['count']
+
+class BollingerBands:
+    """
+    Bollinger bands over the last period prices. A running sum and sum of squares are kept
+    alongside the window so each update is constant time.
+    """
+
+    def __init__(self, period: int = 20, std_dev: float = 2):
+        self.period = period
+        self.std_dev = std_dev
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return len(self.window) == self.period
+
+    @property
+    def bands(self) -> Optional[Tuple[float, float, float]]:
+        """Returns (lower, middle, upper) once the window is full, otherwise None."""
+        if not self.ready:
+            return None
+        mean = self.total / self.period
+        variance = max(self.total_squares / self.period - mean * mean, 0)
+        width = self.std_dev * math.sqrt(variance)
+        return mean - width, mean, mean + width
+
+    def update(self, price: float) -> Optional[Tuple[float, float, float]]:
+        if len(self.window) == self.period:
+            oldest = self.window[0]
+            self.total -= oldest
+            self.total_squares -= oldest * oldest
+        self.window.append(price)
+        self.total += price
+        self.total_squares += price * price
+        return self.bands
+
+    def to_dict(self) -> dict:
+        return {'window': list(self.window)}
+
+    def load(self, state: dict):
+        self.window.clear()
+        self.total = 0.0
+        self.total_squares = 0.0
+        for price in state['window'][-self.period:]:
+            self.update(price)
+
+class EmaCrossCondition:
+    """Fires when the fast EMA crosses above or below the slow EMA."""
+
+    def __init__(self, config: dict):
+        self.fast = EMA(config.get('fast', 12))
+        self.slow = EMA(config.get('slow', 26))
+        self.above = None  # Whether the fast EMA was above the slow EMA on the previous tick
+
+    def update(self, price: float) -> Optional[str]:
+        fast = self.fast.update(price)
+        slow = self.slow.update(price)
+        if not self.slow.ready or fast == slow:
+            return None
+
+        above = fast > slow
+        crossed = self.above is not None and above != self.above
+        self.above = above
+        if crossed:
+            direction = "above" if above else "below"
+            return f"EMA({self.fast.period}) crossed {direction} EMA({self.slow.period})"
+        return None
+
+    def to_dict(self) -> dict:
+        return {'fast': self.fast.to_dict(), 'slow': self.slow.to_dict(), 'above': self.above}
+
+    def load(self, state: dict):
+        self.fast.load(state['fast'])
+        self.slow.load(state['slow'])
+        self.above = state['above']
+
+class RsiCondition:
+    """Fires when the RSI moves above the 'above' level or below the 'below' level."""
+
+    def __init__(self, config: dict):
+        self.rsi = RSI(config.get('period', 14))
+        self.above = config.get('above', 70)
+        self.below = config.get('below', 30)
+        self.zone = None  # 'above', 'below' or 'inside' on the previous tick
+
+    def update(self, price: float) -> Optional[str]:
+        value = self.rsi.update(price)
+        if value is None:
+            return None
+
+        if value > self.above:
+            zone = 'above'
+        elif value < self.below:
+            zone = 'below'
+        else:
+            zone = 'inside'
+
+        entered = zone != 'inside' and zone != self.zone
+        self.zone = zone
+        if entered:
+            level = self.above if zone == 'above' else self.below
+            return f"RSI({self.rsi.period}) is {value:.2f}, {zone} {level}"
+        return None
+
+    def to_dict(self) -> dict:
+        return {'rsi': self.rsi.to_dict(), 'zone': self.zone}
+
+    def load(self, state: dict):
+        self.rsi.load(state['rsi'])
+        self.zone = state['zone']
+
+class BollingerCondition:
+    """Fires when the price breaks out above the upper band or below the lower band."""
+
+    def __init__(self, config: dict):
+        self.bands = BollingerBands(config.get('period', 20), config.get('stdDev', 2))
+        self.zone = None
+
+    def update(self, price: float) -> Optional[str]:
+        # Compare against the bands before this price is added so a breakout isn't diluted by itself
+        bands = self.bands.bands
+        self.bands.update(price)
+        if bands is None:
+            return None
+
+        lower, _, upper = bands
+        if price > upper:
+            zone = 'above'
+        elif price < lower:
+            zone = 'below'
+        else:
+            zone = 'inside'
+
+        entered = zone != 'inside' and zone != self.zone
+        self.zone = zone
+        if entered:
+            band = upper if zone == 'above' else lower
+            return f"Price broke {zone} the Bollinger band ({self.bands.period}, {self.bands.std_dev}) at {band:,.4f}"
+        return None
+
+    def to_dict(self) -> dict:
+        return {'bands': self.bands.to_dict(), 'zone': self.zone}
+
+    def load(self, state: dict):
+        self.bands.load(state['bands'])
+        self.zone = state['zone']
+
+CONDITION_TYPES = {
+    'emaCross': EmaCrossCondition,
+    'rsi': RsiCondition,
+    'bollinger': BollingerCondition
+}
+
+def condition_key(coin_id: str, currency: str, config: dict) -> str:
+    """
+    Returns the key a condition's streaming state is stored under. The parameters are part of the key
+    so editing a condition in the config starts it with fresh state.
+    """
+    return f"{coin_id}-{currency.lower()}-{json.dumps(config, sort_keys=True, separators=(',', ':'))}"
+
+def create_condition(config: dict, state: Optional[dict] = None):
+    """
+    Creates an indicator condition from its config, restoring any saved state.
+
+    Raises:
+    ValueError: If the condition type is unknown.
+    """
+    condition_type = CONDITION_TYPES.get(config.get('type'))
+    if condition_type is None:
+        raise ValueError(f"Unknown indicator condition type '{config.get('type')}'.")
+    condition = condition_type(config)
+    if state:
+        condition.load(state)
+    return condition
@@ -0,0 +1,271 @@
+"""
+In-process metrics in the Prometheus text format, for watching the tools when they run continuously.
+
+Metrics are always recorded, which costs a dictionary update per event, and are only exported when asked
+to: --metrics-file writes them to a file when a tool finishes, for the node_exporter textfile collector,
+and cointracker run-all --metrics-port serves them over HTTP at /metrics while it runs.
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Bucket upper bounds in seconds
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+NOTIFICATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RUN_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """A named metric with a value for each combination of its label values."""
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labels) or 'none'}, got {', '.join(labels) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Returns the (name, labels, value) samples to export."""
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+class Counter(_Metric):
+    """A count that only goes up, such as the number of API requests."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    """A value that can go up and down, such as the number of coins tracked."""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Histogram(_Metric):
+    """
+    A distribution of values, such as request durations, counted in fixed buckets. Observing a value is a
+    binary search over the bucket bounds and an increment, the cumulative counts are only added up on export.
+
+    Args:
+    buckets (sequence of float): Upper bounds of the buckets in increasing order. A +Inf bucket is added.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = API_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per bucket counts, followed by the sum and count of all values
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def get(self, **labels) -> Tuple[float, int]:
+        """Returns the sum and count of the values observed."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[-2], state[-1]) if state else (0.0, 0)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the code run inside it takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+
+        samples = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _format_labels(self.labels, key, f'le="{_format_value(bound)}"'), cumulative))
+            labels = _format_labels(self.labels, key)
+            samples.append((f"{self.name}_sum", labels, state[-2]))
+            samples.append((f"{self.name}_count", labels, state[-1]))
+        return samples
+
+class Registry:
+    """The metrics of this process, in the order they were registered."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric named {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def clear(self):
+        """Resets every metric, keeping them registered."""
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+API_REQUESTS = REGISTRY.register(Counter('cointracker_api_requests_total', "CoinGecko API requests by endpoint and HTTP status, 'error' if there was no response.", ['endpoint', 'status']))
+API_DURATION = REGISTRY.register(Histogram('cointracker_api_request_duration_seconds', "Time taken by CoinGecko API requests.", ['endpoint'], API_BUCKETS))
+CACHE_LOOKUPS = REGISTRY.register(Counter('cointracker_cache_lookups_total', "Config and coin list cache lookups by whether they hit.", ['cache', 'result']))
+COIN_LIST_REFRESHES = REGISTRY.register(Counter('cointracker_coin_list_refreshes_total', "Coin list refreshes by whether the list had changed, or 'error'.", ['result']))
+SOURCE_REQUESTS = REGISTRY.register(Counter('cointracker_price_source_requests_total', "Requests to each configured price source by whether they succeeded.", ['source', 'result']))
+SOURCE_DURATION = REGISTRY.register(Histogram('cointracker_price_source_request_duration_seconds', "Time taken by successful requests to each configured price source.", ['source'], API_BUCKETS))
+HEDGED_REQUESTS = REGISTRY.register(Counter('cointracker_hedged_requests_total', "Requests made to a price source because the one before it was slow.", ['source']))
+FEED_CONNECTIONS = REGISTRY.register(Counter('cointracker_feed_connections_total', "Price feed connections opened, 'connected', and lost or failed to open, 'error'.", ['result']))
+TICKS = REGISTRY.register(Counter('cointracker_feed_ticks_total', "Price ticks received from the price feed."))
+COINS_TRACKED = REGISTRY.register(Gauge('cointracker_coins_tracked', "Number of coins in the last price fetch."))
+ALERTS_FIRED = REGISTRY.register(Counter('cointracker_alerts_fired_total', "Alerts raised by each tool, by the kind of alert.", ['tool', 'kind']))
+NOTIFICATIONS = REGISTRY.register(Counter('cointracker_notifications_total', "Alert emails sent by each tool, by whether sending succeeded.", ['tool', 'result']))
+NOTIFICATION_DURATION = REGISTRY.register(Histogram('cointracker_notification_duration_seconds', "Time taken to send alert emails.", ['tool'], NOTIFICATION_BUCKETS))
+RUNS = REGISTRY.register(Counter('cointracker_runs_total', "Tool runs by whether they succeeded.", ['tool', 'result']))
+RUN_DURATION = REGISTRY.register(Histogram('cointracker_run_duration_seconds', "Time taken by tool runs, after prices are fetched.", ['tool'], RUN_BUCKETS))
+
+@contextmanager
+def track(counter: Counter, histogram: Histogram, **labels):
+    """
+    Times the code run inside it with histogram and counts it with counter, labelled with result 'ok', or
+    'error' if it raises an exception or exits with an error.
+    """
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        yield
+        result = 'ok'
+    except SystemExit as e:
+        if e.code is None or e.code == 0:
+            result = 'ok'
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+        counter.inc(result=result, **labels)
+
+def write_textfile(path: str, registry: Registry = REGISTRY):
+    """
+    Writes the metrics to a file. The file is replaced in one step, so a collector reading it never sees
+    a partly written file. For the node_exporter textfile collector the file name must end in .prom.
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as file:
+        file.write(registry.render())
+    os.replace(temporary_path, path)
+
+def start_http_server(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY):
+    """
+    Serves the metrics at http://host:port/metrics from a background thread.
+
+    Returns:
+    ThreadingHTTPServer: The server, call shutdown() to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            payload = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would otherwise log a line to stderr every few seconds
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_arguments(parser):
+    """Adds the --metrics-file option shared by the tools."""
+    parser.add_argument('--metrics-file', metavar='FILE', help="Write metrics in the Prometheus text format to FILE when finished, for the node_exporter textfile collector.")
+
+@contextmanager
+def exporting(args):
+    """
+    Exports the metrics as asked for by the parsed arguments while the code inside it runs: serving them
+    over HTTP if args.metrics_port is set, and writing them to args.metrics_file when it finishes.
+    """
+    metrics_file = getattr(args, 'metrics_file', None)
+    metrics_port = getattr(args, 'metrics_port', None)
+
+    server = None
+    if metrics_port is not None:
+        try:
+            server = start_http_server(metrics_port)
+        except OSError as e:
+            sys.exit(f"Error: Can't serve metrics on port {metrics_port}: {e}")
+
+    try:
+        yield
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if metrics_file:
+            write_textfile(metrics_file)
@@ -1,14 +1,16 @@
-import json
 import sys
-import os
+from contextlib import redirect_stdout
 from argparse import ArgumentParser
-from prettytable import PrettyTable
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import coingecko
-from jsonschema import validate, ValidationError
-from utils import validate_currency_prices, format_currency, get_currency_symbol
+from configloader import load_config, ConfigError
+from metrics import ALERTS_FIRED, NOTIFICATIONS, NOTIFICATION_DURATION, RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from pricecache import add_arguments as add_resilience_arguments
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from output import add_format_argument, collect_matching, render_table, write_records
+from rules import rules_schema, compile_rules, RuleSyntaxError, UnknownCoinError
+from scheduler import Trigger
+from thresholds import ThresholdIndex
+from utils import fetch_prices, get_formatter, get_arithmetic, CURRENCY_DECIMAL_PLACES, DEFAULT_DECIMAL_PLACES
 
 config_schema = {
     "type": "object",
@@ -30,6 +32,7 @@ config_schema = {
                 "required": ["coinId", "buyUnits", "price", "currency"]
             }
         },
+        "rules": rules_schema,
         "sendEmail": {"type": "boolean"},
         "email": {"type": "string", "format": "email"},
         "smtp": {
@@ -46,19 +49,28 @@ config_schema = {
     "required": ["showOptimalOnly", "purchases", "sendEmail", "email", "smtp"]
 }
 
-def parse_args():
+def parse_args(argv=None):
     parser = ArgumentParser(description="Optimal purchase calculator and alert system.")
     parser.add_argument('config_file', type=str, help="Path to the configuration JSON file. See config/optimalpurchase.json.example for an example.")
-    return parser.parse_args()
+    parser.add_argument('--precise', action='store_true', help="Use exact decimal arithmetic with amounts rounded to each currency's minor unit.")
+    add_format_argument(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    return parser.parse_args(argv)
 
 def send_email(config, message):
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     msg = MIMEMultipart()
     msg['From'] = config['email']
     msg['To'] = config['email']
     msg['Subject'] = "Optimal Purchase Alert"
     msg.attach(MIMEText(message, 'plain'))
     try:
-        with smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
+        with span('notify'), track(NOTIFICATIONS, NOTIFICATION_DURATION, tool='optimalpurchase'), smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
             server.starttls()
             server.login(config['smtp']['username'], config['smtp']['password'])
             server.send_message(msg)
@@ -66,68 +78,187 @@ def send_email(config, message):
     except Exception as e:
         sys.exit(f"Failed to send email: {e}")
 
-def main():
-    args = parse_args()
-    if not os.path.exists(args.config_file):
-        sys.exit(f"Error: Config file does not exist. Usage: {os.path.basename(__file__)} configfilepath")
-
-    with open(args.config_file, 'r') as file:
-        try:
-            config = json.load(file)
-        except json.JSONDecodeError:
-            sys.exit("Error: Failed to decode JSON from the provided file.")
+def load(config_file):
+    """Loads and validates the config and its rules, exiting with an error message if they can't be used."""
+    try:
+        config = load_config(config_file, config_schema)
+    except ConfigError as e:
+        sys.exit(str(e))
 
     try:
-        validate(instance=config, schema=config_schema)
-    except ValidationError as e:
-        error_path = " -> ".join(map(str, e.path))
-        sys.exit(f"Error: Configuration file validation failed at '{error_path}': {e.message}. Look at the sample configs to see how to structure the configuration.")
+        compile_rules(config.get('rules', [])).check_coin_ids()
+    except (RuleSyntaxError, UnknownCoinError) as e:
+        sys.exit(f"Error: Invalid rule: {e}")
 
-    coin_ids = [coin['coinId'] for coin in config['purchases']]
-    currencies = list(set(coin['currency'] for coin in config['purchases']))
+    return config
 
-    try:
-        prices = coingecko.fetch_price_data(coin_ids, currencies)
-        validate_currency_prices(prices, currencies)
-    except Exception as e:
-        sys.exit(str(e))
+def get_price_request(config):
+    """Returns the coin IDs and currencies the purchases and rules need prices for, and the currencies the rules need the 24 hour change in."""
+    rules = compile_rules(config.get('rules', []))
+    coin_ids = [coin['coinId'] for coin in config['purchases']] + list(rules.coin_ids)
+    currencies = list(set(coin['currency'].lower() for coin in config['purchases']) | rules.currencies)
+    return coin_ids, currencies, list(rules.change_currencies)
 
-    table = PrettyTable()
-    table.field_names = ["Buy", "Current Price", "Target Price", "Unit Price", "Target Unit Price", "Price Diff"]
+# Machine readable output fields and the table columns rendered from them
+fields = ["coin_id", "symbol", "units", "currency", "current_price", "target_price", "unit_price", "target_unit_price", "price_diff_percent", "optimal"]
 
-    alert = False
+def _amount(record, key):
+    return f"{get_formatter(record['currency'])(record[key])} {record['currency']}"
 
-    for purchase in config['purchases']:
+table_columns = [
+    ("Buy", lambda record: f"{record['units']} {record['symbol']}"),
+    ("Current Price", lambda record: _amount(record, 'current_price')),
+    ("Target Price", lambda record: _amount(record, 'target_price')),
+    ("Unit Price", lambda record: _amount(record, 'unit_price')),
+    ("Target Unit Price", lambda record: _amount(record, 'target_unit_price')),
+    ("Price Diff", lambda record: f"{record['price_diff_percent']:.2f}%")
+]
+
+def build_purchase_index(purchases: list) -> ThresholdIndex:
+    """Indexes the positions of the purchases by the highest unit price at which each could be optimal."""
+    # Precise mode compares totals rounded to the currency's minor unit, so allow for half a unit of rounding,
+    # and a little more for the float error in the division
+    rounding = {}
+    for purchase in purchases:
+        currency = purchase['currency']
+        if currency not in rounding:
+            rounding[currency] = 0.5 * 10 ** -CURRENCY_DECIMAL_PLACES.get(currency.lower(), DEFAULT_DECIMAL_PLACES)
+    return ThresholdIndex(
+        (purchase['coinId'], purchase['currency'], (purchase['price'] + rounding[purchase['currency']]) / purchase['buyUnits'] * (1 + 1e-9), position)
+        for position, purchase in enumerate(purchases)
+    )
+
+def get_triggers(config):
+    """Returns the unit prices below which each purchase becomes optimal, for cointracker watch."""
+    return [Trigger.price(purchase['coinId'], purchase['currency'], purchase['price'] / purchase['buyUnits']) for purchase in config['purchases']]
+
+# Purchase indexes by the id of their config, with the config to check the id hasn't been reused
+_purchase_indexes = {}
+MAX_PURCHASE_INDEXES = 16
+
+def get_candidate_purchases(config, prices) -> list:
+    """
+    Returns the purchases that could be optimal at the current prices, in config order.
+
+    Building the index costs about as much as checking every purchase once, so a config is only indexed the
+    second time it is run in a process, as with run-all --interval. From then on each coin's candidates are
+    found by binary search, in time proportional to the number found rather than the number configured.
+    """
+    cached = _purchase_indexes.get(id(config))
+    if cached is None or cached[0] is not config:
+        if len(_purchase_indexes) >= MAX_PURCHASE_INDEXES:
+            del _purchase_indexes[next(iter(_purchase_indexes))]
+        _purchase_indexes[id(config)] = (config, None)
+        return config['purchases']
+
+    index = cached[1]
+    if index is None:
+        index = build_purchase_index(config['purchases'])
+        _purchase_indexes[id(config)] = (config, index)
+
+    positions = []
+    for coin_id, currency in index.pairs():
+        if coin_id in prices:
+            positions.extend(index.above(coin_id, currency, prices[coin_id][currency]))
+    positions.sort()
+    purchases = config['purchases']
+    return [purchases[position] for position in positions]
+
+def iter_purchases(config, prices, to_number, round_amount):
+    """Yields a record comparing each purchase to its target price, skipping ones that aren't optimal if showOptimalOnly is set."""
+    purchases = config['purchases']
+    if config['showOptimalOnly']:
+        # Most purchases are far from optimal, so only the ones the index says could be are checked
+        purchases = get_candidate_purchases(config, prices)
+
+    for purchase in purchases:
         currency = purchase['currency']
         coin_id = purchase['coinId']
-        current_price = prices[coin_id][currency.lower()]
-        units = purchase['buyUnits']
-        current_total_purchase_price = current_price * units
-        target_price = purchase['price']
-
-        if target_price > current_total_purchase_price:
-            alert = True
-        elif config['showOptimalOnly']:
+        if coin_id not in prices:
+            continue  # Left out by a --resilient fetch, which has already warned about it
+        current_price = to_number(prices[coin_id][currency.lower()])
+        units = to_number(purchase['buyUnits'])
+        current_total_purchase_price = round_amount(current_price * units, currency)
+        target_price = to_number(purchase['price'])
+        optimal = target_price > current_total_purchase_price
+
+        if not optimal and config['showOptimalOnly']:
             continue
 
         unit_price = current_price
         target_unit_price = target_price / units
-        price_diff = (unit_price - target_unit_price) / target_unit_price * 100
-        currency_symbol = get_currency_symbol(currency)
-
-        table.add_row([
-            f"{units} {coingecko.get_coin_symbol(coin_id)}",
-            f"{currency_symbol}{format_currency(current_total_purchase_price)} {purchase['currency']}",
-            f"{currency_symbol}{format_currency(target_price)} {purchase['currency']}",
-            f"{currency_symbol}{format_currency(unit_price)} {purchase['currency']}",
-            f"{currency_symbol}{format_currency(target_unit_price)} {purchase['currency']}",
-            f"{price_diff:.2f}%"
-        ])
-
-    if table.rows:
-        print(table)
+
+        yield {
+            'coin_id': coin_id,
+            'symbol': coingecko.get_coin_symbol(coin_id),
+            'units': purchase['buyUnits'],
+            'currency': currency.upper(),
+            'current_price': current_total_purchase_price,
+            'target_price': target_price,
+            'unit_price': unit_price,
+            'target_unit_price': target_unit_price,
+            'price_diff_percent': (unit_price - target_unit_price) / target_unit_price * 100,
+            'optimal': optimal
+        }
+
+def run(config, prices, args):
+    """Compares the purchases against the given prices, printing the table and sending an alert if needed."""
+    rules = compile_rules(config.get('rules', []))
+    to_number, round_amount = get_arithmetic(args.precise)
+    records = iter_purchases(config, prices, to_number, round_amount)
+    with span('rules', count=len(rules)):
+        matched_rules = rules.evaluate_new_matches(prices, 'optimalpurchase')
+    rule_output = rules.describe(matched_rules)
+    if matched_rules:
+        ALERTS_FIRED.inc(len(matched_rules), tool='optimalpurchase', kind='rule')
+
+    if args.format != 'table':
+        # Records are streamed to stdout as they are computed, only the optimal ones are kept for the alert email
+        optimal_records = []
+        # Rows are calculated as they are written, so this span covers both
+        with span('render', format=args.format):
+            write_records(collect_matching(records, lambda record: record['optimal'], optimal_records), fields, args.format)
+        if optimal_records:
+            ALERTS_FIRED.inc(len(optimal_records), tool='optimalpurchase', kind='optimal')
+        if rule_output:
+            print(rule_output, file=sys.stderr, end="")
+        output = render_table(optimal_records, table_columns)
+        output = output + "\n" + rule_output if output else rule_output
+        if output and config['sendEmail']:
+            # Keep stdout for the records only
+            with redirect_stdout(sys.stderr):
+                send_email(config, output)
+        return
+
+    with span('compute'):
+        records = list(records)
+    optimal_count = sum(1 for record in records if record['optimal'])
+    if optimal_count:
+        ALERTS_FIRED.inc(optimal_count, tool='optimalpurchase', kind='optimal')
+    alert = optimal_count > 0
+
+    with span('render'):
+        output = render_table(records, table_columns)
+    if output:
+        output += "\n"
+
+    if rule_output:
+        output += rule_output
+        alert = True
+
+    if output:
+        print(output)
         if alert and config['sendEmail']:
-            send_email(config, table.get_string())
+            send_email(config, output)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with instrument(args, 'optimalpurchase'), exporting(args):
+        with span('load'):
+            config = load(args.config_file)
+        prices = fetch_prices(*get_price_request(config), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='optimalpurchase'):
+            run(config, prices, args)
 
 if __name__ == "__main__":
     main()
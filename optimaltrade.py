@@ -1,14 +1,15 @@
-import json
 import sys
-import os
+from contextlib import redirect_stdout
 from argparse import ArgumentParser
-from prettytable import PrettyTable
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import coingecko
-from utils import validate_currency_prices, format_currency
-from jsonschema import validate, ValidationError
+from utils import fetch_prices, format_currency
+from configloader import load_config, ConfigError
+from metrics import ALERTS_FIRED, NOTIFICATIONS, NOTIFICATION_DURATION, RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from pricecache import add_arguments as add_resilience_arguments
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from output import add_format_argument, collect_matching, render_table, write_records
+from rules import rules_schema, compile_rules, RuleSyntaxError, UnknownCoinError
+from scheduler import Trigger
 
 config_schema = {
     "type": "object",
@@ -46,6 +47,7 @@ config_schema = {
                 "required": ["sellCoinId", "sellUnits", "buyCoinId", "buyUnits"]
             }
         },
+        "rules": rules_schema,
         "sendEmail": {
             "type": "boolean"
         },
@@ -78,61 +80,89 @@ config_schema = {
     "required": ["showOptimalOnly", "currency", "trades", "sendEmail", "email", "smtp"]
 }
 
-def parse_args():
+def parse_args(argv=None):
     parser = ArgumentParser(description="Optimal trade calculator and alert system.")
     parser.add_argument('config_file', type=str, help="Path to the configuration JSON file. See config/optimaltrade.json.example for an example.")
-    return parser.parse_args()
+    add_format_argument(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    return parser.parse_args(argv)
 
 def send_email(config, message):
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     msg = MIMEMultipart()
     msg['From'] = config['email']
     msg['To'] = config['email']
     msg['Subject'] = "Optimal Trade Alert"
     msg.attach(MIMEText(message, 'plain'))
     try:
-        with smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
+        with span('notify'), track(NOTIFICATIONS, NOTIFICATION_DURATION, tool='optimaltrade'), smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
             server.starttls()
             server.login(config['smtp']['username'], config['smtp']['password'])
             server.send_message(msg)
-            sys.exit("Email sent successfully.")
+            print("Email sent successfully.")
     except Exception as e:
         sys.exit(f"Failed to send email: {e}")
 
-def main():
-    args = parse_args()
-    if not os.path.exists(args.config_file):
-        sys.exit(f"Error: Config file does not exist. Usage: {os.path.basename(__file__)} configfilepath")
-
-    with open(args.config_file, 'r') as file:
-        try:
-            config = json.load(file)
-        except json.JSONDecodeError:
-            sys.exit("Error: Failed to decode JSON from the provided file.")
+def load(config_file):
+    """Loads and validates the config and its rules, exiting with an error message if they can't be used."""
+    try:
+        config = load_config(config_file, config_schema)
+    except ConfigError as e:
+        sys.exit(str(e))
 
     try:
-        validate(instance=config, schema=config_schema)
-    except ValidationError as e:
-        error_path = " -> ".join(map(str, e.path))
-        sys.exit(f"Error: Configuration file validation failed at '{error_path}': {e.message}. Look at the sample configs to see how to structure the configuration.")
+        compile_rules(config.get('rules', [])).check_coin_ids()
+    except (RuleSyntaxError, UnknownCoinError) as e:
+        sys.exit(f"Error: Invalid rule: {e}")
 
+    return config
+
+def get_price_request(config):
+    """Returns the coin IDs and currencies the trades and rules need prices for, and the currencies the rules need the 24 hour change in."""
+    rules = compile_rules(config.get('rules', []))
     currency = config.get('currency', 'aud').lower()
+    coin_ids = {trade['sellCoinId'] for trade in config['trades']} | {trade['buyCoinId'] for trade in config['trades']} | rules.coin_ids
+    return list(coin_ids), list({currency, 'btc'} | rules.currencies), list(rules.change_currencies)
 
-    coin_ids = {trade['sellCoinId'] for trade in config['trades']} | {trade['buyCoinId'] for trade in config['trades']}
-    
-    try:
-        prices = coingecko.fetch_price_data(list(coin_ids), [currency, 'btc'])
-        validate_currency_prices(prices, [currency, 'btc'])
-    except Exception as e:
-        print(str(e))
-        sys.exit(1)
+def _trade_trigger(trade):
+    sell_coin_id = trade['sellCoinId']
+    buy_coin_id = trade['buyCoinId']
+
+    def price_ratio(prices):
+        sell_price = prices.get(sell_coin_id, {}).get('btc')
+        buy_price = prices.get(buy_coin_id, {}).get('btc')
+        return sell_price / buy_price if sell_price and buy_price else None
+
+    return Trigger((sell_coin_id, buy_coin_id), trade['buyUnits'] / trade['sellUnits'], price_ratio)
+
+def get_triggers(config):
+    """Returns the price ratios between the coins above which each trade becomes optimal, for cointracker watch."""
+    return [_trade_trigger(trade) for trade in config['trades'] if trade['sellUnits'] > 0]
+
+# Machine readable output fields and the table columns rendered from them
+fields = ["sell_coin_id", "sell_symbol", "sell_units", "buy_coin_id", "buy_symbol", "target_buy_units", "current_buy_units", "diff_percent", "currency", "current_sell_price", "target_sell_price", "current_buy_price", "target_buy_price", "optimal"]
+
+table_columns = [
+    ("Sell", lambda record: f"{record['sell_units']:.2f} {record['sell_symbol']}"),
+    ("Target Buy", lambda record: f"{record['target_buy_units']:.2f} {record['buy_symbol']}"),
+    ("Current Buy", lambda record: f"{record['current_buy_units']:.8f} {record['buy_symbol']}"),
+    ("Diff", lambda record: f"{record['diff_percent']:.2f}%"),
+    ("Current Sell Price", lambda record: f"{record['sell_symbol']}: {format_currency(record['current_sell_price'])}"),
+    ("Target Sell Price", lambda record: f"{record['sell_symbol']}: {format_currency(record['target_sell_price'])}"),
+    ("Current Buy Price", lambda record: f"{record['buy_symbol']}: {format_currency(record['current_buy_price'])}"),
+    ("Target Buy Price", lambda record: f"{record['buy_symbol']}: {format_currency(record['target_buy_price'])}")
+]
+
+def iter_trades(config, prices):
+    """Yields a record comparing each trade to its target, skipping ones that aren't optimal if showOptimalOnly is set."""
+    currency = config.get('currency', 'aud').lower()
 
-    alert = False
-    table = PrettyTable()
-    table.field_names = ["Sell", "Target Buy", "Current Buy", "Diff", "Current Sell Price", "Target Sell Price", "Current Buy Price", "Target Buy Price"]
-    
     for trade in config['trades']:
-        sell_symbol = coingecko.get_coin_symbol(trade['sellCoinId'])
-        buy_symbol = coingecko.get_coin_symbol(trade['buyCoinId'])
         sell_coin = prices.get(trade['sellCoinId'])
         buy_coin = prices.get(trade['buyCoinId'])
 
@@ -141,37 +171,88 @@ def main():
 
         price_ratio = sell_coin['btc'] / buy_coin['btc']
         current_buy = trade['sellUnits'] * price_ratio
+        optimal = current_buy > trade['buyUnits']
 
-        if current_buy > trade['buyUnits']:
-            alert = True
-        elif config['showOptimalOnly']:
+        if not optimal and config['showOptimalOnly']:
             continue
 
         target_sell_price = trade['buyUnits'] / trade['sellUnits']
         target_buy_price = 1 / target_sell_price
 
-        target_sell_price_currency = buy_coin[currency] * target_sell_price
-        target_buy_price_currency = sell_coin[currency] * target_buy_price
+        yield {
+            'sell_coin_id': trade['sellCoinId'],
+            'sell_symbol': coingecko.get_coin_symbol(trade['sellCoinId']),
+            'sell_units': trade['sellUnits'],
+            'buy_coin_id': trade['buyCoinId'],
+            'buy_symbol': coingecko.get_coin_symbol(trade['buyCoinId']),
+            'target_buy_units': trade['buyUnits'],
+            'current_buy_units': current_buy,
+            'diff_percent': ((current_buy - trade['buyUnits']) / trade['buyUnits']) * 100,
+            'currency': currency.upper(),
+            'current_sell_price': sell_coin[currency],
+            'target_sell_price': buy_coin[currency] * target_sell_price,
+            'current_buy_price': buy_coin[currency],
+            'target_buy_price': sell_coin[currency] * target_buy_price,
+            'optimal': optimal
+        }
+
+def run(config, prices, args):
+    """Compares the trades against the given prices, printing the table and sending an alert if needed."""
+    rules = compile_rules(config.get('rules', []))
+    records = iter_trades(config, prices)
+    with span('rules', count=len(rules)):
+        matched_rules = rules.evaluate_new_matches(prices, 'optimaltrade')
+    rule_output = rules.describe(matched_rules)
+    if matched_rules:
+        ALERTS_FIRED.inc(len(matched_rules), tool='optimaltrade', kind='rule')
 
-        current_buy_price_currency = buy_coin[currency]
+    if args.format != 'table':
+        # Records are streamed to stdout as they are computed, only the optimal ones are kept for the alert email
+        optimal_records = []
+        # Rows are calculated as they are written, so this span covers both
+        with span('render', format=args.format):
+            write_records(collect_matching(records, lambda record: record['optimal'], optimal_records), fields, args.format)
+        if optimal_records:
+            ALERTS_FIRED.inc(len(optimal_records), tool='optimaltrade', kind='optimal')
+        if rule_output:
+            print(rule_output, file=sys.stderr, end="")
+        output = render_table(optimal_records, table_columns)
+        output = output + "\n" + rule_output if output else rule_output
+        if output and config['sendEmail']:
+            # Keep stdout for the records only
+            with redirect_stdout(sys.stderr):
+                send_email(config, output)
+        return
 
-        diff = ((current_buy - trade['buyUnits']) / trade['buyUnits']) * 100
+    with span('compute'):
+        records = list(records)
+    optimal_count = sum(1 for record in records if record['optimal'])
+    if optimal_count:
+        ALERTS_FIRED.inc(optimal_count, tool='optimaltrade', kind='optimal')
+    alert = optimal_count > 0
 
-        table.add_row([
-            f"{trade['sellUnits']:.2f} {sell_symbol}",
-            f"{trade['buyUnits']:.2f} {buy_symbol}",
-            f"{current_buy:.8f} {buy_symbol}",
-            f"{diff:.2f}%",
-            f"{sell_symbol}: {format_currency(sell_coin[currency])}",
-            f"{sell_symbol}: {format_currency(target_sell_price_currency)}",
-            f"{buy_symbol}: {format_currency(current_buy_price_currency)}",
-            f"{buy_symbol}: {format_currency(target_buy_price_currency)}",
-        ])
+    with span('render'):
+        output = render_table(records, table_columns)
+    if output:
+        output += "\n"
 
-    if table.rows:
-        print(table)
+    if rule_output:
+        output += rule_output
+        alert = True
+
+    if output:
+        print(output)
         if alert and config['sendEmail']:
-            send_email(config, table.get_string())
+            send_email(config, output)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with instrument(args, 'optimaltrade'), exporting(args):
+        with span('load'):
+            config = load(args.config_file)
+        prices = fetch_prices(*get_price_request(config), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='optimaltrade'):
+            run(config, prices, args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+import sys
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Output formats accepted by --format. Only 'table' is meant for people, the rest are for other programs.
+FORMATS = ['table', 'jsonl', 'csv', 'arrow']
+
+# Number of records per Arrow record batch, large enough to amortise per-batch overhead while keeping memory flat
+ARROW_BATCH_SIZE = 1024
+
+# Precise mode amounts are written to Arrow as decimals with this precision and scale
+ARROW_DECIMAL_PRECISION = 38
+ARROW_DECIMAL_SCALE = 18
+
+def add_format_argument(parser):
+    """Adds the --format option shared by the tools that print tables."""
+    parser.add_argument('--format', choices=FORMATS, default='table', help="Output format. 'table' (the default) prints a table, 'jsonl', 'csv' and 'arrow' stream one record per row for other programs.")
+
+def render_table(records: Iterable[dict], columns: List[Tuple[str, Callable[[dict], str]]]) -> str:
+    """
+    Renders records as a PrettyTable.
+
+    Args:
+    records (iterable of dict): The records to show, one per row.
+    columns (list of tuple): (header, render) pairs, render returns the text shown for a record in that column.
+
+    Returns:
+    str: The table, or an empty string if there are no records.
+    """
+    rows = [[render(record) for _, render in columns] for record in records]
+    if not rows:
+        return ""
+
+    # PrettyTable is only imported when there is something to show
+    from prettytable import PrettyTable
+    table = PrettyTable()
+    table.field_names = [header for header, _ in columns]
+    table.add_rows(rows)
+    return table.get_string()
+
+def collect_matching(records: Iterable[dict], predicate: Callable[[dict], bool], matched: List[dict]):
+    """Passes records through unchanged, appending the ones that match the predicate to matched as they go by."""
+    for record in records:
+        if predicate(record):
+            matched.append(record)
+        yield record
+
+def _json_default(value):
+    # Decimals from precise mode are written as strings so no precision is lost
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def write_jsonl(records: Iterable[dict], fields: List[str], stream) -> int:
+    import json
+
+    count = 0
+    for record in records:
+        stream.write(json.dumps({field: record.get(field) for field in fields}, default=_json_default) + "\n")
+        count += 1
+    return count
+
+def write_csv(records: Iterable[dict], fields: List[str], stream) -> int:
+    import csv
+
+    writer = csv.DictWriter(stream, fieldnames=fields, extrasaction='ignore', lineterminator="\n")
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+def _arrow_schema(pa, batch: List[dict], fields: List[str]):
+    """Picks an Arrow type for each field from the first non-null value in the first batch."""
+    types = []
+    for field in fields:
+        value = next((record.get(field) for record in batch if record.get(field) is not None), None)
+        if isinstance(value, bool):
+            types.append(pa.bool_())
+        elif isinstance(value, Decimal):
+            types.append(pa.decimal128(ARROW_DECIMAL_PRECISION, ARROW_DECIMAL_SCALE))
+        elif isinstance(value, (int, float)):
+            # Amounts can be whole numbers in one row and fractional in the next, so numbers are always doubles
+            types.append(pa.float64())
+        else:
+            types.append(pa.string())
+    return pa.schema(list(zip(fields, types)))
+
+def _arrow_batch(pa, batch: List[dict], schema):
+    exponent = Decimal(1).scaleb(-ARROW_DECIMAL_SCALE)
+    columns = []
+    for field in schema:
+        values = [record.get(field.name) for record in batch]
+        if pa.types.is_decimal(field.type):
+            values = [value if value is None else Decimal(value).quantize(exponent) for value in values]
+        elif pa.types.is_floating(field.type):
+            values = [value if value is None else float(value) for value in values]
+        elif pa.types.is_string(field.type):
+            values = [value if value is None else str(value) for value in values]
+        columns.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+def write_arrow(records: Iterable[dict], fields: List[str], stream) -> int:
+    """
+    Writes records in the Arrow IPC streaming format, one record batch at a time.
+
+    Raises:
+    SystemExit: If pyarrow isn't installed.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        sys.exit("Error: The arrow format requires pyarrow. Install it with: pip install pyarrow")
+
+    # The IPC stream is binary, so write to the underlying buffer of a text stream like stdout
+    sink = getattr(stream, 'buffer', stream)
+    writer = None
+    schema = None
+    count = 0
+    batch = []
+
+    def flush():
+        nonlocal writer, schema
+        if schema is None:
+            schema = _arrow_schema(pa, batch, fields)
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_batch(_arrow_batch(pa, batch, schema))
+        batch.clear()
+
+    for record in records:
+        batch.append(record)
+        count += 1
+        if len(batch) >= ARROW_BATCH_SIZE:
+            flush()
+
+    if batch or schema is None:
+        flush()
+    writer.close()
+    return count
+
+WRITERS: Dict[str, Callable] = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+    'arrow': write_arrow
+}
+
+def write_records(records: Iterable[dict], fields: List[str], output_format: str, stream=None) -> int:
+    """
+    Streams records in a machine readable format as they are produced, without holding them all in memory.
+
+    Args:
+    records (iterable of dict): The records to write, usually a generator.
+    fields (list of str): The record keys to write, in column order.
+    output_format (str): 'jsonl', 'csv' or 'arrow'.
+    stream: Where to write, defaults to stdout.
+
+    Returns:
+    int: The number of records written.
+    """
+    if stream is None:
+        stream = sys.stdout
+    return WRITERS[output_format](records, fields, stream)
@@ -1,11 +1,17 @@
-import json
+import os
 import sys
+import time
 import argparse
-from prettytable import PrettyTable
-import os
+from contextlib import closing
 import coingecko
-from utils import merge_configurations, validate_currency_prices, get_currency_symbol, format_currency
-from jsonschema import validate, ValidationError
+from utils import fetch_prices, get_formatter, get_arithmetic
+from configloader import load_config, ConfigError
+from metrics import RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from portfoliohistory import add_arguments as add_history_arguments, append_run, connect as connect_history, get_max_drawdown, get_period_returns, get_span
+from pricecache import add_arguments as add_resilience_arguments
+from pricesnapshot import PriceSnapshot
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from output import add_format_argument, render_table, write_records
 
 config_schema = {
     "type": "object",
@@ -47,100 +53,323 @@ config_schema = {
 }
 
 
-def parse_args():
+# Default configuration with zero or default values
+default_config = {
+    'investmentAmount': 0,
+    'defaultCurrency': 'AUD',
+    'currencies': [],
+    'holdings': []
+}
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Display cryptocurrency portfolio based on CoinGecko data.")
     parser.add_argument('config_file', type=str, help='The JSON file containing the portfolio data. See config/portfolio.json.example for an example.')
-    return parser.parse_args()
+    parser.add_argument('--precise', action='store_true', help="Use exact decimal arithmetic with amounts rounded to each currency's minor unit.")
+    add_format_argument(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    add_history_arguments(parser)
+    return parser.parse_args(argv)
 
-def main():
-    args = parse_args()
-    portfolio_file = args.config_file
+def load(portfolio_file):
+    """Loads and validates the portfolio config, exiting with an error message if it can't be used."""
+    try:
+        portfolio = load_config(portfolio_file, config_schema, default_config)
+    except ConfigError as e:
+        sys.exit(str(e))
 
-    if not os.path.exists(portfolio_file):
-        sys.exit(f"Error: The file '{portfolio_file}' does not exist.")
+    if not portfolio['holdings']:
+        sys.exit("Error: The portfolio holdings are empty in the supplied config.")
 
-    # Default configuration with zero or default values
-    default_config = {
-        'investmentAmount': 0,
-        'defaultCurrency': 'AUD',
-        'currencies': [],
-        'holdings': []
-    }
+    return portfolio
+
+def get_currencies(portfolio):
+    """Returns the default currency and the additional currencies to show totals in."""
+    default_currency = portfolio.get('defaultCurrency', 'AUD').upper()
+    additional_currencies = [currency.upper() for currency in portfolio.get('currencies', []) if currency.upper() != default_currency]
+    return default_currency, additional_currencies
+
+def get_price_request(portfolio):
+    """Returns the coin IDs and currencies the portfolio needs prices for, and the currency it needs the 24 hour change in."""
+    default_currency, additional_currencies = get_currencies(portfolio)
+    return [coin['coinId'] for coin in portfolio['holdings']], [default_currency] + additional_currencies, [default_currency]
+
+def get_fields(portfolio):
+    """Returns the machine readable output fields, which include the value of each holding in the additional currencies."""
+    _, additional_currencies = get_currencies(portfolio)
+    return ["coin_id", "symbol", "units", "currency", "price", "value", "allocation_percent", "change_24h_percent"] + [f"value_{currency.lower()}" for currency in additional_currencies]
+
+def iter_holdings(portfolio, prices, to_number, round_amount):
+    """Yields a record for each holding with its price, value and share of the portfolio in the default currency."""
+    default_currency, additional_currencies = get_currencies(portfolio)
+
+    # Prices are read by row from each currency's column rather than through a dict per coin
+    prices = PriceSnapshot.ensure(prices)
+    price_column = prices.price_column(default_currency.lower())
+    change_column = prices.change_column(default_currency.lower())
+    additional_columns = [(currency, prices.price_column(currency.lower())) for currency in additional_currencies]
+
+    # Holdings without a price were left out by a --resilient fetch, which has already warned about them
+    holdings = [(holding, prices.rows[holding['coinId']]) for holding in portfolio['holdings'] if holding['coinId'] in prices]
+
+    # The allocation of each holding needs the total, so it is worked out before any records are produced
+    total_value = 0
+    for holding, row in holdings:
+        total_value += round_amount(to_number(price_column[row]) * to_number(holding['units']), default_currency)
+
+    for holding, row in holdings:
+        id = holding['coinId']
+        units = to_number(holding['units'])
+        price_currency = to_number(price_column[row])
+        currency_value = round_amount(price_currency * units, default_currency)
+
+        record = {
+            'coin_id': id,
+            'symbol': coingecko.get_coin_symbol(id),
+            'units': holding['units'],
+            'currency': default_currency,
+            'price': price_currency,
+            'value': currency_value,
+            'allocation_percent': currency_value / total_value * 100,
+            'change_24h_percent': to_number(change_column[row])
+        }
+        for currency, column in additional_columns:
+            record[f"value_{currency.lower()}"] = round_amount(to_number(column[row]) * units, currency)
+        yield record
+
+def run(portfolio, prices, args):
+    """Values the portfolio at the given prices and prints the summary and detail tables."""
+    default_currency, additional_currencies = get_currencies(portfolio)
+
+    to_number, round_amount = get_arithmetic(args.precise)
+
+    if args.format != 'table':
+        # Rows are calculated as they are written, so this span covers both
+        with span('render', format=args.format):
+            write_records(iter_holdings(portfolio, prices, to_number, round_amount), get_fields(portfolio), args.format)
+        return
+
+    with span('compute'):
+        holdings = list(iter_holdings(portfolio, prices, to_number, round_amount))
+
+        total_value = 0
+        total_24h_change = 0
+        for holding in holdings:
+            total_value += holding['value']
+            total_24h_change += holding['value'] * (holding['change_24h_percent'] / 100)
+
+        investment_amount = to_number(portfolio.get('investmentAmount', 0))
+        investment_return = total_value - investment_amount
+        return_percent = (investment_return / investment_amount) * 100
+        change_24h_percent = (total_24h_change / total_value) * 100 if total_value != 0 else 0
+        additional_totals = {currency: sum(holding[f"value_{currency.lower()}"] for holding in holdings) for currency in additional_currencies}
+
+    with span('render'):
+        format_amount = get_formatter(default_currency)
+
+        detail_table = render_table(holdings, [
+            ("Name", lambda holding: holding['symbol']),
+            ("Units", lambda holding: holding['units']),
+            ("Alloc", lambda holding: f"{holding['allocation_percent']:.2f}%"),
+            (f"Total ({default_currency})", lambda holding: format_amount(holding['value'])),
+            (f"Price ({default_currency})", lambda holding: format_amount(holding['price'])),
+            (f"24H % ({default_currency})", lambda holding: f"{holding['change_24h_percent']:.2f}%")
+        ])
+
+        from prettytable import PrettyTable
+
+        summary_table = PrettyTable()
+        field_names = [f"Return % ({default_currency})", f"Total ({default_currency})", f"Return ({default_currency})", f"24H Diff ({default_currency})", f"24H % ({default_currency})"]
+        for currency in additional_currencies:
+            field_names.append(f"Total ({currency})")
+        summary_table.field_names = field_names
+
+        row = [f"{return_percent:.2f}%", format_amount(total_value), format_amount(investment_return), f"{format_amount.symbol}{total_24h_change:,.2f}", f"{change_24h_percent:.2f}%"]
+        for currency in additional_currencies:
+            row.append(get_formatter(currency)(additional_totals[currency]))
 
+        summary_table.add_row(row)
+        output = f"{summary_table}\n{detail_table}"
+
+    print(output)
+
+def record_history(portfolio, prices, history_file):
+    """Appends the portfolio's value at the given prices to the history file, warning rather than failing if it can't."""
+    import sqlite3
+
+    default_currency, _ = get_currencies(portfolio)
+    holdings = iter_holdings(portfolio, prices, *get_arithmetic(False))
     try:
-        with open(portfolio_file, 'r') as file:
-            portfolio = json.load(file)
-            portfolio = merge_configurations(default_config, portfolio)
-    except json.JSONDecodeError:
-        sys.exit("Error: Failed to decode JSON from the provided file.")
+        append_run(history_file, default_currency, portfolio.get('investmentAmount', 0), holdings)
+    except sqlite3.Error as e:
+        print(f"Warning: Failed to record the portfolio history in '{history_file}': {e}", file=sys.stderr)
+
+def _check_history(history_file):
+    if not os.path.exists(history_file):
+        sys.exit(f"Error: The history file '{history_file}' doesn't exist. Run with --history alone to record the portfolio in it first.")
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.gmtime(timestamp))
+
+def report(portfolio, args):
+    """Prints the value over time, the returns by period and the max drawdown recorded in the history file, without fetching prices."""
+    import sqlite3
+
+    default_currency, _ = get_currencies(portfolio)
+    _check_history(args.history)
 
     try:
-        validate(instance=portfolio, schema=config_schema)
-    except ValidationError as e:
-        error_path = " -> ".join(map(str, e.path))
-        sys.exit(f"Error: Configuration file validation failed at '{error_path}': {e.message}. Look at the sample configs to see how to structure the configuration.")
+        with closing(connect_history(args.history)) as connection:
+            history_span = get_span(connection, default_currency)
+            if history_span is None:
+                sys.exit(f"Error: The history file '{args.history}' has no values in {default_currency}.")
+            periods = get_period_returns(connection, default_currency, args.period)
+            drawdown = get_max_drawdown(connection, default_currency)
+    except sqlite3.Error as e:
+        sys.exit(f"Error: Failed to read the history file '{args.history}': {e}")
 
-    if not portfolio['holdings']:
-        sys.exit("Error: The portfolio holdings are empty in the supplied config.")
+    if args.format != 'table':
+        write_records(periods, ["period", "open", "close", "runs", "invested", "return_percent"], args.format)
+        return
 
-    default_currency = portfolio.get('defaultCurrency', 'AUD').upper()
-    additional_currencies = [currency.upper() for currency in portfolio.get('currencies', []) if currency.upper() != default_currency]
-    supported_currencies = [default_currency] + additional_currencies
-    
-    ids = [coin['coinId'] for coin in portfolio['holdings']]
+    def format_percent(percent):
+        return "-" if percent is None else f"{percent:.2f}%"
 
+    # The return over the whole history is the period returns compounded, so it also leaves out money put in
+    growth = 1
+    for period in periods:
+        growth *= 1 + period['return_percent'] / 100
+    first, last, runs = history_span
+    summary = {
+        'first': first,
+        'last': last,
+        'runs': runs,
+        'start_value': periods[0]['open'],
+        'end_value': periods[-1]['close'],
+        'invested': sum(period['invested'] for period in periods),
+        'return_percent': (growth - 1) * 100,
+        'drawdown': drawdown
+    }
+
+    format_amount = get_formatter(default_currency)
+    summary_table = render_table([summary], [
+        ("From (UTC)", lambda summary: _format_time(summary['first'])),
+        ("To (UTC)", lambda summary: _format_time(summary['last'])),
+        ("Runs", lambda summary: summary['runs']),
+        (f"Start ({default_currency})", lambda summary: format_amount(summary['start_value'])),
+        (f"End ({default_currency})", lambda summary: format_amount(summary['end_value'])),
+        (f"Invested ({default_currency})", lambda summary: format_amount(summary['invested'])),
+        ("Return %", lambda summary: format_percent(summary['return_percent'])),
+        ("Max Drawdown %", lambda summary: format_percent(summary['drawdown']['drawdown_percent']) if summary['drawdown'] else "-"),
+        ("Peak (UTC)", lambda summary: _format_time(summary['drawdown']['peak_time']) if summary['drawdown'] else "-"),
+        ("Trough (UTC)", lambda summary: _format_time(summary['drawdown']['trough_time']) if summary['drawdown'] else "-")
+    ])
+    period_table = render_table(periods, [
+        (args.period.title(), lambda period: period['period']),
+        (f"Open ({default_currency})", lambda period: format_amount(period['open'])),
+        (f"Close ({default_currency})", lambda period: format_amount(period['close'])),
+        ("Runs", lambda period: period['runs']),
+        (f"Invested ({default_currency})", lambda period: format_amount(period['invested'])),
+        ("Return %", lambda period: format_percent(period['return_percent']))
+    ])
+    print(f"{summary_table}\n{period_table}")
+
+def risk(portfolio, args):
+    """Prints the volatility, correlation and value at risk of the holdings from the prices in the history file, without fetching prices."""
+    import sqlite3
     try:
-        prices = coingecko.fetch_price_data(ids, supported_currencies)
-        validate_currency_prices(prices, supported_currencies)
-    except Exception as e:
-        sys.exit(str(e))
+        from portfoliorisk import analyse, annualise, load_returns
+    except ImportError:
+        sys.exit("Error: --risk requires numpy. Install it with: pip install numpy")
 
-    total_value = {currency: 0 for currency in supported_currencies}
-    total_24h_change = 0
+    default_currency, _ = get_currencies(portfolio)
+    _check_history(args.history)
 
+    units = {}
     for holding in portfolio['holdings']:
-        id = holding['coinId']
-        units = holding['units']
-        currency_value = prices[id][default_currency.lower()] * units
-        total_value[default_currency] += currency_value
-        change_24h_currency = prices[id][f"{default_currency.lower()}_24h_change"]
-        total_24h_change += currency_value * (change_24h_currency / 100)
+        units[holding['coinId']] = units.get(holding['coinId'], 0) + holding['units']
 
-    detail_table = PrettyTable()
-    detail_table.field_names = ["Name", "Units", "Alloc", f"Total ({default_currency})", f"Price ({default_currency})", f"24H % ({default_currency})"]
+    try:
+        with closing(connect_history(args.history)) as connection:
+            returns = load_returns(connection, args.history, default_currency)
+    except sqlite3.Error as e:
+        sys.exit(f"Error: Failed to read the history file '{args.history}': {e}")
 
-    for holding in portfolio['holdings']:
-        id = holding['coinId']
-        units = holding['units']
-        currency_value = prices[id][default_currency.lower()] * units
-        price_currency = prices[id][default_currency.lower()]
-        change_24h_currency = prices[id][f"{default_currency.lower()}_24h_change"]
-        symbol = get_currency_symbol(default_currency)
-
-        detail_table.add_row([
-            coingecko.get_coin_symbol(id), units, f"{(currency_value / total_value[default_currency] * 100):.2f}%", f"{symbol}{format_currency(currency_value)}", f"{symbol}{format_currency(price_currency)}", f"{change_24h_currency:.2f}%"
-        ])
+    try:
+        analysis = analyse(returns, units, args.confidence)
+    except ValueError as e:
+        sys.exit(f"Error: {e} in '{args.history}'.")
+
+    if analysis['missing']:
+        print(f"Warning: No prices in the history for {', '.join(analysis['missing'])}, they are left out.", file=sys.stderr)
+
+    coins = analysis['coins']
+    records = []
+    for index, coin_id in enumerate(coins):
+        record = {
+            'coin_id': coin_id,
+            'symbol': coingecko.get_coin_symbol(coin_id),
+            'weight_percent': float(analysis['weights'][index]) * 100,
+            'volatility_percent': float(analysis['volatility'][index]) * 100,
+            'annual_volatility_percent': annualise(float(analysis['volatility'][index])) * 100
+        }
+        for other_index, other_coin_id in enumerate(coins):
+            record[f"correlation_{other_coin_id}"] = float(analysis['correlation'][index, other_index])
+        records.append(record)
+
+    if args.format != 'table':
+        write_records(records, ["coin_id", "symbol", "weight_percent", "volatility_percent", "annual_volatility_percent"] + [f"correlation_{coin_id}" for coin_id in coins], args.format)
+        return
+
+    format_amount = get_formatter(default_currency)
+    confidence = f"{args.confidence * 100:g}%"
+    summary_table = render_table([analysis], [
+        (f"Value ({default_currency})", lambda analysis: format_amount(analysis['value'])),
+        ("Days", lambda analysis: analysis['days']),
+        ("Daily Vol %", lambda analysis: f"{analysis['portfolio_volatility'] * 100:.2f}%"),
+        ("Annual Vol %", lambda analysis: f"{annualise(analysis['portfolio_volatility']) * 100:.2f}%"),
+        (f"VaR {confidence} Hist ({default_currency})", lambda analysis: format_amount(analysis['historical_var'])),
+        (f"VaR {confidence} Param ({default_currency})", lambda analysis: format_amount(analysis['parametric_var']))
+    ])
+    # Coins are shown by symbol unless two share one, as the columns need different names
+    symbols = [record['symbol'] for record in records]
+    if len(set(symbols)) != len(symbols):
+        symbols = coins
+    asset_table = render_table(records, [
+        ("Name", lambda record: record['symbol']),
+        ("Weight", lambda record: f"{record['weight_percent']:.2f}%"),
+        ("Daily Vol %", lambda record: f"{record['volatility_percent']:.2f}%"),
+        ("Annual Vol %", lambda record: f"{record['annual_volatility_percent']:.2f}%")
+    ] + [
+        # Each column is the correlation with one coin, bound through a default argument for each lambda
+        (symbol, lambda record, coin_id=coin_id: f"{record[f'correlation_{coin_id}']:.2f}") for symbol, coin_id in zip(symbols, coins)
+    ])
+    print(f"{summary_table}\n{asset_table}")
 
-    summary_table = PrettyTable()
-    field_names = [f"Return % ({default_currency})", f"Total ({default_currency})", f"Return ({default_currency})", f"24H Diff ({default_currency})", f"24H % ({default_currency})"]
-    for currency in additional_currencies:
-        field_names.append(f"Total ({currency})")
-    summary_table.field_names = field_names
-    
-    investment_return = total_value[default_currency] - portfolio.get('investmentAmount', 0)
-    return_percent = (investment_return / portfolio.get('investmentAmount', 1)) * 100
-    change_24h_percent = (total_24h_change / total_value[default_currency]) * 100 if total_value[default_currency] != 0 else 0
-    
-    row = [f"{return_percent:.2f}%", f"{symbol}{format_currency(total_value[default_currency])}", f"{symbol}{format_currency(investment_return)}", f"{symbol}{total_24h_change:,.2f}", f"{change_24h_percent:.2f}%"]
-    for currency in additional_currencies:
-        symbol = get_currency_symbol(currency)
-        total_currency_value = sum(prices[coin['coinId']][currency.lower()] * coin['units'] for coin in portfolio['holdings'])
-        row.append(f"{symbol}{format_currency(total_currency_value)}")
-    
-    summary_table.add_row(row)
-    
-    print(summary_table)
-    print(detail_table)
+def main(argv=None):
+    args = parse_args(argv)
+    if (args.report or args.risk) and not args.history:
+        sys.exit(f"Error: --{'report' if args.report else 'risk'} needs the --history file to read.")
+    if not 0 < args.confidence < 1:
+        sys.exit("Error: --confidence must be between 0 and 1, such as 0.95.")
+    with instrument(args, 'portfolio'), exporting(args):
+        with span('load'):
+            portfolio = load(args.config_file)
+        if args.report:
+            with span('report'):
+                report(portfolio, args)
+            return
+        if args.risk:
+            with span('risk'):
+                risk(portfolio, args)
+            return
+        prices = fetch_prices(*get_price_request(portfolio), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='portfolio'):
+            run(portfolio, prices, args)
+        if args.history:
+            with span('record'):
+                record_history(portfolio, prices, args.history)
 
 if __name__ == "__main__":
     main()
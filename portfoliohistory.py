@@ -0,0 +1,188 @@
+"""
+Records of portfolio values over time, kept in a SQLite file, and reports on them.
+
+Each run of portfolio.py with --history appends a row with the time, the total value and the amount invested,
+and a row per coin with its units and price. Nothing is ever updated or deleted, so a run interrupted part way
+through leaves the earlier history intact.
+
+Reports read the runs once in time order from the index, working out the growth from each run to the next
+leaving out changes in the amount invested. The growth is compounded into time-weighted returns by day, week or
+month, and into a running peak for the drawdown. Only running totals are kept, so months of runs every few
+minutes are reported on without loading them.
+"""
+import math
+import time
+from contextlib import closing
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# strftime formats grouping runs by period, in UTC so a report doesn't change with the machine's time zone
+PERIODS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-W%W',
+    'month': '%Y-%m'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    investment REAL NOT NULL,
+    value REAL NOT NULL,
+    change_24h REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_currency ON runs (currency, time);
+CREATE TABLE IF NOT EXISTS coins (
+    id INTEGER PRIMARY KEY,
+    coin_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS holdings (
+    run_id INTEGER NOT NULL,
+    coin INTEGER NOT NULL,
+    units REAL NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (run_id, coin)
+) WITHOUT ROWID;
+"""
+
+# Runs in time order, read straight from the index
+RUNS_QUERY = "SELECT time, investment, value FROM runs WHERE currency = ? ORDER BY time, id"
+
+def add_arguments(parser):
+    """Adds the --history option and the --report and --risk modes that read it."""
+    parser.add_argument('--history', metavar='FILE', help="Record the portfolio's total and holding values in this SQLite file on each run, or with --report or --risk the file to read.")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--report', action='store_true', help="Report the value over time, the returns and the max drawdown recorded in --history instead of fetching prices.")
+    modes.add_argument('--risk', action='store_true', help="Report the volatility, correlation and value at risk of the holdings from the prices recorded in --history instead of fetching prices. Requires numpy.")
+    parser.add_argument('--period', choices=PERIODS, default='day', help="Period the report groups runs and returns by (default: day).")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the value at risk with --risk (default: 0.95).")
+
+def connect(path: str):
+    """Opens the history file, creating it and its tables if needed."""
+    import sqlite3
+
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+def append_run(path: str, currency: str, investment: float, holdings: Iterable[dict], timestamp: float = None) -> int:
+    """
+    Appends a run to the history.
+
+    Args:
+    path (str): The history file.
+    currency (str): The currency the values are in.
+    investment (float): The amount invested in the portfolio.
+    holdings (iterable of dict): Records with coin_id, units, price, value and change_24h_percent, as iter_holdings yields.
+    timestamp (float): When the prices were fetched, defaults to now.
+
+    Returns:
+    int: The ID of the run.
+    """
+    # A coin held in several places is recorded once with its units added together
+    units: Dict[str, float] = {}
+    prices: Dict[str, float] = {}
+    total_value = 0.0
+    total_change = 0.0
+    for holding in holdings:
+        coin_id = holding['coin_id']
+        price = float(holding['price'])
+        # A coin without a price in the currency is left out, as portfolio.py leaves out coins it couldn't fetch
+        if not math.isfinite(price):
+            continue
+        units[coin_id] = units.get(coin_id, 0.0) + float(holding['units'])
+        prices[coin_id] = price
+        total_value += float(holding['value'])
+        # Prices fetched without a 24 hour change have NaN, which counts as no change rather than failing the insert
+        change = float(holding['change_24h_percent'])
+        if math.isfinite(change):
+            total_change += float(holding['value']) * change / 100
+
+    with closing(connect(path)) as connection, connection:
+        run_id = connection.execute(
+            "INSERT INTO runs (time, currency, investment, value, change_24h) VALUES (?, ?, ?, ?, ?)",
+            (int(time.time() if timestamp is None else timestamp), currency, float(investment), total_value, total_change)
+        ).lastrowid
+        if units:
+            connection.executemany("INSERT OR IGNORE INTO coins (coin_id) VALUES (?)", ((coin_id,) for coin_id in units))
+            # Only coins that have been held are in the table, so reading all of it is cheap
+            coins = dict(connection.execute("SELECT coin_id, id FROM coins"))
+            connection.executemany(
+                "INSERT INTO holdings (run_id, coin, units, price) VALUES (?, ?, ?, ?)",
+                ((run_id, coins[coin_id], coin_units, prices[coin_id]) for coin_id, coin_units in units.items())
+            )
+    return run_id
+
+def iter_growth(connection, currency: str) -> Iterator[Tuple[int, float, float, float]]:
+    """
+    Yields the time, value, change in the amount invested and growth of each run since the one before.
+
+    The growth leaves out money put in or taken out: the change in the amount invested is taken to have been spent
+    on, or taken out of, the holdings just before the run, so it is taken off the run's value. The first run, and
+    runs after the portfolio was worth nothing, have a growth of 1. A fall to nothing is kept just above it so
+    growth can still be compounded after it.
+    """
+    previous_value = previous_investment = None
+    for run_time, investment, value in connection.execute(RUNS_QUERY, (currency,)):
+        flow = 0.0 if previous_investment is None else investment - previous_investment
+        growth = max(value - flow, previous_value * 1e-9) / previous_value if previous_value else 1.0
+        previous_value = value
+        previous_investment = investment
+        yield run_time, value, flow, growth
+
+def get_period_returns(connection, currency: str, period: str) -> List[dict]:
+    """
+    Returns the value of the portfolio at the start and end of each period with a run, the change in the amount
+    invested over it, and its time-weighted return. The return is from the end of the period before, or from the
+    first run for the first period, and leaves out money put in or taken out, so buying more of a coin isn't a gain.
+    """
+    period_format = PERIODS[period]
+    records: List[dict] = []
+    record = None
+    day = None
+    for run_time, value, flow, growth in iter_growth(connection, currency):
+        # Only the first run of each day has its period worked out
+        if run_time // 86400 != day:
+            day = run_time // 86400
+            name = time.strftime(period_format, time.gmtime(day * 86400))
+            if record is None or name != record['period']:
+                record = {'period': name, 'open': value, 'close': value, 'runs': 0, 'invested': 0.0, 'growth': 1.0}
+                records.append(record)
+        record['close'] = value
+        record['runs'] += 1
+        record['invested'] += flow
+        record['growth'] *= growth
+
+    for record in records:
+        record['return_percent'] = (record.pop('growth') - 1) * 100
+    return records
+
+def get_max_drawdown(connection, currency: str) -> Optional[Dict[str, float]]:
+    """
+    Returns the largest fall of the portfolio's time-weighted growth from a peak to a later low, with the time
+    and value of the portfolio at each, or None if there are no runs. Like the returns, it leaves out money put in
+    or taken out, so selling coins to take the money out isn't a fall.
+    """
+    drawdown = None
+    index = 1.0
+    peak = peak_time = peak_value = None
+    for run_time, value, _, growth in iter_growth(connection, currency):
+        index *= growth
+        # The peak is the latest run at the highest growth so far, the trough the first run at the largest fall
+        if peak is None or index >= peak:
+            peak, peak_time, peak_value = index, run_time, value
+        fall = index / peak - 1
+        if drawdown is None or fall < drawdown['drawdown_percent'] / 100:
+            drawdown = {
+                'drawdown_percent': fall * 100,
+                'peak_time': peak_time,
+                'peak_value': peak_value,
+                'trough_time': run_time,
+                'trough_value': value
+            }
+    return drawdown
+
+def get_span(connection, currency: str) -> Optional[Tuple[int, int, int]]:
+    """Returns the times of the first and last runs in the currency and the number of runs, or None if there are none."""
+    first, last, runs = connection.execute("SELECT min(time), max(time), count(*) FROM runs WHERE currency = ?", (currency,)).fetchone()
+    return None if runs == 0 else (first, last, runs)
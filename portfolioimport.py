@@ -0,0 +1,474 @@
+"""
+Imports trades from exchange CSV exports into a portfolio config's holdings and investmentAmount.
+
+Exports are read a row at a time, so a file of hundreds of thousands of trades takes no more memory than one
+of ten: only the running units and cost of each coin are kept. Each coin's cost is its average cost, so a buy
+adds the amount paid and its fee, and a sale takes off the sold units' share of the cost.
+
+Only the imported coins' holdings are changed, so holdings entered by hand for coins that aren't traded on an
+exchange are kept. A coin that is in both has to be replaced with --replace. investmentAmount has the cost of
+the imported coins still held in place of the cost from the last import.
+
+Symbols are matched to CoinGecko IDs with the coin list. A symbol shared by several coins is taken to be the
+one already in the portfolio, otherwise it has to be given with --map SYMBOL=coin-id.
+
+After an import the position reached in each file and the units and cost of each coin are saved to a
+checkpoint. Importing the same files again only reads the rows added since, as exchanges add new trades to
+the end of their exports. Run with --full to read every file from the beginning again.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import coingecko
+from utils import get_formatter
+from output import render_table
+
+CHECKPOINT_DIRECTORY = os.path.join(os.path.dirname(__file__), 'cache', 'import')
+
+# Header names each field is found under in the exports of common exchanges, in order of preference and
+# compared in lower case. A total is taken to exclude the fee, so a subtotal is preferred where there is one.
+COLUMN_NAMES = {
+    'side': ('side', 'type', 'transaction type', 'trade type', 'operation', 'direction'),
+    'symbol': ('asset', 'symbol', 'coin', 'base asset', 'base currency', 'cryptocurrency'),
+    'pair': ('pair', 'market', 'product', 'trading pair', 'instrument'),
+    'quantity': ('quantity', 'amount', 'units', 'qty', 'filled', 'executed', 'volume'),
+    'total': ('subtotal', 'total', 'cost', 'value', 'quote amount', 'total cost', 'net amount'),
+    'price': ('price', 'rate', 'unit price', 'spot price', 'price per coin'),
+    'fee': ('fee', 'fees', 'commission'),
+    'quote': ('quote', 'quote asset', 'quote currency', 'price currency', 'spot price currency')
+}
+
+PAIR_SEPARATOR = re.compile(r'[/\-_: ]+')
+NOT_NUMERIC = re.compile(r'[^0-9.eE+\-]')
+
+# Bytes at the start of a file checked to be unchanged before only its new rows are read
+FINGERPRINT_SIZE = 65536
+
+# Units left of a coin once it has all been sold, give or take float rounding
+DUST = 1e-12
+
+# Rows that couldn't be read are listed up to this many times
+MAX_INVALID_LISTED = 5
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import trades from exchange CSV exports into a portfolio config's holdings and investmentAmount.")
+    parser.add_argument('config_file', type=str, help="The portfolio config to update, created if it doesn't exist. See config/portfolio.json.example.")
+    parser.add_argument('csv_files', nargs='+', metavar='csv_file', help="Exchange exports of trades.")
+    parser.add_argument('--map', action='append', default=[], metavar='SYMBOL=COIN_ID', help="The CoinGecko ID of a symbol several coins share, for example BTC=bitcoin. Remembered for later imports.")
+    parser.add_argument('--column', action='append', default=[], metavar='FIELD=HEADER', help=f"The header of a field the export names differently, where FIELD is one of {', '.join(COLUMN_NAMES)}.")
+    parser.add_argument('--checkpoint', metavar='FILE', help="Where to keep the import's progress. Defaults to a file in cache/import for the config.")
+    parser.add_argument('--full', action='store_true', help="Read every file from the beginning, ignoring the checkpoint.")
+    parser.add_argument('--replace', action='store_true', help="Replace holdings already in the config that weren't imported with the imported units of the same coins.")
+    parser.add_argument('--dry-run', action='store_true', help="Show the holdings the import would give without changing the config or checkpoint.")
+    return parser.parse_args(argv)
+
+def get_checkpoint_filename(config_file: str) -> str:
+    path = os.path.abspath(config_file)
+    return os.path.join(CHECKPOINT_DIRECTORY, hashlib.sha1(path.encode()).hexdigest() + '.json')
+
+def load_checkpoint(filename: str) -> dict:
+    """Returns the saved checkpoint, or an empty one if there isn't one."""
+    try:
+        with open(filename, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def save_json(filename: str, data: dict):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, 'w') as file:
+        json.dump(data, file, indent=2)
+        file.write('\n')
+    os.replace(temp_filename, filename)
+
+def fingerprint(path: str, size: int) -> str:
+    """Returns a hash of the first size bytes of a file."""
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read(size)).hexdigest()
+
+def parse_mappings(values: List[str], option: str) -> Dict[str, str]:
+    """
+    Splits NAME=VALUE arguments into a dict.
+
+    Raises:
+    ValueError: If an argument has no '='.
+    """
+    mappings = {}
+    for value in values:
+        name, separator, mapped = value.partition('=')
+        if not separator or not name.strip() or not mapped.strip():
+            raise ValueError(f"{option} takes NAME=VALUE, got '{value}'")
+        mappings[name.strip()] = mapped.strip()
+    return mappings
+
+def find_columns(header: List[str], overrides: Dict[str, str]) -> Dict[str, int]:
+    """
+    Returns the index of each field's column in the header.
+
+    Raises:
+    ValueError: If the side, the quantity, or both the symbol and the pair can't be found.
+    """
+    positions = {name.strip().lower(): index for index, name in reversed(list(enumerate(header)))}
+    columns = {}
+    for field, names in COLUMN_NAMES.items():
+        if field in overrides:
+            names = (overrides[field].lower(),)
+        for name in names:
+            if name in positions:
+                columns[field] = positions[name]
+                break
+
+    missing = [field for field in ('side', 'quantity') if field not in columns]
+    if 'symbol' not in columns and 'pair' not in columns:
+        missing.append('symbol or pair')
+    if missing:
+        raise ValueError(f"No column for the {', '.join(missing)} in the header {', '.join(header)}. Name them with --column, for example --column quantity=Amount")
+    return columns
+
+def parse_amount(text: str) -> float:
+    """
+    Reads a number, ignoring thousands separators and currency symbols such as in '$1,234.50'.
+
+    Raises:
+    ValueError: If there is no number.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return float(NOT_NUMERIC.sub('', text.replace(',', '')))
+
+def parse_pair(pair: str, currency: str) -> Tuple[str, Optional[str]]:
+    """Splits a trading pair such as 'BTC/AUD', 'BTC-AUD' or 'BTCAUD' into the coin's symbol and the quote currency, if it can tell."""
+    parts = [part for part in PAIR_SEPARATOR.split(pair.strip()) if part]
+    if len(parts) >= 2:
+        return parts[0], parts[1]
+    pair = pair.strip()
+    if len(pair) > len(currency) and pair.upper().endswith(currency):
+        return pair[:-len(currency)], currency
+    return pair, None
+
+class Lines:
+    """
+    Iterates over the lines of a file opened in binary mode as text, counting the bytes read. csv.reader takes
+    lines one at a time and only as many as a row needs, so once it returns a row the position is the end of it.
+    """
+    def __init__(self, file, position: int):
+        self.file = file
+        self.position = position
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.file:
+            start = self.position
+            self.position += len(line)
+            yield line.decode('utf-8-sig' if start == 0 else 'utf-8', errors='replace')
+
+class SymbolResolver:
+    """
+    Finds the CoinGecko ID of each symbol in an export, remembering the ones it couldn't.
+
+    Args:
+    coin_list (dict): The coin list as fetch_coin_list returns it.
+    mappings (dict): IDs of symbols given by the user, which win over the coin list.
+    preferred (iterable of str): IDs to choose when a symbol is shared, usually the coins already held.
+    """
+    def __init__(self, coin_list: Dict[str, dict], mappings: Dict[str, str], preferred: Iterable[str]):
+        self.coin_list = coin_list
+        self.resolved = {symbol.lower(): coin_id for symbol, coin_id in mappings.items()}
+        self.chosen: Dict[str, str] = {}  # Shared symbols resolved to a preferred ID, to remember for later imports
+        self.preferred = set(preferred)
+        self.unresolved: Dict[str, List[str]] = {}  # Symbols without an ID and the coins that share them
+        self._by_symbol: Optional[Dict[str, List[str]]] = None
+
+    def _candidates(self, symbol: str) -> List[str]:
+        if self._by_symbol is None:
+            self._by_symbol = {}
+            for coin_id, coin in self.coin_list.items():
+                self._by_symbol.setdefault(coin['symbol'].lower(), []).append(coin_id)
+        return self._by_symbol.get(symbol, [])
+
+    def resolve(self, symbol: str) -> Optional[str]:
+        key = symbol.strip().lower()
+        coin_id = self.resolved.get(key)
+        if coin_id is not None or key in self.unresolved:
+            return coin_id
+
+        candidates = self._candidates(key)
+        preferred = [candidate for candidate in candidates if candidate in self.preferred]
+        if len(candidates) == 1:
+            coin_id = candidates[0]
+        elif len(preferred) == 1:
+            coin_id = self.chosen[key] = preferred[0]
+        elif not candidates and key in self.coin_list:
+            coin_id = key  # The export already uses CoinGecko IDs
+        else:
+            self.unresolved[key] = candidates
+            return None
+        self.resolved[key] = coin_id
+        return coin_id
+
+class Importer:
+    """
+    Adds up trades into the units and cost of each coin.
+
+    Args:
+    currency (str): The portfolio's default currency. Costs in other currencies can't be added up with it.
+    resolver (SymbolResolver): Finds the coin of each trade.
+    holdings (dict): The [units, cost] of each coin so far, updated in place.
+    """
+    def __init__(self, currency: str, resolver: SymbolResolver, holdings: Dict[str, List[float]]):
+        self.currency = currency.upper()
+        self.resolver = resolver
+        self.holdings = holdings
+        self.trades = 0
+        self.skipped: Dict[str, int] = {}  # Rows that aren't trades, by their type
+        self.oversold = 0  # Sales of more than was held, from trades before the export starts
+        self.uncosted = 0  # Buys without a cost in the portfolio's currency
+        self.invalid: List[str] = []  # Where the rows that couldn't be read are, up to MAX_INVALID_LISTED
+        self.invalid_count = 0
+
+    def add(self, row: List[str], columns: Dict[str, int]):
+        """
+        Adds the trade in a row. Every field is read before the holding is changed, so a row that can't be read
+        leaves it as it was.
+
+        Raises:
+        ValueError: If a number can't be read.
+        IndexError: If the row is missing a column.
+        """
+        side = row[columns['side']].strip().lower()
+        if 'buy' in side or side in ('bought', 'purchase'):
+            buying = True
+        elif 'sell' in side or side == 'sold':
+            buying = False
+        else:
+            self.skipped[side or 'blank'] = self.skipped.get(side or 'blank', 0) + 1
+            return
+
+        quote = None
+        if 'symbol' in columns:
+            symbol = row[columns['symbol']]
+        else:
+            symbol, quote = parse_pair(row[columns['pair']], self.currency)
+        if 'quote' in columns and row[columns['quote']].strip():
+            quote = row[columns['quote']]
+        # Some exchanges show sales as negative quantities
+        quantity = abs(parse_amount(row[columns['quantity']]))
+
+        total = None
+        if buying:
+            if 'total' in columns and row[columns['total']].strip():
+                total = abs(parse_amount(row[columns['total']]))
+            elif 'price' in columns and row[columns['price']].strip():
+                total = quantity * abs(parse_amount(row[columns['price']]))
+            if quote is not None and quote.strip().upper() != self.currency:
+                total = None
+            elif total is not None and 'fee' in columns and row[columns['fee']].strip():
+                total += abs(parse_amount(row[columns['fee']]))
+
+        coin_id = self.resolver.resolve(symbol)
+        if coin_id is None:
+            return
+        holding = self.holdings.setdefault(coin_id, [0.0, 0.0])
+        self.trades += 1
+
+        if buying:
+            holding[0] += quantity
+            if total is None:
+                self.uncosted += 1
+            else:
+                holding[1] += total
+            return
+
+        units = holding[0]
+        if quantity > units + DUST:
+            self.oversold += 1
+            quantity = units
+        if units > 0:
+            holding[1] -= holding[1] * quantity / units
+        holding[0] = units - quantity
+
+    def import_file(self, path: str, position: int = 0, header: List[str] = None, line: int = 0, overrides: Dict[str, str] = None) -> Tuple[int, Optional[List[str]], int]:
+        """
+        Adds the trades in a file from a byte position onwards.
+
+        Args:
+        path (str): The export.
+        position (int): Where to start, 0 or the end of the rows read last time.
+        header (list of str): The file's header, when starting after it.
+        line (int): The number of lines before position, for reporting rows that can't be read.
+        overrides (dict): Headers of fields given with --column.
+
+        Returns:
+        tuple: The position and line number the file was read up to, and its header.
+
+        Raises:
+        ValueError: If the columns can't be found.
+        OSError: If the file can't be read.
+        """
+        with open(path, 'rb') as file:
+            file.seek(position)
+            lines = Lines(file, position)
+            reader = csv.reader(lines)
+            if header is None:
+                header = next(reader, None)
+                if header is None:
+                    return lines.position, None, line
+            columns = find_columns(header, overrides or {})
+
+            for row in reader:
+                if not any(field.strip() for field in row):
+                    continue
+                try:
+                    self.add(row, columns)
+                except (ValueError, IndexError):
+                    self.invalid_count += 1
+                    if len(self.invalid) < MAX_INVALID_LISTED:
+                        self.invalid.append(f"{path} line {line + reader.line_num}")
+            return lines.position, header, line + reader.line_num
+
+def read_config(config_file: str) -> dict:
+    """Returns the config as it is in the file, without defaults, so rewriting it keeps everything else the same."""
+    try:
+        with open(config_file, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'investmentAmount': 0, 'defaultCurrency': 'AUD', 'currencies': [], 'holdings': []}
+
+def merge_holdings(existing: List[dict], imported: Dict[str, float], imported_before: Iterable[str]) -> Tuple[List[dict], List[str]]:
+    """
+    Sets the units of the imported coins in a config's holdings, keeping the holdings the import doesn't have as they are.
+
+    Args:
+    existing (list of dict): The config's holdings.
+    imported (dict): The units of each coin in the exports, including ones that have all been sold.
+    imported_before (iterable of str): Coin IDs earlier imports wrote to the config.
+
+    Returns:
+    tuple: The holdings, and the coin IDs that were in the config without being imported but are in the exports.
+    """
+    imported_before = set(imported_before)
+    merged = []
+    replaced = []
+    written = set()
+    for holding in existing:
+        coin_id = holding['coinId']
+        if coin_id not in imported and coin_id not in imported_before:
+            merged.append(holding)
+            continue
+        if coin_id not in imported_before and coin_id not in replaced:
+            replaced.append(coin_id)
+        units = imported.get(coin_id, 0)
+        if coin_id not in written and units > DUST:
+            merged.append({**holding, 'units': round(units, 10)})
+        written.add(coin_id)
+    merged.extend({'coinId': coin_id, 'units': round(units, 10)} for coin_id, units in imported.items() if coin_id not in written and units > DUST)
+    return merged, replaced
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        config = read_config(args.config_file)
+        mappings = parse_mappings(args.map, '--map')
+        overrides = parse_mappings(args.column, '--column')
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    unknown_fields = [field for field in overrides if field not in COLUMN_NAMES]
+    if unknown_fields:
+        sys.exit(f"Error: Unknown --column field {', '.join(unknown_fields)}, use one of {', '.join(COLUMN_NAMES)}.")
+
+    currency = config.get('defaultCurrency', 'AUD').upper()
+    checkpoint_file = args.checkpoint or get_checkpoint_filename(args.config_file)
+    try:
+        checkpoint = load_checkpoint(checkpoint_file)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: Failed to read the checkpoint '{checkpoint_file}': {e}. Run with --full to import everything again.")
+    if checkpoint.get('currency', currency) != currency and not args.full:
+        sys.exit(f"Error: The last import was in {checkpoint['currency']} but the portfolio's defaultCurrency is {currency}. Run with --full to import everything again.")
+
+    mappings = {**checkpoint.get('symbols', {}), **mappings}
+    try:
+        coin_list = coingecko.fetch_coin_list()
+    except Exception as e:
+        sys.exit(f"Error: Failed to load the coin list: {e}")
+    unknown_ids = [coin_id for coin_id in mappings.values() if coin_id not in coin_list]
+    if unknown_ids:
+        sys.exit(f"Error: {', '.join(unknown_ids)} aren't CoinGecko coin IDs. Run coinsearch.py to find the right ones.")
+
+    files = {} if args.full else dict(checkpoint.get('files', {}))
+    holdings = {} if args.full else {coin_id: list(holding) for coin_id, holding in checkpoint.get('holdings', {}).items()}
+    resolver = SymbolResolver(coin_list, mappings, [holding['coinId'] for holding in config.get('holdings', [])] + list(holdings))
+    importer = Importer(currency, resolver, holdings)
+
+    for path in args.csv_files:
+        key = os.path.abspath(path)
+        entry = files.get(key, {'position': 0, 'header': None, 'line': 0})
+        try:
+            if entry['position'] and (os.path.getsize(path) < entry['position'] or fingerprint(path, min(entry['position'], FINGERPRINT_SIZE)) != entry['fingerprint']):
+                sys.exit(f"Error: '{path}' has changed since it was imported, not just had rows added. Run with --full to import everything again.")
+            position, header, line = importer.import_file(path, entry['position'], entry['header'], entry['line'], overrides)
+            files[key] = {'position': position, 'header': header, 'line': line, 'fingerprint': fingerprint(path, min(position, FINGERPRINT_SIZE))}
+        except OSError as e:
+            sys.exit(f"Error: Failed to read '{path}': {e}")
+        except ValueError as e:
+            sys.exit(f"Error: {path}: {e}")
+
+    if resolver.unresolved:
+        # Nothing is saved, so running again with --map reads these rows again
+        symbols = [f"{symbol.upper()} ({', '.join(candidates) if candidates else 'not in the coin list'})" for symbol, candidates in resolver.unresolved.items()]
+        sys.exit(f"Error: Can't tell which coin these symbols are: {'; '.join(symbols)}. Give their IDs with --map SYMBOL=coin-id, for example --map BTC=bitcoin.")
+
+    if importer.invalid_count:
+        print(f"Warning: Skipped {importer.invalid_count:,} rows that couldn't be read, at {', '.join(importer.invalid)}{' and more' if importer.invalid_count > len(importer.invalid) else ''}.", file=sys.stderr)
+    if importer.oversold:
+        print(f"Warning: {importer.oversold:,} sales were of more than had been bought, so the exports may not go back far enough.", file=sys.stderr)
+    if importer.uncosted:
+        print(f"Warning: {importer.uncosted:,} buys had no cost in {currency} and don't count towards investmentAmount.", file=sys.stderr)
+
+    # Coins the checkpoint has are the ones earlier imports wrote, whether or not this one reads from the beginning
+    imported_before = checkpoint.get('holdings', {})
+    config['holdings'], replaced = merge_holdings(config.get('holdings', []), {coin_id: units for coin_id, (units, _) in holdings.items()}, imported_before)
+    if replaced and not args.replace:
+        sys.exit(f"Error: {', '.join(replaced)} {'is' if len(replaced) == 1 else 'are'} in the config's holdings but not from an import. Run with --replace to replace the units with the imported ones, or take them out of the config.")
+    if replaced:
+        print(f"Warning: Replaced the units of {', '.join(replaced)} in the config with the imported ones. investmentAmount still includes what was entered for them.", file=sys.stderr)
+
+    # The cost of the last import is swapped for this one's, so amounts entered for other holdings are kept
+    held = [(coin_id, units, cost) for coin_id, (units, cost) in holdings.items() if units > DUST]
+    investment = sum(cost for _, _, cost in held)
+    previous_investment = checkpoint.get('investment', 0) if checkpoint.get('currency') == currency else 0
+    config['investmentAmount'] = round(config.get('investmentAmount', 0) - previous_investment + investment, 2)
+
+    if not args.dry_run:
+        try:
+            save_json(args.config_file, config)
+            save_json(checkpoint_file, {
+                'currency': currency,
+                'symbols': {**checkpoint.get('symbols', {}), **mappings, **resolver.chosen},
+                'files': files,
+                'holdings': holdings,
+                'investment': investment
+            })
+        except OSError as e:
+            sys.exit(f"Error: Failed to save the import: {e}")
+
+    skipped = sum(importer.skipped.values())
+    print(f"Imported {importer.trades:,} trades" + (f", skipped {skipped:,} other rows ({', '.join(f'{kind}: {count:,}' for kind, count in sorted(importer.skipped.items()))})" if skipped else "") + ".")
+    format_amount = get_formatter(currency)
+    print(render_table(held, [
+        ("Symbol", lambda holding: coin_list[holding[0]]['symbol'].upper()),
+        ("Units", lambda holding: f"{holding[1]:.8g}"),
+        (f"Cost ({currency})", lambda holding: format_amount(holding[2])),
+        (f"Avg Cost ({currency})", lambda holding: format_amount(holding[2] / holding[1]))
+    ]))
+    print(f"investmentAmount: {format_amount(config['investmentAmount'])}" + (" (dry run, nothing was saved)" if args.dry_run else ""))
+
+if __name__ == "__main__":
+    main()
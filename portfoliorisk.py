@@ -0,0 +1,224 @@
+"""
+Risk measures for a portfolio from the prices recorded in its history file (see portfoliohistory.py).
+
+Each coin's price at the last run of each day is its close for the day, and its return for the day is the change
+from the close of the day before with a run. The closes and returns of every coin in the history are kept as
+matrices, one row per day and one column per coin, in a cache file next to the history. Each update only reads
+the runs recorded since the cache was saved and works out the rows for their days, so a report after another
+day of runs costs a day of work rather than the whole history.
+
+From the returns of the coins held, and their weights by current value:
+
+- Volatility is the standard deviation of daily returns, also given annualised over 365 days as crypto trades
+  every day.
+- The covariance and correlation matrices show how the coins move together.
+- Portfolio volatility is sqrt(w' C w) for weights w and covariance C, which is lower than the weighted average
+  of the coins' volatilities when they don't move together.
+- Value at risk is the loss over one day that is only exceeded with the given probability. Historical VaR is
+  the quantile of the portfolio's returns had it been held with today's weights on each past day, parametric
+  VaR assumes returns are normally distributed with their mean and standard deviation.
+
+Requires NumPy, which portfolio.py only imports when --risk is used.
+"""
+import math
+import os
+import zipfile
+from statistics import NormalDist
+from typing import Dict, List
+
+import numpy as np
+
+DAYS_PER_YEAR = 365
+DEFAULT_CONFIDENCE = 0.95
+MIN_RETURNS = 2  # Days of returns needed for a standard deviation
+
+# The closing price of each coin on each day since a time. SQLite takes bare columns from the row of an
+# aggregate's max(), so price is the coin's price at the last run of the day.
+CLOSE_QUERY = """
+SELECT runs.time / 86400 AS day, coins.coin_id, holdings.price, max(runs.time)
+FROM runs
+JOIN holdings ON holdings.run_id = runs.id
+JOIN coins ON coins.id = holdings.coin
+WHERE runs.currency = :currency AND runs.time >= :since
+GROUP BY day, holdings.coin
+ORDER BY day
+"""
+
+def get_cache_filename(history_file: str) -> str:
+    """Returns the file the returns of a history file are cached in."""
+    return f"{history_file}.returns.npz"
+
+class ReturnCache:
+    """
+    Daily closes and returns of every coin in a history file, in one currency.
+
+    Attributes:
+    currency (str): The currency of the prices.
+    last_run (int): The ID of the last run included.
+    days (array): Days with a run, as days since 1970-01-01 UTC.
+    coins (list of str): Coin IDs, one per column.
+    prices (array): Closes, one row per day, NaN for a coin without a price that day.
+    returns (array): Returns as fractions, one row per day after the first, NaN where either close is missing.
+    """
+    def __init__(self, currency: str):
+        self.currency = currency
+        self.clear()
+
+    def clear(self):
+        self.last_run = 0
+        self.days = np.empty(0, dtype=np.int64)
+        self.coins: List[str] = []
+        self.prices = np.empty((0, 0))
+        self.returns = np.empty((0, 0))
+
+    @classmethod
+    def load(cls, filename: str, currency: str) -> 'ReturnCache':
+        """Loads the cache, or gives an empty one if the file is missing, unreadable or in another currency."""
+        cache = cls(currency)
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                if str(data['currency']) != currency:
+                    return cache
+                cache.last_run = int(data['last_run'])
+                cache.days = data['days']
+                cache.coins = [str(coin_id) for coin_id in data['coins']]
+                cache.prices = data['prices']
+                cache.returns = data['returns']
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return cls(currency)
+        return cache
+
+    def save(self, filename: str):
+        temp_filename = f"{filename}.{os.getpid()}.tmp.npz"
+        np.savez(temp_filename, currency=self.currency, last_run=self.last_run, days=self.days, coins=np.array(self.coins, dtype=str), prices=self.prices, returns=self.returns)
+        os.replace(temp_filename, filename)
+
+    def update(self, connection) -> int:
+        """
+        Adds the runs recorded in the history since the cache was last updated.
+
+        The last day already in the cache is worked out again, as runs later that day change its close. If the
+        history has had runs removed, or has a new run earlier than that day, the cache is rebuilt from scratch.
+
+        Returns:
+        int: The number of days worked out.
+        """
+        last_run, = connection.execute("SELECT coalesce(max(id), 0) FROM runs").fetchone()
+        earliest, = connection.execute("SELECT min(time) FROM runs WHERE id > ? AND currency = ?", (self.last_run, self.currency)).fetchone()
+        if last_run < self.last_run or (earliest is not None and len(self.days) and earliest // 86400 < self.days[-1]):
+            self.clear()
+            earliest, = connection.execute("SELECT min(time) FROM runs WHERE currency = ?", (self.currency,)).fetchone()
+        self.last_run = last_run
+        if earliest is None:
+            return 0
+
+        # Keep the days before the first one with a new run, and the returns up to them
+        first_day = int(self.days[-1]) if len(self.days) else earliest // 86400
+        kept = int(np.searchsorted(self.days, first_day))
+        self.days = self.days[:kept]
+        self.prices = self.prices[:kept]
+        self.returns = self.returns[:max(kept - 1, 0)]
+
+        columns = {coin_id: column for column, coin_id in enumerate(self.coins)}
+        new_days: Dict[int, int] = {}
+        closes = []
+        for day, coin_id, price, _ in connection.execute(CLOSE_QUERY, {'currency': self.currency, 'since': first_day * 86400}):
+            if day not in new_days:
+                new_days[day] = len(new_days)
+            if coin_id not in columns:
+                columns[coin_id] = len(columns)
+                self.coins.append(coin_id)
+            closes.append((new_days[day], columns[coin_id], price))
+
+        new_prices = np.full((len(new_days), len(columns)), np.nan)
+        if closes:
+            rows, cols, values = zip(*closes)
+            new_prices[list(rows), list(cols)] = values
+
+        # Coins first held on the new days get a column of NaN in the earlier rows
+        missing_columns = len(columns) - self.prices.shape[1]
+        self.prices = np.vstack([np.pad(self.prices, ((0, 0), (0, missing_columns)), constant_values=np.nan), new_prices])
+        self.returns = np.pad(self.returns, ((0, 0), (0, missing_columns)), constant_values=np.nan)
+        self.days = np.concatenate([self.days, np.fromiter(new_days, dtype=np.int64, count=len(new_days))])
+
+        # Only the returns into the new days are worked out, from the close of the day before them
+        previous = self.prices[max(kept - 1, 0):]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_returns = previous[1:] / previous[:-1] - 1
+        new_returns[~np.isfinite(new_returns)] = np.nan
+        self.returns = np.vstack([self.returns, new_returns])
+        return len(new_days)
+
+def load_returns(connection, history_file: str, currency: str) -> ReturnCache:
+    """Returns the cached returns of the history file brought up to date, saving them if anything changed."""
+    filename = get_cache_filename(history_file)
+    cache = ReturnCache.load(filename, currency)
+    last_run = cache.last_run
+    cache.update(connection)
+    if cache.last_run != last_run:
+        cache.save(filename)
+    return cache
+
+def analyse(cache: ReturnCache, units: Dict[str, float], confidence: float = DEFAULT_CONFIDENCE) -> dict:
+    """
+    Works out the risk measures described in the module docstring for holdings of the coins.
+
+    Args:
+    cache (ReturnCache): Closes and returns from the history.
+    units (dict): Units held of each coin. Coins without a price in the history are left out.
+    confidence (float): Probability the loss doesn't exceed the value at risk, such as 0.95.
+
+    Returns:
+    dict: 'coins', the coin IDs analysed, 'missing', the coin IDs without prices, 'days', the number of days of
+    returns, 'value', the value at the latest closes, 'weights', 'volatility', 'covariance' and 'correlation'
+    by coin, and 'portfolio_volatility', 'historical_var' and 'parametric_var'. Volatilities are daily.
+
+    Raises:
+    ValueError: If there aren't enough days with a return for every coin.
+    """
+    columns = {coin_id: column for column, coin_id in enumerate(cache.coins)}
+    coins = [coin_id for coin_id in units if coin_id in columns]
+    missing = [coin_id for coin_id in units if coin_id not in columns]
+    if not coins:
+        raise ValueError("None of the holdings have prices in the history")
+
+    selected = [columns[coin_id] for coin_id in coins]
+    returns = cache.returns[:, selected]
+    returns = returns[np.isfinite(returns).all(axis=1)]
+    if len(returns) < MIN_RETURNS:
+        raise ValueError(f"The history has {len(returns)} days with a return for every holding, at least {MIN_RETURNS} are needed")
+
+    # Value each holding at its coin's latest close
+    prices = cache.prices[:, selected]
+    latest = len(prices) - 1 - np.argmax(np.isfinite(prices)[::-1], axis=0)
+    values = prices[latest, np.arange(len(selected))] * np.array([units[coin_id] for coin_id in coins])
+    value = float(values.sum())
+    weights = values / value if value else np.full(len(values), 1 / len(values))
+
+    covariance = np.atleast_2d(np.cov(returns, rowvar=False))
+    volatility = np.sqrt(np.diag(covariance))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.outer(volatility, volatility)
+    correlation[~np.isfinite(correlation)] = np.nan
+
+    portfolio_returns = returns @ weights
+    mean = float(portfolio_returns.mean())
+    portfolio_volatility = math.sqrt(max(float(weights @ covariance @ weights), 0))
+
+    return {
+        'coins': coins,
+        'missing': missing,
+        'days': len(returns),
+        'value': value,
+        'weights': weights,
+        'volatility': volatility,
+        'covariance': covariance,
+        'correlation': correlation,
+        'portfolio_volatility': portfolio_volatility,
+        'historical_var': -float(np.quantile(portfolio_returns, 1 - confidence)) * value,
+        'parametric_var': -(mean + NormalDist().inv_cdf(1 - confidence) * portfolio_volatility) * value
+    }
+
+def annualise(volatility):
+    """Scales a daily volatility to a year."""
+    return volatility * math.sqrt(DAYS_PER_YEAR)
@@ -3,11 +3,13 @@ import os
 import sys
 from argparse import ArgumentParser
 import coingecko
-from utils import validate_currency_prices, get_currency_symbol, format_currency
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from jsonschema import validate, ValidationError
+from utils import fetch_prices, get_formatter
+from configloader import load_config, ConfigError
+from metrics import ALERTS_FIRED, NOTIFICATIONS, NOTIFICATION_DURATION, RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from pricecache import add_arguments as add_resilience_arguments
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from rules import rules_schema, compile_rules, RuleSyntaxError, UnknownCoinError
+from scheduler import Trigger
 
 config_schema = {
     "type": "object",
@@ -24,6 +26,16 @@ config_schema = {
                     "currency": {
                         "type": "string",
                         "minLength": 3
+                    },
+                    "decreasePercent": {
+                        "type": "number",
+                        "exclusiveMinimum": 0,
+                        "exclusiveMaximum": 100
+                    },
+                    "trailingStopPercent": {
+                        "type": "number",
+                        "exclusiveMinimum": 0,
+                        "exclusiveMaximum": 100
                     }
                 },
                 "required": ["coinId", "currency"]
@@ -33,6 +45,19 @@ config_schema = {
             "type": "number",
             "minimum": 1 # A percentage increase of at least 1% is represented by the whole number 1 and not 0.01
         },
+        "decreasePercent": {
+            "type": "number",
+            "exclusiveMinimum": 0,
+            "exclusiveMaximum": 100,
+            "description": "Alert when the price drops this percentage below the price it was at when the drop alert was last armed."
+        },
+        "trailingStopPercent": {
+            "type": "number",
+            "exclusiveMinimum": 0,
+            "exclusiveMaximum": 100,
+            "description": "Alert when the price falls this percentage below its peak since the trailing stop was last armed."
+        },
+        "rules": rules_schema,
         "sendEmail": {
             "type": "boolean"
         },
@@ -66,19 +91,26 @@ config_schema = {
     "required": ["coins", "sendEmail", "email", "smtp", "increasePercent"]
 }
 
-def parse_args():
+def parse_args(argv=None):
     parser = ArgumentParser(description="Track if cryptocurrency prices increase by a defined percentage and send alerts.")
     parser.add_argument('config_file', type=str, help="Path to the configuration JSON file. See config/pricealert.json.example for an example.")
-    return parser.parse_args()
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    return parser.parse_args(argv)
 
 def send_email(config, message):
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     msg = MIMEMultipart()
     msg['From'] = config['email']
     msg['To'] = config['email']
-    msg['Subject'] = "Coin Price Increase Alert"
+    msg['Subject'] = "Coin Price Alert"
     msg.attach(MIMEText(message, 'plain'))
     try:
-        with smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
+        with span('notify'), track(NOTIFICATIONS, NOTIFICATION_DURATION, tool='pricealert'), smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
             server.starttls()
             server.login(config['smtp']['username'], config['smtp']['password'])
             server.send_message(msg)
@@ -86,86 +118,167 @@ def send_email(config, message):
     except Exception as e:
         sys.exit(f"Failed to send email: {e}")
 
-def main(cache_directory=None):
-    if cache_directory is None:
-        cache_directory = os.path.join(os.path.dirname(__file__), 'cache')
+def load(config_path):
+    """Loads and validates the config and its rules, exiting with an error message if they can't be used."""
+    try:
+        config = load_config(config_path, config_schema)
+    except ConfigError as e:
+        sys.exit(str(e))
+
+    if not config['coins']:
+        sys.exit("Error: No coins specified in the configuration.")
+
+    try:
+        compile_rules(config.get('rules', [])).check_coin_ids()
+    except (RuleSyntaxError, UnknownCoinError) as e:
+        sys.exit(f"Error: Invalid rule: {e}")
 
-    cache_filename = os.path.join(cache_directory, 'coin_prices_cache.json')
+    return config
 
-    args = parse_args()
-    config_path = args.config_file
+def get_price_request(config):
+    """Returns the coin IDs and currencies the coins and rules need prices for, and the currencies the rules need the 24 hour change in."""
+    rules = compile_rules(config.get('rules', []))
+    coin_ids = [coin['coinId'] for coin in config['coins']] + list(rules.coin_ids)
+    currencies = list(set(coin['currency'].lower() for coin in config['coins']) | rules.currencies)
+    return coin_ids, currencies, list(rules.change_currencies)
 
-    if not os.path.exists(config_path):
-        sys.exit("Error: Config file does not exist.")
+def get_cache_filename(cache_directory=None):
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(__file__), 'cache')
+    return os.path.join(cache_directory, 'coin_prices_cache.json')
 
+def load_price_history(cache_filename):
+    """Loads the stored alert thresholds, exiting with an error message if the file can't be decoded."""
+    if not os.path.exists(cache_filename):
+        return {}
     try:
-        with open(config_path, 'r') as file:
-            config = json.load(file)
+        with open(cache_filename, 'r') as file:
+            with span('state.load'):
+                return json.load(file)
     except json.JSONDecodeError:
-        sys.exit("Error: Failed to decode JSON from the provided file.")
+        sys.exit("Error: Failed to decode JSON from the price history file.")
 
-    try:
-        validate(instance=config, schema=config_schema)
-    except ValidationError as e:
-        error_path = " -> ".join(map(str, e.path))
-        sys.exit(f"Error: Configuration file validation failed at '{error_path}': {e.message}. Look at the sample configs to see how to structure the configuration.")
+def get_triggers(config, cache_directory=None):
+    """
+    Returns the prices at which a run would alert or move a stored threshold, for cointracker watch to check
+    coins more often as they get close. Coins that haven't been run yet have none.
+    """
+    price_history = load_price_history(get_cache_filename(cache_directory))
+    triggers = []
+    for coin in config['coins']:
+        coin_id = coin['coinId']
+        currency = coin['currency'].lower()
+        state = price_history.get(f"{coin_id}-{currency}")
+        if state is None:
+            continue
+        if not isinstance(state, dict):
+            state = {'alertPrice': state}
+        # A new peak moves the trailing stop, so it counts as a trigger too
+        for key in ('alertPrice', 'dropPrice', 'peakPrice'):
+            if key in state:
+                triggers.append(Trigger.price(coin_id, currency, state[key]))
+        trailing_stop_percent = coin.get('trailingStopPercent', config.get('trailingStopPercent'))
+        if trailing_stop_percent and 'peakPrice' in state:
+            triggers.append(Trigger.price(coin_id, currency, state['peakPrice'] - (state['peakPrice'] * (trailing_stop_percent / 100))))
+    return triggers
 
-    if not config['coins']:
-        sys.exit("Error: No coins specified in the configuration.")
+def run(config, prices, args, cache_directory=None):
+    """Checks the given prices against the stored alert thresholds, printing and sending any alerts and updating the thresholds."""
+    cache_filename = get_cache_filename(cache_directory)
+    rules = compile_rules(config.get('rules', []))
 
     if not os.path.exists(os.path.dirname(cache_filename)):
         os.makedirs(os.path.dirname(cache_filename))
 
-    if os.path.exists(cache_filename):
-        try:
-            with open(cache_filename, 'r') as file:
-                price_history = json.load(file)
-        except json.JSONDecodeError:
-            sys.exit("Error: Failed to decode JSON from the price history file.")
-    else:
-        price_history = {}
+    price_history = load_price_history(cache_filename)
 
     active_keys = {f"{coin['coinId']}-{coin['currency'].lower()}" for coin in config['coins'] if 'coinId' in coin and 'currency' in coin}
-    # Remove any keys that are not in the active set
-    price_history = {key: value for key, value in price_history.items() if key in active_keys}
-
-    coin_ids = [coin['coinId'] for coin in config['coins']]
-    currencies = list(set(coin['currency'] for coin in config['coins']))
-
-    try:
-        prices = coingecko.fetch_price_data(coin_ids, currencies)
-        validate_currency_prices(prices, currencies)
-    except Exception as e:
-        sys.exit(str(e))
+    # Remove any keys that are not in the active set. Older caches stored only the increase threshold for each key.
+    price_history = {key: value if isinstance(value, dict) else {'alertPrice': value} for key, value in price_history.items() if key in active_keys}
 
     alert = False
+    state_changed = False
     output = ""
 
-    for coin in config['coins']:
-        coin_id = coin['coinId']
-        currency = coin['currency'].lower()
-        price_key = f"{coin_id}-{currency}"
-        current_price = prices.get(coin_id, {}).get(currency, 0)
-        if current_price == 0:
-            sys.exit(f"Error: No price data for {coin_id} in {currency.upper()}.")
-        alert_price = price_history.get(price_key, 0)
-
-        if current_price > alert_price:
-            currency_symbol = get_currency_symbol(currency)
-            output += f"{coingecko.get_coin_symbol(coin_id)} is now {currency.upper()} {currency_symbol}{format_currency(current_price)}\n"
-            price_history[price_key] = current_price + (current_price * (config['increasePercent'] / 100))
-            alert = True
+    with span('compute', coins=len(config['coins'])):
+        for coin in config['coins']:
+            coin_id = coin['coinId']
+            currency = coin['currency'].lower()
+            price_key = f"{coin_id}-{currency}"
+            if coin_id not in prices:
+                continue  # Left out by a --resilient fetch, which has already warned about it
+            current_price = prices.get(coin_id, {}).get(currency, 0)
+            if current_price == 0:
+                sys.exit(f"Error: No price data for {coin_id} in {currency.upper()}.")
+            state = price_history.setdefault(price_key, {})
+            previous_state = dict(state)
+            format_amount = get_formatter(currency)
+
+            if current_price > state.get('alertPrice', 0):
+                output += f"{coingecko.get_coin_symbol(coin_id)} is now {currency.upper()} {format_amount(current_price)}\n"
+                state['alertPrice'] = current_price + (current_price * (config['increasePercent'] / 100))
+                ALERTS_FIRED.inc(tool='pricealert', kind='increase')
+                alert = True
+
+            decrease_percent = coin.get('decreasePercent', config.get('decreasePercent'))
+            if decrease_percent:
+                drop_price = state.get('dropPrice')
+                if drop_price is not None and current_price < drop_price:
+                    output += f"{coingecko.get_coin_symbol(coin_id)} has dropped to {currency.upper()} {format_amount(current_price)}\n"
+                    ALERTS_FIRED.inc(tool='pricealert', kind='drop')
+                    alert = True
+                if drop_price is None or current_price < drop_price:
+                    # Arm the drop alert below the current price, it ratchets down each time it fires
+                    state['dropPrice'] = current_price - (current_price * (decrease_percent / 100))
+            else:
+                state.pop('dropPrice', None)
+
+            trailing_stop_percent = coin.get('trailingStopPercent', config.get('trailingStopPercent'))
+            if trailing_stop_percent:
+                peak_price = max(state.get('peakPrice', current_price), current_price)
+                if current_price <= peak_price - (peak_price * (trailing_stop_percent / 100)):
+                    percent_from_peak = (peak_price - current_price) / peak_price * 100
+                    output += f"{coingecko.get_coin_symbol(coin_id)} is now {currency.upper()} {format_amount(current_price)}, down {percent_from_peak:.2f}% from its peak of {format_amount(peak_price)}\n"
+                    ALERTS_FIRED.inc(tool='pricealert', kind='trailing_stop')
+                    alert = True
+                    peak_price = current_price  # Re-arm the trailing stop from the current price
+                state['peakPrice'] = peak_price
+            else:
+                state.pop('peakPrice', None)
+
+            if state != previous_state:
+                state_changed = True
+
+    with span('rules', count=len(rules)):
+        matched_rules = rules.evaluate_new_matches(prices, 'pricealert', cache_directory)
+    rule_output = rules.describe(matched_rules)
+    if matched_rules:
+        ALERTS_FIRED.inc(len(matched_rules), tool='pricealert', kind='rule')
+    if rule_output:
+        output += rule_output
+        alert = True
 
     if alert:
         print(output)
+
+    if alert or state_changed:
         try:
-            with open(cache_filename, 'w') as file:
+            with span('state.save'), open(cache_filename, 'w') as file:
                 json.dump(price_history, file, indent=4)
         except Exception as e:
             sys.exit(f"Failed to write price history: {e}")
 
-        if config['sendEmail']:
-            send_email(config, output)
+    if alert and config['sendEmail']:
+        send_email(config, output)
+
+def main(cache_directory=None, argv=None):
+    args = parse_args(argv)
+    with instrument(args, 'pricealert'), exporting(args):
+        with span('load'):
+            config = load(args.config_file)
+        prices = fetch_prices(*get_price_request(config), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='pricealert'):
+            run(config, prices, args, cache_directory)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,172 @@
+"""
+Price fetching that keeps going when CoinGecko is unavailable or doesn't know a coin, for --resilient.
+
+Every price fetched is kept in a cache file along with when it was fetched, and the cache is used in three ways:
+
+- Prices fetched in the last FRESH_AGE seconds are used without asking the API again, so several tools
+  run together from cron share one request.
+- Prices up to STALE_AGE seconds old are used straight away while newer prices are fetched in the background
+  for the next run.
+- If the API can't be reached, prices up to MAX_STALE_AGE seconds old are used instead of failing.
+
+Coins the API doesn't return are reported and left out rather than failing the whole fetch, and are
+remembered as invalid for INVALID_ID_EXPIRY seconds so a delisted coin isn't asked for on every run.
+
+Each coin's prices carry a last_updated_at Unix timestamp, as CoinGecko's own include_last_updated_at
+option gives, and a warning says how old any cached prices used are.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+import pricesources
+from metrics import CACHE_LOOKUPS
+
+CACHE_FILENAME = os.path.join(os.path.dirname(__file__), 'cache', 'price_cache.json')
+FRESH_AGE = 60  # Seconds cached prices are used without a request
+STALE_AGE = 900  # Seconds cached prices are used while they are refreshed in the background
+MAX_STALE_AGE = 86400  # Seconds cached prices can be used for when the API can't be reached
+INVALID_ID_EXPIRY = 86400  # Seconds a coin the API didn't return is skipped for
+
+_cache_lock = threading.Lock()
+_refresh_thread = None
+
+def add_arguments(parser):
+    """Adds the --resilient option shared by the tools."""
+    parser.add_argument('--resilient', action='store_true', help="Keep going when CoinGecko can't be reached or doesn't know a coin: use cached prices up to a day old, with a warning, and skip coins without a price.")
+
+def _read_cache() -> dict:
+    try:
+        with open(CACHE_FILENAME, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {'prices': {}, 'invalid': {}}
+    return {'prices': cache.get('prices', {}), 'invalid': cache.get('invalid', {})}
+
+def _update_cache(prices: Dict[str, dict], invalid_ids: List[str], timestamp: float):
+    """Adds fetched prices and invalid coin IDs to the cache file, dropping invalid IDs that have expired."""
+    with _cache_lock:
+        cache = _read_cache()
+        for coin_id, coin_prices in prices.items():
+            cache['prices'][coin_id] = {'prices': coin_prices, 'timestamp': timestamp}
+            cache['invalid'].pop(coin_id, None)
+        for coin_id in invalid_ids:
+            cache['invalid'][coin_id] = timestamp + INVALID_ID_EXPIRY
+        cache['invalid'] = {coin_id: until for coin_id, until in cache['invalid'].items() if until > timestamp}
+
+        # Written to a temporary file and moved into place so other processes never read a partly written cache
+        os.makedirs(os.path.dirname(CACHE_FILENAME), exist_ok=True)
+        temporary_filename = f"{CACHE_FILENAME}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_filename, 'w') as file:
+            json.dump(cache, file)
+        os.replace(temporary_filename, CACHE_FILENAME)
+
+def _fetch_and_cache(coin_ids: List[str], currencies: List[str], include_24hr_change: bool) -> Tuple[dict, List[str], float]:
+    """Fetches prices from the API and caches them, returning the prices, the coin IDs it didn't return and the time."""
+    data = pricesources.fetch_price_data(coin_ids, currencies, include_24hr_change, allow_missing=True)
+    missing = [coin_id for coin_id in coin_ids if coin_id not in data]
+    timestamp = time.time()
+    _update_cache(data, missing, timestamp)
+    return data, missing, timestamp
+
+def _refresh_in_background(coin_ids: List[str], currencies: List[str], include_24hr_change: bool):
+    try:
+        _fetch_and_cache(coin_ids, currencies, include_24hr_change)
+    except Exception as e:
+        print(f"Warning: Failed to refresh cached prices: {e}", file=sys.stderr)
+
+def start_background_refresh(coin_ids: List[str], currencies: List[str], include_24hr_change: bool):
+    """
+    Fetches prices into the cache from a background thread, unless a refresh is already running. The thread
+    isn't a daemon, so a short lived process waits for it to finish and the next run gets the new prices.
+    """
+    global _refresh_thread
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        return
+    _refresh_thread = threading.Thread(target=_refresh_in_background, args=(coin_ids, currencies, include_24hr_change), name='price-refresh')
+    _refresh_thread.start()
+
+def _format_age(seconds: float) -> str:
+    if seconds < 120:
+        return f"{seconds:.0f} seconds"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} minutes"
+    return f"{seconds / 3600:.1f} hours"
+
+def _with_timestamps(entries: Dict[str, dict]) -> dict:
+    return {coin_id: dict(entry['prices'], last_updated_at=entry['timestamp']) for coin_id, entry in entries.items()}
+
+def fetch_prices(coin_ids: List[str], currencies: List[str], include_24hr_change: bool = True) -> Tuple[dict, Dict[str, str]]:
+    """
+    Fetches prices for the coins in each currency, using the cache as described above. Warnings about cached
+    prices and coins without a price are printed to stderr.
+
+    Args:
+    coin_ids (list of str): The coins to fetch.
+    currencies (list of str): The currencies to fetch prices in.
+    include_24hr_change (bool): Whether the 24 hour change is needed.
+
+    Returns:
+    tuple: The prices in the form fetch_price_data returns with a last_updated_at timestamp for each coin,
+           and an error message for each coin without a price.
+
+    Raises:
+    Exception: The API error, if the API can't be reached and there are no cached prices for any of the coins.
+    """
+    coin_ids = sorted({coin_id.lower() for coin_id in coin_ids})
+    currencies = sorted({currency.lower() for currency in currencies})
+    keys = currencies + [f"{currency}_24h_change" for currency in currencies] if include_24hr_change else currencies
+    now = time.time()
+    cache = _read_cache()
+
+    errors = {}
+    for coin_id in coin_ids:
+        until = cache['invalid'].get(coin_id, 0)
+        if until > now:
+            errors[coin_id] = f"Not found by CoinGecko, it won't be asked for again until {time.strftime('%Y-%m-%d %H:%M', time.localtime(until))}"
+    wanted = [coin_id for coin_id in coin_ids if coin_id not in errors]
+
+    # Only cached entries with every price needed can be used
+    cached = {}
+    for coin_id in wanted:
+        entry = cache['prices'].get(coin_id)
+        if entry and all(key in entry['prices'] for key in keys):
+            cached[coin_id] = entry
+    age = now - min(entry['timestamp'] for entry in cached.values()) if cached and len(cached) == len(wanted) else None
+
+    if age is not None and age <= FRESH_AGE:
+        CACHE_LOOKUPS.inc(cache='prices', result='hit')
+        return _with_timestamps(cached), _report(errors)
+    if age is not None and age <= STALE_AGE:
+        CACHE_LOOKUPS.inc(cache='prices', result='stale')
+        print(f"Warning: Using prices cached {_format_age(age)} ago while they are refreshed.", file=sys.stderr)
+        start_background_refresh(wanted, currencies, include_24hr_change)
+        return _with_timestamps(cached), _report(errors)
+    CACHE_LOOKUPS.inc(cache='prices', result='miss')
+
+    prices = {}
+    if wanted:
+        try:
+            data, missing, timestamp = _fetch_and_cache(wanted, currencies, include_24hr_change)
+        except Exception as e:
+            usable = {coin_id: entry for coin_id, entry in cached.items() if now - entry['timestamp'] <= MAX_STALE_AGE}
+            if not usable:
+                raise
+            for coin_id in wanted:
+                if coin_id not in usable:
+                    errors[coin_id] = f"No cached price to use after the request failed: {e}"
+            oldest = now - min(entry['timestamp'] for entry in usable.values())
+            print(f"Warning: Using prices cached up to {_format_age(oldest)} ago, the request failed: {e}", file=sys.stderr)
+            return _with_timestamps(usable), _report(errors)
+
+        prices = {coin_id: dict(coin_prices, last_updated_at=timestamp) for coin_id, coin_prices in data.items()}
+        for coin_id in missing:
+            errors[coin_id] = "Not found by CoinGecko, check the coin ID with coinsearch.py"
+    return prices, _report(errors)
+
+def _report(errors: Dict[str, str]) -> Dict[str, str]:
+    for coin_id, message in errors.items():
+        print(f"Warning: No price for {coin_id}: {message}.", file=sys.stderr)
+    return errors
@@ -0,0 +1,406 @@
+"""
+Push based prices for cointracker stream, which runs alert configs as soon as prices move rather than when
+they are next polled.
+
+The feed is a WebSocket connection to a streaming ticker. Once connected the client subscribes with
+
+    {"command": "subscribe", "coin_ids": ["bitcoin", ...], "currencies": ["aud", ...]}
+
+and the server sends ticks, one JSON object per message or a list of them, using the short field names of
+CoinGecko's streaming price API:
+
+    {"i": "bitcoin", "vs": "aud", "p": 100000.0, "pp": 2.5, "t": 1700000000}
+
+i is the coin ID, vs the currency and p the price. pp, the 24 hour change in percent, is optional. Anything
+else the server sends is ignored. tests/fake_ticker.py is a local stand-in.
+
+A busy feed can send thousands of ticks a second, far more often than the configs need evaluating. Ticks
+go into a TickCoalescer, which keeps only the latest price of each coin and currency, and the configs are
+evaluated at most once per coalesce interval against every coin that ticked since the last evaluation.
+
+The WebSocket client implements just enough of RFC 6455 for text messages on the standard library, so the
+tools don't gain a dependency for it.
+"""
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from metrics import FEED_CONNECTIONS, TICKS
+from scheduler import WatchJob, run_job
+from tracing import span
+
+COALESCE_INTERVAL = 0.5  # Seconds, the shortest time between evaluations of the configs
+CONNECT_TIMEOUT = 10  # Seconds to wait for the feed to accept a connection
+READ_TIMEOUT = 120  # Seconds without any message after which the connection is assumed dead and reopened
+INITIAL_RECONNECT_DELAY = 1  # Seconds to wait before reconnecting, doubled after each failed attempt
+MAX_RECONNECT_DELAY = 60  # Seconds, the longest wait between attempts to reconnect
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024  # Bytes, larger messages close the connection
+
+# Appended to the client's key to make the key the server must answer with, from RFC 6455
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+class WebSocketError(ConnectionError):
+    """The WebSocket handshake failed or the server broke the protocol."""
+
+def accept_key(key: str) -> str:
+    """Returns the Sec-WebSocket-Accept value a server must answer the client's Sec-WebSocket-Key with."""
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+
+def _apply_mask(payload: bytes, key: bytes) -> bytes:
+    # XORing the payload as one big integer is far faster than a loop over its bytes
+    if not payload:
+        return payload
+    repeated = (key * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(payload), 'big')
+
+def encode_frame(opcode: int, payload: bytes) -> bytes:
+    """Returns a single frame message as a client sends it, which must be masked."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+    key = os.urandom(4)
+    return header + key + _apply_mask(payload, key)
+
+def _read_exact(file, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) < size:
+        raise WebSocketError("The feed closed the connection")
+    return data
+
+def read_frame(file) -> Tuple[bool, int, bytes]:
+    """
+    Reads a frame from a file-like object.
+
+    Returns:
+    tuple: Whether it is the last frame of its message, its opcode and its unmasked payload.
+
+    Raises:
+    WebSocketError: If the connection closes part way through or the frame is too large.
+    """
+    first, second = _read_exact(file, 2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', _read_exact(file, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', _read_exact(file, 8))[0]
+    if length > MAX_MESSAGE_SIZE:
+        raise WebSocketError(f"The feed sent a {length} byte frame, the limit is {MAX_MESSAGE_SIZE}")
+    key = _read_exact(file, 4) if second & 0x80 else None
+    payload = _read_exact(file, length)
+    if key:
+        payload = _apply_mask(payload, key)
+    return bool(first & 0x80), first & 0x0F, payload
+
+class WebSocket:
+    """A client WebSocket connection, opened with WebSocket.connect."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.file = sock.makefile('rb')
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, url: str, timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT) -> 'WebSocket':
+        """
+        Opens a connection to a ws:// or wss:// URL.
+
+        Raises:
+        ValueError: If the URL isn't a WebSocket URL.
+        WebSocketError: If the server doesn't accept the WebSocket handshake.
+        OSError: If the server can't be reached.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('ws', 'wss') or not parts.hostname:
+            raise ValueError(f"Invalid feed URL '{url}'. Use a ws:// or wss:// URL.")
+
+        sock = socket.create_connection((parts.hostname, parts.port or (443 if parts.scheme == 'wss' else 80)), timeout=timeout)
+        try:
+            if parts.scheme == 'wss':
+                import ssl
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+
+            key = base64.b64encode(os.urandom(16)).decode('ascii')
+            path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+            sock.sendall((
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {parts.netloc.rpartition('@')[2]}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                "\r\n"
+            ).encode('ascii'))
+
+            websocket = cls(sock)
+            status = websocket.file.readline().decode('latin-1').strip()
+            headers = {}
+            while True:
+                line = websocket.file.readline().decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if status.split(' ')[1:2] != ['101']:
+                raise WebSocketError(f"The feed refused the connection: {status or 'no response'}")
+            if headers.get('sec-websocket-accept') != accept_key(key):
+                raise WebSocketError("The feed answered the WebSocket handshake with the wrong key")
+        except BaseException:
+            sock.close()
+            raise
+
+        sock.settimeout(read_timeout)
+        return websocket
+
+    def _send_frame(self, opcode: int, payload: bytes):
+        with self._send_lock:
+            self.sock.sendall(encode_frame(opcode, payload))
+
+    def send(self, text: str):
+        self._send_frame(OPCODE_TEXT, text.encode('utf-8'))
+
+    def receive(self) -> Optional[str]:
+        """
+        Returns the next message, answering any pings that arrive first, or None once the server closes the connection.
+
+        Raises:
+        WebSocketError: If the connection drops or the server breaks the protocol.
+        OSError: If no message arrives within the read timeout.
+        """
+        fragments = []
+        while True:
+            final, opcode, payload = read_frame(self.file)
+            if opcode == OPCODE_PING:
+                self._send_frame(OPCODE_PONG, payload)
+            elif opcode == OPCODE_CLOSE:
+                self.close()
+                return None
+            elif opcode in (OPCODE_TEXT, OPCODE_BINARY, OPCODE_CONTINUATION):
+                fragments.append(payload)
+                if final:
+                    return b''.join(fragments).decode('utf-8')
+            elif opcode != OPCODE_PONG:
+                raise WebSocketError(f"The feed sent a frame with the unknown opcode {opcode}")
+
+    def close(self):
+        """Sends a normal closure, if the connection is still open, and closes the socket."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._send_frame(OPCODE_CLOSE, struct.pack('!H', 1000))
+        except OSError:
+            pass
+        try:
+            # Wakes a thread blocked reading the socket, which closing it alone doesn't
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.file.close()
+        self.sock.close()
+
+def parse_ticks(message: str) -> List[Tuple[str, str, float, Optional[float]]]:
+    """
+    Returns the (coin ID, currency, price, 24 hour change) of each tick in a feed message, skipping anything
+    that isn't a tick.
+
+    Raises:
+    ValueError: If the message isn't JSON.
+    """
+    data = json.loads(message)
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list):
+        return []
+
+    ticks = []
+    for tick in data:
+        if not isinstance(tick, dict):
+            continue
+        coin_id = tick.get('i')
+        currency = tick.get('vs')
+        price = tick.get('p')
+        if not isinstance(coin_id, str) or not isinstance(currency, str) or not isinstance(price, (int, float)) or isinstance(price, bool):
+            continue
+        change = tick.get('pp')
+        ticks.append((coin_id.lower(), currency.lower(), float(price), float(change) if isinstance(change, (int, float)) and not isinstance(change, bool) else None))
+    return ticks
+
+class TickCoalescer:
+    """
+    Collects ticks from the feed thread until the evaluation loop takes them, keeping only the latest price
+    of each coin and currency so a burst of ticks costs a single evaluation.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def add(self, ticks: Iterable[Tuple[str, str, float, Optional[float]]]):
+        """Adds ticks as parse_ticks returns them."""
+        with self._lock:
+            pending = self._pending
+            for coin_id, currency, price, change in ticks:
+                coin_prices = pending.get(coin_id)
+                if coin_prices is None:
+                    coin_prices = pending[coin_id] = {}
+                coin_prices[currency] = price
+                if change is not None:
+                    coin_prices[currency + '_24h_change'] = change
+            if pending:
+                self._ready.set()
+
+    def take(self, timeout: float = None) -> Dict[str, Dict[str, float]]:
+        """Waits up to timeout seconds for ticks, then returns the latest prices of each coin that ticked."""
+        if not self._ready.wait(timeout):
+            return {}
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._ready.clear()
+        return pending
+
+class PriceFeed:
+    """
+    Keeps a subscription to the feed open from a background thread, passing ticks to a TickCoalescer and
+    reconnecting with exponential backoff whenever the connection drops.
+
+    Args:
+    url (str): The feed's ws:// or wss:// URL.
+    coin_ids (iterable of str): The coins to subscribe to.
+    currencies (iterable of str): The currencies to subscribe to.
+    coalescer (TickCoalescer): Where to put the ticks.
+    connect (callable): Opens a connection to the URL, replaceable for testing.
+    """
+
+    def __init__(self, url: str, coin_ids: Iterable[str], currencies: Iterable[str], coalescer: TickCoalescer, connect: Callable[[str], WebSocket] = None):
+        self.url = url
+        self.coin_ids = sorted(set(coin_ids))
+        self.currencies = sorted(set(currencies))
+        self.coalescer = coalescer
+        self.connect = connect or WebSocket.connect
+        self.connected = threading.Event()
+        self._stopped = threading.Event()
+        self._websocket = None
+        self._thread = None
+
+    def start(self):
+        # A daemon thread, as it spends its time blocked reading the socket and has nothing to finish at exit
+        self._thread = threading.Thread(target=self._run, name='price-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        websocket = self._websocket
+        if websocket is not None:
+            websocket.close()
+        if self._thread is not None:
+            self._thread.join(timeout=CONNECT_TIMEOUT)
+
+    def handle(self, message: str):
+        """Passes the ticks in a message to the coalescer, warning about messages that aren't JSON."""
+        try:
+            ticks = parse_ticks(message)
+        except ValueError:
+            print(f"Warning: Ignoring a price feed message that isn't JSON: {message[:100]}", file=sys.stderr)
+            return
+        if ticks:
+            TICKS.inc(len(ticks))
+            self.coalescer.add(ticks)
+
+    def _run(self):
+        delay = INITIAL_RECONNECT_DELAY
+        while not self._stopped.is_set():
+            try:
+                self._websocket = self.connect(self.url)
+                self._websocket.send(json.dumps({'command': 'subscribe', 'coin_ids': self.coin_ids, 'currencies': self.currencies}))
+                FEED_CONNECTIONS.inc(result='connected')
+                self.connected.set()
+                delay = INITIAL_RECONNECT_DELAY
+                while (message := self._websocket.receive()) is not None:
+                    self.handle(message)
+                error = "the feed closed the connection"
+            except (OSError, ValueError) as e:
+                error = str(e) or type(e).__name__
+            finally:
+                self.connected.clear()
+                if self._websocket is not None:
+                    self._websocket.close()
+                    self._websocket = None
+
+            if self._stopped.is_set():
+                break
+            FEED_CONNECTIONS.inc(result='error')
+            print(f"Warning: Lost the price feed, reconnecting in {delay:g} seconds: {error}", file=sys.stderr)
+            self._stopped.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+class Streamer:
+    """
+    Runs watched configs against prices pushed by the feed. As in cointracker watch, a config only runs when
+    the prices cross one of its triggers or change which of its rules match.
+
+    Args:
+    jobs (list of WatchJob): The configs to run.
+    prices (dict): The prices to start from, in the form fetch_prices returns, which ticks are applied to.
+    coalescer (TickCoalescer): Where the feed puts ticks.
+    interval (float): The shortest time between evaluations, ticks arriving in between are coalesced.
+    on_exit (callable): Called with the tool name, config path and SystemExit when a run exits, returning
+                        whether it was a failure.
+    clock, sleep: The time source and sleep to use, replaceable for testing.
+    """
+
+    def __init__(self, jobs: List[WatchJob], prices: dict, coalescer: TickCoalescer, interval: float = COALESCE_INTERVAL,
+                 on_exit: Callable = None, clock: Callable[[], float] = None, sleep: Callable[[float], None] = None):
+        self.jobs = jobs
+        # A dict of each coin's prices, so ticks can replace them
+        self.prices = dict(prices)
+        self.coalescer = coalescer
+        self.interval = interval
+        self.on_exit = on_exit
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self.failed = False
+
+    def step(self, timeout: float = None) -> Set[str]:
+        """
+        Waits up to timeout seconds for ticks, applies them and runs any configs that need it, then waits out
+        the rest of the interval so ticks can pile up. Returns the coins that ticked.
+        """
+        updates = self.coalescer.take(timeout)
+        if not updates:
+            return set()
+
+        start = self.clock()
+        with span('evaluate', coins=len(updates)):
+            for coin_id, coin_prices in updates.items():
+                # Replaced rather than updated, as each job keeps the prices it last ran with
+                self.prices[coin_id] = {**self.prices.get(coin_id, {}), **coin_prices}
+            for job in self.jobs:
+                if not job.coin_ids.isdisjoint(updates) and job.coin_ids <= self.prices.keys() and job.should_run(self.prices):
+                    self.failed = run_job(job, self.prices, self.on_exit) or self.failed
+
+        remaining = self.interval - (self.clock() - start)
+        if remaining > 0:
+            self.sleep(remaining)
+        return set(updates)
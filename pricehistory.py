@@ -0,0 +1,193 @@
+import base64
+import json
+import math
+import os
+import re
+import time
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+# Each series is sampled into fixed width time slots so the price at "now - window" is found by index arithmetic
+DEFAULT_RESOLUTION = 300  # Seconds per slot (5 minutes), the smallest supported window
+DEFAULT_MAX_WINDOW = 604800  # Longest window that can be looked up in seconds (7 days)
+
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+WINDOW_PATTERN = re.compile(r'^([0-9]+)([mhdw])$')
+
+def parse_window(window: str) -> int:
+    """
+    Converts a window string such as '5m', '1h', '4h' or '7d' to a number of seconds.
+
+    Raises:
+    ValueError: If the window is not in the expected format.
+    """
+    match = WINDOW_PATTERN.match(window.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window '{window}'. Use a number followed by m, h, d or w, for example 5m, 1h or 7d.")
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+class RingBuffer:
+    """
+    Fixed capacity buffer of prices, one per time slot, backed by a contiguous array of doubles.
+
+    Slots between two samples are filled with the earlier price so every slot holds the last price
+    observed at that time. This keeps lookups O(1) no matter how irregularly the samples arrive.
+    """
+    __slots__ = ('prices', 'first_slot', 'last_slot')
+
+    def __init__(self, capacity: int):
+        self.prices = array('d', [math.nan]) * capacity
+        self.first_slot = None
+        self.last_slot = None
+
+    @property
+    def capacity(self) -> int:
+        return len(self.prices)
+
+    def record(self, slot: int, price: float):
+        capacity = len(self.prices)
+
+        if self.last_slot is None or slot - self.last_slot >= capacity:
+            # Nothing recorded yet, or the gap is too large to carry the last price forward
+            self.first_slot = slot
+        elif slot < self.last_slot:
+            return  # Ignore samples older than the latest one
+        elif slot > self.last_slot:
+            previous_price = self.prices[self.last_slot % capacity]
+            for missing_slot in range(self.last_slot + 1, slot):
+                self.prices[missing_slot % capacity] = previous_price
+            self.first_slot = max(self.first_slot, slot - capacity + 1)
+
+        self.prices[slot % capacity] = price
+        self.last_slot = slot
+
+    def price_at(self, slot: int) -> Optional[float]:
+        if self.last_slot is None or slot < self.first_slot or slot > self.last_slot:
+            return None
+        return self.prices[slot % len(self.prices)]
+
+    def to_dict(self) -> dict:
+        return {
+            'first': self.first_slot,
+            'last': self.last_slot,
+            'prices': base64.b64encode(self.prices.tobytes()).decode('ascii')
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, capacity: int) -> 'RingBuffer':
+        buffer = cls(capacity)
+        prices = array('d')
+        prices.frombytes(base64.b64decode(data['prices']))
+        if len(prices) != capacity:
+            raise ValueError("Stored price history does not match the configured capacity.")
+        buffer.prices = prices
+        buffer.first_slot = data['first']
+        buffer.last_slot = data['last']
+        return buffer
+
+class PriceHistory:
+    """
+    Rolling price history for (coin, currency) pairs used to compute percent changes over arbitrary windows
+    without asking the API for historical data.
+
+    The history can be kept in memory by a long running process or saved to and loaded from a cache file between runs.
+    """
+
+    def __init__(self, resolution: int = DEFAULT_RESOLUTION, max_window: int = DEFAULT_MAX_WINDOW):
+        self.resolution = resolution
+        self.max_window = max_window
+        self.capacity = max_window // resolution + 1
+        self.series: Dict[Tuple[str, str], RingBuffer] = {}
+
+    def record(self, coin_id: str, currency: str, price: float, timestamp: Optional[float] = None):
+        """Records a price sample for a coin, the timestamp defaults to now."""
+        if timestamp is None:
+            timestamp = time.time()
+        key = (coin_id, currency.lower())
+        buffer = self.series.get(key)
+        if buffer is None:
+            buffer = self.series[key] = RingBuffer(self.capacity)
+        buffer.record(int(timestamp // self.resolution), price)
+
+    def record_prices(self, prices: dict, pairs: Iterable[Tuple[str, str]], timestamp: Optional[float] = None):
+        """
+        Records the current price of each (coin_id, currency) pair from a fetch_price_data result in one pass.
+        Pairs missing from the price data are skipped.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        for coin_id, currency in pairs:
+            coin_prices = prices.get(coin_id, {})
+            price = coin_prices.get(currency.lower())
+            if price:
+                # Cached prices from a --resilient fetch are recorded at the time they were fetched
+                self.record(coin_id, currency, price, coin_prices.get('last_updated_at', timestamp))
+
+    def percent_change(self, coin_id: str, currency: str, window: int) -> Optional[float]:
+        """
+        Returns the percent change between the latest sample and the price one window earlier.
+
+        Args:
+        coin_id (str): CoinGecko coin ID.
+        currency (str): Currency the prices are in.
+        window (int): Window length in seconds, see parse_window.
+
+        Returns:
+        float or None: The percent change, or None if the history doesn't go back far enough yet.
+        """
+        buffer = self.series.get((coin_id, currency.lower()))
+        past_price = self.window_start_price(coin_id, currency, window)
+        if not past_price:
+            return None
+        current_price = buffer.prices[buffer.last_slot % buffer.capacity]
+        return (current_price - past_price) / past_price * 100
+
+    def window_start_price(self, coin_id: str, currency: str, window: int) -> Optional[float]:
+        """Returns the price one window before the latest sample, or None if the history doesn't go back that far."""
+        buffer = self.series.get((coin_id, currency.lower()))
+        if buffer is None or buffer.last_slot is None:
+            return None
+        return buffer.price_at(buffer.last_slot - round(window / self.resolution))
+
+    def retain(self, pairs: Iterable[Tuple[str, str]]):
+        """Drops the history of any pair that is no longer configured."""
+        active = {(coin_id, currency.lower()) for coin_id, currency in pairs}
+        self.series = {key: buffer for key, buffer in self.series.items() if key in active}
+
+    def save(self, filename: str):
+        data = {
+            'resolution': self.resolution,
+            'capacity': self.capacity,
+            'series': {f"{coin_id}-{currency}": buffer.to_dict() for (coin_id, currency), buffer in self.series.items()}
+        }
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename: str, resolution: int = DEFAULT_RESOLUTION, max_window: int = DEFAULT_MAX_WINDOW) -> 'PriceHistory':
+        """
+        Loads the history from a cache file. A missing file, or one saved with a different resolution or
+        window, gives an empty history.
+
+        Raises:
+        ValueError: If the file can't be decoded.
+        """
+        history = cls(resolution, max_window)
+        if not os.path.exists(filename):
+            return history
+
+        try:
+            with open(filename, 'r') as file:
+                data = json.load(file)
+        except json.JSONDecodeError:
+            raise ValueError("Failed to decode JSON from the price history file.")
+
+        if data.get('resolution') != history.resolution or data.get('capacity') != history.capacity:
+            return history
+
+        for key, series in data.get('series', {}).items():
+            coin_id, _, currency = key.rpartition('-')
+            history.series[(coin_id, currency)] = RingBuffer.from_dict(series, history.capacity)
+        return history
@@ -1,13 +1,15 @@
-import json
 import sys
 from argparse import ArgumentParser
 import coingecko
-from utils import validate_currency_prices, get_currency_symbol, format_currency
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from utils import fetch_prices, get_formatter
 import os
-from jsonschema import validate, ValidationError
+from configloader import load_config, ConfigError
+from metrics import ALERTS_FIRED, NOTIFICATIONS, NOTIFICATION_DURATION, RUNS, RUN_DURATION, add_arguments as add_metrics_arguments, exporting, track
+from pricecache import add_arguments as add_resilience_arguments
+from tracing import add_arguments as add_tracing_arguments, instrument, span
+from rules import rules_schema, compile_rules, RuleSyntaxError, UnknownCoinError
+from pricehistory import PriceHistory, parse_window, DEFAULT_MAX_WINDOW, DEFAULT_RESOLUTION
+from scheduler import Trigger
 
 config_schema = {
     "type": "object",
@@ -24,6 +26,11 @@ config_schema = {
                     "currency": {
                         "type": "string",
                         "minLength": 3
+                    },
+                    "window": {
+                        "type": "string",
+                        "pattern": "^[0-9]+[mhdw]$",
+                        "description": "Period the percent change is measured over, for example 5m, 1h, 4h or 7d. Defaults to 24h."
                     }
                 },
                 "required": ["coinId", "currency"]
@@ -33,6 +40,7 @@ config_schema = {
             "type": "number",
             "minimum": 1,
         },
+        "rules": rules_schema,
         "sendEmail": {
             "type": "boolean"
         },
@@ -65,19 +73,26 @@ config_schema = {
     "required": ["coins", "alertPercent", "sendEmail", "email", "smtp"]
 }
 
-def parse_args():
+def parse_args(argv=None):
     parser = ArgumentParser(description="Monitor cryptocurrency price changes of a defined percentage and send alerts.")
     parser.add_argument('config_file', type=str, help="Path to the configuration JSON file. See config/pricepercentalert.json.example for an example.")
-    return parser.parse_args()
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    return parser.parse_args(argv)
 
 def send_email(config, message):
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     msg = MIMEMultipart()
     msg['From'] = config['email']
     msg['To'] = config['email']
     msg['Subject'] = "Coin Percent Change Alert"
     msg.attach(MIMEText(message, 'plain'))
     try:
-        with smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
+        with span('notify'), track(NOTIFICATIONS, NOTIFICATION_DURATION, tool='pricepercentalert'), smtplib.SMTP(config['smtp']['host'], config['smtp']['port']) as server:
             server.starttls()
             server.login(config['smtp']['username'], config['smtp']['password'])
             server.send_message(msg)
@@ -85,50 +100,158 @@ def send_email(config, message):
     except Exception as e:
         sys.exit(f"Failed to send email: {e}")
 
-def main():
-    args = parse_args()
-    if not os.path.exists(args.config_file):
-        sys.exit(f"Error: The file '{args.config_file}' does not exist.")
-    
+def load(config_file):
+    """Loads and validates the config, its rules and windows, exiting with an error message if they can't be used."""
     try:
-        with open(args.config_file, 'r') as file:
-            config = json.load(file)
-    except json.JSONDecodeError:
-        sys.exit("Error: Failed to decode JSON from the provided file.")
-    
+        config = load_config(config_file, config_schema)
+    except ConfigError as e:
+        sys.exit(str(e))
+
     try:
-        validate(instance=config, schema=config_schema)
-    except ValidationError as e:
-        error_path = " -> ".join(map(str, e.path))
-        sys.exit(f"Error: Configuration file validation failed at '{error_path}': {e.message}. Look at the sample configs to see how to structure the configuration.")
+        compile_rules(config.get('rules', [])).check_coin_ids()
+    except (RuleSyntaxError, UnknownCoinError) as e:
+        sys.exit(f"Error: Invalid rule: {e}")
 
-    coin_ids = [coin['coinId'] for coin in config['coins']]
-    currencies = list(set(coin['currency'] for coin in config['coins']))
+    for coin in config['coins']:
+        window = coin.get('window', '24h')
+        seconds = parse_window(window)
+        if seconds > DEFAULT_MAX_WINDOW:
+            sys.exit(f"Error: The window '{window}' for {coin['coinId']} is longer than the {DEFAULT_MAX_WINDOW // 86400} days of price history kept.")
+        # The history is kept in slots, so a shorter window would compare the price with itself and never alert
+        if seconds < DEFAULT_RESOLUTION or seconds % DEFAULT_RESOLUTION:
+            sys.exit(f"Error: The window '{window}' for {coin['coinId']} must be a multiple of the {DEFAULT_RESOLUTION // 60} minutes the price history is kept in.")
 
-    try:
-        prices = coingecko.fetch_price_data(coin_ids, currencies)
-        validate_currency_prices(prices, currencies)
-    except Exception as e:
-        sys.exit(str(e))
-    
-    alert = False
-    output = ""
+    return config
+
+def get_price_request(config):
+    """Returns the coin IDs and currencies the coins and rules need prices for, and the currencies they need the 24 hour change in."""
+    rules = compile_rules(config.get('rules', []))
+    coin_ids = [coin['coinId'] for coin in config['coins']] + list(rules.coin_ids)
+    currencies = list(set(coin['currency'].lower() for coin in config['coins']) | rules.currencies)
+    # Coins with a 24h window use CoinGecko's 24 hour change, other windows are worked out from the local history
+    change_currencies = {coin['currency'].lower() for coin in config['coins'] if coin.get('window', '24h') == '24h'} | rules.change_currencies
+    return coin_ids, currencies, list(change_currencies)
+
+def get_history_filename(cache_directory=None):
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(__file__), 'cache')
+    return os.path.join(cache_directory, 'price_history.json')
 
+def _change_ratio(coin_id, currency):
+    key = currency + '_24h_change'
+
+    def value(prices):
+        change = prices.get(coin_id, {}).get(key)
+        return None if change is None else 1 + change / 100
+
+    return value
+
+def get_triggers(config, cache_directory=None):
+    """
+    Returns the levels at which a run would alert, for cointracker watch and stream: the 24 hour change
+    reaching alertPercent either way, or for other windows the price moving alertPercent from its price one
+    window before the last recorded sample.
+    """
+    limit = config['alertPercent'] / 100
+    history = None
+    triggers = []
     for coin in config['coins']:
         coin_id = coin['coinId']
         currency = coin['currency'].lower()
-        if coin_id in prices and currency + '_24h_change' in prices[coin_id]:
-            percent_change = prices[coin_id][currency + '_24h_change']
-            if abs(percent_change) >= config['alertPercent']:
+        window = coin.get('window', '24h')
+
+        if window == '24h':
+            # The change is compared as a ratio so the trigger's distance is a log ratio like a price trigger's
+            value = _change_ratio(coin_id, currency)
+            triggers.append(Trigger((coin_id,), 1 + limit, value))
+            if limit < 1:
+                triggers.append(Trigger((coin_id,), 1 - limit, value))
+            continue
+
+        if history is None:
+            try:
+                history = PriceHistory.load(get_history_filename(cache_directory))
+            except ValueError:
+                history = PriceHistory()
+        past_price = history.window_start_price(coin_id, currency, parse_window(window))
+        if past_price:
+            triggers.append(Trigger.price(coin_id, currency, past_price * (1 + limit)))
+            if limit < 1:
+                triggers.append(Trigger.price(coin_id, currency, past_price * (1 - limit)))
+    return triggers
+
+def run(config, prices, args, cache_directory=None):
+    """Records the given prices in the price history and prints and sends alerts for coins that moved enough over their window."""
+    history_filename = get_history_filename(cache_directory)
+    cache_directory = os.path.dirname(history_filename)
+    rules = compile_rules(config.get('rules', []))
+
+    if not os.path.exists(cache_directory):
+        os.makedirs(cache_directory)
+
+    # Every run adds a sample to the local history so windows other than 24h can be computed without extra API calls
+    pairs = [(coin['coinId'], coin['currency']) for coin in config['coins']]
+    try:
+        with span('state.load'):
+            history = PriceHistory.load(history_filename)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    history.retain(pairs)
+    history.record_prices(prices, pairs)
+
+    alert = False
+    output = ""
+
+    with span('compute', coins=len(config['coins'])):
+        for coin in config['coins']:
+            coin_id = coin['coinId']
+            currency = coin['currency'].lower()
+            window = coin.get('window', '24h')
+            if coin_id not in prices:
+                continue  # Left out by a --resilient fetch, which has already warned about it
+
+            if window == '24h':
+                # CoinGecko reports the 24 hour change directly
+                percent_change = prices.get(coin_id, {}).get(currency + '_24h_change')
+                label = ""
+            else:
+                percent_change = history.percent_change(coin_id, currency, parse_window(window))
+                label = f" {window}"
+
+            if percent_change is not None and abs(percent_change) >= config['alertPercent']:
                 price = prices[coin_id][currency]
-                currency_symbol = get_currency_symbol(currency)
-                output += f"{coingecko.get_coin_symbol(coin_id)} ({percent_change:.2f}%) is now {currency.upper()} {currency_symbol}{format_currency(price)}\n"
+                output += f"{coingecko.get_coin_symbol(coin_id)} ({percent_change:.2f}%{label}) is now {currency.upper()} {get_formatter(currency)(price)}\n"
+                ALERTS_FIRED.inc(tool='pricepercentalert', kind='change')
                 alert = True
-    
+
+    with span('rules', count=len(rules)):
+        matched_rules = rules.evaluate_new_matches(prices, 'pricepercentalert', cache_directory)
+    rule_output = rules.describe(matched_rules)
+    if matched_rules:
+        ALERTS_FIRED.inc(len(matched_rules), tool='pricepercentalert', kind='rule')
+    if rule_output:
+        output += rule_output
+        alert = True
+
+    try:
+        with span('state.save'):
+            history.save(history_filename)
+    except Exception as e:
+        sys.exit(f"Failed to write price history: {e}")
+
     if alert:
         print(output)
         if config['sendEmail']:
             send_email(config, output)
 
+def main(cache_directory=None, argv=None):
+    args = parse_args(argv)
+    with instrument(args, 'pricepercentalert'), exporting(args):
+        with span('load'):
+            config = load(args.config_file)
+        prices = fetch_prices(*get_price_request(config), resilient=args.resilient)
+        with span('run'), track(RUNS, RUN_DURATION, tool='pricepercentalert'):
+            run(config, prices, args, cache_directory)
+
 if __name__ == "__main__":
     main()
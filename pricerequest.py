@@ -0,0 +1,113 @@
+"""
+Plans one price fetch for several configs, as cointracker run-all and watch do.
+
+Each tool's get_price_request returns the coins and currencies it needs prices in and the currencies it
+needs the 24 hour change in. The plan merges these so every coin and currency is asked for once, and only
+asks CoinGecko for the 24 hour change if some config uses it.
+
+/simple/price returns every coin in every currency asked for, so the response grows with coins times
+currencies. With a base currency, fiat currencies are instead converted from the base currency's price
+using CoinGecko's exchange rates, which are fetched at most every few minutes. Crypto currencies such as
+BTC, and currencies a config needs the 24 hour change in, are still fetched directly, since neither can be
+worked out from a slowly changing exchange rate.
+"""
+import sys
+from typing import Dict, Iterable, List, Tuple
+import coingecko
+from pricesnapshot import PriceSnapshot
+from tracing import span
+from utils import fetch_prices
+
+class PricePlan:
+    """
+    The merged price request of several configs.
+
+    Args:
+    coin_ids (iterable of str): The coins to fetch.
+    currencies (iterable of str): The currencies the configs need prices in.
+    change_currencies (iterable of str): The currencies the configs need the 24 hour change in.
+    base_currency (str): The currency to convert fiat currencies from, or None to fetch every currency directly.
+    """
+    __slots__ = ('coin_ids', 'currencies', 'change_currencies', 'base_currency')
+
+    def __init__(self, coin_ids: Iterable[str], currencies: Iterable[str], change_currencies: Iterable[str] = (), base_currency: str = None):
+        self.coin_ids = sorted({coin_id.lower() for coin_id in coin_ids})
+        self.currencies = sorted({currency.lower() for currency in currencies})
+        self.change_currencies = sorted({currency.lower() for currency in change_currencies})
+        self.base_currency = base_currency.lower() if base_currency else None
+
+    def convertible_currencies(self) -> List[str]:
+        """Returns the currencies that could be converted from the base currency rather than fetched."""
+        if self.base_currency is None:
+            return []
+        return [currency for currency in self.currencies if currency != self.base_currency and currency not in self.change_currencies]
+
+def plan_requests(requests: Iterable[Tuple[Iterable[str], Iterable[str], Iterable[str]]], base_currency: str = None) -> PricePlan:
+    """
+    Merges price requests as returned by the tools' get_price_request.
+
+    Args:
+    requests (iterable of tuple): (coin IDs, currencies, change currencies) tuples.
+    base_currency (str): The currency to convert other fiat currencies from, or None.
+
+    Returns:
+    PricePlan: The merged request.
+    """
+    coin_ids = set()
+    currencies = set()
+    change_currencies = set()
+    for request_coin_ids, request_currencies, request_change_currencies in requests:
+        coin_ids.update(request_coin_ids)
+        currencies.update(request_currencies)
+        change_currencies.update(request_change_currencies)
+    return PricePlan(coin_ids, currencies, change_currencies, base_currency)
+
+def get_conversion_rates(plan: PricePlan) -> Dict[str, float]:
+    """
+    Returns the rate from the base currency to each currency the plan can convert to, leaving out any
+    that aren't fiat. Returns no rates if the exchange rates can't be fetched, so every currency is fetched
+    directly instead.
+    """
+    convertible = plan.convertible_currencies()
+    if not convertible:
+        return {}
+
+    try:
+        with span('exchange_rates'):
+            rates = coingecko.fetch_exchange_rates()
+    except Exception as e:
+        print(f"Warning: Failed to fetch exchange rates, fetching every currency instead: {e}", file=sys.stderr)
+        return {}
+
+    base_rate = rates.get(plan.base_currency)
+    if not base_rate or base_rate.get('type') != 'fiat' or not base_rate.get('value'):
+        return {}
+    return {
+        currency: rates[currency]['value'] / base_rate['value']
+        for currency in convertible
+        if rates.get(currency, {}).get('type') == 'fiat' and rates[currency].get('value')
+    }
+
+def fetch_planned_prices(plan: PricePlan, coin_ids: Iterable[str] = None, resilient: bool = False, allow_missing: bool = False) -> PriceSnapshot:
+    """
+    Fetches prices as planned, in the same form as utils.fetch_prices. Exits with the error message if the
+    prices can't be fetched.
+
+    Args:
+    plan (PricePlan): The plan.
+    coin_ids (iterable of str): The coins to fetch, if only some of the plan's coins are needed.
+    resilient (bool): Fetch through the price cache, as utils.fetch_prices does.
+    allow_missing (bool): Leave out coins the API didn't return instead of exiting, as utils.fetch_prices does.
+    """
+    conversion_rates = get_conversion_rates(plan)
+    currencies = [currency for currency in plan.currencies if currency not in conversion_rates]
+    if conversion_rates and plan.base_currency not in currencies:
+        currencies.append(plan.base_currency)
+
+    prices = fetch_prices(plan.coin_ids if coin_ids is None else list(coin_ids), currencies, plan.change_currencies, resilient, allow_missing)
+    if conversion_rates:
+        # Coins without a base currency price stay without a price, as NaN times the rate is NaN
+        base_prices = prices.price_column(plan.base_currency)
+        for currency, rate in conversion_rates.items():
+            prices.set_price_column(currency, [price * rate for price in base_prices])
+    return prices
@@ -0,0 +1,212 @@
+"""
+Prices held in flat arrays rather than a dict per coin, for large watchlists.
+
+fetch_price_data returns {coin_id: {'aud': price, 'aud_24h_change': change, ...}}: a dict per coin and a
+string key per value, so looking up a 24 hour change means building its key. A PriceSnapshot keeps an index
+of coin IDs to rows and of currencies to columns, and for each currency one contiguous array of doubles for
+prices and another for 24 hour changes. A value is found with two index lookups, a whole column can be worked
+through or handed to code expecting a buffer, and each value takes 8 bytes rather than a float object and a
+dict slot. Values a snapshot doesn't have are NaN.
+
+A snapshot is also a read only Mapping in the nested dict form, so code written for fetch_price_data results
+works unchanged: snapshot['bitcoin']['aud_24h_change'] and snapshot.get('bitcoin', {}).get('aud') both work.
+"""
+import math
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional
+
+CHANGE_SUFFIX = '_24h_change'
+TIMESTAMP_KEY = 'last_updated_at'
+
+def _nan_array(length: int) -> array:
+    return array('d', [math.nan]) * length
+
+def _to_array(values: Optional[list], length: int) -> array:
+    """Returns the values as an array of doubles, with NaN for any that aren't numbers."""
+    if values is None:
+        return _nan_array(length)
+    try:
+        return array('d', values)
+    except TypeError:
+        return array('d', [value if isinstance(value, (int, float)) else math.nan for value in values])
+
+class CoinPrices(Mapping):
+    """The prices of one coin in a snapshot, as a read only dict in the form fetch_price_data returns."""
+    __slots__ = ('snapshot', 'row')
+
+    def __init__(self, snapshot: 'PriceSnapshot', row: int):
+        self.snapshot = snapshot
+        self.row = row
+
+    def __getitem__(self, key: str) -> float:
+        value = self.snapshot.arrays[key][self.row]
+        if value != value:  # NaN
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        row = self.row
+        for key, values in self.snapshot.arrays.items():
+            if values[row] == values[row]:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class PriceSnapshot(Mapping):
+    """
+    Prices of coins in several currencies, see the module docstring.
+
+    Args:
+    coin_ids (iterable of str): Coins to add rows for.
+    currencies (iterable of str): Currencies to add columns for.
+    """
+    __slots__ = ('rows', 'columns', 'prices', 'changes', 'timestamps', 'arrays', '_views')
+
+    def __init__(self, coin_ids: Iterable[str] = (), currencies: Iterable[str] = ()):
+        self.rows: Dict[str, int] = {}
+        self.columns: Dict[str, int] = {}
+        self.prices: List[array] = []  # Each currency's prices by row
+        self.changes: List[array] = []  # Each currency's 24 hour change in percent by row
+        self.timestamps = array('d')  # When each coin's prices were fetched, for --resilient
+        # The array behind each key of the dict view, so reading a value through it is one dict lookup
+        self.arrays: Dict[str, array] = {TIMESTAMP_KEY: self.timestamps}
+        # Dict views of the coins that have been looked up, kept as creating one costs more than reading from it
+        self._views: Dict[str, CoinPrices] = {}
+        for currency in currencies:
+            self.ensure_column(currency)
+        for coin_id in coin_ids:
+            self.ensure_row(coin_id)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, dict]) -> 'PriceSnapshot':
+        """Creates a snapshot from prices in the form fetch_price_data returns."""
+        # Values are gathered into a list per key and each list converted to an array once, as growing arrays
+        # value by value is several times slower for the thousands of coins a large config fetches
+        count = len(data)
+        lists: Dict[str, list] = {}
+        for row, coin_prices in enumerate(data.values()):
+            for key, value in coin_prices.items():
+                values = lists.get(key)
+                if values is None:
+                    values = lists[key] = [math.nan] * count
+                values[row] = value
+
+        snapshot = cls()
+        snapshot.rows = dict(zip(data, range(count)))
+        snapshot.timestamps = snapshot.arrays[TIMESTAMP_KEY] = _to_array(lists.pop(TIMESTAMP_KEY, None), count)
+        for key in list(lists):
+            currency = key[:-len(CHANGE_SUFFIX)] if key.endswith(CHANGE_SUFFIX) else key
+            if currency not in snapshot.columns:
+                # Each list is dropped once converted so they don't all stay alive alongside the arrays
+                column = snapshot.columns[currency] = len(snapshot.columns)
+                snapshot.prices.append(_to_array(lists.pop(currency, None), count))
+                snapshot.changes.append(_to_array(lists.pop(currency + CHANGE_SUFFIX, None), count))
+                snapshot.arrays[currency] = snapshot.prices[column]
+                snapshot.arrays[currency + CHANGE_SUFFIX] = snapshot.changes[column]
+        return snapshot
+
+    @classmethod
+    def ensure(cls, prices: Mapping) -> 'PriceSnapshot':
+        """Returns the prices as a snapshot, converting them if they are in the nested dict form."""
+        return prices if isinstance(prices, cls) else cls.from_dict(prices)
+
+    def ensure_row(self, coin_id: str) -> int:
+        """Returns the coin's row, adding one if it doesn't have one yet."""
+        row = self.rows.get(coin_id)
+        if row is None:
+            row = self.rows[coin_id] = len(self.rows)
+            for column in self.prices:
+                column.append(math.nan)
+            for column in self.changes:
+                column.append(math.nan)
+            self.timestamps.append(math.nan)
+        return row
+
+    def ensure_column(self, currency: str) -> int:
+        """Returns the currency's column, adding one if it doesn't have one yet."""
+        column = self.columns.get(currency)
+        if column is None:
+            column = self.columns[currency] = len(self.columns)
+            self.prices.append(_nan_array(len(self.rows)))
+            self.changes.append(_nan_array(len(self.rows)))
+            self.arrays[currency] = self.prices[column]
+            self.arrays[currency + CHANGE_SUFFIX] = self.changes[column]
+        return column
+
+    def price(self, coin_id: str, currency: str) -> Optional[float]:
+        """Returns the coin's price in the currency, or None if the snapshot doesn't have it."""
+        row = self.rows.get(coin_id)
+        column = self.columns.get(currency)
+        if row is None or column is None:
+            return None
+        value = self.prices[column][row]
+        return None if value != value else value
+
+    def change(self, coin_id: str, currency: str) -> Optional[float]:
+        """Returns the coin's 24 hour change in the currency in percent, or None if the snapshot doesn't have it."""
+        row = self.rows.get(coin_id)
+        column = self.columns.get(currency)
+        if row is None or column is None:
+            return None
+        value = self.changes[column][row]
+        return None if value != value else value
+
+    def price_column(self, currency: str) -> array:
+        """
+        Returns every coin's price in the currency by row, NaN where there isn't one. The array is the
+        snapshot's own, so changes to it change the snapshot.
+
+        Raises:
+        KeyError: If the snapshot has no prices in the currency.
+        """
+        return self.prices[self.columns[currency]]
+
+    def change_column(self, currency: str) -> array:
+        """Returns every coin's 24 hour change in the currency by row, like price_column."""
+        return self.changes[self.columns[currency]]
+
+    def set_price(self, coin_id: str, currency: str, price: float, change: float = None):
+        """Sets a coin's price, and optionally its 24 hour change, in a currency, adding a row and column if needed."""
+        row = self.ensure_row(coin_id)
+        column = self.ensure_column(currency)
+        self.prices[column][row] = price
+        if change is not None:
+            self.changes[column][row] = change
+
+    def set_price_column(self, currency: str, prices: Iterable[float]):
+        """Replaces every coin's price in the currency with prices, one per row."""
+        column = array('d', prices)
+        if len(column) != len(self.rows):
+            raise ValueError(f"Expected {len(self.rows)} prices, one for each coin, got {len(column)}")
+        self.prices[self.ensure_column(currency)] = self.arrays[currency] = column
+
+    def to_dict(self) -> Dict[str, dict]:
+        """Returns the prices in the form fetch_price_data returns."""
+        return {coin_id: dict(CoinPrices(self, row)) for coin_id, row in self.rows.items()}
+
+    def __getitem__(self, coin_id: str) -> CoinPrices:
+        view = self._views.get(coin_id)
+        if view is None:
+            view = self._views[coin_id] = CoinPrices(self, self.rows[coin_id])
+        return view
+
+    def get(self, coin_id: str, default=None):
+        # Mapping.get raises and catches KeyError for a missing coin, which the tools look up often
+        return self[coin_id] if coin_id in self.rows else default
+
+    def __contains__(self, coin_id) -> bool:
+        return coin_id in self.rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __repr__(self):
+        return f"PriceSnapshot({self.to_dict()!r})"
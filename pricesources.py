@@ -0,0 +1,404 @@
+"""
+Fetches prices from more than one source, so the tools keep working when CoinGecko is slow or down.
+
+By default prices come from CoinGecko alone. Set the COINTRACKER_PRICE_SOURCES environment variable to a
+sources config (see config/pricesources.json.example) to list other sources as well:
+
+- coingecko: the CoinGecko API, as set by COINGECKO_API_URL.
+- http: any server answering a URL template with JSON in the same form as CoinGecko's /simple/price,
+  such as a mirror or a self-hosted price service.
+- file: a JSON file in the same form, for example one written by another process or kept by hand.
+
+Sources are used in one of two modes:
+
+- hedged: the first source is asked, and if it hasn't answered by the time most of its requests have
+  (hedgePercentile of its recent latencies), the next source is asked too and whichever answers first is
+  used. A source that fails is replaced by the next one straight away.
+- median: every source is asked and each price is the median of the sources' prices, after leaving out
+  prices too far from the others to be trusted (see reject_outliers).
+"""
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+import coingecko
+from metrics import HEDGED_REQUESTS, SOURCE_DURATION, SOURCE_REQUESTS
+
+SOURCES_ENVIRONMENT_VARIABLE = 'COINTRACKER_PRICE_SOURCES'
+
+LATENCY_WINDOW = 100  # Recent request latencies kept for each source
+MIN_LATENCY_SAMPLES = 10  # Latencies needed before the hedge delay is worked out from them
+DEFAULT_HEDGE_DELAY = 2.0  # Seconds to wait before hedging until then
+DEFAULT_HEDGE_PERCENTILE = 95
+OUTLIER_THRESHOLD = 3.0  # Scaled median absolute deviations a price can be from the median
+MIN_OUTLIER_SPREAD = 0.01  # Prices within this fraction of the median are never outliers
+MAD_SCALE = 1.4826  # Makes the median absolute deviation comparable to a standard deviation
+
+config_schema = {
+    "type": "object",
+    "properties": {
+        "mode": {"type": "string", "enum": ["hedged", "median"]},
+        "hedgePercentile": {"type": "number", "exclusiveMinimum": 0, "maximum": 100},
+        "hedgeDelay": {"type": "number", "exclusiveMinimum": 0},
+        "sources": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": ["coingecko", "http", "file"]},
+                    "name": {"type": "string"},
+                    "url": {"type": "string"},
+                    "path": {"type": "string"},
+                    "timeout": {"type": "number", "exclusiveMinimum": 0}
+                },
+                "required": ["type"],
+                "allOf": [
+                    {"if": {"properties": {"type": {"const": "http"}}}, "then": {"required": ["url"]}},
+                    {"if": {"properties": {"type": {"const": "file"}}}, "then": {"required": ["path"]}}
+                ]
+            }
+        }
+    },
+    "required": ["sources"]
+}
+
+default_config = {
+    "mode": "hedged",
+    "hedgePercentile": DEFAULT_HEDGE_PERCENTILE,
+    "hedgeDelay": DEFAULT_HEDGE_DELAY
+}
+
+class LatencyTracker:
+    """The latencies of a source's most recent successful requests."""
+    __slots__ = ('samples', '_lock')
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Returns the latency percent of requests took no longer than, or None without enough samples."""
+        with self._lock:
+            samples = sorted(self.samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(percent / 100 * len(samples)) - 1)]
+
+class PriceSource:
+    """
+    A source of prices. Subclasses implement get_prices, which returns prices in the form
+    coingecko.fetch_price_data does, leaving out any coins the source doesn't have.
+    """
+    kind = ''
+
+    def __init__(self, name: str = None):
+        self.name = name or self.kind
+        self.latencies = LatencyTracker()
+
+    def get_prices(self, coin_ids: List[str], currencies: List[str], include_24hr_change: bool) -> dict:
+        raise NotImplementedError
+
+    def fetch(self, coin_ids: List[str], currencies: List[str], include_24hr_change: bool) -> dict:
+        """Calls get_prices, recording its latency and result."""
+        start = time.perf_counter()
+        try:
+            data = self.get_prices(coin_ids, currencies, include_24hr_change)
+        except Exception:
+            SOURCE_REQUESTS.inc(source=self.name, result='error')
+            raise
+        elapsed = time.perf_counter() - start
+        self.latencies.record(elapsed)
+        SOURCE_DURATION.observe(elapsed, source=self.name)
+        SOURCE_REQUESTS.inc(source=self.name, result='ok')
+        return data
+
+    def hedge_delay(self, percentile: float, default: float) -> float:
+        """Returns how long to wait for this source before asking another, see the module docstring."""
+        delay = self.latencies.percentile(percentile)
+        return default if delay is None else delay
+
+def _select(data: dict, coin_ids: List[str], currencies: List[str], include_24hr_change: bool) -> dict:
+    """Picks the coins and currencies asked for out of a response in /simple/price form."""
+    keys = currencies + [f"{currency}_24h_change" for currency in currencies] if include_24hr_change else currencies
+    selected = {}
+    for coin_id in coin_ids:
+        coin_prices = data.get(coin_id)
+        if isinstance(coin_prices, dict):
+            selected[coin_id] = {key: coin_prices[key] for key in keys if key in coin_prices}
+    return selected
+
+class CoinGeckoSource(PriceSource):
+    kind = 'coingecko'
+
+    def get_prices(self, coin_ids, currencies, include_24hr_change):
+        return coingecko.fetch_price_data(coin_ids, currencies, include_24hr_change, allow_missing=True)
+
+class HttpSource(PriceSource):
+    """
+    A server answering in /simple/price form. {ids}, {currencies} and {include_24hr_change} in the URL are
+    replaced with the comma separated coin IDs, the comma separated currencies and 'true' or 'false'.
+    """
+    kind = 'http'
+
+    def __init__(self, url: str, name: str = None, timeout: float = coingecko.REQUEST_TIMEOUT):
+        super().__init__(name)
+        self.url = url
+        self.timeout = timeout
+
+    def get_prices(self, coin_ids, currencies, include_24hr_change):
+        # Imported here as requests is slow to import, as in coingecko.py
+        import requests
+
+        url = self.url.format(ids=','.join(coin_ids), currencies=','.join(currencies), include_24hr_change='true' if include_24hr_change else 'false')
+        try:
+            response = requests.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to connect to {self.name}: {e}")
+        if response.status_code != 200:
+            raise requests.HTTPError(f"HTTP Error getting prices from {self.name}: {response.status_code} - {response.reason}", response=response)
+        try:
+            data = response.json()
+        except ValueError:
+            raise ValueError(f"{self.name} didn't return JSON")
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.name} returned prices in an unexpected format")
+        return _select(data, coin_ids, currencies, include_24hr_change)
+
+class FileSource(PriceSource):
+    """A JSON file in /simple/price form, read on every fetch so changes to it are picked up."""
+    kind = 'file'
+
+    def __init__(self, path: str, name: str = None):
+        super().__init__(name)
+        self.path = path
+
+    def get_prices(self, coin_ids, currencies, include_24hr_change):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except OSError as e:
+            raise ConnectionError(f"Failed to read {self.path}: {e}")
+        except json.JSONDecodeError:
+            raise ValueError(f"Failed to decode JSON from {self.path}")
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.path} holds prices in an unexpected format")
+        return _select(data, coin_ids, currencies, include_24hr_change)
+
+def _start(source: PriceSource, coin_ids: List[str], currencies: List[str], include_24hr_change: bool, results: queue.Queue):
+    """
+    Fetches from a source in a daemon thread, putting (source, data, error) on results. The thread is a
+    daemon so a process doesn't wait at exit for the request a hedge made unnecessary.
+    """
+    def fetch():
+        try:
+            results.put((source, source.fetch(coin_ids, currencies, include_24hr_change), None))
+        except Exception as e:
+            results.put((source, None, e))
+
+    threading.Thread(target=fetch, name=f"price-source-{source.name}", daemon=True).start()
+
+def _failure(errors: List[str]) -> ConnectionError:
+    return ConnectionError("Failed to fetch prices from every source: " + "; ".join(errors))
+
+def fetch_hedged(sources: List[PriceSource], coin_ids: List[str], currencies: List[str], include_24hr_change: bool = True,
+                 percentile: float = DEFAULT_HEDGE_PERCENTILE, default_delay: float = DEFAULT_HEDGE_DELAY) -> dict:
+    """
+    Returns the first prices any source returns, asking the sources in order and moving on to the next one
+    when a source fails or takes longer than its hedge delay.
+
+    Args:
+    sources (list of PriceSource): The sources, most preferred first.
+    coin_ids (list of str): The coins to fetch.
+    currencies (list of str): The currencies to fetch prices in.
+    include_24hr_change (bool): Whether the 24 hour change is needed.
+    percentile (float): The percentile of a source's latencies to wait for before asking the next source.
+    default_delay (float): Seconds to wait instead while a source has too few latencies recorded.
+
+    Returns:
+    dict: The prices in the form coingecko.fetch_price_data returns.
+
+    Raises:
+    ConnectionError: If every source fails.
+    """
+    results = queue.Queue()
+    pending = list(sources)
+    errors = []
+    source = pending.pop(0)
+    _start(source, coin_ids, currencies, include_24hr_change, results)
+    running = 1
+    delay = source.hedge_delay(percentile, default_delay)
+
+    while running:
+        try:
+            source, data, error = results.get(timeout=delay if pending else None)
+        except queue.Empty:
+            source = pending.pop(0)
+            HEDGED_REQUESTS.inc(source=source.name)
+            _start(source, coin_ids, currencies, include_24hr_change, results)
+            running += 1
+            delay = source.hedge_delay(percentile, default_delay)
+            continue
+
+        running -= 1
+        if error is None:
+            return data
+        errors.append(f"{source.name}: {error}")
+        if pending and not running:
+            source = pending.pop(0)
+            _start(source, coin_ids, currencies, include_24hr_change, results)
+            running = 1
+            delay = source.hedge_delay(percentile, default_delay)
+
+    raise _failure(errors)
+
+def median(values: List[float]) -> float:
+    # statistics.median would do, but importing statistics adds to every script's start up time
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+def reject_outliers(values: List[float]) -> List[float]:
+    """
+    Leaves out values more than OUTLIER_THRESHOLD scaled median absolute deviations from the median. The
+    median absolute deviation isn't thrown by the outliers themselves, as a standard deviation would be, so
+    one source returning a stale or wrong price can't pull the others' prices towards it. Values within
+    MIN_OUTLIER_SPREAD of the median are always kept, so sources that agree closely aren't rejected over
+    tiny differences.
+    """
+    if len(values) < 3:
+        return list(values)
+    middle = median(values)
+    spread = median(abs(value - middle) for value in values) * MAD_SCALE
+    limit = max(OUTLIER_THRESHOLD * spread, MIN_OUTLIER_SPREAD * abs(middle))
+    return [value for value in values if abs(value - middle) <= limit]
+
+def aggregate(responses: List[dict]) -> dict:
+    """
+    Combines the prices returned by several sources, taking the median of each price after rejecting
+    outliers. Each coin gets every price any source returned for it.
+    """
+    combined = {}
+    for data in responses:
+        for coin_id, coin_prices in data.items():
+            for key, value in coin_prices.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    combined.setdefault(coin_id, {}).setdefault(key, []).append(value)
+
+    return {
+        coin_id: {key: median(reject_outliers(values)) for key, values in coin_prices.items()}
+        for coin_id, coin_prices in combined.items()
+    }
+
+def fetch_median(sources: List[PriceSource], coin_ids: List[str], currencies: List[str], include_24hr_change: bool = True) -> dict:
+    """
+    Asks every source at once and returns the aggregated prices of those that answered, see aggregate.
+    Sources that fail are reported as warnings and left out.
+
+    Raises:
+    ConnectionError: If every source fails.
+    """
+    results = queue.Queue()
+    for source in sources:
+        _start(source, coin_ids, currencies, include_24hr_change, results)
+
+    responses = []
+    errors = []
+    for _ in sources:
+        source, data, error = results.get()
+        if error is None:
+            responses.append(data)
+        else:
+            errors.append(f"{source.name}: {error}")
+
+    if not responses:
+        raise _failure(errors)
+    for error in errors:
+        print(f"Warning: Leaving out a price source that failed: {error}", file=sys.stderr)
+    return aggregate(responses)
+
+def create_source(settings: dict) -> PriceSource:
+    """Creates a source from its entry in a sources config."""
+    name = settings.get('name')
+    if settings['type'] == 'http':
+        return HttpSource(settings['url'], name, settings.get('timeout', coingecko.REQUEST_TIMEOUT))
+    if settings['type'] == 'file':
+        return FileSource(settings['path'], name)
+    return CoinGeckoSource(name)
+
+class PriceSources:
+    """
+    The sources of a sources config and how to use them.
+
+    Args:
+    sources (list of PriceSource): The sources, most preferred first.
+    mode (str): 'hedged' or 'median', see the module docstring.
+    hedge_percentile (float): See fetch_hedged.
+    hedge_delay (float): See fetch_hedged.
+    """
+
+    def __init__(self, sources: List[PriceSource], mode: str = 'hedged', hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE, hedge_delay: float = DEFAULT_HEDGE_DELAY):
+        self.sources = list(sources)
+        self.mode = mode
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'PriceSources':
+        sources = [create_source(settings) for settings in config['sources']]
+        return cls(sources, config['mode'], config['hedgePercentile'], config['hedgeDelay'])
+
+    def fetch(self, coin_ids: List[str], currencies: List[str], include_24hr_change: bool = True) -> dict:
+        coin_ids = sorted({coin_id.lower() for coin_id in coin_ids})
+        currencies = sorted({currency.lower() for currency in currencies})
+        if self.mode == 'median':
+            return fetch_median(self.sources, coin_ids, currencies, include_24hr_change)
+        return fetch_hedged(self.sources, coin_ids, currencies, include_24hr_change, self.hedge_percentile, self.hedge_delay)
+
+# Sources loaded by this process and the config they were loaded from, by config path, kept so their
+# latencies build up across fetches
+_configured: Dict[str, tuple] = {}
+
+def get_configured_sources() -> Optional[PriceSources]:
+    """
+    Returns the sources the COINTRACKER_PRICE_SOURCES config lists, or None if it isn't set.
+
+    Raises:
+    ConfigError: If the config can't be loaded.
+    """
+    path = os.environ.get(SOURCES_ENVIRONMENT_VARIABLE)
+    if not path:
+        return None
+    # configloader imports utils, which imports this module
+    from configloader import load_config
+
+    config = load_config(path, config_schema, default_config)
+    loaded_config, sources = _configured.get(path, (None, None))
+    if loaded_config is not config:
+        # load_config returns the same dict until the file changes
+        sources = PriceSources.from_config(config)
+        _configured[path] = (config, sources)
+    return sources
+
+def fetch_price_data(ids: List[str], currencies: List[str], include_24hr_change: bool = True, allow_missing: bool = False) -> Dict[str, Dict[str, float]]:
+    """
+    Fetches prices from the configured sources, or from CoinGecko if none are configured. Takes the same
+    arguments and raises the same errors as coingecko.fetch_price_data.
+    """
+    sources = get_configured_sources()
+    if sources is None:
+        return coingecko.fetch_price_data(ids, currencies, include_24hr_change, allow_missing)
+
+    data = sources.fetch(ids, currencies, include_24hr_change)
+    if not allow_missing and any(coin_id.lower() not in data for coin_id in ids):
+        raise ValueError("Not all coin IDs were found by the price sources. Check that all coin IDs are valid. Run coinsearch.py to find valid IDs.")
+    return data
@@ -0,0 +1,419 @@
+"""
+A small expression language for alert rules, for example:
+
+    price(bitcoin,aud) > 100000 and change_24h(ethereum,usd) < -5
+
+Rules are parsed once and compiled into nested Python closures. Evaluating a rule against a
+fetch_price_data result is then a handful of dictionary lookups and comparisons, with no parsing
+or tree walking per tick.
+
+Grammar:
+    rule       := or_expr
+    or_expr    := and_expr ('or' and_expr)*
+    and_expr   := not_expr ('and' not_expr)*
+    not_expr   := 'not' not_expr | comparison
+    comparison := sum (('<' | '<=' | '>' | '>=' | '==' | '!=') sum)?
+    sum        := product (('+' | '-') product)*
+    product    := unary (('*' | '/') unary)*
+    unary      := '-' unary | NUMBER | function | '(' or_expr ')'
+    function   := NAME '(' coin_id ',' currency ')'
+
+A price that's missing from the price data is unknown rather than false, and so is anything worked out from
+it: 'not' of an unknown is unknown, 'and' is only false and 'or' only true if one of their operands is. A
+rule that comes out unknown doesn't match.
+"""
+import json
+import operator
+import os
+import re
+from typing import Callable, Dict, List, Optional, Set
+import coingecko
+
+# Config schema fragment for the optional "rules" setting shared by the alert tools
+rules_schema = {
+    "type": "array",
+    "items": {
+        "type": "string",
+        "minLength": 1
+    },
+    "description": "Rule expressions such as 'price(bitcoin,aud) > 100000'. An alert is sent when a rule becomes true, and again only once it has been false."
+}
+
+# Directory the matched rules are kept in between runs, so a rule that stays true only alerts once
+CACHE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'cache')
+STATE_FILENAME = 'rule_state.json'
+
+class RuleSyntaxError(ValueError):
+    """Raised when a rule expression can't be parsed."""
+
+    def __init__(self, message: str, source: str, position: int):
+        super().__init__(f"{message} at position {position} in rule '{source}'")
+        self.source = source
+        self.position = position
+
+class UnknownCoinError(ValueError):
+    """Raised when a rule refers to a coin ID that isn't in the CoinGecko coin list."""
+
+    def __init__(self, coin_id: str, source: str):
+        super().__init__(f"'{coin_id}' isn't a CoinGecko coin ID in rule '{source}'. Run coinsearch.py to find the right one.")
+        self.coin_id = coin_id
+        self.source = source
+
+class MissingPriceData(LookupError):
+    """Raised while evaluating a rule that refers to a price that isn't in the price data."""
+
+COMPARISONS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq, '!=': operator.ne
+}
+ARITHMETIC = {
+    '+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv
+}
+
+def _price_key(currency: str) -> str:
+    return currency
+
+def _change_24h_key(currency: str) -> str:
+    return f"{currency}_24h_change"
+
+# Functions that can be used in rules, mapped to how they build the key to look up in a coin's price data
+FUNCTIONS = {
+    'price': _price_key,
+    'change_24h': _change_24h_key
+}
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op><=|>=|==|!=|[<>+\-*/(),])
+    )""", re.VERBOSE)
+ARGUMENT_PATTERN = re.compile(r"\s*([^\s,()]+)\s*")
+
+class _Parser:
+    """Recursive descent parser that builds the compiled closure directly rather than an intermediate tree."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.position = 0
+        self.coin_ids: Set[str] = set()
+        self.currencies: Set[str] = set()
+        self.change_currencies: Set[str] = set()
+
+    def error(self, message: str):
+        raise RuleSyntaxError(message, self.source, self.position)
+
+    def peek(self):
+        match = TOKEN_PATTERN.match(self.source, self.position)
+        if not match or match.end() == self.position:
+            if self.source[self.position:].strip():
+                self.error("Unexpected character")
+            return None, None
+        kind = match.lastgroup
+        return kind, match.group(kind)
+
+    def take(self):
+        match = TOKEN_PATTERN.match(self.source, self.position)
+        self.position = match.end()
+        return match.group(match.lastgroup)
+
+    def expect(self, value: str):
+        kind, token = self.peek()
+        if token != value:
+            self.error(f"Expected '{value}'")
+        self.take()
+
+    def parse(self) -> Callable:
+        compiled = self.or_expr()
+        if self.peek()[0] is not None:
+            self.error("Unexpected token")
+        return compiled
+
+    def or_expr(self) -> Callable:
+        operands = [self.and_expr()]
+        while self.peek() == ('name', 'or'):
+            self.take()
+            operands.append(self.and_expr())
+        if len(operands) == 1:
+            return operands[0]
+
+        def or_expr(prices):
+            result = False
+            for operand in operands:
+                value = operand(prices)
+                if value is None:
+                    result = None
+                elif value:
+                    return True
+            return result
+        return or_expr
+
+    def and_expr(self) -> Callable:
+        operands = [self.not_expr()]
+        while self.peek() == ('name', 'and'):
+            self.take()
+            operands.append(self.not_expr())
+        if len(operands) == 1:
+            return operands[0]
+
+        def and_expr(prices):
+            result = True
+            for operand in operands:
+                value = operand(prices)
+                if value is None:
+                    result = None
+                elif not value:
+                    return False
+            return result
+        return and_expr
+
+    def not_expr(self) -> Callable:
+        if self.peek() == ('name', 'not'):
+            self.take()
+            operand = self.not_expr()
+
+            def not_expr(prices):
+                value = operand(prices)
+                return None if value is None else not value
+            return not_expr
+        return self.comparison()
+
+    def comparison(self) -> Callable:
+        left = self.sum()
+        kind, token = self.peek()
+        if token in COMPARISONS:
+            self.take()
+            compare = COMPARISONS[token]
+            right = self.sum()
+
+            def comparison(prices):
+                # A comparison against a price that's missing is unknown, so 'or' rules still work for the other prices
+                try:
+                    left_value, right_value = left(prices), right(prices)
+                except MissingPriceData:
+                    return None
+                except ZeroDivisionError:
+                    return False
+                if left_value is None or right_value is None:
+                    return None
+                return compare(left_value, right_value)
+            return comparison
+        return left
+
+    def sum(self) -> Callable:
+        left = self.product()
+        while self.peek()[1] in ('+', '-'):
+            apply = ARITHMETIC[self.take()]
+            left = self._binary(apply, left, self.product())
+        return left
+
+    def product(self) -> Callable:
+        left = self.unary()
+        while self.peek()[1] in ('*', '/'):
+            apply = ARITHMETIC[self.take()]
+            left = self._binary(apply, left, self.unary())
+        return left
+
+    @staticmethod
+    def _binary(apply: Callable, left: Callable, right: Callable) -> Callable:
+        def binary(prices):
+            left_value, right_value = left(prices), right(prices)
+            if left_value is None or right_value is None:
+                return None
+            return apply(left_value, right_value)
+        return binary
+
+    def unary(self) -> Callable:
+        kind, token = self.peek()
+        if token == '-':
+            self.take()
+            operand = self.unary()
+
+            def negate(prices):
+                value = operand(prices)
+                return None if value is None else -value
+            return negate
+        if kind == 'number':
+            value = float(self.take())
+            return lambda prices: value
+        if token == '(':
+            self.take()
+            compiled = self.or_expr()
+            self.expect(')')
+            return compiled
+        if kind == 'name' and token in FUNCTIONS:
+            return self.function()
+        if token is None:
+            self.error("Unexpected end of rule")
+        self.error(f"Unexpected '{token}'")
+
+    def function(self) -> Callable:
+        name = self.take()
+        self.expect('(')
+        # Coin IDs can contain dashes and start with digits (e.g. 1inch) so arguments are read as raw words
+        arguments = []
+        while True:
+            match = ARGUMENT_PATTERN.match(self.source, self.position)
+            if not match:
+                self.error(f"Expected an argument for {name}()")
+            arguments.append(match.group(1).lower())
+            self.position = match.end()
+            kind, token = self.peek()
+            if token == ')':
+                self.take()
+                break
+            self.expect(',')
+
+        if len(arguments) != 2:
+            self.error(f"{name}() takes a coin ID and a currency")
+
+        coin_id, currency = arguments
+        key = FUNCTIONS[name](currency)
+        self.coin_ids.add(coin_id)
+        self.currencies.add(currency)
+        if name == 'change_24h':
+            self.change_currencies.add(currency)
+
+        def lookup(prices):
+            try:
+                return prices[coin_id][key]
+            except KeyError:
+                raise MissingPriceData(f"No {name} data for {coin_id} in {currency.upper()}")
+        return lookup
+
+class Rule:
+    """A compiled rule expression."""
+    __slots__ = ('source', 'predicate', 'coin_ids', 'currencies', 'change_currencies', 'include_24hr_change')
+
+    def __init__(self, source: str):
+        parser = _Parser(source)
+        self.source = source
+        self.predicate = parser.parse()
+        self.coin_ids = parser.coin_ids
+        self.currencies = parser.currencies
+        self.change_currencies = parser.change_currencies
+        self.include_24hr_change = bool(parser.change_currencies)
+
+    def evaluate(self, prices: Dict[str, Dict[str, float]]) -> bool:
+        """Returns whether the rule is true for the price data. Rules that are unknown because of missing prices are false."""
+        return bool(self.check(prices))
+
+    def check(self, prices: Dict[str, Dict[str, float]]) -> Optional[bool]:
+        """Returns whether the rule is true for the price data, or None if it's unknown because prices it needs are missing."""
+        try:
+            result = self.predicate(prices)
+        except MissingPriceData:
+            return None
+        except ZeroDivisionError:
+            return False
+        return None if result is None else bool(result)
+
+class RuleSet:
+    """A set of compiled rules that are evaluated together against one price snapshot."""
+
+    def __init__(self, expressions: List[str]):
+        self.rules = [Rule(expression) for expression in expressions]
+        self.coin_ids = set().union(*(rule.coin_ids for rule in self.rules))
+        self.currencies = set().union(*(rule.currencies for rule in self.rules))
+        # Currencies the rules need the 24 hour change in, which has to be requested along with the prices
+        self.change_currencies = set().union(*(rule.change_currencies for rule in self.rules))
+        self.include_24hr_change = bool(self.change_currencies)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def evaluate(self, prices: Dict[str, Dict[str, float]]) -> List[Rule]:
+        """Returns the rules that are true for the price data."""
+        return [rule for rule in self.rules if rule.evaluate(prices)]
+
+    def describe_matches(self, prices: Dict[str, Dict[str, float]]) -> str:
+        """Returns a line of alert output for each rule that is true, or an empty string if none are."""
+        return self.describe(self.evaluate(prices))
+
+    @staticmethod
+    def describe(matches: List[Rule]) -> str:
+        """Returns a line of alert output for each of the matched rules returned by evaluate."""
+        return "".join(f"Rule matched: {rule.source}\n" for rule in matches)
+
+    def check_coin_ids(self):
+        """
+        Checks the coin IDs the rules refer to against the CoinGecko coin list. The check is skipped if the
+        coin list can't be loaded, leaving the price fetch to report any unknown coins.
+
+        Raises:
+        UnknownCoinError: For the first coin ID that isn't in the coin list.
+        """
+        for rule in self.rules:
+            for coin_id in sorted(rule.coin_ids):
+                try:
+                    known = coingecko.get_coin_info(coin_id) is not None
+                except Exception:
+                    return
+                if not known:
+                    raise UnknownCoinError(coin_id, rule.source)
+
+    def evaluate_new_matches(self, prices: Dict[str, Dict[str, float]], tool: str, cache_directory: Optional[str] = None) -> List[Rule]:
+        """
+        Returns the rules that have become true since the tool last checked them, remembering which rules are
+        true in the cache directory for the next run. A rule that's unknown because prices it needs are missing
+        keeps its last state.
+
+        Args:
+        prices: The price data to check the rules against.
+        tool: The name of the tool checking the rules. Each tool keeps its own matched rules.
+        cache_directory: The directory to keep the matched rules in, by default the project's cache directory.
+
+        Returns:
+        The rules that are true now but weren't the last time they were checked.
+        """
+        if not self.rules:
+            return []
+        filename = os.path.join(cache_directory or CACHE_DIRECTORY, STATE_FILENAME)
+        state = _load_state(filename)
+        matched = set(state.get(tool, []))
+        previous = set(matched)
+        new_matches = []
+        for rule in self.rules:
+            result = rule.check(prices)
+            if result is None:
+                continue
+            if result and rule.source not in matched:
+                new_matches.append(rule)
+                matched.add(rule.source)
+            elif not result:
+                matched.discard(rule.source)
+        if matched != previous:
+            state[tool] = sorted(matched)
+            _save_state(filename, state)
+        return new_matches
+
+def _load_state(filename: str) -> Dict[str, List[str]]:
+    """Returns the matched rules of each tool, or nothing if they haven't been saved or can't be read."""
+    try:
+        with open(filename) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+def _save_state(filename: str, state: Dict[str, List[str]]):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(temp_filename, filename)
+
+# Compiled rule sets by their expressions so each config's rules are only parsed once per process
+_compiled_rules: Dict[tuple, RuleSet] = {}
+
+def compile_rules(expressions: List[str]) -> RuleSet:
+    """
+    Parses and compiles rule expressions from a config. Compiling the same expressions again returns the same RuleSet.
+
+    Raises:
+    RuleSyntaxError: If any rule is invalid.
+    """
+    key = tuple(expressions)
+    rule_set = _compiled_rules.get(key)
+    if rule_set is None:
+        rule_set = _compiled_rules[key] = RuleSet(expressions)
+    return rule_set
@@ -0,0 +1,312 @@
+"""
+Adaptive polling for cointracker watch, which runs alert configs continuously instead of from cron.
+
+Each coin has its own next check time, kept in a priority queue. After each check the time until the next
+one is worked out from how far the coin is from the nearest level that would change a tool's output (an
+alert threshold or target price) and how much its price has been moving. A random walk with volatility
+sigma takes about (distance / sigma)^2 to move a given distance, so coins close to a trigger or in a
+volatile stretch are checked often and quiet coins far from any trigger rarely. Each check is a single
+API request for every coin due, and a token bucket keeps requests within a budget per minute.
+
+A config is run when a price crosses one of its triggers or the set of its rules that match changes,
+rather than on every check, so frequent checks don't repeat the same alert.
+"""
+import heapq
+import math
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from metrics import RUNS, RUN_DURATION, track
+from rules import compile_rules
+from tracing import span
+from utils import fetch_prices
+
+MIN_INTERVAL = 60  # Seconds, the shortest time between checks of a coin
+MAX_INTERVAL = 3600  # Seconds, the longest time between checks of a coin
+DEFAULT_BUDGET = 10  # API requests per minute, CoinGecko's free tier allows around 30
+PRIOR_DAILY_VOLATILITY = 0.04  # Assumed daily volatility of a coin until it has been seen to move
+REFERENCE_MOVE = 0.05  # Coins without a nearer trigger are checked as if there were one this far away
+SAFETY_FACTOR = 0.25  # Check a coin after this fraction of the expected time to reach its nearest trigger
+VOLATILITY_SMOOTHING = 0.3  # Weight of the latest price move in a coin's volatility estimate
+LOOKAHEAD = 0.25  # Coins due within this fraction of their interval join a request that's being made anyway
+
+class Trigger:
+    """
+    A level that changes a tool's output when a value calculated from prices crosses it.
+
+    Args:
+    coin_ids (sequence of str): The coins the value depends on.
+    level (float): The level, in the same units as the value.
+    value (callable): Calculates the value from price data, returning None if a price is missing.
+    """
+    __slots__ = ('coin_ids', 'level', 'value')
+
+    def __init__(self, coin_ids: Sequence[str], level: float, value: Callable[[dict], Optional[float]]):
+        self.coin_ids = tuple(coin_ids)
+        self.level = level
+        self.value = value
+
+    @classmethod
+    def price(cls, coin_id: str, currency: str, level: float) -> 'Trigger':
+        """A trigger on the price of a coin in a currency."""
+        currency = currency.lower()
+        return cls((coin_id,), level, lambda prices: prices.get(coin_id, {}).get(currency))
+
+    def distance(self, prices: dict) -> Optional[float]:
+        """Returns how far the value is from the level as the absolute log ratio, about the percentage / 100."""
+        value = self.value(prices)
+        if not value or self.level <= 0:
+            return None
+        return abs(math.log(value / self.level))
+
+    def side(self, prices: dict) -> Optional[bool]:
+        """Returns whether the value is above the level, or None if it can't be calculated."""
+        value = self.value(prices)
+        return None if value is None else value > self.level
+
+class TokenBucket:
+    """
+    Limits the rate of API requests while allowing short bursts.
+
+    Args:
+    rate_per_minute (float): Requests allowed per minute on average.
+    capacity (float): Requests that can be made at once after a quiet period, defaults to one.
+    now (float): The current time in seconds.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = 1, now: float = 0):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Returns the seconds until a request can be made."""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> bool:
+        """Uses up a request if one is available, returning whether it was."""
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class AdaptiveScheduler:
+    """
+    The next check time of each coin, with its volatility estimate and the interval it was last given.
+
+    Args:
+    coin_ids (iterable of str): The coins to check, all of which are due straight away.
+    now (float): The current time in seconds.
+    min_interval (float): The shortest time between checks of a coin.
+    max_interval (float): The longest time between checks of a coin.
+    """
+
+    def __init__(self, coin_ids: Iterable[str], now: float, min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        prior_variance = PRIOR_DAILY_VOLATILITY ** 2 / 86400
+        self._due = {coin_id: now for coin_id in coin_ids}
+        self._heap = [(now, coin_id) for coin_id in sorted(self._due)]
+        heapq.heapify(self._heap)
+        self.intervals = {coin_id: min_interval for coin_id in self._due}
+        # Variance of log price moves per second
+        self.variances = {coin_id: prior_variance for coin_id in self._due}
+        self._last_checked = {}
+
+    def _push(self, coin_id: str, due: float):
+        # Rescheduled coins get a new heap entry, the old one is skipped when it reaches the top
+        self._due[coin_id] = due
+        heapq.heappush(self._heap, (due, coin_id))
+
+    def _discard_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> float:
+        """Returns the time the next coin is due to be checked."""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else math.inf
+
+    def pop_due(self, now: float) -> List[str]:
+        """Removes and returns the coins due by now, along with any due soon enough to share the same request."""
+        coin_ids = []
+        while True:
+            self._discard_stale()
+            if not self._heap:
+                break
+            due, coin_id = self._heap[0]
+            if due > now and due > now + LOOKAHEAD * self.intervals[coin_id]:
+                break
+            heapq.heappop(self._heap)
+            del self._due[coin_id]
+            coin_ids.append(coin_id)
+        return coin_ids
+
+    def get_interval(self, coin_id: str, distance: Optional[float]) -> float:
+        """Returns the time to wait before checking a coin again, given the distance to its nearest trigger."""
+        move = REFERENCE_MOVE if distance is None else min(distance, REFERENCE_MOVE)
+        variance = self.variances[coin_id]
+        if variance <= 0:
+            return self.max_interval
+        expected_time = move * move / variance
+        return min(max(SAFETY_FACTOR * expected_time, self.min_interval), self.max_interval)
+
+    def update(self, coin_id: str, now: float, prices: Dict[str, float], distance: Optional[float]) -> float:
+        """
+        Records a check of a coin, updating its volatility from the move since the last check, and schedules
+        the next check.
+
+        Args:
+        coin_id (str): The coin checked.
+        now (float): The time of the check.
+        prices (dict): The coin's prices by currency.
+        distance (float): The distance to the coin's nearest trigger as returned by Trigger.distance, or None.
+
+        Returns:
+        float: The interval until the next check.
+        """
+        last = self._last_checked.get(coin_id)
+        if last is not None and now > last[0]:
+            # The largest move in any currency, so that a coin priced in itself (BTC in BTC) still counts as moving
+            moves = [math.log(price / last[1][currency]) ** 2 for currency, price in prices.items() if price and last[1].get(currency)]
+            if moves:
+                self.variances[coin_id] += VOLATILITY_SMOOTHING * (max(moves) / (now - last[0]) - self.variances[coin_id])
+        self._last_checked[coin_id] = (now, prices)
+
+        interval = self.intervals[coin_id] = self.get_interval(coin_id, distance)
+        self._push(coin_id, now + interval)
+        return interval
+
+    def defer(self, coin_ids: Iterable[str], now: float):
+        """Schedules coins whose check failed to be tried again after the shortest interval."""
+        for coin_id in coin_ids:
+            self._push(coin_id, now + self.min_interval)
+
+class WatchJob:
+    """A config being watched, with what it looked like when it was last run."""
+    __slots__ = ('tool_name', 'path', 'tool', 'config', 'args', 'coin_ids', 'rules', 'triggers', 'run_prices', 'matched_rules')
+
+    def __init__(self, tool_name: str, path: str, tool, config: dict, args):
+        self.tool_name = tool_name
+        self.path = path
+        self.tool = tool
+        self.config = config
+        self.args = args
+        self.coin_ids = set(tool.get_price_request(config)[0])
+        self.rules = compile_rules(config.get('rules', []))
+        self.triggers = []
+        self.run_prices = None
+        self.matched_rules = None
+
+    def should_run(self, prices: dict) -> bool:
+        """Returns whether the prices have crossed a trigger or changed which rules match since the last run."""
+        if self.run_prices is None:
+            return True
+        if any(trigger.side(self.run_prices) != trigger.side(prices) for trigger in self.triggers):
+            return True
+        return self._match_rules(prices) != self.matched_rules
+
+    def _match_rules(self, prices: dict) -> frozenset:
+        return frozenset(rule.source for rule in self.rules.evaluate(prices))
+
+    def record_run(self, prices: dict):
+        self.run_prices = dict(prices)
+        self.matched_rules = self._match_rules(prices)
+        # Triggers can move when a tool runs, such as a price alert being re-armed above the new price
+        self.triggers = self.tool.get_triggers(self.config)
+
+def run_job(job: WatchJob, prices: dict, on_exit: Callable = None) -> bool:
+    """Runs a watched config against the prices and records the run. Returns whether the run failed, as on_exit decides."""
+    failed = False
+    try:
+        with span('run', tool=job.tool_name, path=job.path), track(RUNS, RUN_DURATION, tool=job.tool_name):
+            job.tool.run(job.config, prices, job.args)
+    except SystemExit as e:
+        if on_exit is not None:
+            failed = on_exit(job.tool_name, job.path, e)
+    job.record_run(prices)
+    return failed
+
+class Watcher:
+    """
+    Checks prices as the scheduler decides and runs the watched configs when their triggers are crossed.
+
+    Args:
+    jobs (list of WatchJob): The configs to watch.
+    currencies (iterable of str): The currencies to fetch prices in.
+    budget (float): API requests allowed per minute.
+    min_interval (float): The shortest time between checks of a coin.
+    max_interval (float): The longest time between checks of a coin.
+    on_exit (callable): Called with the tool name, config path and SystemExit when a run exits, returning
+                        whether it was a failure.
+    clock, sleep, fetch: The time source, sleep and price fetch to use, replaceable for testing.
+    """
+
+    def __init__(self, jobs: List[WatchJob], currencies: Iterable[str], budget: float = DEFAULT_BUDGET, min_interval: float = MIN_INTERVAL,
+                 max_interval: float = MAX_INTERVAL, on_exit: Callable = None, clock: Callable[[], float] = None,
+                 sleep: Callable[[float], None] = None, fetch: Callable = fetch_prices):
+        self.jobs = jobs
+        self.currencies = sorted(set(currencies))
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self.fetch = fetch
+        self.on_exit = on_exit
+        now = self.clock()
+        self.bucket = TokenBucket(budget, now=now)
+        self.scheduler = AdaptiveScheduler(set().union(*(job.coin_ids for job in jobs)), now, min_interval, max_interval)
+        self.prices = {}
+        self.failed = False
+
+    def _run(self, job: WatchJob):
+        self.failed = run_job(job, self.prices, self.on_exit) or self.failed
+
+    def get_distance(self, coin_id: str) -> Optional[float]:
+        """Returns the distance from the coin's prices to the nearest trigger that depends on it."""
+        distances = [trigger.distance(self.prices) for job in self.jobs if coin_id in job.coin_ids for trigger in job.triggers if coin_id in trigger.coin_ids]
+        distances = [distance for distance in distances if distance is not None]
+        return min(distances) if distances else None
+
+    def step(self) -> List[str]:
+        """
+        Waits until coins are due and the budget allows a request, then checks them and runs any configs that
+        need it. Returns the coins checked.
+        """
+        now = self.clock()
+        wait = max(self.scheduler.next_due() - now, self.bucket.wait_time(now))
+        if wait > 0:
+            self.sleep(wait)
+            now = self.clock()
+        self.bucket.take(now)
+
+        coin_ids = self.scheduler.pop_due(now)
+        with span('poll', coins=len(coin_ids)):
+            try:
+                prices = self.fetch(coin_ids, self.currencies)
+            except SystemExit as e:
+                print(e.code, file=sys.stderr)
+                self.scheduler.defer(coin_ids, now)
+                return coin_ids
+        self.prices.update(prices)
+
+        # A coin the API didn't return is tried again on its own, without holding back the coins polled with it
+        checked = [coin_id for coin_id in coin_ids if coin_id in prices]
+        missing = [coin_id for coin_id in coin_ids if coin_id not in prices]
+        if missing:
+            print(f"Warning: No prices found for {', '.join(missing)}, trying again in {self.scheduler.min_interval:g} seconds.", file=sys.stderr)
+            self.scheduler.defer(missing, now)
+
+        for job in self.jobs:
+            # Every coin a config needs has to have been fetched once before it can run
+            if job.coin_ids.intersection(checked) and job.coin_ids <= self.prices.keys() and job.should_run(self.prices):
+                self._run(job)
+
+        for coin_id in checked:
+            self.scheduler.update(coin_id, now, self.prices[coin_id], self.get_distance(coin_id))
+        return coin_ids
@@ -4,18 +4,32 @@ from io import StringIO
 from unittest.mock import patch, mock_open
 import sys
 
-from mocks import fetch_price_data, get_coin_symbol
+from mocks import fetch_price_data, get_coin_info, get_coin_symbol
 
 # add parent directory to import path so we can import the main functions of each script
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+@pytest.fixture(autouse=True)
+def config_cache(mocker, tmp_path):
+    # Keep the validated config cache out of the project cache directory and start each test with it empty
+    import configloader
+    mocker.patch('configloader.CACHE_DIRECTORY', str(tmp_path / 'config_cache'))
+    configloader.clear_cache()
+    yield
+    configloader.clear_cache()
+
+@pytest.fixture(autouse=True)
+def rule_state(mocker, tmp_path):
+    # Keep the matched rules out of the project cache directory so each test starts with none matched
+    mocker.patch('rules.CACHE_DIRECTORY', str(tmp_path / 'rule_state'))
+
 @pytest.fixture
 def base_setup(mocker):
-    def do_setup(config_name):
+    def do_setup(config_name, *args):
         config_file = os.path.join(os.path.dirname(__file__), 'config', config_name)
 
-        # Mock sys.argv to simulate command line input
-        mocker.patch('sys.argv', ['script_name', config_file])
+        # Mock sys.argv to simulate command line input, any extra args are passed as options
+        mocker.patch('sys.argv', ['script_name', config_file, *args])
 
         # Mock stdout to capture print statements
         mock_stdout = StringIO()
@@ -24,6 +38,7 @@ def base_setup(mocker):
         # Mock external calls
         mocker.patch('coingecko.fetch_price_data', return_value=fetch_price_data())
         mocker.patch('coingecko.get_coin_symbol', side_effect=get_coin_symbol)
+        mocker.patch('coingecko.get_coin_info', side_effect=get_coin_info)
 
         return mock_stdout
     return do_setup
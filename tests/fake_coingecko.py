@@ -0,0 +1,249 @@
+"""
+A local stand-in for the CoinGecko API, so the real HTTP client can be tested and load tested offline.
+
+It serves /simple/price, /coins/list, /coins/{id}/market_chart and /exchange_rates from generated data. /coins/list answers
+conditional requests with 304 Not Modified, using an ETag and Last-Modified that change when set_coins is called. Prices are derived
+from the coin ID and currency, so they are the same on every run and every request. Point the tools at it
+with the COINGECKO_API_URL environment variable:
+
+    python tests/fake_coingecko.py --port 8000 --coins 10000 --latency 0.05
+    COINGECKO_API_URL=http://127.0.0.1:8000/api/v3 python portfolio.py config/portfolio.json
+
+In tests use it as a context manager, which starts it on a free port:
+
+    with FakeCoinGecko(latency=0.01) as server:
+        monkeypatch.setenv('COINGECKO_API_URL', server.url)
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = '/api/v3'
+
+# Coins the test configs use, listed before the generated ones
+KNOWN_COINS = [
+    {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'},
+    {'id': 'ethereum', 'symbol': 'eth', 'name': 'Ethereum'},
+    {'id': 'ripple', 'symbol': 'xrp', 'name': 'XRP'},
+    {'id': 'basic-attention-token', 'symbol': 'bat', 'name': 'Basic Attention Token'}
+]
+
+# Value of one bitcoin in the currencies /exchange_rates lists, a few of each type
+EXCHANGE_RATES = {
+    'btc': {'name': 'Bitcoin', 'unit': 'BTC', 'value': 1.0, 'type': 'crypto'},
+    'eth': {'name': 'Ether', 'unit': 'ETH', 'value': 20.0, 'type': 'crypto'},
+    'usd': {'name': 'US Dollar', 'unit': '$', 'value': 60000.0, 'type': 'fiat'},
+    'aud': {'name': 'Australian Dollar', 'unit': 'A$', 'value': 90000.0, 'type': 'fiat'},
+    'eur': {'name': 'Euro', 'unit': '€', 'value': 55000.0, 'type': 'fiat'},
+    'xau': {'name': 'Gold - Troy Ounce', 'unit': 'XAU', 'value': 25.0, 'type': 'commodity'}
+}
+
+def generate_coins(count: int) -> list:
+    """Returns a coin list of count coins, the known coins followed by coin-0, coin-1, ..."""
+    coins = KNOWN_COINS[:count]
+    coins += [{'id': f"coin-{index}", 'symbol': f"c{index}", 'name': f"Coin {index}"} for index in range(count - len(coins))]
+    return coins
+
+def generate_price(coin_id: str, currency: str) -> float:
+    return random.Random(f"{coin_id}-{currency}").uniform(0.0001, 100000)
+
+def generate_change(coin_id: str, currency: str) -> float:
+    return random.Random(f"{coin_id}-{currency}-change").uniform(-20, 20)
+
+class FakeCoinGecko:
+    """
+    The fake API server.
+
+    Args:
+    coin_count (int): Number of coins in the coin list, which sets the size of /coins/list responses.
+    latency (float): Seconds to wait before answering each request.
+    rate_limit_every (int): Answer every nth request with 429 Too Many Requests, 0 to never.
+    market_chart_points (int): Number of prices /market_chart returns for each day requested.
+    conditional_requests (bool): Whether /coins/list sends an ETag and Last-Modified and answers conditional requests.
+    host (str): Address to listen on.
+    port (int): Port to listen on, 0 picks a free port.
+    """
+
+    def __init__(self, coin_count: int = 100, latency: float = 0, rate_limit_every: int = 0, market_chart_points: int = 24, conditional_requests: bool = True, host: str = '127.0.0.1', port: int = 0):
+        self.set_coins(generate_coins(coin_count))
+        self.conditional_requests = conditional_requests
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.market_chart_points = market_chart_points
+        self.rate_limit_next = 0  # Number of upcoming requests to answer with 429
+        self._prices = {}  # Generated prices and changes by (coin ID, currency), so load tests measure the client rather than this server
+        self.request_paths = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """The base URL to use as COINGECKO_API_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    @property
+    def request_count(self) -> int:
+        with self._lock:
+            return len(self.request_paths)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def set_coins(self, coins: list):
+        """Replaces the coin list, as when coins are listed or delisted, which changes its ETag and Last-Modified."""
+        self.coins = coins
+        self.coin_ids = {coin['id'] for coin in coins}
+        self.coins_modified = time.time()
+        self.coins_etag = '"' + hashlib.sha1(json.dumps(coins).encode()).hexdigest() + '"'
+
+    def _record_request(self, path: str) -> bool:
+        """Records a request and returns whether it should be rate limited."""
+        with self._lock:
+            self.request_paths.append(path)
+            count = len(self.request_paths)
+            if self.rate_limit_next > 0:
+                self.rate_limit_next -= 1
+                return True
+        return bool(self.rate_limit_every) and count % self.rate_limit_every == 0
+
+    def simple_price(self, query: dict):
+        ids = [coin_id for coin_id in query.get('ids', [''])[0].split(',') if coin_id]
+        currencies = [currency for currency in query.get('vs_currencies', [''])[0].split(',') if currency]
+        include_change = query.get('include_24hr_change', ['false'])[0] == 'true'
+
+        prices = {}
+        # Like CoinGecko, unknown IDs are left out of the response rather than being an error
+        for coin_id in ids:
+            if coin_id not in self.coin_ids:
+                continue
+            coin_prices = {}
+            for currency in currencies:
+                key = (coin_id, currency)
+                if key not in self._prices:
+                    self._prices[key] = (generate_price(coin_id, currency), generate_change(coin_id, currency))
+                coin_prices[currency], change = self._prices[key]
+                if include_change:
+                    coin_prices[f"{currency}_24h_change"] = change
+            prices[coin_id] = coin_prices
+        return 200, prices
+
+    def coin_list(self, headers: dict):
+        if not self.conditional_requests:
+            return 200, self.coins, {}
+        validators = {'ETag': self.coins_etag, 'Last-Modified': formatdate(self.coins_modified, usegmt=True)}
+
+        # Like HTTP caches, If-None-Match is used in preference to If-Modified-Since when both are sent
+        if headers.get('If-None-Match') is not None:
+            not_modified = headers['If-None-Match'] == self.coins_etag
+        elif headers.get('If-Modified-Since') is not None:
+            not_modified = parsedate_to_datetime(headers['If-Modified-Since']).timestamp() >= int(self.coins_modified)
+        else:
+            not_modified = False
+        return (304, None, validators) if not_modified else (200, self.coins, validators)
+
+    def market_chart(self, coin_id: str, query: dict):
+        if coin_id not in self.coin_ids:
+            return 404, {'error': 'coin not found'}
+        currency = query.get('vs_currency', ['usd'])[0]
+        days = max(1, int(float(query.get('days', ['1'])[0])))
+        count = days * self.market_chart_points
+        interval = 86400 * 1000 // self.market_chart_points
+        end = int(time.time() * 1000)
+        rng = random.Random(f"{coin_id}-{currency}-chart")
+        price = generate_price(coin_id, currency)
+        prices = []
+        for index in range(count):
+            prices.append([end - (count - 1 - index) * interval, price])
+            price *= 1 + rng.uniform(-0.01, 0.01)
+        return 200, {'prices': prices, 'market_caps': [[timestamp, 0] for timestamp, _ in prices], 'total_volumes': [[timestamp, 0] for timestamp, _ in prices]}
+
+    def respond(self, path: str, query: dict, headers: dict = None):
+        """Returns the status code, JSON body and any extra response headers for a request."""
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        if path == '/coins/list':
+            return self.coin_list(headers or {})
+        if path == '/simple/price':
+            return (*self.simple_price(query), {})
+        if path == '/exchange_rates':
+            return 200, {'rates': EXCHANGE_RATES}, {}
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'coins' and parts[2] == 'market_chart':
+            return (*self.market_chart(parts[1], query), {})
+        return 404, {'error': 'Not found'}, {}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API, so clients can reuse connections
+            # Headers and body are written separately, without this Nagle's algorithm delays each response by ~40ms
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                request = urlparse(self.path)
+
+                if server._record_request(request.path):
+                    status, body, headers = 429, {'status': {'error_code': 429, 'error_message': "You've exceeded the Rate Limit."}}, {'Retry-After': '1'}
+                else:
+                    status, body, headers = server.respond(request.path, parse_qs(request.query), self.headers)
+
+                # A 304 Not Modified response has no body
+                payload = json.dumps(body).encode() if status != 304 else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # Keep test and benchmark output quiet
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the CoinGecko API.")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on.")
+    parser.add_argument('--coins', type=int, default=100, help="Number of coins in the coin list.")
+    parser.add_argument('--latency', type=float, default=0, help="Seconds to wait before answering each request.")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="Answer every nth request with 429 Too Many Requests.")
+    args = parser.parse_args()
+
+    server = FakeCoinGecko(coin_count=args.coins, latency=args.latency, rate_limit_every=args.rate_limit_every, port=args.port)
+    print(f"Serving a fake CoinGecko API at {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+A local stand-in for a streaming price ticker, so pricefeed.py and cointracker stream can be tested and load
+tested offline.
+
+It speaks enough of the WebSocket protocol for text messages, written separately from the client in
+pricefeed.py so each is checked against another implementation. Clients subscribe as pricefeed.py describes,
+are sent the current price of every coin and currency they subscribe to, then each tick published for them.
+Prices start from the same generated prices as tests/fake_coingecko.py.
+
+    python tests/fake_ticker.py --port 8765 --coins 1000 --rate 5000
+    cointracker stream config/pricealert.json --url ws://127.0.0.1:8765/
+
+In tests use it as a context manager, which starts it on a free port:
+
+    with FakeTicker() as ticker:
+        ...
+        ticker.wait_for_subscribers(1)
+        ticker.publish([('bitcoin', 'aud', 100000.0)])
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import socketserver
+import struct
+import threading
+import time
+from fake_coingecko import generate_change, generate_coins, generate_price
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+def encode_frame(opcode: int, payload: bytes) -> bytes:
+    """Returns a frame as a server sends it, unmasked."""
+    length = len(payload)
+    if length < 126:
+        return struct.pack('!BB', 0x80 | opcode, length) + payload
+    if length < 65536:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length) + payload
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length) + payload
+
+def read_frame(file):
+    """Reads a client frame, returning its opcode and unmasked payload, or None if the connection closed."""
+    header = file.read(2)
+    if len(header) < 2:
+        return None
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', file.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', file.read(8))[0]
+    key = file.read(4) if header[1] & 0x80 else b'\0\0\0\0'
+    payload = file.read(length)
+    return header[0] & 0x0F, bytes(byte ^ key[index % 4] for index, byte in enumerate(payload))
+
+def make_tick(coin_id: str, currency: str, price: float, change: float = None) -> dict:
+    tick = {'i': coin_id, 'vs': currency, 'p': price, 't': time.time()}
+    if change is not None:
+        tick['pp'] = change
+    return tick
+
+class _Client:
+    """A connected client and what it has subscribed to."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.coin_ids = set()
+        self.currencies = set()
+        self.lock = threading.Lock()
+
+    def send(self, message: str):
+        with self.lock:
+            self.connection.sendall(encode_frame(0x1, message.encode()))
+
+class FakeTicker:
+    """
+    The fake ticker server.
+
+    Args:
+    host (str): Address to listen on.
+    port (int): Port to listen on, 0 picks a free port.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.prices = {}  # (price, 24 hour change) by (coin ID, currency)
+        self.clients = []
+        self.messages_sent = 0
+        self._condition = threading.Condition()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"ws://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.disconnect()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_price(self, coin_id: str, currency: str):
+        key = (coin_id, currency)
+        if key not in self.prices:
+            self.prices[key] = (generate_price(coin_id, currency), generate_change(coin_id, currency))
+        return self.prices[key]
+
+    def wait_for_subscribers(self, count: int, timeout: float = 5) -> bool:
+        """Waits until count clients have subscribed, returning whether they did."""
+        with self._condition:
+            return self._condition.wait_for(lambda: sum(1 for client in self.clients if client.coin_ids) >= count, timeout)
+
+    def publish(self, ticks):
+        """
+        Sends ticks to the clients subscribed to them, as one message per client.
+
+        Args:
+        ticks (iterable of tuple): (coin ID, currency, price) or (coin ID, currency, price, 24 hour change) tuples.
+        """
+        messages = {}
+        with self._condition:
+            clients = list(self.clients)
+            for coin_id, currency, price, *change in ticks:
+                previous_change = self.get_price(coin_id, currency)[1]
+                self.prices[(coin_id, currency)] = (price, change[0] if change else previous_change)
+                tick = make_tick(coin_id, currency, *self.prices[(coin_id, currency)])
+                for client in clients:
+                    if coin_id in client.coin_ids and currency in client.currencies:
+                        messages.setdefault(client, []).append(tick)
+        for client, client_ticks in messages.items():
+            try:
+                client.send(json.dumps(client_ticks))
+                self.messages_sent += 1
+            except OSError:
+                pass
+
+    def disconnect(self):
+        """Drops every client's connection without a closing handshake, as when a network goes down."""
+        with self._condition:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.connection.shutdown(2)
+                client.connection.close()
+            except OSError:
+                pass
+
+    def _subscribe(self, client: _Client, message: str):
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(request, dict) or request.get('command') != 'subscribe':
+            return
+        with self._condition:
+            client.coin_ids.update(request.get('coin_ids', []))
+            client.currencies.update(request.get('currencies', []))
+            snapshot = [make_tick(coin_id, currency, *self.get_price(coin_id, currency)) for coin_id in sorted(client.coin_ids) for currency in sorted(client.currencies)]
+            self._condition.notify_all()
+        client.send(json.dumps(snapshot))
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request_line = self.rfile.readline()
+                headers = {}
+                while True:
+                    line = self.rfile.readline().decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if not request_line.startswith(b'GET ') or headers.get('upgrade', '').lower() != 'websocket' or 'sec-websocket-key' not in headers:
+                    self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                    return
+
+                accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+                self.wfile.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+
+                client = _Client(self.connection)
+                with server._condition:
+                    server.clients.append(client)
+                try:
+                    while True:
+                        frame = read_frame(self.rfile)
+                        if frame is None:
+                            break
+                        opcode, payload = frame
+                        if opcode == 0x1:
+                            server._subscribe(client, payload.decode())
+                        elif opcode == 0x9:
+                            with client.lock:
+                                self.connection.sendall(encode_frame(0xA, payload))
+                        elif opcode == 0x8:
+                            with client.lock:
+                                self.connection.sendall(encode_frame(0x8, payload[:2]))
+                            break
+                except OSError:
+                    pass
+                finally:
+                    with server._condition:
+                        if client in server.clients:
+                            server.clients.remove(client)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for a streaming price ticker.")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on.")
+    parser.add_argument('--coins', type=int, default=100, help="Number of coins that tick, the test configs' coins first.")
+    parser.add_argument('--currencies', default='aud,usd,btc', help="Comma separated currencies that tick.")
+    parser.add_argument('--rate', type=float, default=100, help="Ticks sent per second, spread over the coins.")
+    parser.add_argument('--batch', type=int, default=100, help="Ticks sent per message.")
+    args = parser.parse_args()
+
+    coin_ids = [coin['id'] for coin in generate_coins(args.coins)]
+    currencies = args.currencies.split(',')
+    server = FakeTicker(port=args.port).start()
+    print(f"Serving a fake price ticker at {server.url}, {args.rate:.0f} ticks per second")
+
+    rng = random.Random(42)
+    try:
+        while True:
+            start = time.perf_counter()
+            ticks = []
+            for _ in range(args.batch):
+                coin_id = rng.choice(coin_ids)
+                currency = rng.choice(currencies)
+                price, _ = server.get_price(coin_id, currency)
+                ticks.append((coin_id, currency, price * math.exp(rng.gauss(0, 0.001))))
+            server.publish(ticks)
+            time.sleep(max(0, args.batch / args.rate - (time.perf_counter() - start)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
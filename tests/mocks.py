@@ -12,4 +12,11 @@ def get_coin_symbol(id):
         return 'ETH'
     elif id == 'ripple':
         return 'XRP'
-    return 'Unknown'
\ No newline at end of file
+    return 'Unknown'
+
+def get_coin_info(id, info='all'):
+    symbol = get_coin_symbol(id)
+    if symbol == 'Unknown':
+        return None
+    coin = {'symbol': symbol.lower(), 'name': id.capitalize()}
+    return coin if info == 'all' else coin[info]
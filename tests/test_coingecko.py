@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import time
+import pytest
+import requests
+import coingecko
+from fake_coingecko import FakeCoinGecko, generate_price
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    """Runs the fake CoinGecko server and points the client and its coin list cache at it."""
+    monkeypatch.setattr(coingecko, 'CACHE_FILENAME', str(tmp_path / 'coin_list_cache.json'))
+    monkeypatch.setattr(coingecko, 'CHECKED_FILENAME', str(tmp_path / 'coin_list_checked.json'))
+    monkeypatch.setattr(coingecko, '_coin_dict', None)
+    monkeypatch.setattr(coingecko, '_coin_list_validators', {})
+    monkeypatch.setattr(coingecko, '_coin_list_attempted', 0)
+    monkeypatch.setattr(coingecko, '_exchange_rates', None)
+    with FakeCoinGecko() as server:
+        monkeypatch.setenv('COINGECKO_API_URL', server.url)
+        yield server
+
+def test_api_url(monkeypatch):
+    monkeypatch.delenv('COINGECKO_API_URL', raising=False)
+    assert coingecko.get_api_url('/coins/list') == "https://api.coingecko.com/api/v3/coins/list"
+
+    monkeypatch.setenv('COINGECKO_API_URL', "http://localhost:8000/api/v3/")
+    assert coingecko.get_api_url('/coins/list') == "http://localhost:8000/api/v3/coins/list"
+
+def test_fetch_price_data(fake_api):
+    prices = coingecko.fetch_price_data(['bitcoin', 'Ethereum', 'bitcoin'], ['AUD', 'btc'])
+
+    assert set(prices) == {'bitcoin', 'ethereum'}
+    assert prices['bitcoin']['aud'] == generate_price('bitcoin', 'aud')
+    assert set(prices['ethereum']) == {'aud', 'aud_24h_change', 'btc', 'btc_24h_change'}
+    assert fake_api.request_paths == ['/api/v3/simple/price']
+
+def test_fetch_price_data_without_change(fake_api):
+    prices = coingecko.fetch_price_data(['bitcoin'], ['aud'], include_24hr_change=False)
+
+    assert prices == {'bitcoin': {'aud': generate_price('bitcoin', 'aud')}}
+
+def test_fetch_exchange_rates(fake_api):
+    rates = coingecko.fetch_exchange_rates()
+    assert rates['usd'] == {'name': 'US Dollar', 'unit': '$', 'value': 60000.0, 'type': 'fiat'}
+
+    # Reused until they expire
+    assert coingecko.fetch_exchange_rates() is rates
+    assert fake_api.request_paths == ['/api/v3/exchange_rates']
+
+def test_fetch_price_data_unknown_id(fake_api):
+    with pytest.raises(ValueError, match="Not all coin IDs were found"):
+        coingecko.fetch_price_data(['bitcoin', 'not-a-coin'], ['aud'])
+
+def test_rate_limited(fake_api):
+    fake_api.rate_limit_next = 1
+
+    with pytest.raises(requests.HTTPError, match="429") as error:
+        coingecko.fetch_price_data(['bitcoin'], ['aud'])
+    assert error.value.response.status_code == 429
+
+    # The next request isn't limited
+    assert 'bitcoin' in coingecko.fetch_price_data(['bitcoin'], ['aud'])
+
+def test_connection_error(monkeypatch):
+    with FakeCoinGecko() as server:
+        url = server.url
+    monkeypatch.setenv('COINGECKO_API_URL', url)
+
+    with pytest.raises(ConnectionError, match="Failed to connect to API"):
+        coingecko.fetch_price_data(['bitcoin'], ['aud'])
+
+def test_coin_list_is_fetched_once(fake_api, monkeypatch):
+    assert coingecko.get_coin_symbol('ripple') == 'XRP'
+    assert coingecko.get_coin_symbol('coin-5') == 'C5'
+    assert coingecko.get_coin_symbol('not-a-coin') is None
+
+    # A new process reads the cache file rather than the API
+    monkeypatch.setattr(coingecko, '_coin_dict', None)
+    assert coingecko.get_coin_symbol('bitcoin') == 'BTC'
+    assert fake_api.request_paths == ['/api/v3/coins/list']
+
+def test_fetch_market_chart(fake_api):
+    fake_api.market_chart_points = 12
+    prices = coingecko.fetch_market_chart('bitcoin', 'USD', 2)
+
+    assert len(prices) == 24
+    assert prices[0][0] < prices[-1][0]
+    assert prices[0][1] == generate_price('bitcoin', 'usd')
+
+def test_tool_end_to_end(fake_api, capsys):
+    from portfolio import main
+    main([os.path.join(os.path.dirname(__file__), 'config', 'portfolio_valid.json')])
+    output = capsys.readouterr().out
+
+    assert re.search(r"\|\s*BTC\s*\|\s*3\s*\|", output)
+    assert re.search(r"\|\s*ETH\s*\|\s*5\s*\|", output)
+    assert sorted(fake_api.request_paths) == ['/api/v3/coins/list', '/api/v3/simple/price']
+
+def test_refresh_is_conditional(fake_api):
+    coingecko.fetch_coin_list()
+    assert not coingecko.refresh_coin_list()
+
+    fake_api.set_coins(fake_api.coins[1:] + [{'id': 'new-coin', 'symbol': 'new', 'name': 'New Coin'}])
+    changes = coingecko.refresh_coin_list()
+
+    assert changes.added == ['new-coin']
+    assert changes.removed == ['bitcoin']
+    assert str(changes) == "1 added, 1 removed, 0 changed"
+    assert coingecko.get_coin_symbol('new-coin') == 'NEW'
+    # Only the first and last requests downloaded the list
+    assert fake_api.request_paths == ['/api/v3/coins/list'] * 3
+
+def test_diff_coin_lists():
+    old = {'bitcoin': {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'}, 'ethereum': {'id': 'ethereum', 'symbol': 'eth', 'name': 'Ethereum'}}
+    new = {'ethereum': {'id': 'ethereum', 'symbol': 'eth', 'name': 'Ether'}, 'ripple': {'id': 'ripple', 'symbol': 'xrp', 'name': 'XRP'}}
+    changes = coingecko.diff_coin_lists(old, new)
+
+    assert (changes.added, changes.removed, changes.changed) == (['ripple'], ['bitcoin'], ['ethereum'])
+    assert not coingecko.diff_coin_lists(old, dict(old))
+
+def test_refresh_if_modified_since(fake_api, monkeypatch):
+    coingecko.fetch_coin_list()
+    # Servers that don't send an ETag can still answer conditional requests by date
+    monkeypatch.setattr(coingecko, '_coin_list_validators', {'last_modified': coingecko._coin_list_validators['last_modified']})
+    assert not coingecko.refresh_coin_list()
+
+    monkeypatch.setattr(coingecko, '_coin_list_validators', {'last_modified': "Thu, 01 Jan 2015 00:00:00 GMT"})
+    coingecko.refresh_coin_list()
+    assert 'etag' in coingecko._coin_list_validators
+
+def test_expired_list_is_refreshed_in_background(fake_api, monkeypatch):
+    coingecko.fetch_coin_list()
+    expired = time.time() - coingecko.CACHE_EXPIRY - 1
+    with open(coingecko.CACHE_FILENAME, 'r') as file:
+        cached_data = json.load(file)
+    cached_data['timestamp'] = expired
+    with open(coingecko.CACHE_FILENAME, 'w') as file:
+        json.dump(cached_data, file)
+
+    # A new process uses the expired list straight away while it is checked for changes
+    monkeypatch.setattr(coingecko, '_coin_dict', None)
+    monkeypatch.setattr(coingecko, '_coin_list_attempted', 0)
+    fake_api.latency = 0.2
+    assert coingecko.get_coin_symbol('ripple') == 'XRP'
+    assert coingecko._coin_dict_timestamp == expired
+    coingecko._refresh_thread.join()
+
+    assert coingecko._coin_dict_timestamp > expired
+    # The list hadn't changed, so it isn't written again but the next process sees it was confirmed
+    with open(coingecko.CACHE_FILENAME, 'r') as file:
+        assert json.load(file)['timestamp'] == expired
+    monkeypatch.setattr(coingecko, '_coin_dict', None)
+    coingecko.fetch_coin_list()
+    assert coingecko._coin_dict_timestamp > expired
+
+def test_unknown_id_refreshes_list(fake_api, monkeypatch):
+    coingecko.fetch_coin_list()
+    fake_api.set_coins(fake_api.coins + [{'id': 'new-coin', 'symbol': 'new', 'name': 'New Coin'}])
+
+    # The list was checked recently, so an unknown ID doesn't refresh it
+    assert coingecko.get_coin_symbol('new-coin') is None
+    assert fake_api.request_count == 1
+
+    monkeypatch.setattr(coingecko, '_coin_dict_timestamp', time.time() - coingecko.MIN_REFRESH_INTERVAL)
+    monkeypatch.setattr(coingecko, '_coin_list_attempted', 0)
+    assert coingecko.get_coin_symbol('new-coin') == 'NEW'
+    assert coingecko.get_coin_symbol('not-a-coin') is None
+    assert fake_api.request_count == 2
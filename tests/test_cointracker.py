@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import pytest
+import coingecko
+from cointracker import main, parse_config_entry
+
+def config_path(name):
+    return os.path.join(os.path.dirname(__file__), 'config', name)
+
+def test_subcommand_runs_tool(base_setup):
+    mock_stdout = base_setup('portfolio_valid.json')
+    main(['portfolio', config_path('portfolio_valid.json')])
+    output = mock_stdout.getvalue()
+
+    assert re.search(r"\|\s*BTC\s*\|\s*3\s*\|\s*92\.31%", output)
+
+def test_subcommand_passes_options(base_setup):
+    mock_stdout = base_setup('fiatpurchase_valid.json')
+    main(['fiatpurchase', config_path('fiatpurchase_valid.json'), '--precise'])
+
+    assert "Unit Price" in mock_stdout.getvalue()
+
+def test_run_all_fetches_prices_once(base_setup):
+    mock_stdout = base_setup('portfolio_valid.json')
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run-all', config_path('portfolio_valid.json'), config_path('fiatpurchase_valid.json')])
+    output = mock_stdout.getvalue()
+
+    assert exit_info.value.code == 0
+    assert coingecko.fetch_price_data.call_count == 1
+    assert re.search(r"\|\s*BTC\s*\|\s*3\s*\|\s*92\.31%", output)
+    assert "Unit Price" in output
+
+def test_run_all_requests_change_only_when_needed(base_setup):
+    base_setup('fiatpurchase_valid.json')
+    with pytest.raises(SystemExit):
+        main(['run-all', config_path('fiatpurchase_valid.json')])
+    assert coingecko.fetch_price_data.call_args.args[2] is False
+
+    with pytest.raises(SystemExit):
+        main(['run-all', config_path('fiatpurchase_valid.json'), config_path('portfolio_valid.json')])
+    assert coingecko.fetch_price_data.call_args.args[2] is True
+
+def test_run_all_continues_after_failure(base_setup, capsys):
+    mock_stdout = base_setup('portfolio_valid.json')
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run-all', config_path('portfolio_empty.json'), config_path('fiatpurchase_valid.json')])
+
+    assert exit_info.value.code == 1
+    assert "Unit Price" in mock_stdout.getvalue()
+    assert "Error: The portfolio holdings are empty in the supplied config." in capsys.readouterr().err
+
+def test_run_all_unknown_coin_fails_only_its_config(base_setup, capsys, tmp_path):
+    mock_stdout = base_setup('portfolio_valid.json')
+    unknown_coin_config = tmp_path / 'fiatpurchase_unknown.json'
+    unknown_coin_config.write_text(json.dumps({'purchases': [{'coinId': 'bitcoinn', 'unitAmount': 1, 'currency': 'AUD'}]}))
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run-all', str(unknown_coin_config), config_path('portfolio_valid.json')])
+
+    assert exit_info.value.code == 1
+    assert coingecko.fetch_price_data.call_args.args[3] is True
+    assert re.search(r"\|\s*BTC\s*\|\s*3\s*\|\s*92\.31%", mock_stdout.getvalue())
+    assert "Error: No prices found for bitcoinn." in capsys.readouterr().err
+
+def test_parse_config_entry():
+    assert parse_config_entry('config/pricepercentalert.json') == ('pricepercentalert', 'config/pricepercentalert.json')
+    assert parse_config_entry('pricealert:config/my_alerts.json') == ('pricealert', 'config/my_alerts.json')
+
+    with pytest.raises(ValueError):
+        parse_config_entry('config/my_alerts.json')
+
+def test_run_all_interval_exports_metrics(base_setup, mocker, tmp_path):
+    base_setup('portfolio_valid.json')
+    metrics_file = tmp_path / 'cointracker.prom'
+    # Stop the loop after the second run
+    sleep = mocker.patch('cointracker.time.sleep', side_effect=[None, KeyboardInterrupt])
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run-all', config_path('portfolio_valid.json'), config_path('fiatpurchase_valid.json'), '--interval', '60', '--metrics-file', str(metrics_file)])
+
+    assert exit_info.value.code == 0
+    assert sleep.call_count == 2
+    assert coingecko.fetch_price_data.call_count == 2
+    assert 'cointracker_runs_total{tool="portfolio",result="ok"}' in metrics_file.read_text()
+
+def test_refresh_coins(mocker, capsys):
+    changes = coingecko.CoinListChanges(added=['new-coin'])
+    refresh = mocker.patch('coingecko.refresh_coin_list', return_value=changes)
+    main(['refresh-coins', '--force'])
+
+    refresh.assert_called_once_with(force=True)
+    assert "Coin list refreshed: 1 added, 0 removed, 0 changed." in capsys.readouterr().out
+
+def test_import(mocker):
+    import_main = mocker.patch('portfolioimport.main')
+    main(['import', 'config/portfolio.json', 'trades.csv', '--map', 'ETH=ethereum'])
+    import_main.assert_called_once_with(argv=['config/portfolio.json', 'trades.csv', '--map', 'ETH=ethereum'])
+
+def test_watch(base_setup, mocker, capsys):
+    mock_stdout = base_setup('optimalpurchase_show_all.json')
+    # Stop after the first check, when every coin is due
+    sleep = mocker.patch('scheduler.time.sleep', side_effect=KeyboardInterrupt)
+    with pytest.raises(SystemExit) as exit_info:
+        main(['watch', config_path('optimalpurchase_show_all.json'), config_path('pricealert_malformed.json')])
+
+    assert exit_info.value.code == 1
+    assert sleep.call_count == 1
+    assert coingecko.fetch_price_data.call_count == 1
+    assert "Target Unit Price" in mock_stdout.getvalue()
+    assert "Configuration file validation failed" in capsys.readouterr().err
+
+def test_watch_unknown_coin(base_setup, mocker, tmp_path):
+    mock_stdout = base_setup('optimalpurchase_show_all.json')
+    unknown_coin_config = tmp_path / 'optimalpurchase_unknown.json'
+    unknown_coin_config.write_text(json.dumps({'purchases': [{'coinId': 'bitcoinn', 'buyUnits': 1, 'price': 1, 'currency': 'AUD'}], 'sendEmail': False}))
+    mocker.patch('scheduler.time.sleep', side_effect=KeyboardInterrupt)
+    with pytest.raises(SystemExit):
+        main(['watch', config_path('optimalpurchase_show_all.json'), str(unknown_coin_config)])
+
+    # The coin the API didn't return doesn't stop the other config running
+    assert coingecko.fetch_price_data.call_args.args[3] is True
+    assert "Target Unit Price" in mock_stdout.getvalue()
+
+def test_watch_unsupported_tool(capsys):
+    with pytest.raises(SystemExit):
+        main(['watch', config_path('portfolio_valid.json')])
+
+    assert "portfolio" in capsys.readouterr().err
+
+def test_every_module_is_packaged():
+    # The cointracker entry point only finds the top-level modules listed in pyproject.toml once installed
+    root = os.path.join(os.path.dirname(__file__), '..')
+    with open(os.path.join(root, 'pyproject.toml')) as file:
+        packaged = set(re.findall(r'^\s*"(\w+)",$', re.search(r'py-modules = \[(.*?)\]', file.read(), re.S).group(1), re.M))
+    modules = {name[:-3] for name in os.listdir(root) if name.endswith('.py')}
+    assert modules - packaged == set()
@@ -0,0 +1,112 @@
+import json
+import os
+import pytest
+import configloader
+from configloader import load_config, ConfigError, ConfigWatcher
+
+schema = {
+    "type": "object",
+    "properties": {
+        "coins": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["coins"]
+}
+
+def write_config(path, config):
+    with open(path, 'w') as file:
+        json.dump(config, file)
+
+def test_unchanged_file_is_not_parsed_again(tmp_path, mocker):
+    path = tmp_path / 'config.json'
+    write_config(path, {'coins': ['bitcoin']})
+    parse = mocker.spy(configloader, '_parse_and_validate')
+
+    first = load_config(str(path), schema)
+    second = load_config(str(path), schema)
+
+    assert first == second == {'coins': ['bitcoin']}
+    assert parse.call_count == 1
+
+def test_disk_cache_is_used_by_later_runs(tmp_path, mocker):
+    path = tmp_path / 'config.json'
+    write_config(path, {'coins': ['bitcoin']})
+    load_config(str(path), schema)
+
+    # A new process starts with an empty memory cache
+    configloader.clear_cache()
+    parse = mocker.spy(configloader, '_parse_and_validate')
+
+    assert load_config(str(path), schema) == {'coins': ['bitcoin']}
+    assert parse.call_count == 0
+
+def test_unreadable_disk_cache_is_ignored(tmp_path):
+    path = tmp_path / 'config.json'
+    write_config(path, {'coins': ['bitcoin']})
+    load_config(str(path), schema)
+    configloader.clear_cache()
+
+    # The cache is plain JSON, so a file that isn't, such as a pickle, is never loaded
+    cache_files = os.listdir(configloader.CACHE_DIRECTORY)
+    assert [name[-5:] for name in cache_files] == ['.json']
+    with open(os.path.join(configloader.CACHE_DIRECTORY, cache_files[0]), 'wb') as file:
+        file.write(b"cos\nsystem\n(S'exit 1'\ntR.")
+
+    assert load_config(str(path), schema) == {'coins': ['bitcoin']}
+
+def test_disk_cache_keeps_no_config(tmp_path):
+    path = tmp_path / 'config.json'
+    write_config(path, {'coins': ['bitcoin'], 'smtp': {'password': 'secret'}})
+    load_config(str(path), schema)
+    old_path = tmp_path / 'old.json'
+    write_config(old_path, {'coins': []})
+    load_config(str(old_path), schema)
+    assert len(os.listdir(configloader.CACHE_DIRECTORY)) == 2
+
+    for name in os.listdir(configloader.CACHE_DIRECTORY):
+        with open(os.path.join(configloader.CACHE_DIRECTORY, name)) as file:
+            assert 'secret' not in file.read()
+
+    # A later miss removes the stamps of deleted configs
+    os.remove(old_path)
+    write_config(path, {'coins': ['ethereum']})
+    os.utime(path, ns=(0, 0))
+    assert load_config(str(path), schema)['coins'] == ['ethereum']
+    assert len(os.listdir(configloader.CACHE_DIRECTORY)) == 1
+
+def test_changed_file_is_reloaded(tmp_path):
+    path = tmp_path / 'config.json'
+    write_config(path, {'coins': ['bitcoin']})
+    load_config(str(path), schema)
+
+    write_config(path, {'coins': ['bitcoin', 'ethereum']})
+    os.utime(path, ns=(0, 0))
+
+    assert load_config(str(path), schema) == {'coins': ['bitcoin', 'ethereum']}
+
+def test_defaults_and_errors(tmp_path):
+    path = tmp_path / 'config.json'
+    write_config(path, {})
+    assert load_config(str(path), schema, {'coins': []}) == {'coins': []}
+
+    with pytest.raises(ConfigError, match="validation failed at '': 'coins' is a required property"):
+        load_config(str(path), schema)
+
+    with pytest.raises(ConfigError, match="does not exist"):
+        load_config(str(tmp_path / 'missing.json'), schema)
+
+def test_watcher_keeps_last_good_config(tmp_path):
+    path = tmp_path / 'config.json'
+    write_config(path, {'coins': ['bitcoin']})
+    watcher = ConfigWatcher(str(path), schema)
+    assert not watcher.reload_if_changed()
+
+    write_config(path, {'coins': ['bitcoin', 'ripple']})
+    os.utime(path, ns=(1, 1))
+    assert watcher.reload_if_changed()
+    assert watcher.config == {'coins': ['bitcoin', 'ripple']}
+
+    write_config(path, {'coins': 'notalist'})
+    os.utime(path, ns=(2, 2))
+    with pytest.raises(ConfigError):
+        watcher.reload_if_changed()
+    assert watcher.config == {'coins': ['bitcoin', 'ripple']}
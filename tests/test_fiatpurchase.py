@@ -26,3 +26,19 @@ def test_main_output(base_setup):
 def test_empty_config(base_setup, check_configuration_errors):
     base_setup('fiatpurchase_empty.json')
     check_configuration_errors(main, "No purchases found")
+
+def test_fractional_amounts(base_setup):
+    mock_stdout = base_setup('fiatpurchase_fractional.json')
+    main()
+    output = mock_stdout.getvalue()
+
+    assert re.search(r"\|\s*AUD\s*\|\s*\$50,000.00\s*\|\s*BTC\s*\|\s*0.5000\s*\|", output), "Fractional unit amount was truncated"
+    assert re.search(r"\|\s*AUD\s*\|\s*\$100.50\s*\|\s*XRP\s*\|\s*134.0000\s*\|", output), "Fractional currency amount was truncated"
+
+def test_precise_mode(base_setup):
+    mock_stdout = base_setup('fiatpurchase_fractional.json', '--precise')
+    main()
+    output = mock_stdout.getvalue()
+
+    assert re.search(r"\|\s*AUD\s*\|\s*\$50,000.00\s*\|\s*BTC\s*\|\s*0.5000\s*\|\s*\$100,000.00\s*\|", output)
+    assert re.search(r"\|\s*AUD\s*\|\s*\$100.50\s*\|\s*XRP\s*\|\s*134.0000\s*\|\s*\$0.7500\s*\|", output)
@@ -0,0 +1,45 @@
+import json
+import os
+from indicatoralert import main, load, run
+from indicators import condition_key, create_condition
+
+def test_main_output(base_setup, tmp_path):
+    mock_stdout = base_setup('indicatoralert_valid.json')
+
+    # Seed the streaming state with a quiet market so the mocked price of $100,000 is a breakout
+    with open(os.path.join(os.path.dirname(__file__), 'config', 'indicatoralert_valid.json')) as file:
+        conditions = json.load(file)['coins'][0]['conditions']
+    state = {}
+    for condition_config in conditions:
+        condition = create_condition(condition_config)
+        for index in range(30):
+            condition.update(90000 + (index % 3) * 10)
+        state[condition_key('bitcoin', 'aud', condition_config)] = condition.to_dict()
+    with open(tmp_path / 'indicator_state.json', 'w') as file:
+        json.dump(state, file)
+
+    main(tmp_path)
+    output = mock_stdout.getvalue()
+
+    assert "BTC is now AUD $100,000.00" in output
+    assert "RSI(14) is" in output
+    assert "Price broke above the Bollinger band" in output
+
+def test_warming_up_does_not_alert(base_setup, tmp_path):
+    mock_stdout = base_setup('indicatoralert_valid.json')
+    main(tmp_path)
+
+    assert mock_stdout.getvalue() == ""
+    assert (tmp_path / 'indicator_state.json').exists(), "Indicator state was not saved"
+
+def test_missing_coin_keeps_state(base_setup, tmp_path):
+    base_setup('indicatoralert_valid.json')
+    main(tmp_path)
+    with open(tmp_path / 'indicator_state.json') as file:
+        state = json.load(file)
+
+    # A --resilient fetch that leaves out bitcoin doesn't reset its indicators
+    config = load(os.path.join(os.path.dirname(__file__), 'config', 'indicatoralert_valid.json'))
+    run(config, {'ethereum': {'aud': 5000}}, None, tmp_path)
+    with open(tmp_path / 'indicator_state.json') as file:
+        assert json.load(file) == state
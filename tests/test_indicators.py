@@ -0,0 +1,53 @@
+import statistics
+import pytest
+from indicators import EMA, RSI, BollingerBands, EmaCrossCondition, create_condition
+
+prices = [100, 102, 101, 105, 107, 104, 103, 108, 110, 109, 111, 115, 113, 112, 116, 118, 117, 121, 119, 122, 125, 123]
+
+def test_ema_matches_recursive_definition():
+    ema = EMA(5)
+    expected = ema.update(prices[0])
+    assert expected == prices[0]
+    for price in prices[1:]:
+        expected = expected + (2 / 6) * (price - expected)
+        assert ema.update(price) == pytest.approx(expected)
+
+def test_rsi_all_gains_is_100():
+    rsi = RSI(3)
+    for price in [1, 2, 3, 4, 5]:
+        value = rsi.update(price)
+    assert value == 100
+
+def test_rsi_balanced_moves_is_50():
+    rsi = RSI(4)
+    for price in [10, 11, 10, 11, 10]:
+        value = rsi.update(price)
+    assert value == pytest.approx(50)
+
+def test_bollinger_matches_full_recompute():
+    bands = BollingerBands(period=5, std_dev=2)
+    for index, price in enumerate(prices):
+        result = bands.update(price)
+        if index < 4:
+            assert result is None
+            continue
+        window = prices[index - 4:index + 1]
+        mean = statistics.fmean(window)
+        width = 2 * statistics.pstdev(window)
+        assert result == pytest.approx((mean - width, mean, mean + width))
+
+def test_ema_cross_fires_once_per_cross():
+    condition = EmaCrossCondition({'fast': 2, 'slow': 4})
+    messages = [condition.update(price) for price in [10, 10, 10, 10, 9, 8, 7, 8, 10, 12, 13]]
+    fired = [message for message in messages if message]
+    assert fired == ["EMA(2) crossed above EMA(4)"]
+
+def test_state_round_trip():
+    config = {'type': 'bollinger', 'period': 5}
+    condition = create_condition(config)
+    for price in prices[:10]:
+        condition.update(price)
+
+    restored = create_condition(config, condition.to_dict())
+    for price in prices[10:]:
+        assert restored.update(price) == condition.update(price)
@@ -0,0 +1,110 @@
+import pytest
+import requests
+import coingecko
+import metrics
+from fake_coingecko import FakeCoinGecko
+from pricealert import main
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.REGISTRY.clear()
+    yield
+    metrics.REGISTRY.clear()
+
+def test_render():
+    registry = metrics.Registry()
+    requests_total = registry.register(metrics.Counter('requests_total', "Requests.", ['status']))
+    duration = registry.register(metrics.Histogram('duration_seconds', "Durations.", buckets=[0.1, 1]))
+    coins = registry.register(metrics.Gauge('coins', "Coins."))
+
+    requests_total.inc(status=200)
+    requests_total.inc(2, status='say "hi"\n')
+    for value in [0.05, 0.1, 0.5, 2]:
+        duration.observe(value)
+    coins.set(3)
+
+    assert registry.render() == """# HELP requests_total Requests.
+# TYPE requests_total counter
+requests_total{status="200"} 1
+requests_total{status="say \\"hi\\"\\n"} 2
+# HELP duration_seconds Durations.
+# TYPE duration_seconds histogram
+duration_seconds_bucket{le="0.1"} 2
+duration_seconds_bucket{le="1"} 3
+duration_seconds_bucket{le="+Inf"} 4
+duration_seconds_sum 2.65
+duration_seconds_count 4
+# HELP coins Coins.
+# TYPE coins gauge
+coins 3
+"""
+
+def test_labels_must_match():
+    counter = metrics.Counter('requests_total', "Requests.", ['status'])
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(status=200, endpoint='/coins/list')
+
+def test_duplicate_name():
+    registry = metrics.Registry()
+    registry.register(metrics.Counter('requests_total', "Requests."))
+    with pytest.raises(ValueError):
+        registry.register(metrics.Counter('requests_total', "Requests again."))
+
+def test_track():
+    counter = metrics.Counter('runs_total', "Runs.", ['result'])
+    histogram = metrics.Histogram('run_seconds', "Run time.", buckets=[1])
+
+    with metrics.track(counter, histogram):
+        pass
+    with pytest.raises(SystemExit):
+        with metrics.track(counter, histogram):
+            raise SystemExit("Error: failed")
+
+    assert counter.get(result='ok') == 1
+    assert counter.get(result='error') == 1
+    assert histogram.get()[1] == 2
+
+def test_http_server():
+    metrics.COINS_TRACKED.set(5)
+    server = metrics.start_http_server(0)
+    try:
+        host, port = server.server_address[:2]
+        response = requests.get(f"http://{host}:{port}/metrics", timeout=5)
+        assert response.status_code == 200
+        assert "cointracker_coins_tracked 5" in response.text
+        assert requests.get(f"http://{host}:{port}/", timeout=5).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_api_metrics(monkeypatch, tmp_path):
+    monkeypatch.setattr(coingecko, 'CACHE_FILENAME', str(tmp_path / 'coin_list_cache.json'))
+    monkeypatch.setattr(coingecko, 'CHECKED_FILENAME', str(tmp_path / 'coin_list_checked.json'))
+    monkeypatch.setattr(coingecko, '_coin_dict', None)
+    with FakeCoinGecko() as server:
+        monkeypatch.setenv('COINGECKO_API_URL', server.url)
+        coingecko.fetch_market_chart('bitcoin', 'aud', 1)
+        coingecko.get_coin_symbol('bitcoin')
+        coingecko.get_coin_symbol('ethereum')
+        server.rate_limit_next = 1
+        with pytest.raises(requests.HTTPError):
+            coingecko.fetch_price_data(['bitcoin'], ['aud'])
+
+    assert metrics.API_REQUESTS.get(endpoint='/coins/{id}/market_chart', status=200) == 1
+    assert metrics.API_REQUESTS.get(endpoint='/simple/price', status=429) == 1
+    assert metrics.API_DURATION.get(endpoint='/coins/list')[1] == 1
+    assert metrics.CACHE_LOOKUPS.get(cache='coin_list', result='miss') == 1
+    assert metrics.CACHE_LOOKUPS.get(cache='coin_list', result='hit') == 1
+
+def test_tool_metrics_file(base_setup, tmp_path):
+    metrics_file = tmp_path / 'pricealert.prom'
+    base_setup('pricealert_rules.json', '--metrics-file', str(metrics_file))
+    main(tmp_path)
+
+    text = metrics_file.read_text()
+    assert 'cointracker_runs_total{tool="pricealert",result="ok"} 1' in text
+    assert 'cointracker_alerts_fired_total{tool="pricealert",kind="rule"} 1' in text
+    assert 'cointracker_coins_tracked ' in text
+    assert not list(tmp_path.glob('*.tmp'))
@@ -29,4 +29,41 @@ def test_only_optimal_purchases_show(base_setup, tmp_path):
     output = mock_stdout.getvalue()
 
     assert not re.search(btc_pattern, output), "BTC data row found when it should be hidden as target price is less than the current price"
-    assert re.search(eth_pattern, output), "ETH data row not found or incorrect format"
\ No newline at end of file
+    assert re.search(eth_pattern, output), "ETH data row not found or incorrect format"
+
+def test_rule_alert_without_optimal_purchases(base_setup):
+    mock_stdout = base_setup('optimalpurchase_rules.json')
+    main()
+    output = mock_stdout.getvalue()
+
+    assert not re.search(btc_pattern, output), "BTC data row found when it should be hidden as target price is less than the current price"
+    assert "Rule matched: price(ethereum,btc) < 0.05" in output
+
+def test_csv_format(base_setup):
+    mock_stdout = base_setup('optimalpurchase_show_all.json', '--format', 'csv')
+    main()
+    lines = mock_stdout.getvalue().splitlines()
+
+    assert lines[0] == "coin_id,symbol,units,currency,current_price,target_price,unit_price,target_unit_price,price_diff_percent,optimal"
+    assert lines[1].startswith("bitcoin,BTC,1,AUD,100000.0,90000.0,100000.0,90000.0,11.11")
+    assert lines[1].endswith(",False")
+    assert lines[2].startswith("ethereum,ETH,3,AUD,15000.0,18000.0,5000.0,6000.0,-16.66")
+    assert lines[2].endswith(",True")
+    assert len(lines) == 3
+
+def test_candidate_purchases_use_index_on_later_runs():
+    from optimalpurchase import get_candidate_purchases
+    purchases = [
+        {"coinId": "bitcoin", "buyUnits": 2, "price": 210000, "currency": "AUD"},
+        {"coinId": "bitcoin", "buyUnits": 1, "price": 90000, "currency": "AUD"},
+        {"coinId": "ethereum", "buyUnits": 3, "price": 18000, "currency": "AUD"},
+        {"coinId": "bitcoin", "buyUnits": 0.5, "price": 50000.004, "currency": "AUD"}
+    ]
+    config = {"showOptimalOnly": True, "purchases": purchases}
+    prices = {"bitcoin": {"aud": 100000}, "ethereum": {"aud": 5000}}
+
+    # The first run checks every purchase
+    assert get_candidate_purchases(config, prices) == purchases
+    # Later runs only return purchases that could be optimal, including ones within rounding of their target
+    assert get_candidate_purchases(config, prices) == [purchases[0], purchases[2], purchases[3]]
+    assert get_candidate_purchases(config, {"bitcoin": {"aud": 80000}, "ethereum": {"aud": 7000}}) == [purchases[0], purchases[1], purchases[3]]
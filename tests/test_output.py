@@ -0,0 +1,56 @@
+import io
+from decimal import Decimal
+import pytest
+from output import render_table, write_records
+
+fields = ['coin_id', 'price', 'optimal']
+
+def records():
+    yield {'coin_id': 'bitcoin', 'price': 100000, 'optimal': True}
+    yield {'coin_id': 'ethereum', 'price': Decimal("5000.25"), 'optimal': False}
+
+def test_render_table():
+    table = render_table(records(), [("Coin", lambda record: record['coin_id']), ("Price", lambda record: f"{record['price']:,}")])
+
+    assert "| bitcoin  | 100,000  |" in table
+    assert "| ethereum | 5,000.25 |" in table
+    assert render_table([], [("Coin", lambda record: record['coin_id'])]) == ""
+
+def test_jsonl():
+    stream = io.StringIO()
+    count = write_records(records(), fields, 'jsonl', stream)
+
+    assert count == 2
+    assert stream.getvalue() == '{"coin_id": "bitcoin", "price": 100000, "optimal": true}\n{"coin_id": "ethereum", "price": "5000.25", "optimal": false}\n'
+
+def test_csv():
+    stream = io.StringIO()
+    write_records(records(), fields, 'csv', stream)
+
+    assert stream.getvalue() == "coin_id,price,optimal\nbitcoin,100000,True\nethereum,5000.25,False\n"
+
+def test_streams_without_buffering():
+    stream = io.StringIO()
+
+    def generate():
+        for index in range(3):
+            yield {'coin_id': f"coin-{index}", 'price': index, 'optimal': False}
+            # Each record is written before the next one is produced
+            assert stream.getvalue().count("\n") == index + 1
+
+    write_records(generate(), fields, 'jsonl', stream)
+
+def test_arrow(mocker):
+    pa = pytest.importorskip('pyarrow')
+    mocker.patch('output.ARROW_BATCH_SIZE', 1)
+    stream = io.BytesIO()
+    write_records(records(), fields, 'arrow', stream)
+
+    reader = pa.ipc.open_stream(stream.getvalue())
+    batches = list(reader)
+    table = pa.Table.from_batches(batches)
+
+    assert len(batches) == 2
+    assert table.column('coin_id').to_pylist() == ['bitcoin', 'ethereum']
+    assert table.column('price').to_pylist() == [100000.0, 5000.25]
+    assert table.column('optimal').to_pylist() == [True, False]
@@ -1,4 +1,6 @@
 from portfolio import main
+import json
+import pytest
 import re
 
 def test_main_output(base_setup):
@@ -44,4 +46,78 @@ def test_malformed_config(base_setup, check_configuration_errors):
 
 def test_malformed_currency_config(base_setup, check_configuration_errors):
     base_setup('portfolio_malformed_currency.json')
-    check_configuration_errors(main, "No price found for currency 'NOTVALID'")
\ No newline at end of file
+    check_configuration_errors(main, "No price found for currency 'NOTVALID'")
+
+def test_precise_mode(base_setup):
+    mock_stdout = base_setup('portfolio_valid.json', '--precise')
+    main()
+    output = mock_stdout.getvalue()
+
+    summary_row_pattern = r"\|\s*550\.00%\s*\|\s*\$325,000\.00\s*\|\s*\$275,000\.00\s*\|\s*\$32,208\.13\s*\|\s*9\.91%\s*\|"
+    btc_pattern = r"\|\s*BTC\s*\|\s*3\s*\|\s*92\.31%\s*\|\s*\$300,000\.00\s*\|\s*\$100,000\.00\s*\|\s*10\.78%\s*\|"
+
+    assert re.search(summary_row_pattern, output), "Summary row differs between precise and float mode"
+    assert re.search(btc_pattern, output), "BTC data row differs between precise and float mode"
+
+def test_jsonl_format(base_setup):
+    mock_stdout = base_setup('portfolio_valid.json', '--format', 'jsonl')
+    main()
+    records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+
+    assert [record['coin_id'] for record in records] == ['bitcoin', 'ethereum']
+    assert records[0]['value'] == 300000
+    assert records[0]['allocation_percent'] == pytest.approx(92.3077, abs=1e-4)
+    assert records[1]['change_24h_percent'] == pytest.approx(-0.53, abs=0.01)
+
+def test_jsonl_format_precise(base_setup):
+    mock_stdout = base_setup('portfolio_valid.json', '--format', 'jsonl', '--precise')
+    main()
+    records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+
+    # Decimals are written as strings so they keep their exact value
+    assert records[1]['value'] == "25000.00"
+
+def test_history_report(base_setup, tmp_path):
+    history_file = str(tmp_path / 'history.sqlite')
+    mock_stdout = base_setup('portfolio_valid.json', '--history', history_file)
+    main()
+    main()
+
+    mock_stdout = base_setup('portfolio_valid.json', '--history', history_file, '--report', '--period', 'month')
+    main()
+    output = mock_stdout.getvalue()
+
+    summary_row_pattern = r"\|\s*2\s*\|\s*\$325,000\.00\s*\|\s*\$325,000\.00\s*\|\s*\$0\.0+\s*\|\s*0\.00%\s*\|\s*0\.00%\s*\|"
+    assert re.search(summary_row_pattern, output), "Summary row not found or incorrect format"
+    assert re.search(r"\|\s*Month\s*\|", output)
+
+def test_history_report_missing_file(base_setup, check_configuration_errors, tmp_path):
+    base_setup('portfolio_valid.json', '--history', str(tmp_path / 'missing.sqlite'), '--report')
+    check_configuration_errors(main, "doesn't exist")
+
+def test_report_needs_history(base_setup, check_configuration_errors):
+    base_setup('portfolio_valid.json', '--report')
+    check_configuration_errors(main, "--report needs the --history file")
+
+def test_risk(base_setup, tmp_path):
+    pytest.importorskip('numpy')
+    from portfoliohistory import append_run
+    history_file = str(tmp_path / 'history.sqlite')
+    for day, (bitcoin, ethereum) in enumerate([(100000, 5000), (110000, 5100), (99000, 4900), (101000, 5200), (100000, 5000)]):
+        holdings = [
+            {'coin_id': 'bitcoin', 'units': 3, 'price': bitcoin, 'value': 3 * bitcoin, 'change_24h_percent': 0},
+            {'coin_id': 'ethereum', 'units': 5, 'price': ethereum, 'value': 5 * ethereum, 'change_24h_percent': 0}
+        ]
+        append_run(history_file, 'AUD', 50000, holdings, timestamp=1704067200 + day * 86400)
+
+    mock_stdout = base_setup('portfolio_valid.json', '--history', history_file, '--risk')
+    main()
+    output = mock_stdout.getvalue()
+
+    assert re.search(r"\|\s*\$325,000\.00\s*\|\s*4\s*\|", output), "Summary row not found or incorrect format"
+    assert re.search(r"\|\s*BTC\s*\|\s*92\.31%\s*\|.*\|\s*1\.00\s*\|\s*0\.\d\d\s*\|", output), "BTC row not found or incorrect format"
+
+def test_risk_and_report_are_exclusive(base_setup):
+    base_setup('portfolio_valid.json', '--history', 'history.sqlite', '--risk', '--report')
+    with pytest.raises(SystemExit):
+        main()
@@ -0,0 +1,85 @@
+from contextlib import closing
+import pytest
+from portfoliohistory import append_run, connect, get_max_drawdown, get_period_returns, get_span
+
+DAY = 86400
+START = 1704067200  # 2024-01-01 00:00 UTC, a Monday
+
+def holding(coin_id, units, price):
+    return {'coin_id': coin_id, 'units': units, 'price': price, 'value': units * price, 'change_24h_percent': 0}
+
+def record_values(path, values, step=DAY / 2):
+    for index, value in enumerate(values):
+        append_run(path, 'AUD', 1000, [holding('bitcoin', 1, value)], timestamp=START + index * step)
+
+def test_append_run(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    append_run(path, 'AUD', 1000, [holding('bitcoin', 1, 900), holding('ethereum', 2, 50), holding('bitcoin', 0.5, 900)], timestamp=START)
+    append_run(path, 'AUD', 1000, [holding('ethereum', 2, 60)], timestamp=START + 60)
+
+    with closing(connect(path)) as connection:
+        assert connection.execute("SELECT time, value FROM runs ORDER BY id").fetchall() == [(START, 1450.0), (START + 60, 120.0)]
+        holdings = connection.execute("SELECT run_id, coin_id, units, price FROM holdings JOIN coins ON coins.id = coin ORDER BY run_id, coin_id").fetchall()
+        assert holdings == [(1, 'bitcoin', 1.5, 900.0), (1, 'ethereum', 2.0, 50.0), (2, 'ethereum', 2.0, 60.0)]
+        assert get_span(connection, 'AUD') == (START, START + 60, 2)
+        assert get_span(connection, 'USD') is None
+
+def test_append_run_without_change_or_price(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    no_change = {**holding('bitcoin', 1, 900), 'change_24h_percent': float('nan')}
+    no_price = {**holding('ethereum', 2, float('nan')), 'change_24h_percent': float('nan')}
+    append_run(path, 'AUD', 1000, [no_change, no_price, {**holding('ripple', 10, 1), 'change_24h_percent': 10}], timestamp=START)
+
+    with closing(connect(path)) as connection:
+        assert connection.execute("SELECT value, change_24h FROM runs").fetchall() == [(910.0, 1.0)]
+        assert connection.execute("SELECT coin_id FROM holdings JOIN coins ON coins.id = coin ORDER BY coin_id").fetchall() == [('bitcoin',), ('ripple',)]
+
+def test_period_returns(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    # Two runs a day over three days
+    record_values(path, [100, 110, 121, 99, 88, 132])
+
+    with closing(connect(path)) as connection:
+        days = get_period_returns(connection, 'AUD', 'day')
+        weeks = get_period_returns(connection, 'AUD', 'week')
+
+    assert [(day['period'], day['open'], day['close'], day['runs']) for day in days] == [
+        ('2024-01-01', 100, 110, 2), ('2024-01-02', 121, 99, 2), ('2024-01-03', 88, 132, 2)
+    ]
+    # The first day is from its first run, later days from the close of the day before
+    assert [day['return_percent'] for day in days] == pytest.approx([10, -10, 100 / 3])
+    assert [(week['period'], week['return_percent']) for week in weeks] == [('2024-W01', pytest.approx(32))]
+
+def test_returns_leave_out_money_put_in(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    # 100 more is invested before the third run and 50 taken out before the last
+    for index, (investment, value) in enumerate([(1000, 100), (1000, 110), (1100, 210), (1100, 231), (1050, 181)]):
+        append_run(path, 'AUD', investment, [holding('bitcoin', 1, value)], timestamp=START + index * DAY / 2)
+
+    with closing(connect(path)) as connection:
+        days = get_period_returns(connection, 'AUD', 'day')
+        drawdown = get_max_drawdown(connection, 'AUD')
+
+    assert [day['return_percent'] for day in days] == pytest.approx([10, 10, 0])
+    assert [day['invested'] for day in days] == [0, 100, -50]
+    # The value fell from 231 to 181, but only because money was taken out
+    assert drawdown['drawdown_percent'] == pytest.approx(0)
+
+def test_max_drawdown(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    record_values(path, [100, 120, 90, 150, 60, 80, 200])
+
+    with closing(connect(path)) as connection:
+        drawdown = get_max_drawdown(connection, 'AUD')
+        assert get_max_drawdown(connection, 'USD') is None
+
+    assert drawdown['drawdown_percent'] == pytest.approx(-60)
+    assert (drawdown['peak_value'], drawdown['trough_value']) == (150, 60)
+    assert (drawdown['peak_time'], drawdown['trough_time']) == (START + 3 * DAY / 2, START + 4 * DAY / 2)
+
+def test_max_drawdown_rising(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    record_values(path, [100, 110, 120])
+
+    with closing(connect(path)) as connection:
+        assert get_max_drawdown(connection, 'AUD')['drawdown_percent'] == 0
@@ -0,0 +1,145 @@
+import json
+import pytest
+import portfolioimport
+from portfolioimport import SymbolResolver, find_columns, parse_amount, parse_pair
+
+COIN_LIST = {
+    'bitcoin': {'symbol': 'btc', 'name': 'Bitcoin'},
+    'ethereum': {'symbol': 'eth', 'name': 'Ethereum'},
+    'ethereum-wormhole': {'symbol': 'eth', 'name': 'Ethereum (Wormhole)'},
+    'ripple': {'symbol': 'xrp', 'name': 'XRP'}
+}
+
+@pytest.fixture
+def run_import(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(portfolioimport.coingecko, 'fetch_coin_list', lambda: COIN_LIST)
+    config_file = tmp_path / 'portfolio.json'
+    checkpoint_file = tmp_path / 'checkpoint.json'
+
+    def run(*args):
+        portfolioimport.main([str(config_file), *[str(arg) for arg in args], '--checkpoint', str(checkpoint_file)])
+        with open(config_file) as file:
+            return json.load(file), capsys.readouterr()
+    return run
+
+def write_csv(path, rows, mode='w'):
+    with open(path, mode, newline='') as file:
+        file.write(''.join(f"{row}\r\n" for row in rows))
+
+def test_parsing():
+    assert parse_amount('1.5') == 1.5
+    assert parse_amount('$1,234.50') == 1234.5
+    with pytest.raises(ValueError):
+        parse_amount('n/a')
+    assert parse_pair('BTC/AUD', 'AUD') == ('BTC', 'AUD')
+    assert parse_pair('eth-usdt', 'AUD') == ('eth', 'usdt')
+    assert parse_pair('XRPAUD', 'AUD') == ('XRP', 'AUD')
+    assert parse_pair('XRP', 'AUD') == ('XRP', None)
+    assert find_columns(['Date', 'Pair', 'Side', 'Amount', 'Total', 'Subtotal'], {}) == {'pair': 1, 'side': 2, 'quantity': 3, 'total': 5}
+    assert find_columns(['Kind', 'Asset', 'Qty'], {'side': 'KIND'})['side'] == 0
+    with pytest.raises(ValueError, match='quantity'):
+        find_columns(['Side', 'Asset'], {})
+
+def test_symbol_resolution():
+    resolver = SymbolResolver(COIN_LIST, {'XRP': 'ripple'}, ['ethereum'])
+    assert resolver.resolve('btc') == 'bitcoin'
+    assert resolver.resolve('ETH') == 'ethereum'  # Shared, but the portfolio already holds ethereum
+    assert resolver.resolve('xrp') == 'ripple'
+    assert resolver.resolve('bitcoin') == 'bitcoin'
+    assert resolver.resolve('doge') is None
+    assert resolver.chosen == {'eth': 'ethereum'}
+    assert resolver.unresolved == {'doge': []}
+
+def test_average_cost(tmp_path, run_import):
+    csv_file = tmp_path / 'trades.csv'
+    write_csv(csv_file, [
+        '﻿Date,Side,Asset,Quantity,Price,Fee',
+        '2024-01-01,BUY,BTC,2,100,10',
+        '2024-01-02,Deposit,AUD,1000,,',
+        '2024-01-03,Buy,BTC,2,"$1,200.00",0',
+        '2024-01-04,SELL,BTC,1,2000,5',
+        '2024-01-05,Buy,XRP,100,n/a,0',
+        '2024-01-06,Sell,XRP,50,1,0'
+    ])
+
+    config, output = run_import(csv_file)
+
+    # 4 BTC cost 2610, so selling 1 leaves 3 at an average of 652.50
+    assert config['holdings'] == [{'coinId': 'bitcoin', 'units': 3.0}]
+    assert config['investmentAmount'] == 1957.5
+    assert 'Imported 4 trades, skipped 1 other rows (deposit: 1)' in output.out
+    assert '$652.50' in output.out
+    assert 'line 6' in output.err
+    assert 'more than had been bought' in output.err
+
+def test_incremental_import(tmp_path, run_import):
+    csv_file = tmp_path / 'trades.csv'
+    write_csv(csv_file, ['Pair,Type,Amount,Subtotal,Fee,Total', 'BTC/AUD,Buy,1,100,1,101', 'XRP/USD,Buy,2,50,0,50'])
+    config, _ = run_import(csv_file)
+    assert config['holdings'] == [{'coinId': 'bitcoin', 'units': 1.0}, {'coinId': 'ripple', 'units': 2.0}]
+    assert config['investmentAmount'] == 101  # The XRP was bought in USD, so has no cost in AUD
+
+    # Only the new row is read, not the earlier ones again
+    write_csv(csv_file, ['BTC/AUD,Sell,0.5,60,0,60'], mode='a')
+    config, output = run_import(csv_file)
+    assert 'Imported 1 trades.' in output.out
+    assert config['holdings'][0] == {'coinId': 'bitcoin', 'units': 0.5}
+    assert config['investmentAmount'] == 50.5
+
+    config, output = run_import(csv_file, '--full')
+    assert 'Imported 3 trades.' in output.out
+    assert config['investmentAmount'] == 50.5
+
+    # A file rewritten rather than added to can't be imported from where the last import stopped
+    write_csv(csv_file, ['Pair,Type,Amount,Subtotal,Fee,Total', 'BTC/AUD,Buy,9,100,1,101', 'XRP/USD,Buy,2,50,0,50', 'BTC/AUD,Sell,0.5,60,0,60'])
+    with pytest.raises(SystemExit) as e:
+        run_import(csv_file)
+    assert '--full' in str(e.value)
+
+def test_shared_symbol_needs_map(tmp_path, run_import):
+    csv_file = tmp_path / 'trades.csv'
+    write_csv(csv_file, ['Side,Symbol,Quantity,Total', 'buy,ETH,1,3000'])
+
+    with pytest.raises(SystemExit) as e:
+        run_import(csv_file)
+    assert 'ETH (ethereum, ethereum-wormhole)' in str(e.value)
+    assert not (tmp_path / 'portfolio.json').exists()
+
+    portfolioimport.main([str(tmp_path / 'portfolio.json'), str(csv_file), '--map', 'ETH=ethereum-wormhole', '--checkpoint', str(tmp_path / 'checkpoint.json'), '--dry-run'])
+    assert not (tmp_path / 'portfolio.json').exists()
+    run_import(csv_file, '--map', 'ETH=ethereum-wormhole')
+
+    # The mapping is remembered for the rows added later
+    write_csv(csv_file, ['buy,ETH,1,1000'], mode='a')
+    config, _ = run_import(csv_file)
+    assert config['holdings'] == [{'coinId': 'ethereum-wormhole', 'units': 2.0}]
+    assert config['investmentAmount'] == 4000
+
+def test_keeps_holdings_not_imported(tmp_path, run_import):
+    config_file = tmp_path / 'portfolio.json'
+    config_file.write_text(json.dumps({
+        'investmentAmount': 500,
+        'defaultCurrency': 'AUD',
+        'currencies': ['USD'],
+        'holdings': [{'coinId': 'ripple', 'units': 1000}, {'coinId': 'bitcoin', 'units': 0.1}]
+    }))
+    csv_file = tmp_path / 'trades.csv'
+    write_csv(csv_file, ['Side,Asset,Quantity,Total', 'Buy,BTC,2,100', 'Buy,ETH,1,10'])
+
+    # Bitcoin was entered by hand, so is only replaced when asked to
+    with pytest.raises(SystemExit) as e:
+        run_import(csv_file, '--map', 'ETH=ethereum')
+    assert 'bitcoin is in the config' in str(e.value)
+    assert json.loads(config_file.read_text())['holdings'][1] == {'coinId': 'bitcoin', 'units': 0.1}
+
+    config, output = run_import(csv_file, '--map', 'ETH=ethereum', '--replace')
+    assert config['holdings'] == [{'coinId': 'ripple', 'units': 1000}, {'coinId': 'bitcoin', 'units': 2.0}, {'coinId': 'ethereum', 'units': 1.0}]
+    assert config['investmentAmount'] == 610
+    assert config['currencies'] == ['USD']
+    assert 'Replaced the units of bitcoin' in output.err
+
+    # Later imports own bitcoin, and swap the cost of the last import for the new one
+    write_csv(csv_file, ['Sell,ETH,1,20'], mode='a')
+    config, _ = run_import(csv_file)
+    assert config['holdings'] == [{'coinId': 'ripple', 'units': 1000}, {'coinId': 'bitcoin', 'units': 2.0}]
+    assert config['investmentAmount'] == 600
@@ -0,0 +1,100 @@
+from contextlib import closing
+import math
+import pytest
+np = pytest.importorskip('numpy')
+from portfoliohistory import append_run, connect
+from portfoliorisk import ReturnCache, analyse, get_cache_filename, load_returns
+
+DAY = 86400
+START = 1704067200  # 2024-01-01 00:00 UTC
+
+def record_day(path, day, prices, hour=12):
+    holdings = [{'coin_id': coin_id, 'units': 1, 'price': price, 'value': price, 'change_24h_percent': 0} for coin_id, price in prices.items()]
+    append_run(path, 'AUD', 0, holdings, timestamp=START + day * DAY + hour * 3600)
+
+def test_closes_and_returns(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    record_day(path, 0, {'bitcoin': 100, 'ethereum': 10}, hour=1)
+    record_day(path, 0, {'bitcoin': 110, 'ethereum': 10})  # The close is the last run of the day
+    record_day(path, 1, {'bitcoin': 121, 'ethereum': 12, 'ripple': 1})
+    record_day(path, 3, {'bitcoin': 60.5, 'ripple': 2})
+
+    with closing(connect(path)) as connection:
+        cache = ReturnCache('AUD')
+        assert cache.update(connection) == 3
+
+    assert cache.coins == ['bitcoin', 'ethereum', 'ripple']
+    assert list(cache.days) == [START // DAY, START // DAY + 1, START // DAY + 3]
+    np.testing.assert_allclose(cache.prices, [[110, 10, np.nan], [121, 12, 1], [60.5, np.nan, 2]])
+    np.testing.assert_allclose(cache.returns, [[0.1, 0.2, np.nan], [-0.5, np.nan, 1]])
+
+def test_incremental_update_matches_rebuild(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    for day in range(5):
+        record_day(path, day, {'bitcoin': 100 + day, 'ethereum': 10 + day * day})
+    with closing(connect(path)) as connection:
+        cache = load_returns(connection, path, 'AUD')
+    assert len(cache.days) == 5
+
+    # A later run on the last day changes its close, then a new day and a new coin are added
+    record_day(path, 4, {'bitcoin': 90, 'ethereum': 20}, hour=20)
+    record_day(path, 5, {'bitcoin': 95, 'ethereum': 25, 'ripple': 1})
+    with closing(connect(path)) as connection:
+        cache = ReturnCache.load(get_cache_filename(path), 'AUD')
+        assert cache.update(connection) == 2
+        rebuilt = ReturnCache('AUD')
+        rebuilt.update(connection)
+
+    assert cache.coins == rebuilt.coins
+    np.testing.assert_array_equal(cache.days, rebuilt.days)
+    np.testing.assert_allclose(cache.prices, rebuilt.prices)
+    np.testing.assert_allclose(cache.returns, rebuilt.returns)
+    assert cache.returns[3, 0] == pytest.approx(90 / 103 - 1)
+
+def test_rebuilds_when_history_changes(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    for day in range(3):
+        record_day(path, day, {'bitcoin': 100 + day})
+    with closing(connect(path)) as connection:
+        load_returns(connection, path, 'AUD')
+        connection.execute("DELETE FROM runs WHERE id = 3")
+        connection.commit()
+        cache = load_returns(connection, path, 'AUD')
+
+    assert len(cache.days) == 2
+    assert ReturnCache.load(get_cache_filename(path), 'USD').last_run == 0
+
+def test_analyse():
+    rng = np.random.default_rng(42)
+    cache = ReturnCache('AUD')
+    cache.coins = ['bitcoin', 'ethereum', 'ripple']
+    cache.returns = rng.normal(0, 0.03, (200, 3))
+    cache.returns[0, 1] = np.nan  # Days without a return for a held coin are left out
+    cache.prices = np.vstack([np.ones((200, 3)), [[200, 50, 1]]])
+
+    analysis = analyse(cache, {'bitcoin': 1, 'ethereum': 2, 'dogecoin': 5}, confidence=0.95)
+
+    returns = cache.returns[1:, :2]
+    portfolio_returns = returns @ [2 / 3, 1 / 3]
+    assert analysis['coins'] == ['bitcoin', 'ethereum']
+    assert analysis['missing'] == ['dogecoin']
+    assert analysis['days'] == 199
+    assert analysis['value'] == 300
+    np.testing.assert_allclose(analysis['weights'], [2 / 3, 1 / 3])
+    np.testing.assert_allclose(analysis['volatility'], returns.std(axis=0, ddof=1))
+    np.testing.assert_allclose(analysis['correlation'], np.corrcoef(returns, rowvar=False))
+    assert analysis['portfolio_volatility'] == pytest.approx(portfolio_returns.std(ddof=1))
+    assert analysis['historical_var'] == pytest.approx(-np.quantile(portfolio_returns, 0.05) * 300)
+    expected_parametric = -(portfolio_returns.mean() - 1.6448536 * portfolio_returns.std(ddof=1)) * 300
+    assert analysis['parametric_var'] == pytest.approx(expected_parametric, rel=1e-6)
+    assert not math.isnan(analysis['parametric_var'])
+
+def test_analyse_needs_history():
+    cache = ReturnCache('AUD')
+    with pytest.raises(ValueError):
+        analyse(cache, {'bitcoin': 1})
+    cache.coins = ['bitcoin']
+    cache.prices = np.array([[1.0], [2.0]])
+    cache.returns = np.array([[1.0]])
+    with pytest.raises(ValueError):
+        analyse(cache, {'bitcoin': 1})
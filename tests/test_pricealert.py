@@ -1,4 +1,6 @@
-from pricealert import main
+import json
+import os
+from pricealert import get_triggers, load, main
 
 def test_main_output(base_setup, tmp_path):
     mock_stdout = base_setup('pricealert_valid.json')
@@ -17,4 +19,88 @@ def test_empty_config(base_setup, check_configuration_errors):
 
 def test_malformed_config(base_setup, check_configuration_errors):
     base_setup('pricealert_malformed.json')
-    check_configuration_errors(main, "Configuration file validation failed")
\ No newline at end of file
+    check_configuration_errors(main, "Configuration file validation failed")
+
+def test_rules(base_setup, tmp_path):
+    mock_stdout = base_setup('pricealert_rules.json')
+    main(tmp_path)
+    output = mock_stdout.getvalue()
+
+    assert "Rule matched: change_24h(ethereum,aud) < -0.5 and price(bitcoin,aud) >= 100000" in output
+    assert "price(ripple,aud) > 1" not in output
+
+def test_rules_alert_once(base_setup, tmp_path):
+    mock_stdout = base_setup('pricealert_rules.json')
+    main(tmp_path)
+    main(tmp_path)
+
+    # The rule is still true on the second run, so it isn't alerted again
+    assert mock_stdout.getvalue().count("Rule matched:") == 1
+
+def test_unknown_rule_coin(base_setup, check_configuration_errors):
+    base_setup('pricealert_unknown_rule_coin.json')
+    check_configuration_errors(main, "Error: Invalid rule: 'bitcoinn' isn't a CoinGecko coin ID in rule 'price(bitcoin,aud) > 1 or price(bitcoinn,aud) > 1'")
+
+def test_invalid_rule(base_setup, check_configuration_errors):
+    base_setup('pricealert_invalid_rule.json')
+    check_configuration_errors(main, "Error: Invalid rule: Unexpected end of rule")
+
+def test_drop_and_trailing_stop(base_setup, tmp_path):
+    mock_stdout = base_setup('pricealert_drops.json')
+
+    with open(tmp_path / "coin_prices_cache.json", 'w') as file:
+        json.dump({
+            "bitcoin-aud": {"alertPrice": 110000, "dropPrice": 95000, "peakPrice": 120000},
+            "ethereum-aud": {"alertPrice": 5500, "dropPrice": 5200},
+            "ripple-aud": {"alertPrice": 1, "dropPrice": 0.5, "peakPrice": 1}
+        }, file)
+
+    main(tmp_path)
+    output = mock_stdout.getvalue()
+
+    assert "BTC is now AUD $100,000.00, down 16.67% from its peak of $120,000.00" in output
+    assert "ETH has dropped to AUD $5,000.00" in output
+    assert "XRP" not in output, "XRP is above its drop price and within its 50% trailing stop"
+
+    with open(tmp_path / "coin_prices_cache.json") as file:
+        state = json.load(file)
+    assert state["bitcoin-aud"]["peakPrice"] == 100000, "Trailing stop was not re-armed at the current price"
+    assert state["ethereum-aud"]["dropPrice"] == 4750, "Drop alert was not re-armed below the current price"
+    assert state["ripple-aud"] == {"alertPrice": 1, "dropPrice": 0.5, "peakPrice": 1}
+
+def test_peak_is_tracked_without_alert(base_setup, tmp_path):
+    mock_stdout = base_setup('pricealert_drops.json')
+
+    with open(tmp_path / "coin_prices_cache.json", 'w') as file:
+        json.dump({
+            "bitcoin-aud": {"alertPrice": 110000, "dropPrice": 90000, "peakPrice": 95000},
+            "ethereum-aud": {"alertPrice": 5500, "dropPrice": 4000},
+            "ripple-aud": {"alertPrice": 1, "dropPrice": 0.5, "peakPrice": 1}
+        }, file)
+
+    main(tmp_path)
+
+    assert mock_stdout.getvalue() == ""
+    with open(tmp_path / "coin_prices_cache.json") as file:
+        assert json.load(file)["bitcoin-aud"]["peakPrice"] == 100000, "New peak was not saved"
+
+def test_old_cache_format(base_setup, tmp_path):
+    mock_stdout = base_setup('pricealert_valid.json')
+
+    with open(tmp_path / "coin_prices_cache.json", 'w') as file:
+        json.dump({"bitcoin-aud": 110000, "ripple-aud": 0.8}, file)
+
+    main(tmp_path)
+
+    assert mock_stdout.getvalue() == ""
+
+def test_get_triggers(base_setup, tmp_path):
+    base_setup('pricealert_drops.json')
+    with open(tmp_path / "coin_prices_cache.json", 'w') as file:
+        json.dump({"bitcoin-aud": {"alertPrice": 110000, "dropPrice": 95000, "peakPrice": 120000}, "ethereum-aud": 5500}, file)
+
+    triggers = get_triggers(load(os.path.join(os.path.dirname(__file__), 'config', 'pricealert_drops.json')), tmp_path)
+
+    assert [(trigger.coin_ids, trigger.level) for trigger in triggers] == [
+        (('bitcoin',), 110000), (('bitcoin',), 95000), (('bitcoin',), 120000), (('bitcoin',), 108000), (('ethereum',), 5500)
+    ]
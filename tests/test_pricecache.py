@@ -0,0 +1,97 @@
+import pytest
+import coingecko
+import pricecache
+from fake_coingecko import FakeCoinGecko, generate_price
+from mocks import fetch_price_data
+from portfolio import main as portfolio_main
+
+@pytest.fixture(autouse=True)
+def price_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(pricecache, 'CACHE_FILENAME', str(tmp_path / 'price_cache.json'))
+    monkeypatch.setattr(pricecache, '_refresh_thread', None)
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    with FakeCoinGecko() as server:
+        monkeypatch.setenv('COINGECKO_API_URL', server.url)
+        yield server
+
+def expire_cache(monkeypatch, fresh=True, stale=True):
+    if fresh:
+        monkeypatch.setattr(pricecache, 'FRESH_AGE', -1)
+    if stale:
+        monkeypatch.setattr(pricecache, 'STALE_AGE', -1)
+
+def test_fresh_prices_are_reused(fake_api):
+    prices, errors = pricecache.fetch_prices(['bitcoin'], ['aud'])
+    cached, _ = pricecache.fetch_prices(['Bitcoin'], ['AUD'])
+
+    assert prices['bitcoin']['aud'] == generate_price('bitcoin', 'aud')
+    assert 'last_updated_at' in prices['bitcoin']
+    assert errors == {}
+    assert cached == prices
+    assert fake_api.request_count == 1
+
+def test_cached_prices_need_every_currency(fake_api):
+    pricecache.fetch_prices(['bitcoin'], ['aud'], include_24hr_change=False)
+    pricecache.fetch_prices(['bitcoin'], ['aud'])
+    pricecache.fetch_prices(['bitcoin'], ['aud', 'usd'])
+
+    assert fake_api.request_count == 3
+
+def test_unknown_ids_are_skipped(fake_api, monkeypatch, mocker, capsys):
+    prices, errors = pricecache.fetch_prices(['bitcoin', 'not-a-coin'], ['aud'])
+
+    assert set(prices) == {'bitcoin'}
+    assert "Not found by CoinGecko" in errors['not-a-coin']
+    assert "No price for not-a-coin" in capsys.readouterr().err
+
+    # The unknown ID isn't asked for again
+    expire_cache(monkeypatch)
+    spy = mocker.spy(coingecko, 'fetch_price_data')
+    prices, errors = pricecache.fetch_prices(['bitcoin', 'not-a-coin'], ['aud'])
+    assert set(prices) == {'bitcoin'}
+    assert "won't be asked for again" in errors['not-a-coin']
+    assert spy.call_args.args[0] == ['bitcoin']
+
+def test_stale_prices_are_served_while_refreshing(fake_api, monkeypatch, capsys):
+    prices, _ = pricecache.fetch_prices(['bitcoin'], ['aud'])
+    expire_cache(monkeypatch, stale=False)
+    stale, _ = pricecache.fetch_prices(['bitcoin'], ['aud'])
+    pricecache._refresh_thread.join()
+
+    assert stale['bitcoin']['last_updated_at'] == prices['bitcoin']['last_updated_at']
+    assert "Using prices cached" in capsys.readouterr().err
+    assert fake_api.request_count == 2
+    refreshed, _ = pricecache.fetch_prices(['bitcoin'], ['aud'])
+    assert refreshed['bitcoin']['last_updated_at'] > prices['bitcoin']['last_updated_at']
+
+def test_cached_prices_are_used_when_the_api_fails(fake_api, monkeypatch, capsys):
+    pricecache.fetch_prices(['bitcoin'], ['aud'])
+    expire_cache(monkeypatch)
+    fake_api.rate_limit_next = 1
+
+    prices, errors = pricecache.fetch_prices(['bitcoin', 'ethereum'], ['aud'])
+
+    assert prices['bitcoin']['aud'] == generate_price('bitcoin', 'aud')
+    assert "No cached price" in errors['ethereum']
+    assert "the request failed" in capsys.readouterr().err
+
+def test_api_failure_without_cached_prices(fake_api):
+    fake_api.rate_limit_next = 1
+
+    with pytest.raises(Exception, match="429"):
+        pricecache.fetch_prices(['bitcoin'], ['aud'])
+
+def test_portfolio_skips_coins_without_prices(base_setup, capsys):
+    mock_stdout = base_setup('portfolio_valid.json', '--resilient')
+    prices = fetch_price_data()
+    del prices['ethereum']
+    coingecko.fetch_price_data.return_value = prices
+
+    portfolio_main()
+
+    output = mock_stdout.getvalue()
+    assert "BTC" in output
+    assert "ETH" not in output
+    assert "No price for ethereum" in capsys.readouterr().err
@@ -0,0 +1,140 @@
+import io
+import json
+import os
+import pytest
+import optimaltrade
+import pricefeed
+from fake_ticker import FakeTicker
+from metrics import FEED_CONNECTIONS
+from pricefeed import OPCODE_TEXT, PriceFeed, Streamer, TickCoalescer, WebSocket, WebSocketError, encode_frame, parse_ticks, read_frame
+from scheduler import WatchJob
+
+def config_path(name):
+    return os.path.join(os.path.dirname(__file__), 'config', name)
+
+def test_frames_round_trip():
+    for size in (0, 10, 200, 70000):
+        payload = os.urandom(size)
+        final, opcode, decoded = read_frame(io.BytesIO(encode_frame(OPCODE_TEXT, payload)))
+        assert (final, opcode, decoded) == (True, OPCODE_TEXT, payload)
+
+    with pytest.raises(WebSocketError):
+        read_frame(io.BytesIO(encode_frame(OPCODE_TEXT, b'truncated')[:-1]))
+
+def test_parse_ticks():
+    message = json.dumps([
+        {'i': 'Bitcoin', 'vs': 'AUD', 'p': 100000, 'pp': 2.5, 't': 1700000000},
+        {'i': 'ethereum', 'vs': 'aud', 'p': 5000},
+        {'type': 'subscribed'},
+        {'i': 'ripple', 'vs': 'aud', 'p': 'not a price'}
+    ])
+
+    assert parse_ticks(message) == [('bitcoin', 'aud', 100000.0, 2.5), ('ethereum', 'aud', 5000.0, None)]
+    assert parse_ticks(json.dumps({'i': 'bitcoin', 'vs': 'usd', 'p': 1})) == [('bitcoin', 'usd', 1.0, None)]
+    with pytest.raises(ValueError):
+        parse_ticks('not json')
+
+def test_coalescer_keeps_latest_tick():
+    coalescer = TickCoalescer()
+    assert coalescer.take(timeout=0) == {}
+
+    coalescer.add([('bitcoin', 'aud', 100.0, 1.0), ('bitcoin', 'aud', 101.0, None), ('bitcoin', 'usd', 70.0, None)])
+    coalescer.add([('bitcoin', 'aud', 102.0, None), ('ethereum', 'aud', 10.0, None)])
+
+    assert coalescer.take(timeout=0) == {'bitcoin': {'aud': 102.0, 'aud_24h_change': 1.0, 'usd': 70.0}, 'ethereum': {'aud': 10.0}}
+    assert coalescer.take(timeout=0) == {}
+
+def test_websocket_client():
+    with FakeTicker() as ticker:
+        websocket = WebSocket.connect(ticker.url)
+        websocket.send(json.dumps({'command': 'subscribe', 'coin_ids': ['bitcoin'], 'currencies': ['aud']}))
+        snapshot = parse_ticks(websocket.receive())
+        ticker.publish([('bitcoin', 'aud', 123.0), ('ethereum', 'aud', 5.0)])
+        update = parse_ticks(websocket.receive())
+        websocket.close()
+
+    assert [tick[:2] for tick in snapshot] == [('bitcoin', 'aud')]
+    assert update == [('bitcoin', 'aud', 123.0, snapshot[0][3])]
+
+def test_connect_errors():
+    with pytest.raises(ValueError, match="ws://"):
+        WebSocket.connect('http://127.0.0.1/')
+
+    with FakeTicker() as ticker:
+        url = ticker.url
+    with pytest.raises(OSError):
+        WebSocket.connect(url, timeout=1)
+
+def test_feed_reconnects(monkeypatch, capsys):
+    FEED_CONNECTIONS.clear()
+    monkeypatch.setattr(pricefeed, 'INITIAL_RECONNECT_DELAY', 0.01)
+    coalescer = TickCoalescer()
+
+    with FakeTicker() as ticker:
+        feed = PriceFeed(ticker.url, ['bitcoin'], ['aud'], coalescer)
+        feed.start()
+        assert ticker.wait_for_subscribers(1)
+        assert 'bitcoin' in coalescer.take(timeout=5)
+
+        ticker.disconnect()
+        assert ticker.wait_for_subscribers(1)
+        ticker.publish([('bitcoin', 'aud', 42.0)])
+        received = {}
+        while received.get('bitcoin', {}).get('aud') != 42.0:
+            received = coalescer.take(timeout=5)
+            assert received
+        feed.stop()
+
+    assert FEED_CONNECTIONS.get(result='connected') == 2
+    assert FEED_CONNECTIONS.get(result='error') == 1
+    assert "Lost the price feed" in capsys.readouterr().err
+
+def test_streamer_runs_jobs_when_triggers_are_crossed(mocker):
+    config = optimaltrade.load(config_path('optimaltrade_show_optimal.json'))
+    job = WatchJob('optimaltrade', 'trades.json', optimaltrade, config, optimaltrade.parse_args(['trades.json']))
+    run = mocker.patch.object(optimaltrade, 'run')
+    coalescer = TickCoalescer()
+    sleeps = []
+    streamer = Streamer([job], {'bitcoin': {'btc': 1, 'aud': 100000}, 'ethereum': {'btc': 0.06, 'aud': 6000}, 'ripple': {'btc': 0.00001, 'aud': 1}}, coalescer, interval=1, sleep=sleeps.append)
+
+    def tick(ethereum_btc):
+        coalescer.add([('ethereum', 'btc', ethereum_btc, None)])
+        return streamer.step(timeout=0)
+
+    # The first tick runs the job, later ones only when the trade becomes optimal or stops being so
+    assert tick(0.059) == {'ethereum'}
+    assert tick(0.058) == {'ethereum'}
+    assert run.call_count == 1
+    tick(0.04)
+    assert run.call_count == 2
+    assert run.call_args.args[1]['ethereum'] == {'btc': 0.04, 'aud': 6000}
+    assert streamer.step(timeout=0) == set()
+    # Each evaluation waits out the rest of the interval so ticks can pile up
+    assert len(sleeps) == 3 and all(0 < seconds <= 1 for seconds in sleeps)
+
+def test_stream_end_to_end(base_setup, mocker):
+    mock_stdout = base_setup('optimaltrade_show_all.json')
+    from cointracker import stream
+
+    with FakeTicker() as ticker:
+        streamer, feed = stream([('optimaltrade', config_path('optimaltrade_show_all.json'))], ticker.url, 0)
+        feed.start()
+        assert ticker.wait_for_subscribers(1)
+        # The snapshot sent on subscribing is applied to the prices fetched at the start
+        assert streamer.step(timeout=5) == {'bitcoin', 'ethereum', 'ripple'}
+        feed.stop()
+
+    assert "Target Buy" in mock_stdout.getvalue()
+    assert streamer.prices['bitcoin']['btc'] == ticker.prices[('bitcoin', 'btc')][0]
+
+def test_many_ticks_are_coalesced():
+    coalescer = TickCoalescer()
+    feed = PriceFeed('ws://unused/', ['coin'], ['aud'], coalescer)
+    messages = [json.dumps([{'i': f"coin-{index % 100}", 'vs': 'aud', 'p': batch * 1000 + index} for index in range(100)]) for batch in range(50)]
+
+    for message in messages:
+        feed.handle(message)
+
+    prices = coalescer.take(timeout=0)
+    assert len(prices) == 100
+    assert prices['coin-5'] == {'aud': 49005.0}
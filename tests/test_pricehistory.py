@@ -0,0 +1,41 @@
+import pytest
+from pricehistory import PriceHistory, parse_window
+
+def test_parse_window():
+    assert parse_window('5m') == 300
+    assert parse_window('4h') == 14400
+    assert parse_window('7d') == 604800
+    with pytest.raises(ValueError):
+        parse_window('10x')
+
+def test_percent_change_fills_gaps():
+    history = PriceHistory(resolution=60, max_window=3600)
+    history.record('bitcoin', 'aud', 100, 0)
+    history.record('bitcoin', 'aud', 110, 600)
+    history.record('bitcoin', 'aud', 121, 1200)
+
+    # The price 5 minutes before the last sample is the one carried forward from the 600 second sample
+    assert history.percent_change('bitcoin', 'AUD', 300) == pytest.approx(10)
+    assert history.percent_change('bitcoin', 'aud', 1200) == pytest.approx(21)
+    assert history.percent_change('bitcoin', 'aud', 1800) is None, "History doesn't go back 30 minutes"
+
+def test_old_samples_are_overwritten():
+    history = PriceHistory(resolution=60, max_window=600)
+    for minute in range(30):
+        history.record('bitcoin', 'aud', 100 + minute, minute * 60)
+
+    assert history.percent_change('bitcoin', 'aud', 600) == pytest.approx((129 - 119) / 119 * 100)
+    assert history.percent_change('bitcoin', 'aud', 660) is None
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'history.json')
+    history = PriceHistory()
+    history.record('bitcoin', 'aud', 100, 0)
+    history.record('bitcoin', 'aud', 90, 3600)
+    history.save(filename)
+
+    loaded = PriceHistory.load(filename)
+    assert loaded.percent_change('bitcoin', 'aud', 3600) == pytest.approx(-10)
+
+    # A history saved at a different resolution is discarded rather than misread
+    assert PriceHistory.load(filename, resolution=60).series == {}
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+import pytest
+from pricepercentalert import get_triggers, load, main
+from pricehistory import PriceHistory
+
+def test_main_output(base_setup, tmp_path):
+    mock_stdout = base_setup('pricepercentalert_valid.json')
+    main(tmp_path)
+    output = mock_stdout.getvalue()
+
+    assert "BTC (10.78%) is now AUD $100,000.00" in output
+    assert "ETH" not in output
+
+def test_window_without_history(base_setup, tmp_path):
+    mock_stdout = base_setup('pricepercentalert_window.json')
+    main(tmp_path)
+
+    assert mock_stdout.getvalue() == ""
+    assert (tmp_path / "price_history.json").exists(), "Price history was not saved"
+
+def test_window_from_history(base_setup, tmp_path):
+    mock_stdout = base_setup('pricepercentalert_window.json')
+
+    history = PriceHistory()
+    history.record('bitcoin', 'aud', 80000, time.time() - 3600)
+    history.record('ethereum', 'aud', 4900, time.time() - 300)
+    history.save(str(tmp_path / "price_history.json"))
+
+    main(tmp_path)
+    output = mock_stdout.getvalue()
+
+    assert "BTC (25.00% 1h) is now AUD $100,000.00" in output
+    assert "ETH" not in output, "ETH only moved 2.04% in 5m so it should not alert"
+
+def test_window_too_long(base_setup, check_configuration_errors, tmp_path):
+    base_setup('pricepercentalert_window_too_long.json')
+    check_configuration_errors(lambda: main(tmp_path), "is longer than the 7 days of price history kept")
+
+def test_window_too_short(base_setup, check_configuration_errors, tmp_path):
+    base_setup('pricepercentalert_window_too_short.json')
+    check_configuration_errors(lambda: main(tmp_path), "The window '2m' for bitcoin must be a multiple of the 5 minutes the price history is kept in.")
+
+def test_window_not_multiple_of_resolution(tmp_path):
+    with open(os.path.join(os.path.dirname(__file__), 'config', 'pricepercentalert_window_too_short.json')) as file:
+        config = json.load(file)
+    config['coins'][0]['window'] = '7m'
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps(config))
+
+    with pytest.raises(SystemExit) as exit_info:
+        load(str(config_file))
+    assert "'7m'" in str(exit_info.value)
+
+def test_get_triggers(tmp_path):
+    config = load(os.path.join(os.path.dirname(__file__), 'config', 'pricepercentalert_window.json'))
+    history = PriceHistory()
+    history.record('bitcoin', 'aud', 80000, time.time() - 3600)
+    history.record('bitcoin', 'aud', 85000, time.time())
+    history.save(str(tmp_path / "price_history.json"))
+
+    # Ethereum has no history one window back yet
+    triggers = get_triggers(config, tmp_path)
+    assert [(trigger.coin_ids, trigger.level) for trigger in triggers] == [(('bitcoin',), pytest.approx(88000)), (('bitcoin',), pytest.approx(72000))]
+
+    config['coins'] = [{'coinId': 'bitcoin', 'currency': 'AUD'}]
+    rise, drop = get_triggers(config, tmp_path)
+    assert rise.side({'bitcoin': {'aud_24h_change': 10.5}}) is True
+    assert rise.side({'bitcoin': {'aud_24h_change': 9.5}}) is False
+    assert drop.side({'bitcoin': {'aud_24h_change': -10.5}}) is False
+    assert rise.side({'bitcoin': {'aud': 100000}}) is None
@@ -0,0 +1,55 @@
+import pytest
+import coingecko
+from fake_coingecko import FakeCoinGecko, generate_price
+from pricerequest import fetch_planned_prices, plan_requests
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    monkeypatch.setattr(coingecko, '_exchange_rates', None)
+    with FakeCoinGecko() as server:
+        monkeypatch.setenv('COINGECKO_API_URL', server.url)
+        yield server
+
+@pytest.fixture
+def price_urls(mocker):
+    spy = mocker.spy(coingecko, 'fetch_data_from_api')
+    return lambda: [call.args[0] for call in spy.call_args_list if '/simple/price' in call.args[0]]
+
+def test_plan_requests():
+    plan = plan_requests([
+        (['bitcoin', 'ethereum'], ['AUD'], []),
+        (['Bitcoin', 'ripple'], ['aud', 'btc', 'usd'], ['usd'])
+    ], base_currency='AUD')
+
+    assert plan.coin_ids == ['bitcoin', 'ethereum', 'ripple']
+    assert plan.currencies == ['aud', 'btc', 'usd']
+    assert plan.change_currencies == ['usd']
+    # USD is needed with its 24 hour change, so it can't be converted from AUD
+    assert plan.convertible_currencies() == ['btc']
+
+def test_fetch_without_change(fake_api, price_urls):
+    prices = fetch_planned_prices(plan_requests([(['bitcoin'], ['aud'], [])]))
+
+    assert prices == {'bitcoin': {'aud': generate_price('bitcoin', 'aud')}}
+    assert 'include_24hr_change=false' in price_urls()[0]
+
+def test_fetch_converts_fiat_currencies(fake_api, price_urls):
+    plan = plan_requests([(['bitcoin', 'ethereum'], ['aud', 'eur', 'btc'], []), (['ripple'], ['usd'], [])], base_currency='usd')
+    prices = fetch_planned_prices(plan)
+    fetch_planned_prices(plan)
+
+    usd_price = generate_price('bitcoin', 'usd')
+    assert prices['bitcoin']['aud'] == pytest.approx(usd_price * 1.5)
+    assert prices['bitcoin']['eur'] == pytest.approx(usd_price * 55000 / 60000)
+    # BTC isn't fiat so it is fetched rather than converted
+    assert prices['bitcoin']['btc'] == generate_price('bitcoin', 'btc')
+    assert 'vs_currencies=btc,usd' in price_urls()[0] or 'vs_currencies=usd,btc' in price_urls()[0]
+    # The exchange rates are fetched once and reused
+    assert fake_api.request_paths.count('/api/v3/exchange_rates') == 1
+
+def test_fetch_without_exchange_rates(fake_api, mocker, capsys):
+    mocker.patch('coingecko.fetch_exchange_rates', side_effect=ConnectionError("Failed to connect to API"))
+    prices = fetch_planned_prices(plan_requests([(['bitcoin'], ['aud', 'usd'], [])], base_currency='usd'))
+
+    assert prices['bitcoin']['aud'] == generate_price('bitcoin', 'aud')
+    assert "Failed to fetch exchange rates" in capsys.readouterr().err
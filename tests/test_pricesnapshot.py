@@ -0,0 +1,46 @@
+import math
+import pytest
+from pricesnapshot import PriceSnapshot
+
+PRICES = {
+    'bitcoin': {'aud': 100000, 'aud_24h_change': 2.5, 'usd': 70000, 'last_updated_at': 1700000000},
+    'ethereum': {'aud': 5000, 'usd': 3500, 'usd_24h_change': -1.0}
+}
+
+def test_reads_like_a_dict():
+    snapshot = PriceSnapshot.from_dict(PRICES)
+
+    assert snapshot == PRICES
+    assert snapshot.to_dict() == PRICES
+    assert list(snapshot) == ['bitcoin', 'ethereum']
+    assert 'bitcoin' in snapshot and 'ripple' not in snapshot
+    assert snapshot['bitcoin']['aud_24h_change'] == 2.5
+    assert snapshot.get('ethereum', {}).get('aud_24h_change') is None
+    assert snapshot.get('ripple', {}).get('aud') is None
+    assert dict(snapshot['ethereum']) == PRICES['ethereum']
+    with pytest.raises(KeyError):
+        snapshot['ethereum']['aud_24h_change']
+
+def test_columns():
+    snapshot = PriceSnapshot.from_dict(PRICES)
+
+    assert snapshot.price('bitcoin', 'usd') == 70000
+    assert snapshot.change('ethereum', 'usd') == -1.0
+    assert snapshot.change('ethereum', 'aud') is None
+    assert snapshot.price('bitcoin', 'eur') is None
+    assert list(snapshot.price_column('aud')) == [100000, 5000]
+    assert math.isnan(snapshot.change_column('aud')[snapshot.rows['ethereum']])
+
+    snapshot.set_price_column('eur', [price * 0.6 for price in snapshot.price_column('aud')])
+    assert snapshot['ethereum']['eur'] == pytest.approx(3000)
+    with pytest.raises(ValueError):
+        snapshot.set_price_column('eur', [1.0])
+
+def test_grows():
+    snapshot = PriceSnapshot()
+    snapshot.set_price('bitcoin', 'aud', 100000, 2.5)
+    snapshot.set_price('ethereum', 'usd', 3500)
+
+    assert snapshot == {'bitcoin': {'aud': 100000, 'aud_24h_change': 2.5}, 'ethereum': {'usd': 3500}}
+    assert PriceSnapshot.ensure(snapshot) is snapshot
+    assert PriceSnapshot.ensure(PRICES) == PRICES
@@ -0,0 +1,134 @@
+import json
+import time
+import pytest
+import pricesources
+from fake_coingecko import FakeCoinGecko, generate_price
+from metrics import HEDGED_REQUESTS
+from pricesources import FileSource, HttpSource, LatencyTracker, PriceSource, PriceSources, aggregate, fetch_hedged, fetch_median, reject_outliers
+from utils import fetch_prices
+
+class StubSource(PriceSource):
+    """A source answering with fixed prices after a delay, or raising an error."""
+    kind = 'stub'
+
+    def __init__(self, name, prices=None, delay=0, error=None):
+        super().__init__(name)
+        self.prices = prices or {}
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def get_prices(self, coin_ids, currencies, include_24hr_change):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {coin_id: self.prices[coin_id] for coin_id in coin_ids if coin_id in self.prices}
+
+def bitcoin(price):
+    return {'bitcoin': {'aud': price}}
+
+def test_latency_percentile():
+    tracker = LatencyTracker()
+    for _ in range(pricesources.MIN_LATENCY_SAMPLES - 1):
+        tracker.record(0.1)
+    assert tracker.percentile(95) is None
+
+    for seconds in range(1, 101):
+        tracker.record(seconds / 100)
+    assert tracker.percentile(95) == 0.95
+    assert tracker.percentile(50) == 0.5
+
+def test_fast_source_is_not_hedged():
+    primary = StubSource('primary', bitcoin(100))
+    backup = StubSource('backup', bitcoin(200))
+
+    assert fetch_hedged([primary, backup], ['bitcoin'], ['aud'], default_delay=1) == bitcoin(100)
+    assert backup.calls == 0
+
+def test_slow_source_is_hedged():
+    HEDGED_REQUESTS.clear()
+    primary = StubSource('primary', bitcoin(100), delay=1)
+    backup = StubSource('backup', bitcoin(200))
+
+    start = time.perf_counter()
+    assert fetch_hedged([primary, backup], ['bitcoin'], ['aud'], default_delay=0.05) == bitcoin(200)
+    assert time.perf_counter() - start < 0.5
+    assert HEDGED_REQUESTS.get(source='backup') == 1
+
+def test_hedge_delay_follows_latency_percentile():
+    primary = StubSource('primary', bitcoin(100), delay=0.2)
+    backup = StubSource('backup', bitcoin(200))
+    for _ in range(pricesources.MIN_LATENCY_SAMPLES):
+        primary.latencies.record(0.5)
+
+    # The primary usually takes half a second, so it isn't hedged at the default delay
+    assert fetch_hedged([primary, backup], ['bitcoin'], ['aud'], default_delay=0.01) == bitcoin(100)
+    assert backup.calls == 0
+
+def test_failed_source_fails_over():
+    primary = StubSource('primary', error=ConnectionError("down"))
+    backup = StubSource('backup', bitcoin(200))
+
+    assert fetch_hedged([primary, backup], ['bitcoin'], ['aud'], default_delay=10) == bitcoin(200)
+
+    backup.error = ValueError("bad response")
+    with pytest.raises(ConnectionError, match="primary: down; backup: bad response"):
+        fetch_hedged([primary, backup], ['bitcoin'], ['aud'], default_delay=10)
+
+def test_reject_outliers():
+    assert reject_outliers([100, 101, 99, 150]) == [100, 101, 99]
+    # Close prices are kept even when the others agree exactly
+    assert reject_outliers([100, 100, 100.5]) == [100, 100, 100.5]
+    # With two values there is no way to tell which is wrong
+    assert reject_outliers([100, 150]) == [100, 150]
+
+def test_aggregate():
+    responses = [
+        {'bitcoin': {'aud': 100, 'aud_24h_change': 1.0}, 'ethereum': {'aud': 10}},
+        {'bitcoin': {'aud': 102, 'aud_24h_change': 3.0}},
+        {'bitcoin': {'aud': 5000, 'aud_24h_change': 2.0}}
+    ]
+
+    assert aggregate(responses) == {'bitcoin': {'aud': 101, 'aud_24h_change': 2.0}, 'ethereum': {'aud': 10}}
+
+def test_fetch_median_skips_failed_sources(capsys):
+    sources = [StubSource('a', bitcoin(100)), StubSource('b', bitcoin(104)), StubSource('c', error=ConnectionError("down"))]
+
+    assert fetch_median(sources, ['bitcoin'], ['aud']) == bitcoin(102)
+    assert "c: down" in capsys.readouterr().err
+
+def test_http_source():
+    with FakeCoinGecko() as server:
+        source = HttpSource(server.url + "/simple/price?ids={ids}&vs_currencies={currencies}&include_24hr_change={include_24hr_change}", 'mirror')
+        data = source.fetch(['bitcoin', 'not-a-coin'], ['aud'], False)
+        url = server.url
+
+    assert data == {'bitcoin': {'aud': generate_price('bitcoin', 'aud')}}
+    with pytest.raises(ConnectionError, match="Failed to connect to mirror"):
+        HttpSource(url + "/simple/price?ids={ids}", 'mirror', timeout=1).fetch(['bitcoin'], ['aud'], False)
+
+def test_file_source(tmp_path):
+    path = tmp_path / 'prices.json'
+    path.write_text(json.dumps({'bitcoin': {'aud': 100, 'usd': 70, 'aud_24h_change': 1.5}}))
+
+    assert FileSource(str(path)).fetch(['bitcoin', 'ethereum'], ['aud'], True) == {'bitcoin': {'aud': 100, 'aud_24h_change': 1.5}}
+    with pytest.raises(ConnectionError, match="Failed to read"):
+        FileSource(str(tmp_path / 'missing.json')).fetch(['bitcoin'], ['aud'], True)
+
+def test_configured_sources(tmp_path, monkeypatch):
+    prices_path = tmp_path / 'prices.json'
+    prices_path.write_text(json.dumps({'bitcoin': {'aud': 100, 'aud_24h_change': 1.5}}))
+    config_path = tmp_path / 'sources.json'
+    config_path.write_text(json.dumps({'mode': 'median', 'sources': [{'type': 'file', 'path': str(prices_path)}]}))
+    monkeypatch.setenv(pricesources.SOURCES_ENVIRONMENT_VARIABLE, str(config_path))
+
+    sources = pricesources.get_configured_sources()
+    assert isinstance(sources, PriceSources)
+    assert sources.mode == 'median'
+    # Loaded once so the sources' latencies build up
+    assert pricesources.get_configured_sources() is sources
+
+    assert fetch_prices(['Bitcoin'], ['AUD']) == {'bitcoin': {'aud': 100, 'aud_24h_change': 1.5}}
+    with pytest.raises(SystemExit, match="Not all coin IDs were found"):
+        fetch_prices(['bitcoin', 'ethereum'], ['aud'])
@@ -0,0 +1,65 @@
+import pytest
+from rules import compile_rules, RuleSyntaxError
+from mocks import fetch_price_data
+
+@pytest.mark.parametrize("expression, expected", [
+    ("price(bitcoin,aud) > 90000", True),
+    ("price(bitcoin, AUD) >= 100000 and change_24h(ethereum,aud) < -5", False),
+    ("price(ripple,aud) * 10000 == 7500", True),
+    ("not (price(ethereum,btc) > 0.05)", True),
+    ("-change_24h(ripple,aud) > 1", True),
+    ("price(bitcoin,aud) / price(ethereum,aud) > 25 or price(ripple,aud) > 1", False),
+    # Missing prices make a comparison false without hiding the rest of the rule
+    ("price(basic-attention-token,aud) > 0 or price(bitcoin,btc) == 1", True),
+    # A missing price is unknown, and so is its negation, rather than false
+    ("not price(basic-attention-token,aud) > 100", False),
+    ("not (price(basic-attention-token,aud) > 0 and price(bitcoin,btc) == 1)", False),
+    ("not (price(basic-attention-token,aud) > 0 and price(bitcoin,btc) == 2)", True),
+])
+def test_evaluate(expression, expected):
+    rules = compile_rules([expression])
+    assert bool(rules.evaluate(fetch_price_data())) == expected
+
+def test_check_missing_price():
+    prices = fetch_price_data()
+    del prices['bitcoin']
+    rules = compile_rules(["not price(bitcoin,aud) > 100", "price(bitcoin,aud) > 1 or price(ripple,aud) > 0.5", "-price(bitcoin,aud) < 0 and price(ripple,aud) > 1"])
+    assert [rule.check(prices) for rule in rules.rules] == [None, True, False]
+
+def test_requirements():
+    rules = compile_rules(["price(bitcoin,aud) > 1", "change_24h(1inch,USD) < -5"])
+    assert rules.coin_ids == {'bitcoin', '1inch'}
+    assert rules.currencies == {'aud', 'usd'}
+    assert rules.include_24hr_change
+    assert rules.change_currencies == {'usd'}
+
+@pytest.mark.parametrize("expression", [
+    "price(bitcoin) > 1",
+    "price(bitcoin,aud) >",
+    "volume(bitcoin,aud) > 1",
+    "price(bitcoin,aud) > 1 2",
+    "(price(bitcoin,aud) > 1",
+    "price(bitcoin,aud) $ 1",
+])
+def test_syntax_errors(expression):
+    with pytest.raises(RuleSyntaxError):
+        compile_rules([expression])
+
+def test_new_matches(tmp_path):
+    rules = compile_rules(["price(bitcoin,aud) > 90000", "price(ripple,aud) > 1"])
+    prices = fetch_price_data()
+    assert [rule.source for rule in rules.evaluate_new_matches(prices, 'pricealert', tmp_path)] == ["price(bitcoin,aud) > 90000"]
+    assert rules.evaluate_new_matches(prices, 'pricealert', tmp_path) == []
+    # Each tool keeps its own matched rules
+    assert len(rules.evaluate_new_matches(prices, 'optimaltrade', tmp_path)) == 1
+
+    # A coin left out of the prices keeps the rule's last state, so it doesn't alert again when it's back
+    del prices['bitcoin']
+    assert rules.evaluate_new_matches(prices, 'pricealert', tmp_path) == []
+    assert rules.evaluate_new_matches(fetch_price_data(), 'pricealert', tmp_path) == []
+
+    # Once false, the rule alerts again when it's next true
+    prices = fetch_price_data()
+    prices['bitcoin']['aud'] = 80000
+    assert rules.evaluate_new_matches(prices, 'pricealert', tmp_path) == []
+    assert len(rules.evaluate_new_matches(fetch_price_data(), 'pricealert', tmp_path)) == 1
@@ -0,0 +1,128 @@
+import os
+import pytest
+import optimalpurchase
+import optimaltrade
+from scheduler import AdaptiveScheduler, TokenBucket, Watcher, WatchJob
+
+def config_path(name):
+    return os.path.join(os.path.dirname(__file__), 'config', name)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_token_bucket():
+    bucket = TokenBucket(6, now=0)
+
+    assert bucket.take(0)
+    assert not bucket.take(5)
+    assert bucket.wait_time(5) == pytest.approx(5)
+    assert bucket.take(10)
+
+def test_interval_shrinks_near_triggers_and_with_volatility():
+    scheduler = AdaptiveScheduler(['near', 'far', 'volatile'], now=0, min_interval=60, max_interval=3600)
+    assert scheduler.pop_due(0) == ['far', 'near', 'volatile']
+
+    for coin_id in ('near', 'far', 'volatile'):
+        scheduler.update(coin_id, 0, {'aud': 100}, None)
+    near = scheduler.update('near', 600, {'aud': 100}, 0.001)
+    far = scheduler.update('far', 600, {'aud': 100}, None)
+    volatile = scheduler.update('volatile', 600, {'aud': 110}, None)
+
+    assert near == 60
+    assert far == 3600
+    assert 60 < volatile < 3600
+    assert scheduler.next_due() == 660
+
+def test_pop_due_includes_coins_due_soon():
+    scheduler = AdaptiveScheduler(['a', 'b', 'c'], now=0, min_interval=100, max_interval=100)
+    scheduler.pop_due(0)
+    scheduler.update('a', 0, {'aud': 1}, None)
+    scheduler.update('b', 10, {'aud': 1}, None)
+    scheduler.update('c', 50, {'aud': 1}, None)
+
+    # b is due within a quarter of its interval of a, c isn't
+    assert scheduler.pop_due(100) == ['a', 'b']
+    assert scheduler.next_due() == 150
+
+def test_trade_trigger():
+    config = optimaltrade.load(config_path('optimaltrade_show_optimal.json'))
+    trigger = optimaltrade.get_triggers(config)[0]
+
+    assert trigger.coin_ids == ('bitcoin', 'ethereum')
+    assert trigger.side({'bitcoin': {'btc': 1}, 'ethereum': {'btc': 0.04}}) is True
+    assert trigger.side({'bitcoin': {'btc': 1}, 'ethereum': {'btc': 0.06}}) is False
+    assert trigger.side({'bitcoin': {'btc': 1}}) is None
+
+def test_watcher(base_setup, mocker):
+    mock_stdout = base_setup('optimalpurchase_show_optimal.json')
+    run = mocker.spy(optimalpurchase, 'run')
+    path = config_path('optimalpurchase_show_optimal.json')
+    job = WatchJob('optimalpurchase', path, optimalpurchase, optimalpurchase.load(path), optimalpurchase.parse_args([path]))
+
+    # Bitcoin wavers just above its 90,000 target, ethereum is far above its 6,000 target
+    bitcoin_prices = [90500, 91000]
+    polls = {'bitcoin': 0, 'ethereum': 0}
+
+    def fetch(coin_ids, currencies):
+        assert currencies == ['aud']
+        prices = {}
+        for coin_id in coin_ids:
+            polls[coin_id] += 1
+            prices[coin_id] = {'aud': bitcoin_prices[polls[coin_id] % len(bitcoin_prices)] if coin_id == 'bitcoin' else 9000}
+        return prices
+
+    clock = FakeClock()
+    watcher = Watcher([job], ['aud'], budget=2, min_interval=60, max_interval=3600, clock=clock, sleep=clock.sleep, fetch=fetch)
+    requests = 0
+    while clock.now < 1000 + 7200:
+        watcher.step()
+        requests += 1
+
+    # Only the first check runs the config, later ones don't cross a target
+    assert run.call_count == 1
+    assert polls['bitcoin'] > 4 * polls['ethereum']
+    assert requests <= 2 * 120 + 1
+    assert "BTC" not in mock_stdout.getvalue()
+
+    bitcoin_prices[:] = [89000]
+    while 'bitcoin' not in watcher.step():
+        pass
+
+    assert run.call_count == 2
+    assert "BTC" in mock_stdout.getvalue()
+
+def test_watcher_defers_only_missing_coins(base_setup, mocker, capsys):
+    base_setup('optimalpurchase_show_all.json')
+    run = mocker.spy(optimalpurchase, 'run')
+    path = config_path('optimalpurchase_show_all.json')
+    job = WatchJob('optimalpurchase', path, optimalpurchase, optimalpurchase.load(path), optimalpurchase.parse_args([path]))
+    dead_job = WatchJob('optimalpurchase', path, optimalpurchase, optimalpurchase.load(path), optimalpurchase.parse_args([path]))
+    dead_job.coin_ids = {'bitcoin', 'dead'}
+    polls = []
+
+    def fetch(coin_ids, currencies):
+        polls.append(sorted(coin_ids))
+        return {coin_id: {'aud': 100000} for coin_id in coin_ids if coin_id != 'dead'}
+
+    clock = FakeClock()
+    watcher = Watcher([job, dead_job], ['aud'], budget=60, min_interval=60, max_interval=3600, clock=clock, sleep=clock.sleep, fetch=fetch)
+    watcher.step()
+
+    # The coins that came back are used and only the config needing the dead coin waits for it
+    assert polls == [['bitcoin', 'dead', 'ethereum']]
+    assert run.call_count == 1
+    assert "No prices found for dead" in capsys.readouterr().err
+    assert watcher.scheduler.intervals['bitcoin'] > 60
+
+    # The dead coin is tried again after the shortest interval, on its own
+    start = clock.now
+    watcher.step()
+    assert polls[-1] == ['dead']
+    assert clock.now == start + 60
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SCRIPTS = ['portfolio', 'pricealert', 'pricepercentalert', 'indicatoralert', 'fiatpurchase', 'optimaltrade', 'optimalpurchase']
+
+# Modules that must only be imported on the code paths that use them
+HEAVY_MODULES = ['requests', 'jsonschema', 'prettytable', 'sqlite3', 'numpy', 'smtplib', 'email.mime.multipart', 'email.mime.text']
+
+# Cumulative import time allowed for a script's module in microseconds. Cold start is around 25ms, it was 200ms
+# when every dependency was imported up front, so this leaves room for slow machines while catching a regression.
+STARTUP_BUDGET = 100000
+
+def import_times(module: str) -> dict:
+    """Imports a module in a fresh interpreter with -X importtime and returns the cumulative time of every module it loaded."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=ROOT_DIRECTORY, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_cold_start(script):
+    # Take the best of a few runs to smooth out noise from the rest of the machine
+    runs = [import_times(script) for _ in range(3)]
+
+    loaded = [module for module in HEAVY_MODULES if module in runs[0]]
+    assert not loaded, f"{script} imports {', '.join(loaded)} at startup"
+
+    startup_time = min(times[script] for times in runs)
+    assert startup_time < STARTUP_BUDGET, f"{script} took {startup_time / 1000:.1f}ms to import, the budget is {STARTUP_BUDGET / 1000:.0f}ms"
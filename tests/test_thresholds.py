@@ -0,0 +1,18 @@
+from thresholds import ThresholdIndex
+
+def test_above():
+    index = ThresholdIndex([
+        ('bitcoin', 'AUD', 90000, 'a'),
+        ('bitcoin', 'aud', 110000, 'b'),
+        ('bitcoin', 'aud', 100000, 'c'),
+        ('bitcoin', 'usd', 120000, 'd'),
+        ('ethereum', 'aud', 5000, 'e')
+    ])
+
+    assert len(index) == 5
+    assert sorted(index.pairs()) == [('bitcoin', 'aud'), ('bitcoin', 'usd'), ('ethereum', 'aud')]
+    assert index.above('bitcoin', 'AUD', 95000) == ['c', 'b']
+    # Thresholds equal to the price aren't above it
+    assert index.above('bitcoin', 'aud', 100000) == ['b']
+    assert index.above('bitcoin', 'aud', 200000) == []
+    assert index.above('ripple', 'aud', 1) == []
@@ -0,0 +1,80 @@
+import json
+import pytest
+import tracing
+from portfolio import main
+
+@pytest.fixture(autouse=True)
+def reset_tracing():
+    yield
+    tracing.disable()
+
+def test_span_does_nothing_when_disabled():
+    with tracing.span('fetch', coins=3) as current:
+        current.set(cache='miss')
+
+    assert tracing.span('fetch') is tracing.NULL_SPAN
+    assert tracing.get_spans() == []
+
+def test_span_records_parent_and_attributes():
+    tracing.enable()
+    with tracing.span('run'):
+        with tracing.span('fetch', coins=3) as current:
+            current.set(cache='miss')
+
+    fetch, run = tracing.get_spans()
+    assert fetch.name == 'fetch'
+    assert fetch.parent == 'run'
+    assert fetch.attributes == {'coins': 3, 'cache': 'miss'}
+    assert run.parent is None
+    assert run.duration >= fetch.duration
+
+def test_span_records_error():
+    tracing.enable()
+    with pytest.raises(ValueError):
+        with tracing.span('compute'):
+            raise ValueError()
+
+    assert tracing.get_spans()[0].attributes == {'error': 'ValueError'}
+
+def test_keeps_latest_spans():
+    tracing.enable()
+    for index in range(tracing.MAX_SPANS + 10):
+        with tracing.span('tick', index=index):
+            pass
+
+    spans = tracing.get_spans()
+    assert len(spans) == tracing.MAX_SPANS
+    assert spans[0].attributes == {'index': 10}
+
+def test_write_trace(tmp_path):
+    tracing.enable()
+    with tracing.span('fetch', coins=3):
+        pass
+    trace_file = tmp_path / 'trace.json'
+    tracing.write_trace(str(trace_file))
+
+    event, = json.loads(trace_file.read_text())['traceEvents']
+    assert event['name'] == 'fetch'
+    assert event['ph'] == 'X'
+    assert event['args'] == {'coins': 3}
+
+def test_tool_trace_and_profile(base_setup, tmp_path, capsys):
+    trace_file = tmp_path / 'trace.json'
+    profile_file = tmp_path / 'portfolio.prof'
+    base_setup('portfolio_valid.json', '--trace', str(trace_file), '--profile', str(profile_file))
+    main()
+
+    names = {event['name'] for event in json.loads(trace_file.read_text())['traceEvents']}
+    assert {'portfolio', 'load', 'fetch', 'run', 'compute', 'render'} <= names
+    assert profile_file.exists()
+    assert "cumulative" in capsys.readouterr().err
+    # Tracing is switched off again once the tool finishes
+    assert tracing.span('fetch') is tracing.NULL_SPAN
+
+def test_tool_trace_log(base_setup, capsys):
+    base_setup('portfolio_valid.json', '--trace-log')
+    main()
+
+    spans = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert spans[-1]['span'] == 'portfolio'
+    assert all('duration_ms' in logged for logged in spans)
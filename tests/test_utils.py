@@ -0,0 +1,24 @@
+from decimal import Decimal
+from utils import CURRENCY_DECIMAL_PLACES, CURRENCY_SYMBOLS, format_column, format_currency, get_currency_symbol, get_formatter
+
+values = [0, 0.000012345, -0.005, 0.5, -0.75, 1, 1234.5, -98765.4321, 100000, Decimal("0.00000814"), Decimal("25000.00")]
+
+def test_formatter_matches_format_currency():
+    for currency in ['aud', 'EUR', 'btc', 'xyz']:
+        formatter = get_formatter(currency)
+        for value in values:
+            assert formatter(value) == get_currency_symbol(currency) + format_currency(value)
+
+def test_format_column():
+    assert format_column(values, 'AUD') == [get_formatter('aud')(value) for value in values]
+    assert format_column(values) == [format_currency(value) for value in values]
+    assert format_column([1234.5, 0.5], 'gbp') == ['£1,234.50', '£0.5000']
+
+def test_formatters_are_cached():
+    assert get_formatter('usd') is get_formatter('USD')
+    assert get_formatter('jpy')(1234.5) == '¥1,234.50'
+    assert get_formatter('btc').symbol == ''
+
+def test_symbols_cover_decimal_places():
+    # Every currency with its own rounding rules is a known currency with a symbol entry
+    assert all(currency.upper() in CURRENCY_SYMBOLS for currency in CURRENCY_DECIMAL_PLACES)
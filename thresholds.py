@@ -0,0 +1,46 @@
+"""
+An index of price thresholds, for finding the thresholds a price is past without checking every one.
+"""
+from bisect import bisect_right
+from typing import Hashable, Iterable, List, Tuple
+
+class ThresholdIndex:
+    """
+    Price thresholds grouped by coin and currency, with each group sorted by price. The thresholds above a
+    price are found by binary search, so a query costs O(log n) plus the number of thresholds it returns
+    rather than the number in the index.
+
+    Each threshold carries an item, such as the position of the config entry it came from, which is what
+    the queries return.
+
+    Args:
+    thresholds (iterable of tuple): (coin ID, currency, price, item) tuples.
+    """
+    __slots__ = ('_groups',)
+
+    def __init__(self, thresholds: Iterable[Tuple[str, str, float, Hashable]] = ()):
+        groups = {}
+        for coin_id, currency, price, item in thresholds:
+            key = (coin_id, currency.lower())
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = []
+            group.append((price, item))
+
+        # Prices and items are kept in separate lists so the prices can be searched with bisect
+        self._groups = {}
+        for key, group in groups.items():
+            group.sort(key=lambda threshold: threshold[0])
+            self._groups[key] = ([price for price, _ in group], [item for _, item in group])
+
+    def __len__(self):
+        return sum(len(prices) for prices, _ in self._groups.values())
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        """Returns the (coin ID, currency) pairs with thresholds."""
+        return list(self._groups)
+
+    def above(self, coin_id: str, currency: str, price: float) -> list:
+        """Returns the items of the thresholds greater than the price, in order of threshold."""
+        prices, items = self._groups.get((coin_id, currency.lower()), ([], []))
+        return items[bisect_right(prices, price):]
@@ -0,0 +1,182 @@
+"""
+Lightweight span timing for finding out where a run spends its time.
+
+Code marks a stage with a span:
+
+    with span('config.validate', path=path) as current:
+        ...
+        current.set(cache='miss')
+
+Tracing is off unless a tool is run with --trace or --trace-log, and while it's off span() returns a shared
+object whose enter and exit do nothing, so spans can stay in hot paths. --profile runs the tool under
+cProfile instead, for when span timings aren't detailed enough.
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+_enabled = False
+_log_stream = None
+# Spans kept for the trace file. Only the latest are kept so watch and stream can run with --trace indefinitely.
+MAX_SPANS = 100000
+_spans = deque(maxlen=MAX_SPANS)
+_local = threading.local()
+
+def _stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+class Span:
+    """A timed stage of a run, with the span it's nested in and any attributes describing it."""
+    __slots__ = ('name', 'attributes', 'parent', 'thread_id', 'start', 'end')
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.thread_id = None
+        self.start = None
+        self.end = None
+
+    def set(self, **attributes):
+        """Adds attributes worked out during the span, such as whether a cache was hit."""
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        """The span's duration in seconds."""
+        return (self.end - self.start) / 1e9
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter_ns()
+        _stack().pop()
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        _spans.append(self)
+        if _log_stream is not None:
+            import json
+            _log_stream.write(json.dumps({'span': self.name, 'parent': self.parent, 'duration_ms': round(self.duration * 1000, 3), **self.attributes}, default=str) + "\n")
+        return False
+
+class _NullSpan:
+    """Stands in for a Span while tracing is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+def span(name: str, **attributes):
+    """
+    Returns a context manager that times a stage while tracing is enabled.
+
+    Args:
+    name (str): The stage name, dotted names group related stages such as api.request.
+    attributes: Details to record with the span.
+    """
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, attributes)
+
+def enable(log_stream=None):
+    """Starts recording spans, also writing each one to log_stream as a JSON line when it finishes if given."""
+    global _enabled, _log_stream
+    _enabled = True
+    _log_stream = log_stream
+
+def disable():
+    """Stops recording and forgets the recorded spans."""
+    global _enabled, _log_stream
+    _enabled = False
+    _log_stream = None
+    _spans.clear()
+
+def get_spans() -> list:
+    """Returns the finished spans in the order they finished, up to the latest MAX_SPANS of them."""
+    return list(_spans)
+
+def write_trace(path: str):
+    """
+    Writes the recorded spans to a file in the Trace Event Format, which can be opened in
+    chrome://tracing or https://ui.perfetto.dev to see the stages on a timeline. Runs that record more
+    than MAX_SPANS spans only write the latest ones.
+    """
+    import json
+
+    process_id = os.getpid()
+    events = [{
+        'name': recorded.name,
+        'cat': recorded.name.split('.')[0],
+        'ph': 'X',
+        'ts': recorded.start / 1000,
+        'dur': (recorded.end - recorded.start) / 1000,
+        'pid': process_id,
+        'tid': recorded.thread_id,
+        'args': recorded.attributes
+    } for recorded in sorted(_spans, key=lambda recorded: recorded.start)]
+
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, default=str)
+
+def add_arguments(parser):
+    """Adds the --trace, --trace-log and --profile options shared by the tools."""
+    parser.add_argument('--trace', metavar='FILE', help="Write the time spent in each stage to a JSON trace file, which can be opened in chrome://tracing or ui.perfetto.dev.")
+    parser.add_argument('--trace-log', action='store_true', help="Print the time spent in each stage to stderr as JSON lines.")
+    parser.add_argument('--profile', metavar='FILE', help="Run under cProfile, writing the stats to FILE and a summary of the slowest functions to stderr.")
+
+@contextmanager
+def instrument(args, name: str = 'main'):
+    """
+    Applies the tracing and profiling options for the code run inside it, writing the trace and
+    profile when it finishes, including when it exits with an error.
+
+    Args:
+    args (Namespace): Parsed arguments with the options from add_arguments.
+    name (str): The name of the span around the whole run.
+    """
+    trace_file = getattr(args, 'trace', None)
+    trace_log = getattr(args, 'trace_log', False)
+    profile_file = getattr(args, 'profile', None)
+
+    if trace_file or trace_log:
+        enable(sys.stderr if trace_log else None)
+
+    profiler = None
+    if profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        with span(name):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            import pstats
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+        if trace_file:
+            write_trace(trace_file)
+        if trace_file or trace_log:
+            disable()
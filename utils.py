@@ -1,5 +1,24 @@
 import sys
-from typing import List
+import pricecache
+import pricesources
+from pricesnapshot import PriceSnapshot
+from metrics import COINS_TRACKED
+from tracing import span
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Callable, Iterable, List, Tuple
+
+# Number of decimal places money amounts are rounded to in precise mode. Anything not listed
+# uses DEFAULT_DECIMAL_PLACES which suits most fiat currencies.
+CURRENCY_DECIMAL_PLACES = {
+    # Fiat currencies without minor units
+    'jpy': 0, 'krw': 0, 'vnd': 0, 'clp': 0,
+    # Crypto and commodity units CoinGecko supports as vs_currencies
+    'btc': 8, 'eth': 8, 'ltc': 8, 'bch': 8, 'bnb': 8, 'eos': 4, 'xrp': 6, 'xlm': 7,
+    'link': 8, 'dot': 8, 'yfi': 8, 'sol': 8, 'bits': 2, 'sats': 0, 'xag': 8, 'xau': 8,
+    # Fiat currencies with three decimal places
+    'bhd': 3, 'kwd': 3
+}
+DEFAULT_DECIMAL_PLACES = 2
 
 def merge_configurations(default_config: dict, user_config: dict) -> dict:
     merged_config = default_config.copy()
@@ -10,35 +29,163 @@ def validate_currency_prices(prices: List, supported_currencies: List):
     if not prices:
         sys.exit("Error: No prices found for the specified coins.")
 
-    first_price = list(prices.values())[0]
+    first_price = next(iter(prices.values()))
     for currency in supported_currencies:
         if currency.lower() not in first_price:
             sys.exit(f"Error: No price found for currency '{currency}'.")
 
+def fetch_prices(coin_ids: List[str], currencies: List[str], change_currencies: List[str] = None, resilient: bool = False, allow_missing: bool = False) -> PriceSnapshot:
+    """
+    Fetches prices for the coins in each currency as a PriceSnapshot, which can be read like the dict
+    fetch_price_data returns, and checks every currency was returned. The 24 hour
+    change is only requested if change_currencies, the currencies it is needed in, isn't empty, and is
+    always requested if it isn't given. Exits with the error message if the prices can't be fetched.
+
+    With resilient set, prices are fetched through the price cache (see pricecache.py): cached prices are
+    used when the API can't be reached, and coins without a price are left out with a warning instead of
+    failing the fetch.
+
+    With allow_missing set, coins the API didn't return are left out instead of failing the fetch, for callers
+    that check the coins they need themselves.
+    """
+    include_24hr_change = change_currencies is None or bool(change_currencies)
+    try:
+        with span('fetch', coins=len(coin_ids), currencies=len(currencies)):
+            if resilient:
+                prices, _ = pricecache.fetch_prices(list(coin_ids), list(currencies), include_24hr_change)
+            else:
+                prices = pricesources.fetch_price_data(list(coin_ids), list(currencies), include_24hr_change, allow_missing)
+            validate_currency_prices(prices, currencies)
+    except Exception as e:
+        sys.exit(str(e))
+    COINS_TRACKED.set(len(prices))
+    return PriceSnapshot.from_dict(prices)
+
+def to_decimal(value) -> Decimal:
+    """
+    Converts a number to a Decimal. Floats go through their string form so that a price of 0.1
+    becomes Decimal('0.1') rather than the binary approximation 0.1000000000000000055511151231257827.
+    """
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+def quantize_currency(value, currency: str) -> Decimal:
+    """
+    Rounds a money amount to the number of decimal places used by the currency (see CURRENCY_DECIMAL_PLACES),
+    using banker's rounding so repeated rounding of totals doesn't drift in one direction.
+    """
+    places = CURRENCY_DECIMAL_PLACES.get(currency.lower(), DEFAULT_DECIMAL_PLACES)
+    return to_decimal(value).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_EVEN)
+
+def _unrounded(value, currency: str):
+    return value
+
+def get_arithmetic(precise: bool) -> Tuple[Callable, Callable]:
+    """
+    Returns the pair of functions the tools use for money math.
+
+    The first converts config values and prices into numbers, the second rounds a money amount for a currency.
+    Precise mode uses Decimal with per-currency rounding which is slower but exact, suitable for reporting.
+    Fast mode uses floats and leaves amounts unrounded, suitable for frequent alert evaluation.
+
+    Args:
+    precise (bool): Whether to use Decimal arithmetic.
+
+    Returns:
+    tuple: (to_number, round_amount)
+    """
+    if precise:
+        return to_decimal, quantize_currency
+    return float, _unrounded
+
+# Symbols shown before amounts for each of CoinGecko's supported vs_currencies. Crypto and commodity units
+# have no symbol, amounts in them are shown alongside the coin or currency code instead.
+CURRENCY_SYMBOLS = {
+    'AUD': '$', 'USD': '$', 'CAD': '$', 'NZD': '$', 'HKD': '$', 'SGD': '$', 'MXN': '$', 'ARS': '$', 'CLP': '$',
+    'BMD': '$', 'TWD': 'NT$', 'BRL': 'R$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'CNY': '¥', 'KRW': '₩',
+    'INR': '₹', 'RUB': '₽', 'UAH': '₴', 'NGN': '₦', 'PHP': '₱', 'THB': '฿', 'VND': '₫', 'ILS': '₪',
+    'TRY': '₺', 'GEL': '₾', 'BDT': '৳', 'PKR': '₨', 'LKR': 'Rs', 'IDR': 'Rp', 'MYR': 'RM', 'ZAR': 'R',
+    'PLN': 'zł', 'CZK': 'Kč', 'HUF': 'Ft', 'CHF': 'Fr', 'SEK': 'kr', 'NOK': 'kr', 'DKK': 'kr',
+    'AED': 'د.إ', 'SAR': '﷼', 'BHD': '.د.ب', 'KWD': 'د.ك', 'MMK': 'K', 'VEF': 'Bs', 'XDR': 'SDR',
+    'BTC': '', 'ETH': '', 'LTC': '', 'BCH': '', 'BNB': '', 'EOS': '', 'XRP': '', 'XLM': '', 'LINK': '',
+    'DOT': '', 'YFI': '', 'SOL': '', 'BITS': '', 'SATS': '', 'XAG': '', 'XAU': ''
+}
+
 def get_currency_symbol(currency: str) -> str:
-    symbols = {
-        'AUD': '$', 'USD': '$', 'CAD': '$',
-        'EUR': '€', 'GBP': '£', 'JPY': '¥'
-    }
-    return symbols.get(currency.upper(), '')  # Default to empty string if not found
+    return CURRENCY_SYMBOLS.get(currency.upper(), '')  # Default to empty string if not found
 
 def format_currency(value: float) -> str:
     """
     Formats currency values based on their magnitude:
     - If the value is less than $0.01, it will have 8 decimal places.
     - If the value is less than $1, it will have 4 decimal places.
-    - If the value is less than $10,000, it will have 2 decimal places.
-    - If the value is $10,000 or more, it will have no decimal places.
+    - Otherwise it will have 2 decimal places and a comma as the thousands separator.
 
     Args:
-    value (float): The currency value to format.
+    value (float or Decimal): The currency value to format.
 
     Returns:
     str: Formatted currency string.
     """
-    if abs(value) < 0.01:
+    magnitude = abs(value)
+    if magnitude < 0.01:
         return f"{value:.8f}"
-    elif abs(value) < 1:
+    elif magnitude < 1:
         return f"{value:.4f}"
     else:
         return f"{value:,.2f}"  # Includes comma for thousands separator
+
+class CurrencyFormatter:
+    """
+    Formats amounts in one currency as its symbol followed by format_currency's output, so
+    get_formatter('aud')(1234.5) gives '$1,234.50'. The symbol is looked up once when the formatter
+    is created rather than on every call. Decimal places follow format_currency's magnitudes for every
+    currency, not the currency's minor unit.
+    """
+    __slots__ = ('currency', 'symbol')
+
+    def __init__(self, currency: str):
+        self.currency = currency.upper()
+        self.symbol = get_currency_symbol(currency)
+
+    def __call__(self, value) -> str:
+        magnitude = abs(value)
+        if magnitude < 0.01:
+            return f"{self.symbol}{value:.8f}"
+        elif magnitude < 1:
+            return f"{self.symbol}{value:.4f}"
+        return f"{self.symbol}{value:,.2f}"
+
+    def format_column(self, values: Iterable) -> List[str]:
+        """Formats a whole column of amounts at once, avoiding a method call per value."""
+        symbol = self.symbol
+        return [
+            f"{symbol}{value:.8f}" if abs(value) < 0.01 else f"{symbol}{value:.4f}" if abs(value) < 1 else f"{symbol}{value:,.2f}"
+            for value in values
+        ]
+
+_formatters = {}
+
+def get_formatter(currency: str) -> CurrencyFormatter:
+    """Returns the formatter for a currency code in any case, creating it the first time the currency is used."""
+    formatter = _formatters.get(currency)
+    if formatter is None:
+        formatter = _formatters.setdefault(currency.lower(), CurrencyFormatter(currency))
+        _formatters[currency] = formatter
+    return formatter
+
+def format_column(values: Iterable, currency: str = None) -> List[str]:
+    """
+    Formats a column of amounts, with the currency's symbol if a currency is given.
+
+    Args:
+    values (iterable of float or Decimal): The amounts to format.
+    currency (str): The currency code, or None for no symbol.
+
+    Returns:
+    list of str: The formatted amounts in the same order.
+    """
+    if currency is None:
+        return [format_currency(value) for value in values]
+    return get_formatter(currency).format_column(values)